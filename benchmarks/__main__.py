@@ -0,0 +1,82 @@
+from pathlib import Path
+from typing import Annotated
+
+from rich.console import Console
+from rich.table import Table
+from typer import Exit, Option, Typer
+
+from benchmarks.suite import compare, load_report, run_suite, save_report
+
+# the benchmarks are not part of the package, they are run from the repository by 'python -m benchmarks'
+app = Typer(add_completion=False)
+console = Console()
+
+
+@app.command(help="Run the benchmarks and compare them with the report of an earlier run.")
+def main(only: Annotated[str | None, Option(help="Comma separated benchmarks to run, e.g. 'pages,worker'. Defaults to all.")] = None,
+         quick: Annotated[bool, Option(help="Run with small parameters, e.g. to check that nothing is broken.")] = False,
+         output: Annotated[Path | None, Option(help="Save the report as JSON to this file.")] = None,
+         baseline: Annotated[Path | None, Option(help="Compare with the JSON report of an earlier run, e.g. of the last release.")] = None,
+         threshold: Annotated[float, Option(help="Relative change of a metric from which it counts as regressed or improved.")] = 0.1) -> None:
+    """
+    Run the benchmarks and compare them with the report of an earlier run.
+
+    :param only: Comma separated benchmarks to run. If None, all are run.
+    :param quick: Run with small parameters.
+    :param output: Save the report as JSON to this file.
+    :param baseline: Compare with the JSON report of an earlier run.
+    :param threshold: Relative change of a metric from which it counts as regressed or improved.
+    :return: None
+    """
+
+    previous = None
+    if baseline is not None:
+        try:
+            previous = load_report(baseline)
+        except (OSError, ValueError) as e:
+            console.print(f"[red]Error:[/red] Could not load the baseline: {e}")
+            raise Exit(code=1)
+
+    def on_result(name: str, metrics: dict[str, float] | None, error: str | None) -> None:
+        if error is not None:
+            console.print(f"[bold]{name}[/bold]: [red]failed[/red] {error}")
+            return
+        console.print(f"[bold]{name}[/bold]")
+        for key, value in metrics.items():
+            console.print(f"  {key}: {value:.3f}")
+
+    try:
+        report = run_suite(names=[name.strip() for name in only.split(",") if name.strip()] if only else None,
+                           quick=quick,
+                           on_result=on_result)
+    except ValueError as e:
+        console.print(f"[red]Error:[/red] {e}")
+        raise Exit(code=1)
+    if output is not None:
+        save_report(report, output)
+        console.print(f"Saved the report to '{output}'.")
+
+    regressed = 0
+    if previous is not None:
+        if previous.get("quick") != report["quick"]:
+            console.print("[yellow]Warning:[/yellow] The baseline ran with other parameters.")
+        rows = compare(previous, report, threshold=threshold)
+        regressed = sum(1 for row in rows if row["state"] == "regressed")
+        table = Table(title=f"Compared with {previous.get('version')} of {previous.get('created')}")
+        for column in ("Benchmark", "Metric", "Baseline", "Current", "Change", "State"):
+            table.add_column(column, justify="right" if column in ("Baseline", "Current", "Change") else "left")
+        for row in rows:
+            if row["state"] not in ("regressed", "improved"):
+                continue
+            color = "red" if row["state"] == "regressed" else "green"
+            table.add_row(row["benchmark"], row["metric"], f"{row['baseline']:.3f}", f"{row['current']:.3f}",
+                          f"[{color}]{row['change']:+.1%}[/{color}]", row["state"])
+        console.print(table)
+        console.print(f"{regressed} regressed, {sum(1 for row in rows if row['state'] == 'improved')} improved, "
+                      f"{sum(1 for row in rows if row['state'] == 'unchanged')} unchanged metrics.")
+    if report["errors"] or regressed:
+        raise Exit(code=1)
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,99 @@
+import asyncio
+import random
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+from sqlalchemy import create_engine, event, func, insert, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from mikrotik_manager.db import Device, DeviceStatus, DeviceTag, _sqlite_pragmas
+from mikrotik_manager.device_status import STATUS_FIELDS, StatusWriter, find_devices, upsert
+
+
+def run(devices: int = 10000, updates: int = 100000, chunk: int = 250, batch_size: int = 1000,
+        naive_updates: int = 2000, sites: int = 50, tags: int = 20) -> dict[str, float]:
+    """
+    Write device status updates into a temporary SQLite database through the status writer, and one by one for
+    comparison. The updates arrive in chunks, like the results of concurrent polls.
+
+    :param devices: Number of simulated devices.
+    :param updates: Number of status updates written through the status writer.
+    :param chunk: Number of updates between two yields to the event loop.
+    :param batch_size: Maximum number of devices per bulk upsert.
+    :param naive_updates: Number of status updates written one by one.
+    :param sites: Number of sites the devices are spread over.
+    :param tags: Number of tags the devices are spread over.
+    :return: Updates per second and lookup times.
+    """
+
+    rnd = random.Random(0)
+    with tempfile.TemporaryDirectory() as directory:
+        path = Path(directory) / "db.sqlite"
+        engine = create_engine(f"sqlite:///{path}")
+        event.listen(engine, "connect", _sqlite_pragmas)
+        Device.metadata.create_all(bind=engine, tables=[Device.__table__, DeviceTag.__table__, DeviceStatus.__table__])
+        with engine.begin() as connection:
+            connection.execute(insert(Device.__table__), [{"id": i, "name": f"device-{i}", "host": f"10.0.{i // 256}.{i % 256}",
+                                                           "username": "admin", "password": "", "tls": False,
+                                                           "site": f"site-{i % sites}"} for i in range(devices)])
+            connection.execute(insert(DeviceTag.__table__), [{"device_id": i, "tag": f"tag-{i % tags}"}
+                                                             for i in range(devices)])
+
+        # one by one, like a poll writing its own result
+        statement = upsert(DeviceStatus.__table__, dialect="sqlite", key="device_id", columns=STATUS_FIELDS)
+        start = time.perf_counter()
+        with engine.connect() as connection:
+            for i in range(naive_updates):
+                connection.execute(statement, {"device_id": rnd.randrange(devices), "status": "online", "rtt": 0.01,
+                                               "error": None, "updated": datetime.now(timezone.utc)})
+                connection.commit()
+        naive = naive_updates / (time.perf_counter() - start)
+        engine.dispose()
+
+        async def main() -> dict[str, float]:
+            async_engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+            event.listen(async_engine.sync_engine, "connect", _sqlite_pragmas)
+            session_maker = async_sessionmaker(async_engine, expire_on_commit=False)
+            writer = StatusWriter(session_maker=session_maker, batch_size=batch_size)
+            try:
+                start = time.perf_counter()
+                for i in range(updates):
+                    device_id = rnd.randrange(devices)
+                    writer.put(device_id,
+                               status="online" if device_id % 10 else "offline",
+                               rtt=rnd.random() / 10,
+                               error=None if device_id % 10 else "TimeoutError")
+                    if i % chunk == chunk - 1:
+                        await asyncio.sleep(0)
+                await writer.close()
+                elapsed = time.perf_counter() - start
+
+                lookups = {}
+                for name, kwargs in {"site": {"site": "site-1"},
+                                     "tag": {"tag": "tag-1"},
+                                     "status": {"status": "offline"}}.items():
+                    start = time.perf_counter()
+                    found = await find_devices(session_maker, limit=devices, **kwargs)
+                    lookups[f"lookup_{name}_ms"] = (time.perf_counter() - start) * 1000
+                    lookups[f"lookup_{name}_devices"] = float(len(found))
+                async with session_maker() as session:
+                    rows = await session.scalar(select(func.count()).select_from(DeviceStatus))
+                return {"batched_updates_per_second": updates / elapsed,
+                        # updates of the same device are merged before they are written
+                        "written_rows": float(writer.written),
+                        "written_rows_per_second": writer.written / elapsed,
+                        "status_rows": float(rows),
+                        **lookups}
+            finally:
+                await async_engine.dispose()
+
+        report = {"devices": float(devices), "naive_updates_per_second": naive, **asyncio.run(main())}
+        report["speedup"] = report["batched_updates_per_second"] / naive
+        return report
+
+
+if __name__ == "__main__":
+    for key, value in run().items():
+        print(f"{key}: {value:.2f}")
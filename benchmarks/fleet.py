@@ -0,0 +1,70 @@
+import asyncio
+import resource
+import time
+
+from mikrotik_manager.routeros.fake import FakeRouterOsServer
+from mikrotik_manager.routeros.pool import ConnectionPool
+from mikrotik_manager.tasks.devices import poll_devices
+
+
+def raise_open_files_limit() -> int:
+    """
+    Raise the soft limit of open files to the hard limit, every pooled session needs one on both ends.
+
+    :return: The new soft limit.
+    """
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    return resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+
+
+def run(devices: int = 5000, concurrency: int = 256, page_size: int = 100, latency: float = 0.005,
+        failing: int = 50) -> dict[str, float]:
+    """
+    Poll a simulated fleet served by the fake RouterOS API server, once cold (connecting) and once warm (pooled).
+
+    :param devices: Number of simulated devices.
+    :param concurrency: Maximum number of devices polled at the same time.
+    :param page_size: Number of results per page.
+    :param latency: Simulated latency per command in seconds.
+    :param failing: Number of unreachable devices in the fleet.
+    :return: Devices per second of the cold and the warm poll.
+    """
+
+    # each simulated device keeps one pooled session open
+    devices = min(devices, max((raise_open_files_limit() - 100) // 2, 1))
+
+    async def main() -> dict[str, float]:
+        async with FakeRouterOsServer(latency=latency) as server:
+            fleet = [{"id": i, "host": server.host, "port": server.port, "username": f"device-{i}"}
+                     for i in range(devices - failing)]
+            fleet += [{"id": i, "host": server.host, "port": 1, "username": f"device-{i}"}
+                      for i in range(devices - failing, devices)]
+            pool = ConnectionPool(max_connections_per_device=1, reconnect_attempts=0)
+            pages = []
+            try:
+                report = {"devices": float(devices)}
+                for name in ("cold", "warm"):
+                    start = time.perf_counter()
+                    summary = await poll_devices(pool=pool,
+                                                 devices=fleet,
+                                                 concurrency=concurrency,
+                                                 page_size=page_size,
+                                                 on_page=pages.append)
+                    elapsed = time.perf_counter() - start
+                    report[f"{name}_devices_per_second"] = devices / elapsed
+                    report[f"{name}_failed"] = float(summary["failed"])
+                report["pages"] = float(len(pages))
+                report["sessions"] = float(server.sessions)
+                return report
+            finally:
+                await pool.close()
+
+    return asyncio.run(main())
+
+
+if __name__ == "__main__":
+    for key, value in run().items():
+        print(f"{key}: {value:.2f}")
@@ -0,0 +1,93 @@
+import asyncio
+import inspect
+import time
+from typing import Any
+
+from nicegui import helpers
+
+from mikrotik_manager.ui.base_layout import BaseLayout
+
+
+def _legacy_dispatch(layout: BaseLayout, func, signature: inspect.Signature):
+    """
+    Rebuild of the previous per-request dispatch (sorting sections and binding signatures on every call).
+    Used as the baseline for the compiled call plan.
+    """
+
+    async def wrapper(*a, **kw) -> Any:
+        def map_parameters(s: inspect.Signature) -> dict[str, Any]:
+            _kw = {k: v for k, v in kw.items() if k in s.parameters.keys()}
+            return s.bind(*a, **_kw).arguments
+
+        for section in layout._get_sections("before"):
+            r = section.func(**map_parameters(section.signature))
+            if helpers.is_coroutine_function(section.func):
+                r = await r
+            if r is not None:
+                kw[section.name] = r
+        result = func(**map_parameters(signature))
+        if helpers.is_coroutine_function(func):
+            result = await result
+        for section in layout._get_sections("after"):
+            r = section.func(**map_parameters(section.signature))
+            if helpers.is_coroutine_function(section.func):
+                r = await r
+            if r is not None:
+                kw[section.name] = r
+        return result
+
+    return wrapper
+
+
+def build_layout(sections: int) -> BaseLayout:
+    """
+    Build a layout with the given number of trivial sections, half of them async.
+
+    :param sections: Number of sections.
+    :return: BaseLayout
+    """
+
+    layout = BaseLayout()
+    for i in range(sections):
+        if i % 2:
+            async def section(request, client):
+                return None
+        else:
+            def section(request, client):
+                return None
+        layout.section(name=f"section_{i}", render="before" if i < sections // 2 else "after")(section)
+    return layout
+
+
+def run(sections: int = 24, iterations: int = 20000) -> dict[str, float]:
+    """
+    Measure the per-request dispatch overhead of BaseLayout with many sections.
+
+    :param sections: Number of sections in the layout.
+    :param iterations: Number of simulated requests.
+    :return: Microseconds per request for the compiled and the legacy dispatch.
+    """
+
+    async def page(request, client):
+        return None
+
+    layout = build_layout(sections)
+    compiled = layout.compile(page)
+    legacy = _legacy_dispatch(layout, page, inspect.signature(page))
+
+    async def measure(wrapper) -> float:
+        start = time.perf_counter()
+        for _ in range(iterations):
+            await wrapper(request=None, client=None)
+        return (time.perf_counter() - start) / iterations * 1_000_000
+
+    async def main() -> dict[str, float]:
+        return {"compiled_us_per_request": await measure(compiled),
+                "legacy_us_per_request": await measure(legacy)}
+
+    return asyncio.run(main())
+
+
+if __name__ == "__main__":
+    for key, value in run().items():
+        print(f"{key}: {value:.2f}")
@@ -0,0 +1,188 @@
+import asyncio
+import random
+import socket
+import tempfile
+import time
+from pathlib import Path
+
+from sqlalchemy import create_engine, event, func, insert, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from mikrotik_manager.db import Device, DeviceEvent, DeviceStatus, _sqlite_pragmas
+from mikrotik_manager.listener import EventListener, parse_syslog, parse_trap
+
+
+def _tlv(tag: int, value: bytes) -> bytes:
+    if len(value) < 0x80:
+        return bytes([tag, len(value)]) + value
+    length = len(value).to_bytes((len(value).bit_length() + 7) // 8, "big")
+    return bytes([tag, 0x80 | len(length)]) + length + value
+
+
+def _oid(oid: str) -> bytes:
+    parts = [int(part) for part in oid.split(".")]
+    encoded = bytes([parts[0] * 40 + parts[1]])
+    for part in parts[2:]:
+        chunk = [part & 0x7F]
+        part >>= 7
+        while part:
+            chunk.insert(0, 0x80 | (part & 0x7F))
+            part >>= 7
+        encoded += bytes(chunk)
+    return _tlv(0x06, encoded)
+
+
+def _integer(value: int) -> bytes:
+    return _tlv(0x02, value.to_bytes(max(1, (value.bit_length() + 8) // 8), "big", signed=True))
+
+
+def link_trap(interface: str, if_index: int, up: bool, community: str = "public") -> bytes:
+    """
+    Encode the SNMPv2c linkUp or linkDown trap of an interface, like RouterOS sends it.
+
+    :param interface: Name of the interface.
+    :param if_index: Index of the interface.
+    :param up: linkUp instead of linkDown.
+    :param community: Community of the trap.
+    :return: bytes
+    """
+
+    bindings = [(_oid("1.3.6.1.2.1.1.3.0"), _tlv(0x43, (12345).to_bytes(2, "big"))),
+                (_oid("1.3.6.1.6.3.1.1.4.1.0"), _oid("1.3.6.1.6.3.1.1.5.4" if up else "1.3.6.1.6.3.1.1.5.3")),
+                (_oid(f"1.3.6.1.2.1.2.2.1.1.{if_index}"), _integer(if_index)),
+                (_oid(f"1.3.6.1.2.1.2.2.1.2.{if_index}"), _tlv(0x04, interface.encode()))]
+    variables = _tlv(0x30, b"".join(_tlv(0x30, oid + value) for oid, value in bindings))
+    pdu = _tlv(0xA7, _integer(random.randrange(1 << 30)) + _integer(0) + _integer(0) + variables)
+    return _tlv(0x30, _integer(1) + _tlv(0x04, community.encode()) + pdu)
+
+
+def syslog_messages() -> list[bytes]:
+    """
+    Get RouterOS log messages of all known events and some unknown ones.
+
+    :return: Syslog datagrams.
+    """
+
+    return [b"<30>Oct 18 12:00:00 router interface,info ether1 link down",
+            b"<30>Oct 18 12:00:01 router interface,info ether1 link up (speed 1G, full duplex)",
+            b"<134>system,info,account user admin logged in from 10.0.0.5 via winbox",
+            b"<134>system,info,account user admin logged out from 10.0.0.5 via winbox",
+            b"<131>system,error,critical login failure for user root from 10.0.0.9 via ssh",
+            b"<133>system,info ip address added by winbox-3.41/tcp-msg(winbox):admin@10.0.0.5 (*3 = /ip address add)",
+            b"<130>system,info,critical router rebooted",
+            b"<134>firewall,info input: in:ether1 out:(unknown 0), proto TCP (SYN), 10.0.0.9:51234->10.0.0.1:22",
+            b"<134>dhcp,info dhcp1 assigned 10.0.1.23 to 00:11:22:33:44:55"]
+
+
+def run(devices: int = 1000, datagrams: int = 50000, parse_iterations: int = 100000, batch_size: int = 1000,
+        chunk: int = 100, pause: float = 0.001) -> dict[str, float]:
+    """
+    Send locally generated syslog messages and SNMP traps over UDP to a listener writing into a temporary SQLite
+    database. The devices are simulated by the source addresses 127.0.x.y, so the loopback interface has to route
+    127.0.0.0/8, which it does on Linux.
+
+    :param devices: Number of simulated devices.
+    :param datagrams: Number of datagrams sent to the listener.
+    :param parse_iterations: Number of datagrams parsed without the listener.
+    :param batch_size: Maximum number of datagrams processed at once.
+    :param chunk: Number of datagrams sent at once.
+    :param pause: Seconds to wait between two chunks.
+    :return: Parsed and processed datagrams per second.
+    """
+
+    rnd = random.Random(0)
+    messages = syslog_messages()
+    traps = [link_trap(f"ether{i}", i, up=bool(i % 2)) for i in range(1, 9)]
+
+    start = time.perf_counter()
+    for i in range(parse_iterations):
+        parse_syslog(messages[i % len(messages)])
+    syslog_parsed = parse_iterations / (time.perf_counter() - start)
+    start = time.perf_counter()
+    for i in range(parse_iterations):
+        parse_trap(traps[i % len(traps)])
+    traps_parsed = parse_iterations / (time.perf_counter() - start)
+
+    addresses = [f"127.0.{1 + i // 250}.{1 + i % 250}" for i in range(devices)]
+    with tempfile.TemporaryDirectory() as directory:
+        path = Path(directory) / "db.sqlite"
+        engine = create_engine(f"sqlite:///{path}")
+        event.listen(engine, "connect", _sqlite_pragmas)
+        Device.metadata.create_all(bind=engine, tables=[Device.__table__, DeviceEvent.__table__,
+                                                              DeviceStatus.__table__])
+        with engine.begin() as connection:
+            connection.execute(insert(Device.__table__), [{"id": i, "name": f"device-{i}", "host": address,
+                                                           "username": "admin", "password": "", "tls": False}
+                                                          for i, address in enumerate(addresses)])
+        engine.dispose()
+
+        async def main() -> dict[str, float]:
+            async_engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+            event.listen(async_engine.sync_engine, "connect", _sqlite_pragmas)
+            session_maker = async_sessionmaker(async_engine, expire_on_commit=False)
+            listener = EventListener(session_maker=session_maker, batch_size=batch_size, store_messages=True)
+            ports = []
+            for _ in range(2):
+                with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as probe:
+                    probe.bind(("127.0.0.1", 0))
+                    ports.append(probe.getsockname()[1])
+            server = asyncio.create_task(listener.serve("127.0.0.1", syslog_port=ports[0], trap_port=ports[1]))
+            senders = []
+            try:
+                while listener.index.addresses.keys() != set(addresses):
+                    if server.done():
+                        server.result()
+                    await asyncio.sleep(0.01)
+                for address in addresses:
+                    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                    sender.bind((address, 0))
+                    senders.append(sender)
+
+                def send() -> None:
+                    # like devices, the datagrams are sent from outside the event loop of the listener
+                    for i in range(datagrams):
+                        if i % 4:
+                            rnd.choice(senders).sendto(rnd.choice(messages), ("127.0.0.1", ports[0]))
+                        else:
+                            rnd.choice(senders).sendto(rnd.choice(traps), ("127.0.0.1", ports[1]))
+                        if i % chunk == chunk - 1:
+                            time.sleep(pause)
+
+                start = time.perf_counter()
+                await asyncio.to_thread(send)
+                sent = time.perf_counter() - start
+                # done when everything received is stored and nothing arrived for a while
+                received, idle = -1, time.perf_counter()
+                while time.perf_counter() - idle < 0.5:
+                    if listener.received != received or listener.events + listener.dropped < listener.received:
+                        received, idle = listener.received, time.perf_counter()
+                    await asyncio.sleep(0.01)
+                elapsed = idle - start
+            finally:
+                server.cancel()
+                try:
+                    await server
+                except asyncio.CancelledError:
+                    pass
+                for sender in senders:
+                    sender.close()
+            async with session_maker() as session:
+                rows = await session.scalar(select(func.count()).select_from(DeviceEvent))
+            await async_engine.dispose()
+            return {"sent_per_second": datagrams / sent,
+                    "datagrams_per_second": listener.events / elapsed,
+                    "received": float(listener.received),
+                    # the kernel drops datagrams if the socket buffer overflows
+                    "lost": float(datagrams - listener.received - listener.dropped),
+                    "dropped": float(listener.dropped),
+                    "event_rows": float(rows)}
+
+        return {"devices": float(devices),
+                "syslog_parsed_per_second": syslog_parsed,
+                "traps_parsed_per_second": traps_parsed,
+                **asyncio.run(main())}
+
+
+if __name__ == "__main__":
+    for key, value in run().items():
+        print(f"{key}: {value:.2f}")
@@ -0,0 +1,216 @@
+import asyncio
+import multiprocessing
+import os
+import re
+import socket
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+import socketio
+
+from mikrotik_manager import __name__ as __module_name__
+from mikrotik_manager.settings import settings
+
+from benchmarks.suite import isolate
+
+PATHS = ("/dashboard", "/graphs", "/measurements", "/files")
+
+# path prefix of the websocket and the ID of the client, rendered into every page for its websocket connection
+PAGE_PREFIX = re.compile(r'prefix: "(?P<prefix>[^"]*)"')
+PAGE_CLIENT = re.compile(r"'client_id': '(?P<client_id>[^']+)', 'next_message_id': (?P<next_message_id>\d+)")
+
+
+def _serve(directory: str, sock: socket.socket, devices: int) -> None:
+    # the entry point of the server process, the settings are changed before the database is initialized
+    isolate(Path(directory))
+
+    from sqlalchemy import insert
+
+    from mikrotik_manager.db import Device, create_all, db
+    from mikrotik_manager.server import _serve as serve
+    from mikrotik_manager.worker import celery_app
+
+    # the status hub subscribes to the inventory deltas, there is no broker to talk to
+    celery_app.conf.broker_url = "memory://localhost/"
+    create_all()
+    with db().session_maker() as session, session.begin():
+        session.execute(insert(Device.__table__), [{"id": i, "name": f"device-{i:05d}", "host": f"10.0.{i // 256}.{i % 256}",
+                                                    "username": "admin", "password": "", "tls": False,
+                                                    "site": f"site-{i % 50}", "model": "RB5009UG+S+",
+                                                    "version": "7.16.1"} for i in range(1, devices + 1)])
+    serve(f"{__module_name__}.core_app:CoreApp", sock, {})
+
+
+def _rss_bytes(pid: int) -> float:
+    # resident memory of a process, only available on Linux
+    try:
+        with open(f"/proc/{pid}/statm") as file:
+            return float(int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE"))
+    except (OSError, ValueError, IndexError):
+        return 0.0
+
+
+async def _connect(server_url: str, http: httpx.AsyncClient, page: httpx.Response) -> socketio.AsyncClient:
+    # like a browser, the page connects its websocket and shakes hands, the server keeps its state until disconnect
+    prefix, client = PAGE_PREFIX.search(page.text), PAGE_CLIENT.search(page.text)
+    if prefix is None or client is None:
+        raise RuntimeError("The page has no websocket connection.")
+    sio = socketio.AsyncClient(reconnection=False)
+
+    @sio.on("run_javascript")
+    async def run_javascript(message: dict) -> None:
+        # there is no browser running the code, the awaited requests are answered with no result
+        if message.get("request_id"):
+            await sio.emit("javascript_response", {"request_id": message["request_id"],
+                                                   "client_id": client["client_id"],
+                                                   "result": None})
+
+    await sio.connect(f"{server_url}?client_id={client['client_id']}&next_message_id={client['next_message_id']}",
+                      headers={"Cookie": "; ".join(f"{name}={value}" for name, value in http.cookies.items())},
+                      transports=["websocket"],
+                      socketio_path=f"{prefix['prefix']}/_nicegui_ws/socket.io",
+                      wait_timeout=10)
+    try:
+        accepted = await sio.call("handshake", {"client_id": client["client_id"],
+                                                "document_id": os.urandom(8).hex(),
+                                                "tab_id": os.urandom(8).hex(),
+                                                "old_tab_id": None,
+                                                "next_message_id": int(client["next_message_id"])}, timeout=10)
+    except BaseException:
+        await sio.disconnect()
+        raise
+    if not accepted:
+        await sio.disconnect()
+        raise RuntimeError(f"The handshake of the client {client['client_id']} was refused.")
+    return sio
+
+
+def _percentile(values: list[float], percent: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+def run(clients: int = 50, requests: int = 20, devices: int = 1000, dwell: float = 1.0,
+        startup_timeout: float = 60.0) -> dict[str, float]:
+    """
+    Load a server process of the core app with many concurrent simulated clients. Every client has its own cookies,
+    like a browser, and loads the pages built by the layout one after another. Like a browser, every loaded page
+    connects its websocket and shakes hands, and the connection is closed when the client navigates to the next page.
+
+    :param clients: Number of concurrent clients.
+    :param requests: Number of page loads per client.
+    :param devices: Number of devices in the temporary database shown by the dashboard.
+    :param dwell: Seconds the last page of a client stays connected, it is not part of the page loads per second.
+    :param startup_timeout: Seconds to wait for the server process.
+    :return: Page loads per second, latency percentiles per page and of the websocket handshakes and the memory of
+             the server process.
+    """
+
+    with tempfile.TemporaryDirectory() as directory:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind(("127.0.0.1", 0))
+        sock.listen(2048)
+        sock.set_inheritable(True)
+        server_url = f"http://127.0.0.1:{sock.getsockname()[1]}"
+        base_url = f"{server_url}{settings.app_root_web_path}{settings.ui_web_path}"
+
+        process = multiprocessing.get_context("spawn").Process(target=_serve, args=(directory, sock, devices),
+                                                               name="benchmark-server", daemon=True)
+        process.start()
+
+        async def load(client: int, latencies: dict[str, list[float]], connects: list[float],
+                       errors: list[str]) -> float:
+            sio = None
+            async with httpx.AsyncClient(base_url=base_url, timeout=60.0) as http:
+                try:
+                    for i in range(requests):
+                        path = PATHS[(client + i) % len(PATHS)]
+                        start = time.perf_counter()
+                        try:
+                            response = await http.get(path)
+                            response.raise_for_status()
+                        except httpx.HTTPError as e:
+                            errors.append(f"{path}: {e}")
+                            continue
+                        finally:
+                            # like a browser, the previous page is left when the next one arrives
+                            if sio is not None:
+                                await sio.disconnect()
+                                sio = None
+                        latencies[path].append((time.perf_counter() - start) * 1000)
+                        start = time.perf_counter()
+                        try:
+                            sio = await _connect(server_url, http, response)
+                        except (socketio.exceptions.SocketIOError, RuntimeError, TimeoutError) as e:
+                            errors.append(f"{path} websocket: {e!r}")
+                            continue
+                        connects.append((time.perf_counter() - start) * 1000)
+                    finished = time.perf_counter()
+                    if sio is not None:
+                        # the last page stays open a moment, so the server gets the answers of its first requests
+                        await asyncio.sleep(dwell)
+                    return finished
+                finally:
+                    if sio is not None:
+                        await sio.disconnect()
+
+        async def main() -> dict[str, float]:
+            deadline = time.monotonic() + startup_timeout
+            async with httpx.AsyncClient(base_url=base_url, timeout=5.0) as http:
+                while True:
+                    if not process.is_alive():
+                        raise RuntimeError(f"The server process exited with code {process.exitcode}.")
+                    try:
+                        # the first load of every page also compiles it, it is not measured
+                        for path in PATHS:
+                            (await http.get(path)).raise_for_status()
+                        break
+                    except httpx.HTTPError:
+                        if time.monotonic() > deadline:
+                            raise
+                        await asyncio.sleep(0.2)
+            rss_before = _rss_bytes(process.pid)
+
+            latencies: dict[str, list[float]] = {path: [] for path in PATHS}
+            connects: list[float] = []
+            errors: list[str] = []
+            start = time.perf_counter()
+            finished = await asyncio.gather(*(load(client, latencies, connects, errors) for client in range(clients)))
+            elapsed = max(finished) - start
+
+            loads = [latency for path in PATHS for latency in latencies[path]]
+            if not loads:
+                raise RuntimeError(f"No page could be loaded: {errors[:3]}")
+            report = {"clients": float(clients),
+                      "pages_per_second": len(loads) / elapsed,
+                      "errors": float(len(errors)),
+                      "p50_ms": statistics.median(loads),
+                      "p95_ms": _percentile(loads, 95),
+                      "p99_ms": _percentile(loads, 99)}
+            if connects:
+                report["websocket_p50_ms"] = statistics.median(connects)
+                report["websocket_p95_ms"] = _percentile(connects, 95)
+            for path in PATHS:
+                if latencies[path]:
+                    report[f"{path.strip('/')}_p50_ms"] = statistics.median(latencies[path])
+            report["server_rss_bytes"] = _rss_bytes(process.pid)
+            report["server_rss_growth_bytes"] = report["server_rss_bytes"] - rss_before
+            return report
+
+        try:
+            return asyncio.run(main())
+        finally:
+            process.terminate()
+            process.join(10.0)
+            if process.is_alive():
+                process.kill()
+            sock.close()
+
+
+if __name__ == "__main__":
+    for key, value in run().items():
+        print(f"{key}: {value:.2f}")
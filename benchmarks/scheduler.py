@@ -0,0 +1,103 @@
+import random
+import statistics
+from collections import Counter
+
+from mikrotik_manager.scheduler import FleetScheduler, HashRing
+
+
+def smoothness(dispatches: Counter, seconds: int) -> dict[str, float]:
+    """
+    Measure the smoothness of a load curve.
+
+    :param dispatches: Number of dispatched polls per second.
+    :param seconds: Length of the measured period in seconds.
+    :return: Peak to mean ratio and coefficient of variation of the polls per second.
+    """
+
+    curve = [dispatches.get(second, 0) for second in range(seconds)]
+    mean = statistics.fmean(curve)
+    return {"peak_to_mean": max(curve) / mean if mean else 0.0,
+            "coefficient_of_variation": statistics.pstdev(curve) / mean if mean else 0.0}
+
+
+def simulate_naive(devices: int, interval: int, cycles: int) -> Counter:
+    """
+    Simulate one periodic task per device, all started at the same time.
+
+    :param devices: Number of devices.
+    :param interval: Poll interval in seconds.
+    :param cycles: Number of simulated intervals.
+    :return: Number of dispatched polls per second.
+    """
+
+    return Counter({cycle * interval: devices for cycle in range(cycles)})
+
+
+def simulate_fleet(devices: int, interval: int, cycles: int, failing: float, slow: float,
+                   seed: int) -> tuple[Counter, FleetScheduler]:
+    """
+    Simulate the fleet scheduler with a tick of one second. Some devices fail, some answer slowly.
+
+    :param devices: Number of devices.
+    :param interval: Poll interval in seconds.
+    :param cycles: Number of simulated intervals.
+    :param failing: Fraction of failing devices.
+    :param slow: Fraction of slow devices.
+    :param seed: Seed of the simulation.
+    :return: Number of dispatched polls per second and the scheduler.
+    """
+
+    rng = random.Random(seed)
+    scheduler = FleetScheduler(interval=interval, jitter=0.1, max_interval=interval * 8, slow_rtt=5.0, seed=seed)
+    scheduler.sync(range(devices), now=0.0)
+    sample = rng.sample(range(devices), int(devices * (failing + slow)))
+    failing_devices = set(sample[:int(devices * failing)])
+    slow_devices = set(sample[int(devices * failing):])
+    dispatches: Counter = Counter()
+    for second in range(interval * cycles):
+        for device_ids in scheduler.due(now=float(second)).values():
+            dispatches[second] += len(device_ids)
+            for device_id in device_ids:
+                ok = device_id not in failing_devices
+                scheduler.report(device_id, ok=ok, rtt=8.0 if device_id in slow_devices else 0.2, now=second + 0.5)
+    return dispatches, scheduler
+
+
+def run(devices: int = 10000, interval: int = 300, cycles: int = 6, nodes: int = 8, failing: float = 0.05,
+        slow: float = 0.05, seed: int = 1) -> dict[str, float]:
+    """
+    Compare the load curve of naive periodic polling with the fleet scheduler and measure the sharding.
+
+    :param devices: Number of simulated devices.
+    :param interval: Poll interval in seconds.
+    :param cycles: Number of simulated intervals.
+    :param nodes: Number of worker nodes.
+    :param failing: Fraction of failing devices.
+    :param slow: Fraction of slow devices.
+    :param seed: Seed of the simulation.
+    :return: Smoothness of both load curves, the shard balance and the moved devices when adding a node.
+    """
+
+    seconds = interval * cycles
+    report = {}
+    for key, value in smoothness(simulate_naive(devices, interval, cycles), seconds).items():
+        report[f"naive_{key}"] = value
+    # the first interval only fills up, the steady state is measured
+    dispatches, scheduler = simulate_fleet(devices, interval, cycles, failing, slow, seed)
+    steady = Counter({second - interval: count for second, count in dispatches.items() if second >= interval})
+    for key, value in smoothness(steady, seconds - interval).items():
+        report[f"fleet_{key}"] = value
+    report["fleet_backed_off"] = float(sum(1 for d in range(devices) if scheduler.state(d).interval > interval))
+
+    ring = HashRing(f"node-{i}" for i in range(nodes))
+    before = {d: ring.node(str(d)) for d in range(devices)}
+    shards = Counter(before.values())
+    report["shard_max_to_mean"] = max(shards.values()) / (devices / nodes)
+    ring.add(f"node-{nodes}")
+    report["moved_on_add"] = sum(1 for d in range(devices) if ring.node(str(d)) != before[d]) / devices
+    return report
+
+
+if __name__ == "__main__":
+    for key, value in run().items():
+        print(f"{key}: {value:.3f}")
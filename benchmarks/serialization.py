@@ -0,0 +1,86 @@
+import json
+import random
+import time
+from typing import Any, Callable
+
+from mikrotik_manager.serialization import make_codec
+
+
+def make_export(seed: int, lines: int = 2000) -> str:
+    """
+    Generate a realistic looking RouterOS '/export' output.
+
+    :param seed: Seed of the generated values, so every router differs.
+    :param lines: Approximate number of lines.
+    :return: str
+    """
+
+    rnd = random.Random(seed)
+    export = [f"# 2026-01-01 00:00:00 by RouterOS 7.16.1\n# software id = {rnd.randrange(16 ** 8):08X}\n#",
+              "# model = RB5009UG+S+\n# serial number = HG" + str(rnd.randrange(10 ** 9)),
+              "/interface bridge\nadd admin-mac=48:A9:8A:00:00:01 auto-mac=no name=bridge vlan-filtering=yes"]
+    export.append("/interface vlan")
+    for vlan in range(lines // 20):
+        export.append(f"add interface=bridge name=vlan{vlan + 10} vlan-id={vlan + 10}")
+    export.append("/ip address")
+    for vlan in range(lines // 20):
+        export.append(f"add address=10.{seed % 250}.{vlan}.1/24 interface=vlan{vlan + 10} network=10.{seed % 250}.{vlan}.0")
+    export.append("/ip firewall filter")
+    while len(export) < lines:
+        chain = rnd.choice(["input", "forward", "output"])
+        action = rnd.choice(["accept", "drop", "reject", "jump jump-target=custom"])
+        export.append(f"add action={action} chain={chain} comment=\"rule {len(export)}\" "
+                      f"dst-port={rnd.randrange(1, 65535)} protocol={rnd.choice(['tcp', 'udp'])} "
+                      f"src-address=10.{rnd.randrange(256)}.{rnd.randrange(256)}.0/24")
+    return "\n".join(export)
+
+
+def make_payload(routers: int, lines: int) -> list[dict[str, Any]]:
+    return [{"id": i, "hostname": f"router-{i}", "export": make_export(seed=i, lines=lines)} for i in range(routers)]
+
+
+def _measure(encode: Callable[[Any], bytes], decode: Callable[[bytes], Any], payload: Any,
+             repeat: int) -> tuple[int, float, float]:
+    data = encode(payload)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        data = encode(payload)
+    encode_time = (time.perf_counter() - start) / repeat
+    start = time.perf_counter()
+    for _ in range(repeat):
+        decode(data)
+    decode_time = (time.perf_counter() - start) / repeat
+    return len(data), encode_time, decode_time
+
+
+def run(routers: int = 100, lines: int = 2000, repeat: int = 3, compression_threshold: int = 16384) -> dict[str, float]:
+    """
+    Compare payload size and encode/decode time of the available serializers on RouterOS export samples.
+
+    :param routers: Number of routers in the payload.
+    :param lines: Approximate number of lines per export.
+    :param repeat: Number of repetitions per measurement.
+    :param compression_threshold: Compression threshold of the serializers.
+    :return: Size in bytes and milliseconds per encode/decode for every serializer.
+    """
+
+    payload = make_payload(routers=routers, lines=lines)
+    codecs = {"plain_json": (lambda obj: json.dumps(obj).encode("utf-8"), lambda data: json.loads(data))}
+    for serializer in ("json", "msgpack"):
+        try:
+            codecs[serializer] = make_codec(serializer, compression_threshold)
+        except RuntimeError:
+            continue
+
+    report = {}
+    for name, (encode, decode) in codecs.items():
+        size, encode_time, decode_time = _measure(encode, decode, payload, repeat)
+        report[f"{name}_bytes"] = float(size)
+        report[f"{name}_encode_ms"] = encode_time * 1000
+        report[f"{name}_decode_ms"] = decode_time * 1000
+    return report
+
+
+if __name__ == "__main__":
+    for key, value in run().items():
+        print(f"{key}: {value:.2f}")
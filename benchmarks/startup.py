@@ -0,0 +1,25 @@
+from mikrotik_manager.startup import COMMAND_MODULES, measure_help, profile_imports
+
+
+def run(repeat: int = 3) -> dict[str, float]:
+    """
+    Measure the startup time of the CLI and the imports of every command in fresh interpreters.
+
+    :param repeat: Number of runs of every measurement, the fastest one is reported.
+    :return: Seconds of '--help' and of the imports of every command.
+    """
+
+    report = {"help_s": measure_help(repeat=repeat)}
+    for command, modules in COMMAND_MODULES.items():
+        wall_times = []
+        for _ in range(repeat):
+            wall_time, import_times = profile_imports(modules)
+            wall_times.append(wall_time)
+        report[f"{command}_import_s"] = min(wall_times)
+        report[f"{command}_modules"] = float(len(import_times))
+    return report
+
+
+if __name__ == "__main__":
+    for key, value in run().items():
+        print(f"{key}: {value:.3f}")
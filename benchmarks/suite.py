@@ -0,0 +1,187 @@
+import importlib
+import json
+import multiprocessing
+import platform
+import re
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable
+
+from mikrotik_manager import __name__ as __module_name__, __version__
+from mikrotik_manager.settings import settings
+
+# parameters of every benchmark, the quick ones only check that nothing is broken
+BENCHMARKS: dict[str, dict[str, dict[str, Any]]] = {
+    "startup": {"full": {}, "quick": {"repeat": 1}},
+    "layout": {"full": {}, "quick": {"iterations": 2000}},
+    "pages": {"full": {}, "quick": {"clients": 5, "requests": 4, "devices": 100}},
+    "serialization": {"full": {}, "quick": {"routers": 10, "lines": 500, "repeat": 1}},
+    "fleet": {"full": {}, "quick": {"devices": 200, "concurrency": 64, "failing": 5}},
+    "worker": {"full": {}, "quick": {"devices": 200, "batch_size": 50, "pings": 20}},
+    "scheduler": {"full": {}, "quick": {"devices": 1000}},
+    "db": {"full": {}, "quick": {"devices": 1000, "updates": 10000, "naive_updates": 200}},
+    "timeseries": {"full": {}, "quick": {"devices": 5, "days": 3, "repeat": 1}},
+    "listener": {"full": {}, "quick": {"devices": 50, "datagrams": 2000, "parse_iterations": 5000}},
+}
+
+# direction of the metrics by name, all others are informational and not compared
+HIGHER_IS_BETTER = re.compile(r"(_per_second|speedup)$")
+LOWER_IS_BETTER = re.compile(r"(_ms|_us|_s|_bytes|_us_per_request|_per_series_and_day|peak_to_mean|"
+                             r"coefficient_of_variation|max_to_mean|moved_on_add|lost)$")
+
+
+def isolate(directory: Path) -> None:
+    """
+    Point the database, the result backend and the UI storage of this process to a directory, so a benchmark does
+    not touch the configured ones. It has to be called before the database is initialized.
+
+    :param directory: Directory of the temporary files.
+    :return: None
+    :raises RuntimeError: If the database of this process is already initialized.
+    """
+
+    if f"{__module_name__}.db" in sys.modules:
+        raise RuntimeError("The database is already initialized, the benchmark has to run in a process of its own.")
+    directory.mkdir(parents=True, exist_ok=True)
+    (directory / "db.sqlite").touch()
+    # the settings are frozen, they are replaced as a whole like on a reload
+    object.__setattr__(settings, "__dict__", settings.model_copy(update={
+        "db_protocol": "sqlite",
+        "db_file": directory / "db.sqlite",
+        "result_backend": "sqlite",
+        "result_backend_file": directory / "results.sqlite",
+        "ui_storage_backend": "file",
+        "ui_storage_path": directory / "storage",
+        "server_workers": 1,
+        "settings_reload_interval": 0.0}).__dict__)
+
+
+def _run(name: str, params: dict[str, Any]) -> tuple[dict[str, float], float]:
+    # the entry point of a benchmark process
+    module = importlib.import_module(f"{__package__}.{name}")
+    start = time.perf_counter()
+    metrics = module.run(**params)
+    return {key: float(value) for key, value in metrics.items()}, time.perf_counter() - start
+
+
+def run_suite(names: list[str] | None = None,
+              quick: bool = False,
+              on_result: Callable[[str, dict[str, float] | None, str | None], None] | None = None) -> dict[str, Any]:
+    """
+    Run benchmarks, each in a fresh process, so they neither share imports nor a database.
+
+    :param names: Names of the benchmarks. If None, all are run.
+    :param quick: Use the quick parameters.
+    :param on_result: Called with the name, the metrics and the error of every finished benchmark.
+    :return: Report with the metrics of the benchmarks and the environment they ran in.
+    :raises ValueError: If a benchmark is unknown.
+    """
+
+    names = names or list(BENCHMARKS)
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        raise ValueError(f"Unknown benchmarks {', '.join(unknown)}, known are {', '.join(BENCHMARKS)}.")
+
+    report = {"version": __version__,
+              "python": platform.python_version(),
+              "platform": platform.platform(),
+              "cpus": multiprocessing.cpu_count(),
+              "created": datetime.now(timezone.utc).isoformat(),
+              "quick": quick,
+              "benchmarks": {},
+              "durations": {},
+              "errors": {}}
+    context = multiprocessing.get_context("spawn")
+    for name in names:
+        params = BENCHMARKS[name]["quick" if quick else "full"]
+        metrics, error = None, None
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            try:
+                metrics, duration = executor.submit(_run, name, params).result()
+                report["benchmarks"][name] = metrics
+                report["durations"][name] = duration
+            except Exception as e:
+                error = "".join(traceback.format_exception_only(e)).strip()
+                report["errors"][name] = error
+        if on_result is not None:
+            on_result(name, metrics, error)
+    return report
+
+
+def save_report(report: dict[str, Any], path: Path) -> None:
+    """
+    Save a report as JSON.
+
+    :param report: Report of run_suite.
+    :param path: Path of the file.
+    :return: None
+    """
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(report, indent=2, sort_keys=True))
+
+
+def load_report(path: Path) -> dict[str, Any]:
+    """
+    Load a report saved by save_report.
+
+    :param path: Path of the file.
+    :return: Report
+    """
+
+    return json.loads(path.read_text())
+
+
+def direction(metric: str) -> int:
+    """
+    Get the direction of a metric.
+
+    :param metric: Name of the metric.
+    :return: 1 if higher is better, -1 if lower is better, 0 if it is informational.
+    """
+
+    if HIGHER_IS_BETTER.search(metric):
+        return 1
+    if LOWER_IS_BETTER.search(metric):
+        return -1
+    return 0
+
+
+def compare(baseline: dict[str, Any], current: dict[str, Any], threshold: float = 0.1) -> list[dict[str, Any]]:
+    """
+    Compare the metrics of two reports, e.g. of the last release and of the current tree.
+
+    :param baseline: Report to compare against.
+    :param current: Report to compare.
+    :param threshold: Relative change of a metric from which it counts as regressed or improved.
+    :return: One row per metric of both reports with 'benchmark', 'metric', 'baseline', 'current', 'change' and
+             'state', which is 'regressed', 'improved', 'unchanged' or 'info'.
+    """
+
+    rows = []
+    for name, metrics in current["benchmarks"].items():
+        for metric, value in metrics.items():
+            old = baseline["benchmarks"].get(name, {}).get(metric)
+            if old is None:
+                continue
+            change = (value - old) / abs(old) if old else 0.0
+            sign = direction(metric)
+            if not sign:
+                state = "info"
+            elif change * sign < -threshold:
+                state = "regressed"
+            elif change * sign > threshold:
+                state = "improved"
+            else:
+                state = "unchanged"
+            rows.append({"benchmark": name,
+                         "metric": metric,
+                         "baseline": old,
+                         "current": value,
+                         "change": change,
+                         "state": state})
+    return rows
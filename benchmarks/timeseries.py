@@ -0,0 +1,72 @@
+import math
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.orm import sessionmaker
+
+from mikrotik_manager.db import MetricBlock, MetricSample, MetricSeries
+from mikrotik_manager.timeseries import MetricStore
+
+
+def run(devices: int = 50, interfaces: int = 4, days: int = 30, step: int = 600, repeat: int = 5) -> dict[str, float]:
+    """
+    Write the traffic of a simulated fleet into a temporary SQLite metric store and query it.
+
+    :param devices: Number of simulated devices.
+    :param interfaces: Number of interfaces per device, each has a rx and a tx series.
+    :param days: Number of simulated days.
+    :param step: Seconds between two samples.
+    :param repeat: Number of runs of every query, the median is reported.
+    :return: Write and query times and the storage size.
+    """
+
+    with tempfile.TemporaryDirectory() as directory:
+        engine = create_engine(f"sqlite:///{Path(directory) / 'metrics.sqlite'}")
+        MetricSeries.metadata.create_all(bind=engine, tables=[MetricSeries.__table__, MetricBlock.__table__,
+                                                              MetricSample.__table__])
+        store = MetricStore(session_maker=sessionmaker(bind=engine))
+
+        names = [f"interface/ether{i}/{direction}_bps" for i in range(1, interfaces + 1) for direction in ("rx", "tx")]
+        end = int(time.time()) // 86400 * 86400
+        start = end - days * 86400
+        samples = 0
+        write_time = 0.0
+        # one bulk write per simulated hour, merged into the blocks once per simulated day
+        for hour_start in range(start, end, 3600):
+            batch = [(device_id, name, timestamp, 1e6 * (1 + math.sin(timestamp / 3600 + device_id)))
+                     for timestamp in range(hour_start, hour_start + 3600, step)
+                     for device_id in range(1, devices + 1)
+                     for name in names]
+            begin = time.perf_counter()
+            store.write(batch)
+            if (hour_start + 3600) % 86400 == 0:
+                store.compact()
+            write_time += time.perf_counter() - begin
+            samples += len(batch)
+
+        series_ids = [s["id"] for s in store.series(range(1, devices + 1))]
+        report = {"series": float(len(series_ids)), "samples_per_second": samples / write_time}
+        # graphs only need the average, tables all aggregates
+        for name, duration, aggregates in (("24h_avg", 86400, ("avg",)),
+                                           ("30d_avg", days * 86400, ("avg",)),
+                                           ("30d_all", days * 86400, ("avg", "min", "max"))):
+            times = []
+            for _ in range(repeat):
+                begin = time.perf_counter()
+                timestamps, _ = store.query(series_ids, start=end - duration, end=end, aggregates=aggregates)
+                times.append((time.perf_counter() - begin) * 1000)
+            report[f"query_{name}_ms"] = statistics.median(times)
+            report[f"query_{name}_points"] = float(len(timestamps))
+        with store.session_maker() as session:
+            size = session.execute(select(func.sum(func.length(MetricBlock.data)))).scalar_one()
+        report["bytes_per_series_and_day"] = size / len(series_ids) / days
+        engine.dispose()
+        return report
+
+
+if __name__ == "__main__":
+    for key, value in run().items():
+        print(f"{key}: {value:.2f}")
@@ -0,0 +1,101 @@
+import asyncio
+import statistics
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from benchmarks.suite import isolate
+
+
+def run(devices: int = 2000, batch_size: int = 100, concurrency: int = 4, latency: float = 0.002,
+        pings: int = 200) -> dict[str, float]:
+    """
+    Run a Celery worker with the in-memory broker in this process and measure the task throughput against a
+    simulated fleet served by the fake RouterOS API server. The database is a temporary SQLite file, so this has to
+    run in a process of its own.
+
+    :param devices: Number of simulated devices.
+    :param batch_size: Number of devices per batch task.
+    :param concurrency: Number of worker threads.
+    :param latency: Simulated latency per command in seconds.
+    :param pings: Number of empty tasks for the round trip and overhead measurements.
+    :return: Tasks and devices per second and the round trip time of an empty task.
+    """
+
+    with tempfile.TemporaryDirectory() as directory:
+        isolate(Path(directory))
+
+        from celery.contrib.testing.worker import start_worker
+        from sqlalchemy import insert
+
+        from mikrotik_manager.db import Device, create_all, db
+        from mikrotik_manager.results import get_result_stream, get_task_keys
+        from mikrotik_manager.routeros.fake import FakeRouterOsServer
+        from mikrotik_manager.tasks import fetch_device_info_batch, test
+        from mikrotik_manager.tasks.base import BaseTask
+        from mikrotik_manager.worker import celery_app
+
+        from benchmarks.fleet import raise_open_files_limit
+
+        # the in-memory broker polls its queues, once a second by default
+        celery_app.conf.update(broker_url="memory://",
+                               broker_transport_options={"polling_interval": 0.001},
+                               result_backend="cache+memory://")
+        # each simulated device keeps one pooled session open
+        devices = min(devices, max((raise_open_files_limit() - 100) // 2, 1))
+        create_all()
+        # creating the stores before the worker threads race for them
+        get_result_stream()
+        get_task_keys()
+
+        # the fake devices answer on a loop of their own, like real devices do
+        loop = asyncio.new_event_loop()
+        thread = threading.Thread(target=loop.run_forever, name="fake-fleet", daemon=True)
+        thread.start()
+        server = FakeRouterOsServer(latency=latency)
+        asyncio.run_coroutine_threadsafe(server.start(), loop).result()
+        try:
+            fleet = [{"id": i + 1, "host": server.host, "port": server.port, "username": f"device-{i}",
+                      "password": "", "tls": False} for i in range(devices)]
+            with db().session_maker() as session, session.begin():
+                session.execute(insert(Device.__table__), [{**device, "name": device["username"]} for device in fleet])
+            batches = [[device["id"] for device in fleet[i:i + batch_size]] for i in range(0, devices, batch_size)]
+
+            report = {"devices": float(devices)}
+            with start_worker(celery_app, pool="threads", concurrency=concurrency, perform_ping_check=False,
+                              queues=["interactive", "bulk"], shutdown_timeout=30.0):
+                round_trips = []
+                for _ in range(pings):
+                    start = time.perf_counter()
+                    test.delay().get(timeout=30, interval=0.001)
+                    round_trips.append((time.perf_counter() - start) * 1000)
+                report["empty_task_round_trip_ms"] = statistics.median(round_trips)
+
+                start = time.perf_counter()
+                for result in [test.delay() for _ in range(pings)]:
+                    result.get(timeout=30, interval=0.001)
+                report["empty_tasks_per_second"] = pings / (time.perf_counter() - start)
+
+                # connecting first, then with pooled sessions, then identical calls sharing the result
+                for name, force in (("cold", False), ("warm", True), ("shared", False)):
+                    start = time.perf_counter()
+                    results = [fetch_device_info_batch.apply_async(args=[batch], force=force) for batch in batches]
+                    summaries = [result.get(timeout=300, interval=0.001) for result in results]
+                    elapsed = time.perf_counter() - start
+                    report[f"{name}_devices_per_second"] = devices / elapsed
+                    report[f"{name}_tasks_per_second"] = len(batches) / elapsed
+                    report[f"{name}_failed"] = float(sum(summary["failed"] for summary in summaries))
+            BaseTask.shutdown_runtime()
+            report["sessions"] = float(server.sessions)
+            return report
+        finally:
+            asyncio.run_coroutine_threadsafe(server.stop(), loop).result()
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join()
+            db().engine.dispose()
+
+
+if __name__ == "__main__":
+    for key, value in run().items():
+        print(f"{key}: {value:.2f}")
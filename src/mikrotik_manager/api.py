@@ -0,0 +1,105 @@
+import secrets
+from typing import Any
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+from pydantic import BaseModel, Field
+
+from mikrotik_manager.db import async_session_maker
+from mikrotik_manager.device_status import find_devices
+from mikrotik_manager.jobs import get_job_store, start_job
+from mikrotik_manager.settings import settings
+
+_bearer = HTTPBearer(auto_error=False)
+
+
+def authenticate(credentials: HTTPAuthorizationCredentials | None = Depends(_bearer)) -> None:
+    if settings.app_api_token is None:
+        raise HTTPException(status_code=403, detail="The API is disabled, no token is configured.")
+    if credentials is None or not secrets.compare_digest(credentials.credentials.encode(),
+                                                         settings.app_api_token.encode()):
+        raise HTTPException(status_code=401, detail="Invalid token.", headers={"WWW-Authenticate": "Bearer"})
+
+
+api_router = APIRouter(prefix="/api", dependencies=[Depends(authenticate)])
+
+
+class JobCreate(BaseModel):
+    action: str = Field(description="Name of the action, e.g. 'reboot', 'upgrade' or 'backup'.")
+    device_ids: list[int] = Field(min_length=1, description="IDs of the devices.")
+    params: dict[str, Any] = Field(default_factory=dict, description="Parameters passed to the action.")
+    wave_size: int | None = Field(default=None, ge=1, description="Number of devices per wave.")
+    wave_interval: float | None = Field(default=None, ge=0, description="Seconds to wait between two waves.")
+    concurrency: int | None = Field(default=None, ge=1, description="Maximum number of devices at the same time.")
+    site_concurrency: int | None = Field(default=None, ge=1, description="Maximum number of devices of a site at the same time.")
+    rate: float | None = Field(default=None, gt=0, description="Number of devices per second the action is started on.")
+    burst: int | None = Field(default=None, ge=1, description="Number of devices the action may start on at once.")
+    max_failure_ratio: float | None = Field(default=None, ge=0, le=1, description="Share of failed devices of a wave above which the job is paused.")
+
+
+def _progress(job_id: int) -> dict[str, Any]:
+    try:
+        return get_job_store().progress(job_id)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+
+@api_router.get("/devices")
+async def list_devices(site: str | None = None,
+                       tag: str | None = None,
+                       status: str | None = None,
+                       limit: int = Query(100, ge=1, le=1000),
+                       offset: int = Query(0, ge=0)) -> list[dict[str, Any]]:
+    try:
+        session_maker = async_session_maker()
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return await find_devices(session_maker, site=site, tag=tag, status=status, limit=limit, offset=offset)
+
+
+@api_router.get("/jobs")
+def list_jobs(limit: int = Query(50, ge=1, le=1000)) -> list[dict[str, Any]]:
+    return get_job_store().jobs(limit=limit)
+
+
+@api_router.post("/jobs", status_code=201)
+def create_job(job: JobCreate) -> dict[str, Any]:
+    from mikrotik_manager.tasks.jobs import validate_params
+
+    try:
+        params = validate_params(job.action, job.params)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    job_id = get_job_store().create(**job.model_dump(exclude={"params"}), params=params)
+    start_job(job_id)
+    return _progress(job_id)
+
+
+@api_router.get("/jobs/{job_id}")
+def get_job(job_id: int) -> dict[str, Any]:
+    return _progress(job_id)
+
+
+@api_router.post("/jobs/{job_id}/pause")
+def pause_job(job_id: int) -> dict[str, Any]:
+    progress = _progress(job_id)
+    if not get_job_store().pause(job_id):
+        raise HTTPException(status_code=409, detail=f"Job {job_id} is {progress['state']}.")
+    return _progress(job_id)
+
+
+@api_router.post("/jobs/{job_id}/resume")
+def resume_job(job_id: int) -> dict[str, Any]:
+    progress = _progress(job_id)
+    if not get_job_store().resume(job_id):
+        raise HTTPException(status_code=409, detail=f"Job {job_id} is {progress['state']}.")
+    start_job(job_id)
+    return _progress(job_id)
+
+
+@api_router.post("/jobs/{job_id}/abort")
+def abort_job(job_id: int) -> dict[str, Any]:
+    progress = _progress(job_id)
+    if not get_job_store().abort(job_id):
+        raise HTTPException(status_code=409, detail=f"Job {job_id} is {progress['state']}.")
+    return _progress(job_id)
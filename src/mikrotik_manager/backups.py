@@ -0,0 +1,364 @@
+import hashlib
+import logging
+import os
+import tempfile
+import time
+import zlib
+from datetime import datetime, timedelta, timezone
+from difflib import SequenceMatcher
+from functools import cache
+from pathlib import Path
+from typing import BinaryIO, Iterator
+
+from sqlalchemy import delete, func, select
+from sqlalchemy.orm import sessionmaker
+
+from mikrotik_manager.db import db, Backup
+from mikrotik_manager.settings import settings
+
+logger = logging.getLogger(__name__)
+
+KINDS = ("export", "backup")
+
+# a manifest entry is the digest of a chunk and its number of lines
+_ENTRY_SIZE = 32 + 4
+
+
+def _count_lines(data: bytes) -> int:
+    # a chunk may end within a line, e.g. after a very long line, which counts as a line of its own
+    return data.count(b"\n") + (not data.endswith(b"\n"))
+
+
+def _is_header(line: bytes) -> bool:
+    # the first line of an export is the time it was made
+    return line.startswith(b"# ") and b" by RouterOS" in line
+
+
+def _split_lines(data: bytes) -> list[str]:
+    # only newlines separate lines, unlike str.splitlines, so the lines match _count_lines
+    lines = data.decode("utf-8", errors="replace").split("\n")
+    return [f"{line}\n" for line in lines[:-1]] + ([lines[-1]] if lines[-1] else [])
+
+
+def _format_range(start: int, length: int) -> str:
+    # line range of a unified diff hunk header
+    if length == 1:
+        return f"{start + 1}"
+    if length == 0:
+        return f"{start},0"
+    return f"{start + 1},{length}"
+
+
+class BackupStore:
+    def __init__(self,
+                 directory: Path,
+                 session_maker: sessionmaker,
+                 average_lines: int = 64,
+                 max_chunk_size: int = 65536,
+                 compression_level: int = 6):
+        """
+        Create a new backup store. Backups are split into chunks which are stored compressed and content-addressed
+        on disk, so a chunk shared by several versions or devices is stored once. A version is a manifest of its
+        chunks in the database.
+
+        Exports are cut before every section header and after lines whose hash is a multiple of average_lines, so
+        the chunks of a section stay aligned when lines are inserted or removed. The timestamp header of an export
+        is a chunk of its own, so it does not change the first chunk of every version. Binary backups are cut into
+        chunks of max_chunk_size.
+
+        :param directory: Directory of the chunks.
+        :param session_maker: Session maker of the database.
+        :param average_lines: Average number of lines per chunk within a section of an export.
+        :param max_chunk_size: Maximum size of a chunk in bytes.
+        :param compression_level: zlib compression level of the chunks.
+        """
+
+        self.directory = Path(directory)
+        self.session_maker = session_maker
+        self.average_lines = average_lines
+        self.max_chunk_size = max_chunk_size
+        self.compression_level = compression_level
+
+        self.objects_directory = self.directory / "objects"
+        self.temp_directory = self.directory / "tmp"
+        self.objects_directory.mkdir(parents=True, exist_ok=True)
+        self.temp_directory.mkdir(parents=True, exist_ok=True)
+
+    def __str__(self):
+        return f"{self.__class__.__name__}({self.directory})"
+
+    def temp_file(self) -> Path:
+        """
+        Create a temporary file within the store, e.g. to stream a backup from a device into.
+
+        :return: Path of the file.
+        """
+
+        fd, path = tempfile.mkstemp(dir=self.temp_directory)
+        os.close(fd)
+        return Path(path)
+
+    def _object_path(self, digest: bytes) -> Path:
+        name = digest.hex()
+        return self.objects_directory / name[:2] / name
+
+    def _put_object(self, data: bytes) -> bytes:
+        digest = hashlib.sha256(data).digest()
+        path = self._object_path(digest)
+        try:
+            # a reused chunk is touched, so the garbage collection keeps it until the version is added
+            os.utime(path)
+            return digest
+        except FileNotFoundError:
+            pass
+        path.parent.mkdir(exist_ok=True)
+        # writing to a temporary file first, so a chunk is never visible half written
+        temp = self.temp_file()
+        temp.write_bytes(zlib.compress(data, self.compression_level))
+        os.replace(temp, path)
+        return digest
+
+    def _get_object(self, digest: bytes) -> bytes:
+        return zlib.decompress(self._object_path(digest).read_bytes())
+
+    def _chunks(self, file: BinaryIO, kind: str) -> Iterator[tuple[bytes, int]]:
+        if kind == "backup":
+            while data := file.read(self.max_chunk_size):
+                yield data, 0
+            return
+
+        # the timestamp header changes with every export, it is a chunk of its own
+        header = file.readline(self.max_chunk_size)
+        if _is_header(header):
+            yield header, _count_lines(header)
+            header = b""
+        chunk = bytearray()
+        while line := header or file.readline(self.max_chunk_size):
+            header = b""
+            # every section starts a new chunk, so unchanged sections are shared between versions
+            if line.startswith(b"/") and chunk:
+                yield bytes(chunk), _count_lines(chunk)
+                chunk = bytearray()
+            chunk += line
+            if zlib.crc32(line) % self.average_lines == 0 or len(chunk) >= self.max_chunk_size:
+                yield bytes(chunk), _count_lines(chunk)
+                chunk = bytearray()
+        if chunk:
+            yield bytes(chunk), _count_lines(chunk)
+
+    def add(self, device_id: int, path: Path, kind: str = "export") -> tuple[int, bool]:
+        """
+        Add a backup file to the store. It is read in chunks, so its size does not matter. If the content equals
+        the latest version of the device, no new version is created.
+
+        :param device_id: ID of the device.
+        :param path: Path of the file.
+        :param kind: 'export' for a configuration export or 'backup' for a binary backup.
+        :return: ID of the version and whether it is new.
+        """
+
+        if kind not in KINDS:
+            raise ValueError(f"Unknown backup kind '{kind}'.")
+        content_hash = hashlib.sha256()
+        manifest = bytearray()
+        size = 0
+        lines = 0
+        first = True
+        with open(path, "rb") as file:
+            for data, chunk_lines in self._chunks(file, kind):
+                manifest += self._put_object(data) + chunk_lines.to_bytes(4, "little")
+                # the timestamp header is not part of the content
+                if not (first and kind == "export" and _is_header(data)):
+                    content_hash.update(data)
+                first = False
+                size += len(data)
+                lines += chunk_lines
+
+        now = datetime.now(timezone.utc)
+        with self.session_maker() as session, session.begin():
+            latest = session.execute(select(Backup)
+                                     .where(Backup.device_id == device_id, Backup.kind == kind)
+                                     .order_by(Backup.created.desc(), Backup.id.desc())
+                                     .limit(1)).scalar_one_or_none()
+            if latest is not None and latest.content_hash == content_hash.hexdigest():
+                latest.checked = now
+                return latest.id, False
+            backup = Backup(device_id=device_id,
+                            kind=kind,
+                            created=now,
+                            checked=now,
+                            content_hash=content_hash.hexdigest(),
+                            size=size,
+                            lines=lines,
+                            manifest=zlib.compress(bytes(manifest)))
+            session.add(backup)
+            session.flush()
+            logger.debug(f"{self} added {kind} {backup.id} of device {device_id} with {len(manifest) // _ENTRY_SIZE} chunks.")
+            return backup.id, True
+
+    @staticmethod
+    def _parse_manifest(manifest: bytes) -> list[tuple[bytes, int]]:
+        manifest = zlib.decompress(manifest)
+        return [(manifest[i:i + 32], int.from_bytes(manifest[i + 32:i + _ENTRY_SIZE], "little"))
+                for i in range(0, len(manifest), _ENTRY_SIZE)]
+
+    def _get_backup(self, backup_id: int) -> Backup:
+        with self.session_maker() as session:
+            backup = session.get(Backup, backup_id)
+            if backup is None:
+                raise KeyError(f"Backup {backup_id} does not exist.")
+            session.expunge(backup)
+            return backup
+
+    def versions(self, device_id: int, kind: str | None = None) -> list[dict[str, object]]:
+        """
+        Get the versions of a device, the newest first.
+
+        :param device_id: ID of the device.
+        :param kind: Only versions of this kind. If None, all versions are returned.
+        :return: List of versions with 'id', 'kind', 'created', 'checked', 'size' and 'lines'.
+        """
+
+        query = (select(Backup.id, Backup.kind, Backup.created, Backup.checked, Backup.size, Backup.lines)
+                 .where(Backup.device_id == device_id)
+                 .order_by(Backup.created.desc(), Backup.id.desc()))
+        if kind is not None:
+            query = query.where(Backup.kind == kind)
+        with self.session_maker() as session:
+            return [dict(row._mapping) for row in session.execute(query)]
+
+    def version(self, backup_id: int) -> dict[str, object]:
+        """
+        Get a single version.
+
+        :param backup_id: ID of the version.
+        :return: Version with 'id', 'device_id', 'kind', 'created', 'checked', 'size' and 'lines'.
+        """
+
+        backup = self._get_backup(backup_id)
+        return {"id": backup.id,
+                "device_id": backup.device_id,
+                "kind": backup.kind,
+                "created": backup.created,
+                "checked": backup.checked,
+                "size": backup.size,
+                "lines": backup.lines}
+
+    def read(self, backup_id: int) -> Iterator[bytes]:
+        """
+        Read the content of a version chunk by chunk.
+
+        :param backup_id: ID of the version.
+        :return: Iterator of the chunks.
+        """
+
+        for digest, _ in self._parse_manifest(self._get_backup(backup_id).manifest):
+            yield self._get_object(digest)
+
+    def _chunk_lines(self, digest: bytes) -> list[str]:
+        return _split_lines(self._get_object(digest))
+
+    def diff(self, old_id: int, new_id: int, context: int = 3) -> Iterator[str]:
+        """
+        Get the unified diff between two versions of an export. The chunk manifests are compared first, then the lines
+        of every run of changed chunks are loaded and compared, so only the chunks of one run are in memory at a time.
+
+        :param old_id: ID of the old version.
+        :param new_id: ID of the new version.
+        :param context: Number of context lines around a change, within the changed chunks.
+        :return: Iterator of the lines of the diff.
+        """
+
+        old, new = self._get_backup(old_id), self._get_backup(new_id)
+        if old.kind != "export" or new.kind != "export":
+            raise ValueError("Only exports can be compared.")
+        a, b = self._parse_manifest(old.manifest), self._parse_manifest(new.manifest)
+        a_starts = [0]
+        for _, lines in a:
+            a_starts.append(a_starts[-1] + lines)
+        b_starts = [0]
+        for _, lines in b:
+            b_starts.append(b_starts[-1] + lines)
+
+        yield f"--- {old.id} {old.created:%Y-%m-%d %H:%M:%S}\n"
+        yield f"+++ {new.id} {new.created:%Y-%m-%d %H:%M:%S}\n"
+        matcher = SequenceMatcher(None, [digest for digest, _ in a], [digest for digest, _ in b], autojunk=False)
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+            if tag == "equal":
+                continue
+            # a change can move the chunk boundaries after it, so the runs are compared as a whole
+            old_lines = [line for digest, _ in a[i1:i2] for line in self._chunk_lines(digest)]
+            new_lines = [line for digest, _ in b[j1:j2] for line in self._chunk_lines(digest)]
+            old_start, new_start = a_starts[i1], b_starts[j1]
+            line_matcher = SequenceMatcher(None, old_lines, new_lines, autojunk=False)
+            for group in line_matcher.get_grouped_opcodes(context):
+                first, last = group[0], group[-1]
+                yield (f"@@ -{_format_range(old_start + first[1], last[2] - first[1])} "
+                       f"+{_format_range(new_start + first[3], last[4] - first[3])} @@\n")
+                for line_tag, k1, k2, l1, l2 in group:
+                    if line_tag == "equal":
+                        yield from (f" {line}" for line in old_lines[k1:k2])
+                        continue
+                    if line_tag in ("replace", "delete"):
+                        yield from (f"-{line}" for line in old_lines[k1:k2])
+                    if line_tag in ("replace", "insert"):
+                        yield from (f"+{line}" for line in new_lines[l1:l2])
+
+    def cleanup(self, retention: float, now: datetime | None = None) -> int:
+        """
+        Delete all versions older than the retention and the chunks no version refers to anymore. The latest
+        version of every device and kind is always kept.
+
+        :param retention: Seconds a version is kept. If 0, versions are kept forever.
+        :param now: Current time. If None, the current time is used.
+        :return: Number of deleted versions.
+        """
+
+        deleted = 0
+        if retention:
+            expired = (now or datetime.now(timezone.utc)) - timedelta(seconds=retention)
+            latest = select(func.max(Backup.id)).group_by(Backup.device_id, Backup.kind)
+            with self.session_maker() as session, session.begin():
+                # selecting first, some databases do not allow a subquery of the same table in a delete
+                ids = session.execute(select(Backup.id).where(Backup.created < expired,
+                                                              Backup.id.not_in(latest))).scalars().all()
+                for i in range(0, len(ids), 500):
+                    deleted += session.execute(delete(Backup).where(Backup.id.in_(ids[i:i + 500]))).rowcount
+        self.collect_garbage()
+        return deleted
+
+    def collect_garbage(self, grace: float = 3600.0) -> int:
+        """
+        Delete all chunks no version refers to.
+
+        :param grace: Minimum age of a deleted chunk in seconds, so chunks of versions being added are kept.
+        :return: Number of deleted chunks.
+        """
+
+        referenced = set()
+        with self.session_maker() as session:
+            for manifest in session.execute(select(Backup.manifest)).scalars():
+                referenced.update(digest.hex() for digest, _ in self._parse_manifest(manifest))
+
+        deleted = 0
+        threshold = time.time() - grace
+        for directory in [self.objects_directory, self.temp_directory]:
+            for path in directory.rglob("*"):
+                if path.is_file() and path.name not in referenced and path.stat().st_mtime < threshold:
+                    path.unlink(missing_ok=True)
+                    deleted += 1
+        logger.debug(f"{self} deleted {deleted} unreferenced chunks.")
+        return deleted
+
+
+@cache
+def get_backup_store() -> BackupStore:
+    """
+    Get the backup store of the configured directory and database.
+
+    :return: BackupStore
+    """
+
+    return BackupStore(directory=settings.backup_directory,
+                       session_maker=db().session_maker,
+                       average_lines=settings.backup_average_chunk_lines)
@@ -1,17 +1,29 @@
+from typing import Annotated
+
+from typer import Exit, Option
 from wiederverwendbar.typer import Typer
-from wiederverwendbar.logger import LoggerSingleton
 
 from mikrotik_manager import __name__ as __module_name__
 from mikrotik_manager.settings import settings
 
-logger = LoggerSingleton(name=__module_name__,
-                         settings=settings,
-                         ignored_loggers_like=["sqlalchemy", "pymysql", "asyncio", "parso", "engineio", "socketio"],
-                         init=True)
-
 cli_app = Typer(settings=settings)
 
 
+def init_logger() -> None:
+    """
+    Initialize the logger. It is done by the commands, so '--help' and friends do not pay for it.
+
+    :return: None
+    """
+
+    from wiederverwendbar.logger import LoggerSingleton
+
+    LoggerSingleton(name=__module_name__,
+                    settings=settings,
+                    ignored_loggers_like=["sqlalchemy", "pymysql", "asyncio", "parso", "engineio", "socketio"],
+                    init=True)
+
+
 @cli_app.command(name="serve", help=f"Start the {settings.branding_title} - server.")
 def serve_command() -> None:
     """
@@ -20,6 +32,8 @@ def serve_command() -> None:
     :return: None
     """
 
+    init_logger()
+
     import pidfile
     from mikrotik_manager.server import Server
 
@@ -41,13 +55,16 @@ def serve_command() -> None:
 
 
 @cli_app.command(name="worker", help=f"Start the {settings.branding_title} - worker.")
-def worker_command() -> None:
+def worker_command(queues: Annotated[str | None, Option(help="Comma separated queues to consume, e.g. 'interactive' or 'bulk,backups'. Defaults to the worker queues setting.")] = None) -> None:
     """
     Start the Worker.
 
+    :param queues: Comma separated queues to consume. If None, the setting is used.
     :return: None
     """
 
+    init_logger()
+
     from mikrotik_manager.worker import run
 
     # print header
@@ -57,7 +74,36 @@ def worker_command() -> None:
     # ToDo: test DB
 
     # start server
-    run()
+    try:
+        run(queues=[queue.strip() for queue in queues.split(",") if queue.strip()] if queues else None)
+    except ValueError as e:
+        cli_app.console.print(f"[red]Error:[/red] {e}")
+        raise Exit(code=1)
+
+
+@cli_app.command(name="listen", help=f"Start the {settings.branding_title} - syslog and SNMP trap listener.")
+def listen_command() -> None:
+    """
+    Start the syslog and SNMP trap listener.
+
+    :return: None
+    """
+
+    init_logger()
+
+    from mikrotik_manager.listener import run
+
+    # print header
+    cli_app.console.print(f"Starting {settings.branding_title} - listener ...")
+    cli_app.console.print(f"[white]{cli_app.title_header}[/white]")
+
+    # start listener
+    try:
+        run()
+    except (OSError, RuntimeError) as e:
+        cli_app.console.print(f"[red]Error:[/red] {e}")
+        raise Exit(code=1)
+
 
 @cli_app.command(name="init", help=f"Initialize database.")
 def init_command() -> None:
@@ -67,11 +113,43 @@ def init_command() -> None:
     :return: None
     """
 
-    from mikrotik_manager.db import db
+    init_logger()
+
+    from mikrotik_manager.db import create_all
 
     # print header
     cli_app.console.print(f"Initializing database ...")
     cli_app.console.print(f"[white]{cli_app.title_header}[/white]")
 
     # initialize DB
-    db().create_all()
+    create_all()
+
+
+@cli_app.command(name="profile-startup", help="Profile the startup time of the commands.")
+def profile_startup_command(budget: Annotated[float | None, Option(help="Fail if 'mikrotik-manager --help' takes longer than this number of seconds.")] = None,
+                            top: Annotated[int, Option(help="Number of slowest imports to show per command.")] = 10) -> None:
+    """
+    Profile the startup time of the commands.
+
+    :param budget: Fail if 'mikrotik-manager --help' takes longer than this number of seconds.
+    :param top: Number of slowest imports to show per command.
+    :return: None
+    """
+
+    from mikrotik_manager.startup import COMMAND_MODULES, measure_help, profile_imports
+
+    for command, modules in COMMAND_MODULES.items():
+        wall_time, import_times = profile_imports(modules)
+        cli_app.console.print(f"[bold]{command}[/bold]: {wall_time:.3f}s")
+
+        # showing the slowest direct imports of the top level packages
+        import_times = [i for i in import_times if i.depth <= 1]
+        import_times.sort(key=lambda i: i.cumulative_us, reverse=True)
+        for i in import_times[:top]:
+            cli_app.console.print(f"  {i.cumulative_us / 1000:8.1f}ms  {i.name}")
+
+    help_time = measure_help()
+    cli_app.console.print(f"[bold]--help[/bold]: {help_time:.3f}s")
+    if budget is not None and help_time > budget:
+        cli_app.console.print(f"[red]Error:[/red] '--help' took {help_time:.3f}s, the budget is {budget:.3f}s.")
+        raise Exit(code=1)
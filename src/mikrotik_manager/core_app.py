@@ -1,7 +1,9 @@
 from fastapi import FastAPI
-from fastapi.responses import RedirectResponse
+from fastapi.responses import RedirectResponse, Response
 
+from mikrotik_manager.api import api_router
 from mikrotik_manager.settings import settings
+from mikrotik_manager.telemetry import latest
 from mikrotik_manager.ui.app import UiApp
 
 
@@ -18,5 +20,18 @@ class CoreApp(FastAPI):
         # add root route
         self.add_api_route("/", self.root)
 
+        # add the job API
+        self.include_router(api_router)
+
+        # add the prometheus metrics
+        if settings.app_metrics_enabled:
+            self.add_api_route("/metrics", self.metrics, include_in_schema=False)
+
     async def root(self):
         return RedirectResponse(url=settings.app_root_web_path + settings.ui_web_path)
+
+    @staticmethod
+    def metrics() -> Response:
+        # collecting the queue depths talks to the broker, so it runs in the thread pool
+        data, content_type = latest()
+        return Response(content=data, media_type=content_type)
@@ -0,0 +1,269 @@
+import os
+import threading
+
+from sqlalchemy import Boolean, Column, DateTime, Float, ForeignKey, Index, Integer, JSON, LargeBinary, String, \
+    UniqueConstraint, event
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import declarative_base
+from wiederverwendbar.sqlalchemy import Base, SqlalchemyDbSingleton
+
+from mikrotik_manager.settings import settings
+
+# drivers of the async engine by protocol, the others are not supported by it
+ASYNC_DRIVERS = {"sqlite": "sqlite+aiosqlite",
+                 "postgresql": "postgresql+asyncpg",
+                 "mysql": "mysql+aiomysql",
+                 "mariadb": "mariadb+aiomysql"}
+
+# declarative base of all models, it is bound to the database when the database is initialized, not on import
+ModelBase = declarative_base()
+
+
+def _sqlite_pragmas(connection, _connection_record) -> None:
+    # readers do not block the writer with write-ahead logging, which is durable enough with synchronous=NORMAL
+    cursor = connection.cursor()
+    if settings.db_sqlite_handle_foreign_keys:
+        cursor.execute("PRAGMA foreign_keys=ON")
+    if settings.db_sqlite_wal:
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={int(settings.db_pool_timeout * 1000)}")
+    cursor.close()
+
+
+def db() -> SqlalchemyDbSingleton:
+    """
+    Get the database. It is initialized on first use.
+
+    :return: SqlalchemyDbSingleton
+    """
+
+    try:
+        return SqlalchemyDbSingleton()
+    except RuntimeError:
+        instance = SqlalchemyDbSingleton(settings=settings, init=True)
+        if instance.protocol == "sqlite" and instance.file is not None:
+            instance.listen("connect", _sqlite_pragmas)
+        ModelBase.db = instance
+        return instance
+
+
+def create_all() -> None:
+    """
+    Create the tables of all models which do not exist yet.
+
+    :return: None
+    """
+
+    ModelBase.metadata.create_all(bind=db().engine)
+
+
+# async engine of the current process, it can not be shared with forked children
+_async_lock = threading.Lock()
+_async_engine: tuple[int, AsyncEngine, async_sessionmaker] | None = None
+
+
+def async_engine() -> AsyncEngine:
+    """
+    Get the async engine of the configured database, e.g. for the server and the event loops of the workers.
+    It is created on first use in every process.
+
+    :return: AsyncEngine
+    """
+
+    global _async_engine
+
+    with _async_lock:
+        if _async_engine is None or _async_engine[0] != os.getpid():
+            protocol = db().protocol
+            if protocol not in ASYNC_DRIVERS:
+                raise RuntimeError(f"The database protocol '{protocol}' is not supported by the async engine.")
+            if protocol == "sqlite" and db().file is None:
+                # every connection to an in-memory database is a database of its own
+                raise RuntimeError("The async engine needs a database file for SQLite.")
+            url = ASYNC_DRIVERS[protocol] + db().connection_string[len(protocol):]
+            engine = create_async_engine(url,
+                                         echo=db().echo,
+                                         pool_size=settings.db_pool_size,
+                                         max_overflow=settings.db_pool_max_overflow,
+                                         pool_timeout=settings.db_pool_timeout,
+                                         pool_recycle=settings.db_pool_recycle,
+                                         # a local file does not drop connections
+                                         pool_pre_ping=protocol != "sqlite")
+            if protocol == "sqlite":
+                event.listen(engine.sync_engine, "connect", _sqlite_pragmas)
+            _async_engine = (os.getpid(), engine, async_sessionmaker(engine, expire_on_commit=False))
+        return _async_engine[1]
+
+
+def async_session_maker() -> async_sessionmaker:
+    """
+    Get the async session maker of the async engine.
+
+    :return: async_sessionmaker
+    """
+
+    async_engine()
+    return _async_engine[2]
+
+
+class Device(Base, ModelBase):
+    __tablename__ = "devices"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    name = Column(String(255), nullable=False, unique=True)
+    host = Column(String(255), nullable=False, index=True)
+    port = Column(Integer, nullable=True)
+    username = Column(String(255), nullable=False, default="admin")
+    password = Column(String(255), nullable=False, default="")
+    tls = Column(Boolean, nullable=False, default=False)
+    site = Column(String(255), nullable=True, index=True)
+
+    # basic information fetched from the device
+    hostname = Column(String(255), nullable=True, index=True)
+    model = Column(String(255), nullable=True, index=True)
+    serial_number = Column(String(255), nullable=True, index=True)
+    firmware_version = Column(String(255), nullable=True)
+    version = Column(String(255), nullable=True, index=True)
+    content_hash = Column(String(64), nullable=True)
+    last_seen = Column(DateTime(timezone=True), nullable=True, index=True)
+
+
+class DeviceTag(Base, ModelBase):
+    __tablename__ = "device_tags"
+    __table_args__ = (Index("ix_device_tags_tag", "tag", "device_id"),)
+
+    device_id = Column(Integer, ForeignKey("devices.id", ondelete="CASCADE"), primary_key=True)
+    tag = Column(String(64), primary_key=True)
+
+
+class DeviceStatus(Base, ModelBase):
+    __tablename__ = "device_status"
+    __table_args__ = (Index("ix_device_status_status", "status", "device_id"),)
+
+    # written in bulk by the status writer of the workers, one row per device
+    device_id = Column(Integer, ForeignKey("devices.id", ondelete="CASCADE"), primary_key=True)
+    status = Column(String(16), nullable=False)  # 'online' or 'offline'
+    rtt = Column(Float, nullable=True)
+    error = Column(String(1024), nullable=True)
+    updated = Column(DateTime(timezone=True), nullable=False)
+
+
+class DeviceEvent(Base, ModelBase):
+    __tablename__ = "device_events"
+    __table_args__ = (Index("ix_device_events_device", "device_id", "time"),)
+
+    # written in bulk by the syslog and SNMP trap listener
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    device_id = Column(Integer, ForeignKey("devices.id", ondelete="CASCADE"), nullable=False)
+    time = Column(DateTime(timezone=True), nullable=False, index=True)
+    source = Column(String(16), nullable=False)  # 'syslog' or 'trap'
+    kind = Column(String(16), nullable=False)  # 'link', 'login', 'login_failure', 'config', 'reboot' or 'message'
+    severity = Column(Integer, nullable=True)
+    message = Column(String(1024), nullable=False)
+    data = Column(JSON, nullable=False, default=dict)
+
+
+class MetricSeries(Base, ModelBase):
+    __tablename__ = "metric_series"
+    __table_args__ = (UniqueConstraint("device_id", "name"),)
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    device_id = Column(Integer, ForeignKey("devices.id", ondelete="CASCADE"), nullable=False, index=True)
+    name = Column(String(255), nullable=False)  # e.g. 'cpu_load' or 'interface/ether1/rx_bps'
+
+
+class MetricBlock(Base, ModelBase):
+    __tablename__ = "metric_blocks"
+
+    # one block holds the aggregates of a fixed number of consecutive slots of one resolution as packed arrays
+    series_id = Column(Integer, ForeignKey("metric_series.id", ondelete="CASCADE"), primary_key=True)
+    resolution = Column(String(8), primary_key=True)
+    start = Column(Integer, primary_key=True)  # unix timestamp of the first slot
+    data = Column(LargeBinary, nullable=False)
+
+
+class MetricSample(Base, ModelBase):
+    __tablename__ = "metric_samples"
+    __table_args__ = (Index("ix_metric_samples_series_timestamp", "series_id", "timestamp"),)
+
+    # samples are appended here and merged into their blocks by compaction, so a write does not rewrite blocks
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    series_id = Column(Integer, ForeignKey("metric_series.id", ondelete="CASCADE"), nullable=False)
+    timestamp = Column(Float, nullable=False)  # unix timestamp
+    value = Column(Float, nullable=False)
+
+
+class MetricCounter(Base, ModelBase):
+    __tablename__ = "metric_counters"
+
+    # latest value of a counter, shared by all worker processes to calculate its rate
+    series_id = Column(Integer, ForeignKey("metric_series.id", ondelete="CASCADE"), primary_key=True)
+    timestamp = Column(Float, nullable=False)
+    value = Column(Float, nullable=False)
+
+
+class Backup(Base, ModelBase):
+    __tablename__ = "backups"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    device_id = Column(Integer, ForeignKey("devices.id", ondelete="CASCADE"), nullable=False, index=True)
+    kind = Column(String(16), nullable=False)  # 'export' or 'backup'
+    created = Column(DateTime(timezone=True), nullable=False, index=True)
+    checked = Column(DateTime(timezone=True), nullable=False)  # last time the same content was fetched again
+    content_hash = Column(String(64), nullable=False)
+    size = Column(Integer, nullable=False)
+    lines = Column(Integer, nullable=False)
+    manifest = Column(LargeBinary, nullable=False)  # digests and line counts of the chunks
+
+
+class Job(Base, ModelBase):
+    __tablename__ = "jobs"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    action = Column(String(64), nullable=False)
+    params = Column(JSON, nullable=False, default=dict)
+    state = Column(String(16), nullable=False, index=True)  # 'queued', 'running', 'paused', 'aborted' or 'finished'
+    control = Column(String(16), nullable=True)  # 'pause' or 'abort' requested from outside the runner
+    runner = Column(String(32), nullable=True)  # ID of the runner holding the lease of a running job
+    heartbeat = Column(DateTime(timezone=True), nullable=True)  # last renewal of the lease
+    message = Column(String(1024), nullable=True)
+    wave_size = Column(Integer, nullable=False)
+    wave_interval = Column(Float, nullable=False)
+    concurrency = Column(Integer, nullable=False)
+    site_concurrency = Column(Integer, nullable=False)
+    rate = Column(Float, nullable=False)  # devices started per second
+    burst = Column(Integer, nullable=False)
+    max_failure_ratio = Column(Float, nullable=False)
+    created = Column(DateTime(timezone=True), nullable=False)
+    started = Column(DateTime(timezone=True), nullable=True)
+    finished = Column(DateTime(timezone=True), nullable=True)
+
+
+class JobItem(Base, ModelBase):
+    __tablename__ = "job_items"
+
+    job_id = Column(Integer, ForeignKey("jobs.id", ondelete="CASCADE"), primary_key=True)
+    device_id = Column(Integer, ForeignKey("devices.id", ondelete="CASCADE"), primary_key=True)
+    wave = Column(Integer, nullable=False)
+    site = Column(String(255), nullable=True)
+    state = Column(String(16), nullable=False)  # 'pending', 'succeeded', 'failed' or 'skipped'
+    error = Column(String(1024), nullable=True)
+    finished = Column(DateTime(timezone=True), nullable=True)
+
+
+class RateLimit(Base, ModelBase):
+    __tablename__ = "rate_limits"
+
+    name = Column(String(64), primary_key=True)  # e.g. 'jobs'
+    tokens = Column(Float, nullable=False)  # tokens left at updated, negative if borrowed from the future
+    updated = Column(Float, nullable=False)  # unix timestamp
+
+
+class StorageEntry(Base, ModelBase):
+    __tablename__ = "ui_storage_entries"
+
+    id = Column(String(255), primary_key=True)  # e.g. 'general' or 'user-<session id>'
+    key = Column(String(255), primary_key=True)  # every key of a storage is a row of its own
+    value = Column(JSON, nullable=True)
+    updated = Column(DateTime(timezone=True), nullable=False)
@@ -0,0 +1,286 @@
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import Any, Callable
+
+from sqlalchemy import Insert, Table, func, select
+from sqlalchemy.exc import DBAPIError, DataError, DisconnectionError, IntegrityError, InterfaceError, \
+    OperationalError, TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from mikrotik_manager.db import Device, DeviceStatus, DeviceTag
+
+logger = logging.getLogger(__name__)
+
+STATUS_FIELDS = ("status", "rtt", "error", "updated")
+
+# errors which may pass on the next attempt, e.g. a locked SQLite database or a lost connection
+TRANSIENT_ERRORS = (OperationalError, InterfaceError, DisconnectionError, PoolTimeoutError, OSError, TimeoutError)
+
+
+def upsert(table: Table, dialect: str, key: str | tuple[str, ...], columns: tuple[str, ...]) -> Insert:
+    """
+    Build an insert statement which updates the existing row of the same key instead.
+
+    :param table: Table to write.
+    :param dialect: Name of the database dialect.
+    :param key: Primary key or unique columns.
+    :param columns: Columns updated on conflict.
+    :return: Insert
+    """
+
+    keys = (key,) if isinstance(key, str) else key
+    if dialect in ("sqlite", "postgresql"):
+        if dialect == "sqlite":
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert
+        statement = insert(table)
+        return statement.on_conflict_do_update(index_elements=[table.c[key] for key in keys],
+                                               set_={column: statement.excluded[column] for column in columns})
+    if dialect in ("mysql", "mariadb"):
+        from sqlalchemy.dialects.mysql import insert
+
+        statement = insert(table)
+        return statement.on_duplicate_key_update({column: statement.inserted[column] for column in columns})
+    raise ValueError(f"Upserts are not supported for the dialect '{dialect}'.")
+
+
+class StatusWriter:
+    def __init__(self,
+                 session_maker: async_sessionmaker,
+                 batch_size: int = 1000,
+                 interval: float = 0.5,
+                 max_attempts: int = 5,
+                 publish: Callable[[list[dict[str, Any]]], None] | None = None):
+        """
+        Write device status updates behind the callers back. Updates of the same device are merged, so only the
+        latest one is written, and the pending updates are written in bulk upserts.
+        All methods have to be called on the same event loop.
+
+        :param session_maker: Async session maker of the database.
+        :param batch_size: Maximum number of devices written at once. Reaching it starts a write immediately.
+        :param interval: Maximum seconds an update waits before it is written.
+        :param max_attempts: Maximum number of attempts to write an update if the database is not reachable.
+        :param publish: Called with the deltas of the devices whose status changed, after they are written. It is
+                        called in a thread.
+        """
+
+        self.session_maker = session_maker
+        self.publish = publish
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_attempts = max_attempts
+        self.updates = 0
+        self.written = 0
+        self.dropped = 0
+        self._pending: dict[int, dict[str, Any]] = {}
+        # failed attempts by device, until its update is written or dropped
+        self._attempts: dict[int, int] = {}
+        self._wakeup: asyncio.Event | None = None
+        self._lock: asyncio.Lock | None = None
+        self._task: asyncio.Task | None = None
+
+    def __str__(self):
+        return f"{self.__class__.__name__}(pending={len(self._pending)}, written={self.written})"
+
+    def put(self, device_id: int, status: str, rtt: float | None = None, error: str | None = None) -> None:
+        """
+        Queue a status update of a device.
+
+        :param device_id: ID of the device.
+        :param status: 'online' or 'offline'.
+        :param rtt: Duration of the poll in seconds.
+        :param error: Error of a failed poll.
+        :return: None
+        """
+
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._lock = asyncio.Lock()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        self.updates += 1
+        self._pending[device_id] = {"device_id": device_id,
+                                    "status": status,
+                                    "rtt": rtt,
+                                    "error": error[:1024] if error else None,
+                                    "updated": datetime.now(timezone.utc)}
+        if len(self._pending) >= self.batch_size:
+            self._wakeup.set()
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.interval)
+            except TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.warning(f"{self} could not write the device status: {e}")
+
+    @staticmethod
+    def _is_transient(error: Exception) -> bool:
+        if isinstance(error, DBAPIError) and error.connection_invalidated:
+            return True
+        return isinstance(error, TRANSIENT_ERRORS)
+
+    async def _write(self, rows: list[dict[str, Any]]) -> None:
+        device_ids = [row["device_id"] for row in rows]
+        async with self.session_maker() as session, session.begin():
+            previous = {}
+            if self.publish is not None:
+                previous = dict((await session.execute(
+                    select(DeviceStatus.device_id, DeviceStatus.status)
+                    .where(DeviceStatus.device_id.in_(device_ids)))).all())
+            statement = upsert(DeviceStatus.__table__,
+                               dialect=session.bind.dialect.name,
+                               key="device_id",
+                               columns=STATUS_FIELDS)
+            await session.execute(statement, rows)
+        self.written += len(rows)
+        for device_id in device_ids:
+            self._attempts.pop(device_id, None)
+        if self.publish is None:
+            return
+        # only the devices which went online or offline are published
+        transitions = [{"id": row["device_id"], "status": row["status"]} for row in rows
+                       if previous.get(row["device_id"]) != row["status"]]
+        if transitions:
+            # the status is already stored, subscribers can catch up from the database
+            try:
+                await asyncio.to_thread(self.publish, transitions)
+            except Exception as e:
+                logger.warning(f"{self} could not publish {len(transitions)} status changes: {e}")
+
+    async def _write_valid(self, rows: list[dict[str, Any]]) -> None:
+        # the rows violating a constraint, e.g. of a device deleted meanwhile, are searched by bisection
+        try:
+            await self._write(rows)
+        except (IntegrityError, DataError) as e:
+            if len(rows) > 1:
+                middle = len(rows) // 2
+                await self._write_valid(rows[:middle])
+                await self._write_valid(rows[middle:])
+                return
+            device_id = rows[0]["device_id"]
+            self._attempts.pop(device_id, None)
+            self.dropped += 1
+            logger.error(f"{self} dropped the status of device {device_id}: {e.orig}")
+
+    async def flush(self) -> None:
+        """
+        Write all pending updates. Updates which can never be written, e.g. of a deleted device, are dropped.
+        Updates of a write failed because the database is not reachable are kept for the next one, unless there is
+        a newer one, until they failed max_attempts times.
+
+        :return: None
+        :raises Exception: The database is not reachable.
+        """
+
+        if self._lock is None:
+            return
+        async with self._lock:
+            while self._pending:
+                device_ids = list(self._pending)[:self.batch_size]
+                rows = [self._pending.pop(device_id) for device_id in device_ids]
+                try:
+                    await self._write_valid(rows)
+                except Exception as e:
+                    if not self._is_transient(e):
+                        for device_id in device_ids:
+                            self._attempts.pop(device_id, None)
+                        self.dropped += len(rows)
+                        logger.exception(f"{self} dropped the status of {len(rows)} devices: {e}")
+                        continue
+                    # rows written before the error are written again, the upsert does not change them
+                    dropped = 0
+                    for row in rows:
+                        device_id = row["device_id"]
+                        if device_id in self._pending:
+                            # replaced by a newer update, which gets attempts of its own
+                            self._attempts.pop(device_id, None)
+                            continue
+                        attempts = self._attempts.get(device_id, 0) + 1
+                        if attempts < self.max_attempts:
+                            self._attempts[device_id] = attempts
+                            self._pending[device_id] = row
+                        else:
+                            self._attempts.pop(device_id, None)
+                            dropped += 1
+                    if dropped:
+                        self.dropped += dropped
+                        logger.error(f"{self} dropped the status of {dropped} devices after "
+                                     f"{self.max_attempts} attempts: {e}")
+                    raise
+
+    async def close(self) -> None:
+        """
+        Stop writing in the background and write the pending updates.
+
+        :return: None
+        """
+
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+
+async def find_devices(session_maker: async_sessionmaker,
+                       site: str | None = None,
+                       tag: str | None = None,
+                       status: str | None = None,
+                       limit: int = 100,
+                       offset: int = 0) -> list[dict[str, Any]]:
+    """
+    Find devices by site, tag and status.
+
+    :param session_maker: Async session maker of the database.
+    :param site: Site of the devices.
+    :param tag: Tag of the devices.
+    :param status: Last status of the devices, 'online' or 'offline'.
+    :param limit: Maximum number of devices.
+    :param offset: Number of devices to skip.
+    :return: Devices with their last status.
+    """
+
+    query = (select(Device.id, Device.name, Device.host, Device.site, Device.hostname, Device.model, Device.version,
+                    DeviceStatus.status, DeviceStatus.rtt, DeviceStatus.updated)
+             .outerjoin(DeviceStatus, DeviceStatus.device_id == Device.id))
+    if site is not None:
+        query = query.where(Device.site == site)
+    if tag is not None:
+        query = query.where(Device.id.in_(select(DeviceTag.device_id).where(DeviceTag.tag == tag)))
+    if status is not None:
+        query = query.where(DeviceStatus.status == status)
+    query = query.order_by(Device.id).limit(limit).offset(offset)
+    async with session_maker() as session:
+        return [dict(row._mapping) for row in await session.execute(query)]
+
+
+async def status_counts(session_maker: async_sessionmaker, by_site: bool = False) -> dict[str | None, dict[str, int]]:
+    """
+    Count devices by their last status. Devices which have not been polled yet are counted as 'unknown'.
+
+    :param session_maker: Async session maker of the database.
+    :param by_site: Count the devices of every site on its own.
+    :return: Number of devices by status, by site if by_site is set, else under the key None.
+    """
+
+    status = func.coalesce(DeviceStatus.status, "unknown")
+    sites = (Device.site,) if by_site else ()
+    query = (select(*sites, status, func.count())
+             .select_from(Device)
+             .outerjoin(DeviceStatus, DeviceStatus.device_id == Device.id)
+             .group_by(*sites, status))
+    counts: dict[str | None, dict[str, int]] = {}
+    async with session_maker() as session:
+        for *site, row_status, count in await session.execute(query):
+            counts.setdefault(site[0] if site else None, {"online": 0, "offline": 0, "unknown": 0})[row_status] = count
+    return counts
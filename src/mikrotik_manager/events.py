@@ -0,0 +1,49 @@
+from typing import Any, Callable
+
+from kombu import Consumer, Exchange, Queue
+from kombu.mixins import ConsumerMixin
+
+# device changes are broadcast to every subscribed process
+inventory_exchange = Exchange("mikrotik_manager.inventory", type="fanout", durable=False)
+
+
+def publish_inventory_deltas(deltas: list[dict[str, Any]]) -> None:
+    """
+    Publish inventory deltas to all subscribers.
+
+    :param deltas: List of deltas with 'id' and the changed fields.
+    :return: None
+    """
+
+    from mikrotik_manager.worker import celery_app
+
+    with celery_app.producer_or_acquire() as producer:
+        producer.publish(deltas,
+                         exchange=inventory_exchange,
+                         routing_key="",
+                         declare=[inventory_exchange],
+                         serializer="json",
+                         retry=True,
+                         retry_policy={"max_retries": 3})
+
+
+class InventorySubscriber(ConsumerMixin):
+    def __init__(self, callback: Callable[[list[dict[str, Any]]], None]):
+        """
+        Subscribe to the inventory deltas. Blocks in run until should_stop is set, so it is meant to run in a thread.
+
+        :param callback: Called with every list of deltas.
+        """
+
+        from mikrotik_manager.worker import celery_app
+
+        self.connection = celery_app.connection_for_read()
+        self.callback = callback
+
+    def get_consumers(self, consumer_cls: type[Consumer], channel: Any) -> list[Consumer]:
+        # every subscriber gets its own temporary queue
+        queue = Queue(exchange=inventory_exchange, exclusive=True, auto_delete=True, durable=False)
+        return [consumer_cls(queues=[queue], callbacks=[self.on_message], accept=["json"], no_ack=True)]
+
+    def on_message(self, body: list[dict[str, Any]], _message: Any) -> None:
+        self.callback(body)
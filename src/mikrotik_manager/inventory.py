@@ -0,0 +1,144 @@
+import hashlib
+import json
+import logging
+import time
+from datetime import datetime, timezone
+from itertools import groupby
+from typing import Any, Callable
+
+from sqlalchemy import bindparam, select, update
+from sqlalchemy.orm import sessionmaker
+
+from mikrotik_manager.db import Device
+
+logger = logging.getLogger(__name__)
+
+INVENTORY_FIELDS = ("hostname", "model", "serial_number", "firmware_version", "version")
+
+
+def content_hash(info: dict[str, Any]) -> str:
+    """
+    Get the content hash of the inventory fields of a device.
+
+    :param info: Fetched information of the device.
+    :return: str
+    """
+
+    data = json.dumps([info.get(field) for field in INVENTORY_FIELDS], separators=(",", ":"), default=str)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+class Inventory:
+    def __init__(self,
+                 session_maker: sessionmaker,
+                 publish: Callable[[list[dict[str, Any]]], None] | None = None,
+                 last_seen_interval: float = 900.0):
+        """
+        Create a new inventory cache. It keeps the content hash and the inventory fields of every device, so only
+        changed fields are written to the database and published. The cached hashes are compared with the stored ones
+        on every apply, as other processes write the same devices.
+
+        :param session_maker: Session maker of the database.
+        :param publish: Called with the list of deltas after they are written.
+        :param last_seen_interval: Seconds after which the last seen timestamp of an unchanged device is written.
+        """
+
+        self.session_maker = session_maker
+        self.publish = publish
+        self.last_seen_interval = last_seen_interval
+
+        self._hashes: dict[int, str | None] = {}
+        self._fields: dict[int, dict[str, Any]] = {}
+        self._last_seen_written: dict[int, float] = {}
+
+    def __str__(self):
+        return f"{self.__class__.__name__}(devices={len(self._hashes)})"
+
+    def _load(self, device_ids: list[int]) -> None:
+        with self.session_maker() as session:
+            # other worker processes write the same devices, so the cached hashes are checked against the stored ones
+            stored = session.execute(select(Device.id, Device.content_hash).where(Device.id.in_(device_ids)))
+            for device_id, stored_hash in stored:
+                if device_id in self._hashes and self._hashes[device_id] != stored_hash:
+                    self._hashes.pop(device_id)
+                    self._fields.pop(device_id, None)
+            # loading the state of devices that are not cached yet or changed elsewhere, e.g. after a restart
+            missing = [device_id for device_id in device_ids if device_id not in self._hashes]
+            if not missing:
+                return
+            columns = [getattr(Device, field) for field in INVENTORY_FIELDS]
+            for row in session.execute(select(Device.id, Device.content_hash, *columns).where(Device.id.in_(missing))):
+                self._hashes[row[0]] = row[1]
+                self._fields[row[0]] = dict(zip(INVENTORY_FIELDS, row[2:]))
+
+    def forget(self, device_id: int) -> None:
+        """
+        Remove a device from the cache, e.g. after it was changed or deleted by other means.
+
+        :param device_id: ID of the device.
+        :return: None
+        """
+
+        self._hashes.pop(device_id, None)
+        self._fields.pop(device_id, None)
+        self._last_seen_written.pop(device_id, None)
+
+    def apply(self, infos: dict[int, dict[str, Any]]) -> list[dict[str, Any]]:
+        """
+        Apply fetched device information. Only changed fields are written and published.
+
+        :param infos: Fetched information by device ID.
+        :return: List of deltas with 'id' and the changed fields.
+        """
+
+        self._load(list(infos.keys()))
+        now = time.monotonic()
+        deltas = []
+        touched = []
+        # the new state is staged, the cache only takes it after it is written
+        staged: dict[int, tuple[str, dict[str, Any]]] = {}
+        for device_id, info in infos.items():
+            new_hash = content_hash(info)
+            if self._hashes.get(device_id) == new_hash:
+                # unchanged, only the last seen timestamp is written from time to time
+                if now - self._last_seen_written.get(device_id, float("-inf")) > self.last_seen_interval:
+                    touched.append(device_id)
+                continue
+            old = self._fields.get(device_id, {})
+            delta = {field: info.get(field) for field in INVENTORY_FIELDS if old.get(field) != info.get(field)}
+            deltas.append({"id": device_id, **delta})
+            staged[device_id] = (new_hash, {field: info.get(field) for field in INVENTORY_FIELDS})
+
+        if deltas or touched:
+            self._write(deltas, touched, {device_id: new_hash for device_id, (new_hash, _) in staged.items()})
+            for device_id, (new_hash, fields) in staged.items():
+                self._hashes[device_id] = new_hash
+                self._fields[device_id] = fields
+            for device_id in [*staged, *touched]:
+                self._last_seen_written[device_id] = now
+        if deltas:
+            logger.debug(f"{self} wrote {len(deltas)} changed and {len(touched)} unchanged devices.")
+            if self.publish is not None:
+                # the changes are already stored, subscribers can catch up from the database
+                try:
+                    self.publish(deltas)
+                except Exception as e:
+                    logger.warning(f"{self} could not publish {len(deltas)} deltas: {e}")
+        return deltas
+
+    def _write(self, deltas: list[dict[str, Any]], touched: list[int], hashes: dict[int, str]) -> None:
+        last_seen = datetime.now(timezone.utc)
+        table = Device.__table__
+        with self.session_maker() as session, session.begin():
+            # one executemany per set of changed columns
+            for keys, group in groupby(sorted(deltas, key=lambda d: sorted(d)), key=lambda d: tuple(sorted(d))):
+                columns = [key for key in keys if key != "id"]
+                values = {column: bindparam(f"v_{column}") for column in columns}
+                statement = (update(table)
+                             .where(table.c.id == bindparam("v_id"))
+                             .values(**values, content_hash=bindparam("v_content_hash"), last_seen=last_seen))
+                session.execute(statement, [{"v_id": d["id"],
+                                             "v_content_hash": hashes[d["id"]],
+                                             **{f"v_{column}": d[column] for column in columns}} for d in group])
+            if touched:
+                session.execute(update(table).where(table.c.id.in_(touched)).values(last_seen=last_seen))
@@ -0,0 +1,570 @@
+import asyncio
+import contextlib
+import logging
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from functools import cache
+from typing import Any, Awaitable, Callable, Iterable
+
+from sqlalchemy import bindparam, case, func, insert, or_, select, update
+from sqlalchemy.orm import sessionmaker
+
+from mikrotik_manager.db import db, Device, Job, JobItem, RateLimit
+from mikrotik_manager.device_status import upsert
+from mikrotik_manager.settings import settings
+
+logger = logging.getLogger(__name__)
+
+JOB_STATES = ("queued", "running", "paused", "aborted", "finished")
+ITEM_STATES = ("pending", "succeeded", "failed", "skipped")
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int = 1, clock: Callable[[], float] = time.monotonic):
+        """
+        Create a new token bucket. It holds up to burst tokens and is refilled with rate tokens per second.
+
+        :param rate: Tokens per second.
+        :param burst: Maximum number of tokens.
+        :param clock: Monotonic clock in seconds.
+        """
+
+        if rate <= 0:
+            raise ValueError("The rate must be greater than 0.")
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.clock = clock
+        self._tokens = float(self.burst)
+        self._updated = clock()
+
+    def __str__(self):
+        return f"{self.__class__.__name__}(rate={self.rate}, burst={self.burst})"
+
+    def reserve(self) -> float:
+        """
+        Take a token. If none is left, the token is borrowed from the future.
+
+        :return: Seconds to wait until the token is available.
+        """
+
+        now = self.clock()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        # the tokens may become negative, so every caller waits for its own token in the order of the calls
+        self._tokens -= 1
+        return max(0.0, -self._tokens / self.rate)
+
+    async def acquire(self) -> None:
+        """
+        Wait until a token is available and take it.
+
+        :return: None
+        """
+
+        delay = self.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class SharedTokenBucket(TokenBucket):
+    def __init__(self,
+                 session_maker: sessionmaker,
+                 name: str,
+                 rate: float,
+                 burst: int = 1,
+                 clock: Callable[[], float] = time.time):
+        """
+        Create a new token bucket shared by all processes of the database, e.g. the runners of all jobs. Its tokens
+        are kept in a row of its own, every token is taken by a single update.
+
+        :param session_maker: Session maker of the database.
+        :param name: Name of the bucket.
+        :param rate: Tokens per second.
+        :param burst: Maximum number of tokens.
+        :param clock: Clock in seconds, the same on all hosts.
+        """
+
+        super().__init__(rate=rate, burst=burst, clock=clock)
+        self.session_maker = session_maker
+        self.name = name
+
+        self._created = False
+
+    def __str__(self):
+        return f"{self.__class__.__name__}(name={self.name}, rate={self.rate}, burst={self.burst})"
+
+    def reserve(self) -> float:
+        """
+        Take a token. If none is left, the token is borrowed from the future. It blocks on the database.
+
+        :return: Seconds to wait until the token is available.
+        """
+
+        now = self.clock()
+        table = RateLimit.__table__
+        with self.session_maker() as session, session.begin():
+            if not self._created:
+                # an existing bucket is kept
+                session.execute(upsert(table, dialect=session.bind.dialect.name, key="name", columns=("name",)),
+                                [{"name": self.name, "tokens": float(self.burst), "updated": now}])
+                self._created = True
+            # the clocks of the hosts may differ slightly, time never goes back for the bucket
+            elapsed = case((table.c.updated < now, now - table.c.updated), else_=0.0)
+            tokens = table.c.tokens + elapsed * self.rate
+            session.execute(update(table)
+                            .where(table.c.name == self.name)
+                            .values(tokens=case((tokens > self.burst, float(self.burst)), else_=tokens) - 1,
+                                    updated=case((table.c.updated < now, now), else_=table.c.updated)))
+            tokens = session.execute(select(table.c.tokens).where(table.c.name == self.name)).scalar_one()
+        return max(0.0, -tokens / self.rate)
+
+    async def acquire(self) -> None:
+        """
+        Wait until a token is available and take it. The database is accessed from a thread.
+
+        :return: None
+        """
+
+        delay = await asyncio.to_thread(self.reserve)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class WaveRunner:
+    def __init__(self,
+                 action: Callable[[dict[str, Any]], Awaitable[Any]],
+                 concurrency: int,
+                 site_concurrency: int,
+                 bucket: TokenBucket,
+                 shared_bucket: TokenBucket | None = None):
+        """
+        Run an action on the devices of a wave within the concurrency limits and the rate of the token buckets.
+        The bucket is shared by all waves of a job, the shared bucket by all jobs.
+
+        :param action: Coroutine function running the action on one device.
+        :param concurrency: Maximum number of devices the action runs on at the same time.
+        :param site_concurrency: Maximum number of devices of the same site the action runs on at the same time.
+        :param bucket: Token bucket limiting the rate the action of the job is started with.
+        :param shared_bucket: Token bucket limiting the rate the actions of all jobs are started with.
+        """
+
+        self.action = action
+        self.concurrency = concurrency
+        self.site_concurrency = site_concurrency
+        self.bucket = bucket
+        self.shared_bucket = shared_bucket
+        self.stopped = False
+
+    def stop(self) -> None:
+        """
+        Do not start the action on further devices. The running actions are completed. It may be called from any thread.
+
+        :return: None
+        """
+
+        self.stopped = True
+
+    async def run(self, devices: list[dict[str, Any]], on_result: Callable[[dict[str, Any]], None]) -> int:
+        """
+        Run the action on the devices until all are done or the runner is stopped.
+
+        :param devices: Devices with 'id', 'site' and the fields of device_address.
+        :param on_result: Called with the result of every device, a dict with 'id', 'ok' and 'error'.
+        :return: Number of devices the action was run on.
+        """
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+        site_semaphores: defaultdict[str, asyncio.Semaphore] = defaultdict(lambda: asyncio.Semaphore(self.site_concurrency))
+        started = 0
+
+        async def run_one(device: dict[str, Any]) -> None:
+            nonlocal started
+            # the site slot is taken first, so the devices of a busy site do not hold global slots while waiting
+            site_semaphore = site_semaphores[device["site"]] if device.get("site") else contextlib.nullcontext()
+            async with site_semaphore, semaphore:
+                if self.stopped:
+                    return
+                await self.bucket.acquire()
+                if self.shared_bucket is not None:
+                    await self.shared_bucket.acquire()
+                if self.stopped:
+                    return
+                started += 1
+                try:
+                    await self.action(device)
+                    result = {"id": device["id"], "ok": True, "error": None}
+                except Exception as e:
+                    result = {"id": device["id"], "ok": False, "error": f"{e.__class__.__name__}: {e}"[:1024]}
+            on_result(result)
+
+        await asyncio.gather(*(run_one(device) for device in devices))
+        return started
+
+
+class JobStore:
+    def __init__(self, session_maker: sessionmaker):
+        """
+        Create a new job store. A job runs an action on many devices in waves, its state and the state of every
+        device are kept in the database, so its progress can be read and it can be controlled from any process.
+
+        :param session_maker: Session maker of the database.
+        """
+
+        self.session_maker = session_maker
+
+    def __str__(self):
+        return f"{self.__class__.__name__}()"
+
+    def create(self,
+               action: str,
+               device_ids: Iterable[int],
+               params: dict[str, Any] | None = None,
+               wave_size: int | None = None,
+               wave_interval: float | None = None,
+               concurrency: int | None = None,
+               site_concurrency: int | None = None,
+               rate: float | None = None,
+               burst: int | None = None,
+               max_failure_ratio: float | None = None) -> int:
+        """
+        Create a new queued job. Unknown device IDs are ignored. If an option is None, its setting is used.
+
+        :param action: Name of the action.
+        :param device_ids: IDs of the devices.
+        :param params: Parameters passed to the action.
+        :param wave_size: Number of devices per wave.
+        :param wave_interval: Seconds to wait between two waves.
+        :param concurrency: Maximum number of devices the action runs on at the same time.
+        :param site_concurrency: Maximum number of devices of the same site the action runs on at the same time.
+        :param rate: Number of devices per second the action is started on.
+        :param burst: Number of devices the action may start on at once.
+        :param max_failure_ratio: Share of failed devices of a wave above which the job is paused.
+        :return: ID of the job.
+        """
+
+        device_ids = list(device_ids)
+        wave_size = wave_size or settings.jobs_wave_size
+        with self.session_maker() as session, session.begin():
+            devices = []
+            for i in range(0, len(device_ids), 500):
+                devices += session.execute(select(Device.id, Device.site)
+                                           .where(Device.id.in_(device_ids[i:i + 500]))).all()
+
+            # the devices of a site are spread evenly over the waves, so a wave only takes a share of every site
+            by_site: defaultdict[str | None, list[int]] = defaultdict(list)
+            for device_id, site in sorted(devices, key=lambda device: device[0]):
+                by_site[site].append(device_id)
+            position = {device_id: i / len(site_ids) for site_ids in by_site.values() for i, device_id in enumerate(site_ids)}
+            sites = {device_id: site for device_id, site in devices}
+            ordered = sorted(devices, key=lambda device: (position[device[0]], str(device[1]), device[0]))
+
+            job = Job(action=action,
+                      params=params or {},
+                      state="queued",
+                      wave_size=wave_size,
+                      wave_interval=settings.jobs_wave_interval if wave_interval is None else wave_interval,
+                      concurrency=concurrency or settings.jobs_concurrency,
+                      site_concurrency=site_concurrency or settings.jobs_site_concurrency,
+                      rate=rate or settings.jobs_rate,
+                      burst=burst or settings.jobs_burst,
+                      max_failure_ratio=settings.jobs_max_failure_ratio if max_failure_ratio is None else max_failure_ratio,
+                      created=datetime.now(timezone.utc))
+            session.add(job)
+            session.flush()
+            if ordered:
+                session.execute(insert(JobItem), [{"job_id": job.id,
+                                                   "device_id": device_id,
+                                                   "wave": i // wave_size,
+                                                   "site": sites[device_id],
+                                                   "state": "pending"} for i, (device_id, _) in enumerate(ordered)])
+            logger.debug(f"{self} created job {job.id} '{action}' for {len(ordered)} devices.")
+            return job.id
+
+    @staticmethod
+    def _job_dict(job: Job) -> dict[str, Any]:
+        return {column.name: getattr(job, column.name) for column in Job.__table__.columns}
+
+    def get(self, job_id: int) -> dict[str, Any]:
+        """
+        Get a job.
+
+        :param job_id: ID of the job.
+        :return: Job with all its columns.
+        """
+
+        with self.session_maker() as session:
+            job = session.get(Job, job_id)
+            if job is None:
+                raise KeyError(f"Job {job_id} does not exist.")
+            return self._job_dict(job)
+
+    def jobs(self, limit: int = 50) -> list[dict[str, Any]]:
+        """
+        Get the latest jobs.
+
+        :param limit: Maximum number of jobs.
+        :return: Jobs with all their columns, the newest first.
+        """
+
+        with self.session_maker() as session:
+            return [self._job_dict(job) for job in session.execute(select(Job).order_by(Job.id.desc()).limit(limit)).scalars()]
+
+    def progress(self, job_id: int) -> dict[str, Any]:
+        """
+        Get the progress of a job.
+
+        :param job_id: ID of the job.
+        :return: Job with all its columns, the number of devices by state as 'counts', the number of devices by state
+                 of every wave as 'waves', the current wave as 'wave' and 'done' and 'total'.
+        """
+
+        progress = self.get(job_id)
+        with self.session_maker() as session:
+            rows = session.execute(select(JobItem.wave, JobItem.state, func.count())
+                                   .where(JobItem.job_id == job_id)
+                                   .group_by(JobItem.wave, JobItem.state)
+                                   .order_by(JobItem.wave)).all()
+        counts = dict.fromkeys(ITEM_STATES, 0)
+        waves: dict[int, dict[str, int]] = {}
+        for wave, state, count in rows:
+            counts[state] += count
+            waves.setdefault(wave, dict.fromkeys(ITEM_STATES, 0))[state] += count
+        pending_waves = [wave for wave, wave_counts in waves.items() if wave_counts["pending"]]
+        progress.update(counts=counts,
+                        waves=waves,
+                        wave=pending_waves[0] if pending_waves else None,
+                        done=sum(counts.values()) - counts["pending"],
+                        total=sum(counts.values()))
+        return progress
+
+    def recover(self, job_id: int) -> bool:
+        """
+        Pause a running job whose runner has not renewed its lease, e.g. because its worker was killed.
+
+        :param job_id: ID of the job.
+        :return: True if the job was orphaned.
+        """
+
+        expired = datetime.now(timezone.utc) - timedelta(seconds=settings.jobs_lease)
+        with self.session_maker() as session, session.begin():
+            recovered = session.execute(update(Job)
+                                        .where(Job.id == job_id,
+                                               Job.state == "running",
+                                               or_(Job.heartbeat.is_(None), Job.heartbeat < expired))
+                                        .values(state="paused",
+                                                control=None,
+                                                runner=None,
+                                                message="The runner of the job was lost.")).rowcount > 0
+        if recovered:
+            logger.warning(f"{self} job {job_id} was orphaned and is paused.")
+        return recovered
+
+    def pause(self, job_id: int) -> bool:
+        """
+        Request a queued or running job to pause. Its runner completes the running actions and stops. An orphaned
+        job is paused at once.
+
+        :param job_id: ID of the job.
+        :return: True if the request was accepted.
+        """
+
+        if self.recover(job_id):
+            return True
+        with self.session_maker() as session, session.begin():
+            return session.execute(update(Job)
+                                   .where(Job.id == job_id, Job.state.in_(("queued", "running")), Job.control.is_(None))
+                                   .values(control="pause")).rowcount > 0
+
+    def resume(self, job_id: int) -> bool:
+        """
+        Queue a paused or orphaned job again. A new runner has to be started afterwards, see start_job.
+
+        :param job_id: ID of the job.
+        :return: True if the job was paused.
+        """
+
+        self.recover(job_id)
+        with self.session_maker() as session, session.begin():
+            return session.execute(update(Job)
+                                   .where(Job.id == job_id, Job.state == "paused")
+                                   .values(state="queued", control=None, message=None)).rowcount > 0
+
+    def abort(self, job_id: int) -> bool:
+        """
+        Abort a job. A paused or orphaned job is aborted at once, a queued or running job by its runner after the
+        running actions.
+
+        :param job_id: ID of the job.
+        :return: True if the request was accepted.
+        """
+
+        self.recover(job_id)
+        with self.session_maker() as session, session.begin():
+            if session.execute(update(Job)
+                               .where(Job.id == job_id, Job.state.in_(("queued", "running")))
+                               .values(control="abort")).rowcount > 0:
+                return True
+        if self.get(job_id)["state"] != "paused":
+            return False
+        self.finish(job_id, "aborted", "Aborted while paused.")
+        return True
+
+    def claim(self, job_id: int) -> dict[str, Any] | None:
+        """
+        Mark a queued job as running. Only one runner gets a job, it holds its lease as long as it renews it.
+
+        :param job_id: ID of the job.
+        :return: The job with the ID of the runner as 'runner' or None if it is not queued.
+        """
+
+        now = datetime.now(timezone.utc)
+        with self.session_maker() as session, session.begin():
+            claimed = session.execute(update(Job)
+                                      .where(Job.id == job_id, Job.state == "queued")
+                                      .values(state="running",
+                                              runner=uuid.uuid4().hex,
+                                              heartbeat=now,
+                                              started=func.coalesce(Job.started, now))).rowcount > 0
+        return self.get(job_id) if claimed else None
+
+    def renew(self, job_id: int, runner: str) -> bool:
+        """
+        Renew the lease of a running job.
+
+        :param job_id: ID of the job.
+        :param runner: ID of the runner.
+        :return: False if the runner lost the job, e.g. because it was recovered as orphaned.
+        """
+
+        with self.session_maker() as session, session.begin():
+            return session.execute(update(Job)
+                                   .where(Job.id == job_id, Job.state == "running", Job.runner == runner)
+                                   .values(heartbeat=datetime.now(timezone.utc))).rowcount > 0
+
+    def control(self, job_id: int) -> str | None:
+        """
+        Get the pending control request of a job.
+
+        :param job_id: ID of the job.
+        :return: 'pause', 'abort' or None.
+        """
+
+        with self.session_maker() as session:
+            return session.execute(select(Job.control).where(Job.id == job_id)).scalar_one_or_none()
+
+    def pending(self, job_id: int) -> list[tuple[int, list[dict[str, Any]]]]:
+        """
+        Get the pending devices of a job by wave.
+
+        :param job_id: ID of the job.
+        :return: List of wave and its devices with 'id', 'site' and the fields of device_address, ordered by wave.
+        """
+
+        query = (select(JobItem.wave, JobItem.site, Device.id, Device.host, Device.port, Device.username,
+                        Device.password, Device.tls)
+                 .join(Device, Device.id == JobItem.device_id)
+                 .where(JobItem.job_id == job_id, JobItem.state == "pending")
+                 .order_by(JobItem.wave))
+        waves: dict[int, list[dict[str, Any]]] = {}
+        with self.session_maker() as session:
+            for row in session.execute(query):
+                waves.setdefault(row.wave, []).append({"id": row.id,
+                                                       "site": row.site,
+                                                       "host": row.host,
+                                                       "port": row.port,
+                                                       "username": row.username,
+                                                       "password": row.password,
+                                                       "tls": row.tls})
+        return list(waves.items())
+
+    def record(self, job_id: int, results: list[dict[str, Any]]) -> None:
+        """
+        Record the results of devices of a job.
+
+        :param job_id: ID of the job.
+        :param results: Results with 'id', 'ok' and 'error'.
+        :return: None
+        """
+
+        if not results:
+            return
+        now = datetime.now(timezone.utc)
+        statement = (update(JobItem.__table__)
+                     .where(JobItem.__table__.c.job_id == job_id, JobItem.__table__.c.device_id == bindparam("b_id"))
+                     .values(state=bindparam("b_state"), error=bindparam("b_error"), finished=now))
+        with self.session_maker() as session, session.begin():
+            session.connection().execute(statement, [{"b_id": result["id"],
+                                                      "b_state": "succeeded" if result["ok"] else "failed",
+                                                      "b_error": result["error"]} for result in results])
+
+    def finish(self, job_id: int, state: str, message: str | None = None, runner: str | None = None) -> bool:
+        """
+        End the run of a job. The pending devices of an aborted job are skipped.
+
+        :param job_id: ID of the job.
+        :param state: 'paused', 'aborted' or 'finished'.
+        :param message: Reason shown with the state.
+        :param runner: ID of the runner. If set, the job is only ended while the runner holds its lease.
+        :return: True if the job was ended.
+        """
+
+        if state not in ("paused", "aborted", "finished"):
+            raise ValueError(f"Invalid final state '{state}'.")
+        now = datetime.now(timezone.utc)
+        with self.session_maker() as session, session.begin():
+            query = update(Job).where(Job.id == job_id)
+            if runner is not None:
+                query = query.where(Job.state == "running", Job.runner == runner)
+            if not session.execute(query.values(state=state,
+                                                control=None,
+                                                runner=None,
+                                                message=message,
+                                                finished=None if state == "paused" else now)).rowcount:
+                return False
+            if state == "aborted":
+                session.execute(update(JobItem)
+                                .where(JobItem.job_id == job_id, JobItem.state == "pending")
+                                .values(state="skipped", finished=now))
+        logger.debug(f"{self} job {job_id} {state}{f': {message}' if message else ''}.")
+        return True
+
+
+def start_job(job_id: int) -> None:
+    """
+    Start a runner for a queued job on a worker. Small jobs run on the interactive queue, large ones on the bulk queue.
+
+    :param job_id: ID of the job.
+    :return: None
+    """
+
+    from mikrotik_manager.worker import celery_app
+
+    queue = "interactive" if get_job_store().progress(job_id)["total"] <= settings.jobs_interactive_max_devices else "bulk"
+    celery_app.send_task("run_job", args=[job_id], queue=queue)
+
+
+@cache
+def get_job_bucket() -> SharedTokenBucket:
+    """
+    Get the token bucket shared by the runners of all jobs.
+
+    :return: SharedTokenBucket
+    """
+
+    return SharedTokenBucket(session_maker=db().session_maker,
+                             name="jobs",
+                             rate=settings.jobs_global_rate,
+                             burst=settings.jobs_global_burst)
+
+
+@cache
+def get_job_store() -> JobStore:
+    """
+    Get the job store of the configured database.
+
+    :return: JobStore
+    """
+
+    return JobStore(session_maker=db().session_maker)
@@ -0,0 +1,588 @@
+import asyncio
+import ipaddress
+import logging
+import re
+import signal
+import socket
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable
+
+from sqlalchemy import insert, select, update
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from mikrotik_manager.db import Device, DeviceEvent, DeviceStatus
+from mikrotik_manager.device_status import upsert
+
+logger = logging.getLogger(__name__)
+
+# syslog header of RFC 5424 or RFC 3164, the hostname of RFC 3164 is left in the message
+SYSLOG_HEADER = re.compile(r"^<(?P<pri>\d{1,3})>"
+                           r"(?:1 \S+ \S+ \S+ \S+ \S+ (?:-|(?:\[.*?])+) ?|[A-Z][a-z]{2} [ \d]\d \d\d:\d\d:\d\d )?")
+
+# events of the RouterOS log messages, the first matching one wins
+SYSLOG_EVENTS = (("link", re.compile(r"(?P<interface>\S+) link (?P<state>up|down)\b")),
+                 ("login_failure", re.compile(r"login failure for user (?P<user>\S+)"
+                                              r"(?: from (?P<address>\S+))?(?: via (?P<via>\S+))?")),
+                 ("login", re.compile(r"user (?P<user>\S+) logged (?P<state>in|out)"
+                                      r"(?: from (?P<address>\S+))?(?: via (?P<via>\S+))?")),
+                 ("config", re.compile(r"\b(?P<action>changed|added|removed|moved) by (?P<user>\S+)")),
+                 ("reboot", re.compile(r"\brouter (?:was )?rebooted\b")))
+
+SNMP_TRAP_OID = "1.3.6.1.6.3.1.1.4.1.0"
+# kind and fields of the standard traps of SNMPv2-MIB and IF-MIB
+SNMP_TRAPS = {"1.3.6.1.6.3.1.1.5.1": ("reboot", {}),
+              "1.3.6.1.6.3.1.1.5.2": ("reboot", {}),
+              "1.3.6.1.6.3.1.1.5.3": ("link", {"state": "down"}),
+              "1.3.6.1.6.3.1.1.5.4": ("link", {"state": "up"}),
+              "1.3.6.1.6.3.1.1.5.5": ("login_failure", {})}
+# the generic traps of SNMPv1 are the standard traps above
+SNMP_GENERIC_TRAPS = {0: "1.3.6.1.6.3.1.1.5.1",
+                      1: "1.3.6.1.6.3.1.1.5.2",
+                      2: "1.3.6.1.6.3.1.1.5.3",
+                      3: "1.3.6.1.6.3.1.1.5.4",
+                      4: "1.3.6.1.6.3.1.1.5.5"}
+IF_NAME_OIDS = ("1.3.6.1.2.1.31.1.1.1.1.", "1.3.6.1.2.1.2.2.1.2.")  # ifName, ifDescr
+IF_INDEX_OID = "1.3.6.1.2.1.2.2.1.1."
+
+# events which change the inventory of a device
+REFRESH_KINDS = frozenset({"config", "reboot"})
+
+
+def parse_syslog(data: bytes) -> dict[str, Any]:
+    """
+    Parse a syslog message of a device.
+
+    :param data: Received datagram.
+    :return: Event with 'kind', 'severity', 'message' and 'data'. Unknown messages are of the kind 'message'.
+    """
+
+    text = data.decode("utf-8", errors="replace").strip()
+    severity = None
+    header = SYSLOG_HEADER.match(text)
+    if header is not None:
+        severity = int(header["pri"]) & 7
+        text = text[header.end():]
+    for kind, pattern in SYSLOG_EVENTS:
+        match = pattern.search(text)
+        if match is not None:
+            return {"kind": kind,
+                    "severity": severity,
+                    "message": text[:1024],
+                    "data": {key: value for key, value in match.groupdict().items() if value is not None}}
+    return {"kind": "message", "severity": severity, "message": text[:1024], "data": {}}
+
+
+def _ber(data: bytes, offset: int) -> tuple[int, bytes, int]:
+    # one BER encoded element, returns its tag, its value and the offset of the next element
+    tag = data[offset]
+    length = data[offset + 1]
+    offset += 2
+    if length & 0x80:
+        size = length & 0x7F
+        if not 0 < size <= 4:
+            raise ValueError(f"Unsupported BER length of {size} bytes.")
+        length = int.from_bytes(data[offset:offset + size], "big")
+        offset += size
+    end = offset + length
+    if end > len(data):
+        raise ValueError("Truncated BER element.")
+    return tag, data[offset:end], end
+
+
+def _ber_sequence(data: bytes) -> list[tuple[int, bytes]]:
+    items = []
+    offset = 0
+    while offset < len(data):
+        tag, value, offset = _ber(data, offset)
+        items.append((tag, value))
+    return items
+
+
+def _ber_oid(value: bytes) -> str:
+    first = value[0]
+    parts = [min(first // 40, 2), first - min(first // 40, 2) * 40]
+    number = 0
+    for byte in value[1:]:
+        number = (number << 7) | (byte & 0x7F)
+        if not byte & 0x80:
+            parts.append(number)
+            number = 0
+    return ".".join(str(part) for part in parts)
+
+
+def _ber_value(tag: int, value: bytes) -> Any:
+    if tag == 0x02:  # INTEGER
+        return int.from_bytes(value, "big", signed=True)
+    if tag == 0x04:  # OCTET STRING
+        return value.decode("utf-8", errors="replace")
+    if tag == 0x06:  # OBJECT IDENTIFIER
+        return _ber_oid(value)
+    if tag == 0x40:  # IpAddress
+        return ".".join(str(byte) for byte in value)
+    if tag in (0x41, 0x42, 0x43, 0x46):  # Counter32, Gauge32, TimeTicks, Counter64
+        return int.from_bytes(value, "big")
+    if tag == 0x05:  # NULL
+        return None
+    return value.hex()
+
+
+def parse_trap(data: bytes, community: str | None = None) -> dict[str, Any] | None:
+    """
+    Parse an SNMPv1 or SNMPv2c trap of a device.
+
+    :param data: Received datagram.
+    :param community: Only accept traps of this community. If None, traps of every community are accepted.
+    :return: Event with 'kind', 'severity', 'message' and 'data'. Unknown traps are of the kind 'message'.
+             None if the datagram is no trap or of another community.
+    """
+
+    try:
+        tag, message, _ = _ber(data, 0)
+        if tag != 0x30:
+            return None
+        (_, version), (_, trap_community), (pdu_tag, pdu) = _ber_sequence(message)[:3]
+        if community is not None and trap_community.decode("utf-8", errors="replace") != community:
+            return None
+        fields = _ber_sequence(pdu)
+        if pdu_tag == 0xA4 and int.from_bytes(version, "big") == 0:
+            # SNMPv1: enterprise, agent address, generic trap, specific trap, time stamp, variable bindings
+            enterprise = _ber_oid(fields[0][1])
+            generic = int.from_bytes(fields[2][1], "big")
+            specific = int.from_bytes(fields[3][1], "big")
+            trap = SNMP_GENERIC_TRAPS.get(generic, f"{enterprise}.0.{specific}")
+            bindings = fields[5][1]
+        elif pdu_tag == 0xA7 and int.from_bytes(version, "big") == 1:
+            # SNMPv2c: request ID, error status, error index, variable bindings
+            trap = None
+            bindings = fields[3][1]
+        else:
+            return None
+        variables = {}
+        for _, binding in _ber_sequence(bindings):
+            (_, oid), (value_tag, value) = _ber_sequence(binding)[:2]
+            variables[_ber_oid(oid)] = _ber_value(value_tag, value)
+    except (IndexError, ValueError):
+        return None
+
+    trap = trap or variables.pop(SNMP_TRAP_OID, None)
+    if not isinstance(trap, str):
+        return None
+    kind, extra = SNMP_TRAPS.get(trap, ("message", {}))
+    event = {"trap": trap, **extra}
+    if kind == "link":
+        for oid, value in variables.items():
+            if oid.startswith(IF_NAME_OIDS) and value:
+                event.setdefault("interface", value)
+            elif oid.startswith(IF_INDEX_OID):
+                event["if_index"] = value
+        interface = event.get("interface", event.get("if_index", "interface"))
+        message = f"{interface} link {event['state']}"
+    else:
+        message = f"{kind} trap {trap}" if kind != "message" else f"trap {trap}"
+    event["variables"] = {oid: value for oid, value in variables.items() if isinstance(value, (int, str))}
+    return {"kind": kind, "severity": None, "message": message[:1024], "data": event}
+
+
+def normalize_address(address: str) -> str:
+    """
+    Normalize an IP address, IPv4 mapped IPv6 addresses become IPv4 addresses.
+
+    :param address: IP address.
+    :return: str
+    :raises ValueError: If the address is no IP address.
+    """
+
+    ip = ipaddress.ip_address(address)
+    if ip.version == 6 and ip.ipv4_mapped is not None:
+        ip = ip.ipv4_mapped
+    return str(ip)
+
+
+class DeviceIndex:
+    def __init__(self, session_maker: async_sessionmaker, resolve: bool = True, resolve_timeout: float = 5.0,
+                 resolve_concurrency: int = 32):
+        """
+        Map the source addresses of received messages to devices. The addresses are held in memory and reloaded from
+        the database by refresh. If several devices share an address, the one with the lowest ID wins.
+
+        :param session_maker: Async session maker of the database.
+        :param resolve: Resolve the devices configured by hostname.
+        :param resolve_timeout: Seconds to wait for the resolution of a hostname.
+        :param resolve_concurrency: Maximum number of hostnames resolved at the same time.
+        """
+
+        self.session_maker = session_maker
+        self.resolve = resolve
+        self.resolve_timeout = resolve_timeout
+        self.resolve_concurrency = resolve_concurrency
+        self.addresses: dict[str, int] = {}
+
+    def __str__(self):
+        return f"{self.__class__.__name__}(addresses={len(self.addresses)})"
+
+    def lookup(self, address: str) -> int | None:
+        """
+        Get the device of a source address.
+
+        :param address: Source address of a message.
+        :return: ID of the device or None if the address is unknown.
+        """
+
+        device_id = self.addresses.get(address)
+        if device_id is None and ":" in address:
+            try:
+                device_id = self.addresses.get(normalize_address(address))
+            except ValueError:
+                return None
+        return device_id
+
+    async def _resolve(self, semaphore: asyncio.Semaphore, host: str) -> list[str]:
+        loop = asyncio.get_running_loop()
+        async with semaphore:
+            try:
+                infos = await asyncio.wait_for(loop.getaddrinfo(host, None, type=socket.SOCK_DGRAM),
+                                               self.resolve_timeout)
+            except (OSError, TimeoutError) as e:
+                logger.debug(f"{self} could not resolve '{host}': {e}")
+                return []
+        return [normalize_address(str(info[4][0])) for info in infos]
+
+    async def refresh(self) -> None:
+        """
+        Reload the addresses of all devices from the database.
+
+        :return: None
+        """
+
+        async with self.session_maker() as session:
+            rows = (await session.execute(select(Device.id, Device.host).order_by(Device.id))).all()
+        addresses: dict[str, int] = {}
+        hostnames = []
+        for device_id, host in rows:
+            try:
+                addresses.setdefault(normalize_address(host), device_id)
+            except ValueError:
+                hostnames.append((device_id, host))
+        if hostnames and self.resolve:
+            semaphore = asyncio.Semaphore(self.resolve_concurrency)
+            resolved = await asyncio.gather(*(self._resolve(semaphore, host) for _, host in hostnames))
+            # the devices configured by address win over the ones configured by hostname
+            for (device_id, _), host_addresses in zip(hostnames, resolved):
+                for address in host_addresses:
+                    addresses.setdefault(address, device_id)
+        self.addresses = addresses
+        logger.debug(f"{self} loaded {len(rows)} devices.")
+
+
+class _ListenerProtocol(asyncio.DatagramProtocol):
+    def __init__(self, listener: "EventListener", source: str):
+        self.listener = listener
+        self.source = source
+
+    def datagram_received(self, data: bytes, addr: tuple[Any, ...]) -> None:
+        self.listener.receive(self.source, data, addr[0])
+
+    def error_received(self, exc: Exception) -> None:
+        logger.debug(f"{self.listener} {self.source} socket error: {exc}")
+
+
+class EventListener:
+    def __init__(self,
+                 session_maker: async_sessionmaker,
+                 index: DeviceIndex | None = None,
+                 publish: Callable[[list[dict[str, Any]]], None] | None = None,
+                 refresh: Callable[[list[int]], None] | None = None,
+                 batch_size: int = 1000,
+                 interval: float = 0.2,
+                 queue_size: int = 100000,
+                 store_messages: bool = False,
+                 trap_community: str | None = None,
+                 last_seen_interval: float = 900.0,
+                 refresh_interval: float = 60.0):
+        """
+        Receive the syslog messages and SNMP traps of the devices. The received datagrams are queued by the protocols
+        and processed in batches: the events of a batch are written in one insert, the last seen timestamp of the
+        devices in one update, and the changes are published as inventory deltas.
+
+        :param session_maker: Async session maker of the database.
+        :param index: Index of the device addresses. If None, one is created.
+        :param publish: Called with the list of deltas after they are written. It is called in a thread.
+        :param refresh: Called with the IDs of the devices whose configuration changed or which rebooted. It is called
+                        in a thread.
+        :param batch_size: Maximum number of datagrams processed at once. Reaching it starts processing immediately.
+        :param interval: Maximum seconds a datagram waits before it is processed.
+        :param queue_size: Maximum number of waiting datagrams, further datagrams are dropped.
+        :param store_messages: Also store messages which are no known event.
+        :param trap_community: Only accept traps of this community. If None, traps of every community are accepted.
+        :param last_seen_interval: Seconds after which the last seen timestamp of a device is written again.
+        :param refresh_interval: Minimum seconds between two refreshes of a device. If 0, there are no refreshes.
+        """
+
+        self.session_maker = session_maker
+        self.index = index or DeviceIndex(session_maker=session_maker)
+        self.publish = publish
+        self.refresh = refresh
+        self.batch_size = batch_size
+        self.interval = interval
+        self.queue_size = queue_size
+        self.store_messages = store_messages
+        self.trap_community = trap_community
+        self.last_seen_interval = last_seen_interval
+        self.refresh_interval = refresh_interval
+
+        self.received = 0
+        self.dropped = 0
+        self.unknown = 0
+        self.invalid = 0
+        self.events = 0
+        self._queue: list[tuple[str, bytes, str]] = []
+        self._wakeup: asyncio.Event | None = None
+        self._last_seen_written: dict[int, float] = {}
+        self._refreshed: dict[int, float] = {}
+
+    def __str__(self):
+        return f"{self.__class__.__name__}(received={self.received}, events={self.events}, dropped={self.dropped})"
+
+    def receive(self, source: str, data: bytes, address: str) -> None:
+        """
+        Queue a received datagram.
+
+        :param source: 'syslog' or 'trap'.
+        :param data: Received datagram.
+        :param address: Source address of the datagram.
+        :return: None
+        """
+
+        if len(self._queue) >= self.queue_size:
+            self.dropped += 1
+            return
+        self.received += 1
+        self._queue.append((source, data, address))
+        if len(self._queue) >= self.batch_size and self._wakeup is not None:
+            self._wakeup.set()
+
+    def parse(self, batch: list[tuple[str, bytes, str]]) -> tuple[list[dict[str, Any]], set[int]]:
+        """
+        Parse a batch of datagrams.
+
+        :param batch: Source, datagram and source address of the received datagrams.
+        :return: Events to store and the IDs of the devices heard from.
+        """
+
+        now = datetime.now(timezone.utc)
+        events = []
+        heard = set()
+        for source, data, address in batch:
+            device_id = self.index.lookup(address)
+            if device_id is None:
+                self.unknown += 1
+                continue
+            event = parse_syslog(data) if source == "syslog" else parse_trap(data, community=self.trap_community)
+            if event is None:
+                self.invalid += 1
+                continue
+            heard.add(device_id)
+            if event["kind"] == "message" and not self.store_messages:
+                continue
+            events.append({"device_id": device_id, "time": now, "source": source, **event})
+        return events, heard
+
+    async def process(self, batch: list[tuple[str, bytes, str]]) -> list[dict[str, Any]]:
+        """
+        Process a batch of datagrams. The events, the last seen timestamps and the status of the devices which went
+        online are written in one transaction.
+
+        :param batch: Source, datagram and source address of the received datagrams.
+        :return: List of deltas with 'id' and the changed fields.
+        """
+
+        events, heard = self.parse(batch)
+        if not heard:
+            return []
+        now = time.monotonic()
+        touched = [device_id for device_id in heard
+                   if now - self._last_seen_written.get(device_id, float("-inf")) > self.last_seen_interval]
+
+        last_seen = datetime.now(timezone.utc)
+        async with self.session_maker() as session, session.begin():
+            # a device which sends messages is online, only the devices which were not are written
+            online = set((await session.execute(select(DeviceStatus.device_id)
+                                                .where(DeviceStatus.device_id.in_(heard),
+                                                       DeviceStatus.status == "online"))).scalars())
+            went_online = sorted(heard - online)
+            if went_online:
+                await session.execute(upsert(DeviceStatus.__table__,
+                                             dialect=session.bind.dialect.name,
+                                             key="device_id",
+                                             columns=("status", "error", "updated")),
+                                      [{"device_id": device_id, "status": "online", "rtt": None, "error": None,
+                                        "updated": last_seen} for device_id in went_online])
+            if events:
+                await session.execute(insert(DeviceEvent.__table__), events)
+            if touched:
+                await session.execute(update(Device.__table__)
+                                      .where(Device.__table__.c.id.in_(touched))
+                                      .values(last_seen=last_seen))
+        self.events += len(events)
+        for device_id in touched:
+            self._last_seen_written[device_id] = now
+
+        deltas: dict[int, dict[str, Any]] = {device_id: {"id": device_id, "last_seen": last_seen} for device_id in touched}
+        for device_id in went_online:
+            deltas.setdefault(device_id, {"id": device_id})["status"] = "online"
+        for event in events:
+            if event["kind"] != "message":
+                deltas.setdefault(event["device_id"], {"id": event["device_id"]})["last_event"] = event["message"]
+        if deltas and self.publish is not None:
+            # the changes are already stored, subscribers can catch up from the database
+            try:
+                await asyncio.to_thread(self.publish, list(deltas.values()))
+            except Exception as e:
+                logger.warning(f"{self} could not publish {len(deltas)} deltas: {e}")
+
+        if self.refresh is not None and self.refresh_interval:
+            due = {event["device_id"] for event in events if event["kind"] in REFRESH_KINDS
+                   and now - self._refreshed.get(event["device_id"], float("-inf")) >= self.refresh_interval}
+            if due:
+                await self._refresh(sorted(due), now)
+        return list(deltas.values())
+
+    async def _refresh(self, device_ids: list[int], now: float) -> None:
+        try:
+            await asyncio.to_thread(self.refresh, device_ids)
+        except Exception as e:
+            logger.warning(f"{self} could not refresh {len(device_ids)} devices: {e}")
+            return
+        for device_id in device_ids:
+            self._refreshed[device_id] = now
+        logger.debug(f"{self} refreshed {len(device_ids)} devices.")
+
+    async def flush(self) -> None:
+        """
+        Process all waiting datagrams. A failed batch is dropped.
+
+        :return: None
+        """
+
+        while self._queue:
+            batch, self._queue = self._queue[:self.batch_size], self._queue[self.batch_size:]
+            try:
+                await self.process(batch)
+            except Exception as e:
+                self.dropped += len(batch)
+                logger.warning(f"{self} could not process {len(batch)} datagrams: {e}")
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.interval)
+            except TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def _refresh_index(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.index.refresh()
+            except Exception as e:
+                logger.warning(f"{self} could not reload the device addresses: {e}")
+
+    async def serve(self,
+                    host: str,
+                    syslog_port: int | None = None,
+                    trap_port: int | None = None,
+                    index_interval: float = 60.0,
+                    receive_buffer: int = 4 * 1024 * 1024) -> None:
+        """
+        Receive datagrams until cancelled.
+
+        :param host: Host to listen on.
+        :param syslog_port: UDP port of the syslog messages. If None, no syslog messages are received.
+        :param trap_port: UDP port of the SNMP traps. If None, no traps are received.
+        :param index_interval: Seconds between two reloads of the device addresses.
+        :param receive_buffer: Receive buffer of the sockets in bytes, it holds bursts while a batch is written.
+        :return: None
+        """
+
+        loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        await self.index.refresh()
+        transports = []
+        try:
+            for source, port in (("syslog", syslog_port), ("trap", trap_port)):
+                if port is None:
+                    continue
+                transport, _ = await loop.create_datagram_endpoint(lambda s=source: _ListenerProtocol(self, s),
+                                                                   local_addr=(host, port))
+                try:
+                    transport.get_extra_info("socket").setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, receive_buffer)
+                except OSError as e:
+                    logger.debug(f"{self} could not set the receive buffer: {e}")
+                transports.append(transport)
+                logger.info(f"{self} listening for {source} on {host}:{transport.get_extra_info('sockname')[1]}.")
+            await asyncio.gather(self._run(), self._refresh_index(index_interval))
+        finally:
+            for transport in transports:
+                transport.close()
+            await self.flush()
+
+
+def send_refresh(device_ids: list[int]) -> None:
+    """
+    Send the devices to the workers to fetch their information again.
+
+    :param device_ids: IDs of the devices.
+    :return: None
+    """
+
+    from mikrotik_manager.tasks import fetch_device_info_batch
+
+    # the configuration changed, so a recently fetched result of the same devices is outdated
+    fetch_device_info_batch.apply_async(args=[device_ids], force=True)
+
+
+def run() -> None:
+    """
+    Run the syslog and SNMP trap listener with the settings until interrupted.
+
+    :return: None
+    """
+
+    from mikrotik_manager.db import async_engine, async_session_maker
+    from mikrotik_manager.events import publish_inventory_deltas
+    from mikrotik_manager.settings import settings
+
+    async def main() -> None:
+        try:
+            # stopping like on an interrupt, so the waiting datagrams are processed
+            asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+        except NotImplementedError:
+            pass
+        listener = EventListener(session_maker=async_session_maker(),
+                                 publish=publish_inventory_deltas,
+                                 refresh=send_refresh,
+                                 batch_size=settings.listener_batch_size,
+                                 interval=settings.listener_batch_interval,
+                                 queue_size=settings.listener_queue_size,
+                                 store_messages=settings.listener_store_messages,
+                                 trap_community=settings.listener_trap_community,
+                                 last_seen_interval=settings.inventory_last_seen_interval,
+                                 refresh_interval=settings.listener_refresh_interval)
+        try:
+            await listener.serve(host=settings.listener_host,
+                                 syslog_port=settings.listener_syslog_port,
+                                 trap_port=settings.listener_trap_port,
+                                 index_interval=settings.listener_index_interval)
+        finally:
+            logger.info(f"{listener} stopped, {listener.unknown} datagrams of unknown sources, "
+                        f"{listener.invalid} invalid.")
+            # the connections of aiosqlite are threads which would keep the process alive
+            await async_engine().dispose()
+
+    try:
+        asyncio.run(main())
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass
@@ -0,0 +1,184 @@
+import logging
+import os
+import threading
+from typing import Any, Callable
+
+import yaml
+from pydantic import ValidationError
+
+from mikrotik_manager import __name__ as __module_name__
+from mikrotik_manager.settings import Settings, settings, settings_file_key, settings_file_path
+
+logger = logging.getLogger(__name__)
+
+# settings which are read on use or applied by a callback, all others need a restart
+RELOADABLE_FIELDS = frozenset({"log_level",
+                               "log_console_level",
+                               "log_file_level",
+                               "worker_batch_concurrency",
+                               "worker_batch_page_size",
+                               "scheduler_enabled",
+                               "scheduler_interval",
+                               "scheduler_jitter",
+                               "scheduler_max_interval",
+                               "scheduler_slow_rtt",
+                               "scheduler_batch_size",
+                               "scheduler_tick",
+                               "scheduler_sync_interval",
+                               "metrics_interval",
+                               "metrics_max_points",
+                               "backup_interval",
+                               "backup_binary",
+                               "backup_show_sensitive",
+                               "backup_diff_max_lines",
+                               "backup_retention",
+                               "jobs_wave_size",
+                               "jobs_wave_interval",
+                               "jobs_concurrency",
+                               "jobs_site_concurrency",
+                               "jobs_rate",
+                               "jobs_burst",
+                               "jobs_max_failure_ratio",
+                               "jobs_control_interval",
+                               "ui_status_update_interval",
+                               "ui_device_table_rows_per_page"})
+
+
+class SettingsWatcher:
+    def __init__(self, target: Settings, interval: float = 5.0):
+        """
+        Watch the settings file and apply changes of the reloadable settings to the settings of this process.
+        Only the changed fields are validated, the settings file is not loaded as a whole again. The fields of the
+        settings are replaced at once by a validated copy, they are never changed in place.
+
+        :param target: Settings to update.
+        :param interval: Seconds between two checks of the settings file.
+        """
+
+        self.target = target
+        self.interval = interval
+        self.path = settings_file_path()
+        self._key = settings_file_key(self.path)
+        self._lock = threading.Lock()
+        self._callbacks: list[Callable[[dict[str, Any]], None]] = []
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._pid: int | None = None
+
+    def __str__(self):
+        return f"{self.__class__.__name__}({self.path})"
+
+    def on_change(self, callback: Callable[[dict[str, Any]], None]) -> None:
+        """
+        Register a callback called with the changed settings after they are applied.
+
+        :param callback: Called with the new values by field name.
+        :return: None
+        """
+
+        self._callbacks.append(callback)
+
+    def check(self) -> dict[str, Any]:
+        """
+        Apply the changed reloadable settings if the settings file changed. Invalid files are ignored.
+
+        :return: The applied values by field name.
+        """
+
+        with self._lock:
+            key = settings_file_key(self.path)
+            if key is None or key == self._key:
+                return {}
+            self._key = key
+            try:
+                data = yaml.safe_load(self.path.read_text()) or {}
+            except (OSError, yaml.YAMLError) as e:
+                logger.error(f"{self} could not read the settings file: {e}")
+                return {}
+
+            current = self.target.model_dump(mode="json", include=set(data.keys()))
+            changed = {name: value for name, value in data.items()
+                       if name in Settings.model_fields and current.get(name) != value}
+            if not changed:
+                return {}
+            restart = sorted(name for name in changed if name not in RELOADABLE_FIELDS)
+            if restart:
+                logger.warning(f"{self} ignored changes of {', '.join(restart)}, they need a restart.")
+
+            # validating only the changed fields on a copy, so nothing is applied if one of them is invalid
+            scratch = self.target.model_copy()
+            try:
+                for name in changed.keys() - set(restart):
+                    Settings.__pydantic_validator__.validate_assignment(scratch, name, changed[name])
+            except ValidationError as e:
+                logger.error(f"{self} ignored the changes, they are invalid: {e}")
+                return {}
+            applied = {name: getattr(scratch, name) for name in changed.keys() - set(restart)}
+            if applied:
+                # swapping the field dict in one step instead of setting the fields one by one, so a concurrent
+                # reader never sees a half applied reload
+                object.__setattr__(self.target, "__dict__", scratch.__dict__)
+
+        if applied:
+            logger.info(f"{self} reloaded {', '.join(sorted(applied))}.")
+            for callback in self._callbacks:
+                try:
+                    callback(applied)
+                except Exception as e:
+                    logger.exception(f"{self} callback {callback} failed: {e}")
+        return applied
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.check()
+
+    def start(self) -> None:
+        """
+        Check the settings file in a background thread.
+
+        :return: None
+        """
+
+        # a forked process inherits the thread object but not the thread
+        if (self._thread is not None and self._pid == os.getpid()) or not self.interval:
+            return
+        self._pid = os.getpid()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="settings-watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """
+        Stop the background thread.
+
+        :return: None
+        """
+
+        self._stop.set()
+        if self._thread is not None and self._pid == os.getpid():
+            self._thread.join()
+            self._thread = None
+
+
+def apply_log_levels(changed: dict[str, Any]) -> None:
+    """
+    Apply reloaded log levels to the logger of the package and its handlers.
+
+    :param changed: Changed settings by field name.
+    :return: None
+    """
+
+    if not changed.keys() & {"log_level", "log_console_level", "log_file_level"}:
+        return
+    package_logger = logging.getLogger(__module_name__)
+    package_logger.setLevel(settings.log_level.value)
+    for handler in package_logger.handlers:
+        if isinstance(handler, logging.FileHandler):
+            handler.setLevel(settings.log_file_level.value)
+        else:
+            handler.setLevel(settings.log_console_level.value)
+
+
+# one watcher per process, started by the server, the worker processes and the beat scheduler
+settings_watcher = SettingsWatcher(target=settings, interval=settings.settings_reload_interval)
+settings_watcher.on_change(apply_log_levels)
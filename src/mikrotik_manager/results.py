@@ -0,0 +1,287 @@
+import json
+import os
+import zlib
+from datetime import datetime, timedelta, timezone
+from functools import cache
+from typing import Any
+
+from sqlalchemy import Boolean, Column, DateTime, Engine, Integer, LargeBinary, MetaData, String, Table, \
+    UniqueConstraint, create_engine, delete, func, insert, or_, select, update
+from sqlalchemy.exc import IntegrityError
+
+from mikrotik_manager.settings import settings
+
+metadata = MetaData()
+
+result_chunks = Table("task_result_chunks",
+                      metadata,
+                      Column("id", Integer, primary_key=True, autoincrement=True),
+                      Column("task_id", String(155), nullable=False, index=True),
+                      Column("seq", Integer, nullable=False),
+                      Column("created", DateTime(timezone=True), nullable=False, index=True),
+                      Column("compressed", Boolean, nullable=False, default=False),
+                      Column("data", LargeBinary, nullable=False),
+                      UniqueConstraint("task_id", "seq"))
+
+task_keys = Table("task_keys",
+                  metadata,
+                  Column("key", String(255), primary_key=True),  # '<task name>:<hash of the arguments>'
+                  Column("task", String(155), nullable=False, index=True),
+                  Column("task_id", String(155), nullable=False),
+                  Column("created", DateTime(timezone=True), nullable=False, index=True),
+                  Column("finished", DateTime(timezone=True), nullable=True))
+
+
+class ResultStream:
+    def __init__(self, engine: Engine, expires: int = 86400, compression_threshold: int = 4096, attempts: int = 10):
+        """
+        Create a new result stream store. Tasks push partial results as numbered chunks, readers fetch the chunks
+        after the last one they have seen. This allows showing the progress of long-running tasks in any process.
+
+        :param engine: Engine of the result backend database.
+        :param expires: Seconds after which chunks are deleted by cleanup. If 0, chunks never expire.
+        :param compression_threshold: Chunks larger than this number of bytes are compressed.
+        :param attempts: Number of attempts to push a chunk if concurrent pushes to the same task take its number.
+        """
+
+        self.expires = expires
+        self.compression_threshold = compression_threshold
+        self.attempts = attempts
+        self.engine = engine
+        metadata.create_all(bind=self.engine, tables=[result_chunks], checkfirst=True)
+
+    def __str__(self):
+        return f"{self.__class__.__name__}({self.engine.url.render_as_string(hide_password=True)})"
+
+    def _encode(self, items: Any) -> tuple[bool, bytes]:
+        data = json.dumps(items, separators=(",", ":"), default=str).encode("utf-8")
+        if len(data) > self.compression_threshold:
+            return True, zlib.compress(data)
+        return False, data
+
+    @staticmethod
+    def _decode(compressed: bool, data: bytes) -> Any:
+        if compressed:
+            data = zlib.decompress(data)
+        return json.loads(data)
+
+    def push(self, task_id: str, items: Any) -> int:
+        """
+        Append a chunk to the stream of a task.
+
+        :param task_id: ID of the task.
+        :param items: JSON serializable partial result.
+        :return: Sequence number of the chunk.
+        :raises IntegrityError: If every attempt collided with a concurrent push.
+        """
+
+        compressed, data = self._encode(items)
+        for attempt in range(self.attempts):
+            try:
+                with self.engine.begin() as connection:
+                    seq = connection.execute(select(func.coalesce(func.max(result_chunks.c.seq), 0))
+                                             .where(result_chunks.c.task_id == task_id)).scalar_one() + 1
+                    connection.execute(insert(result_chunks).values(task_id=task_id,
+                                                                    seq=seq,
+                                                                    created=datetime.now(timezone.utc),
+                                                                    compressed=compressed,
+                                                                    data=data))
+                return seq
+            except IntegrityError:
+                # a concurrent push took the number, the next attempt takes the one after it
+                if attempt + 1 >= self.attempts:
+                    raise
+
+    def read(self, task_id: str, after: int = 0, limit: int | None = None) -> list[tuple[int, Any]]:
+        """
+        Read the chunks of a task.
+
+        :param task_id: ID of the task.
+        :param after: Only return chunks with a sequence number greater than this one.
+        :param limit: Maximum number of chunks. If None, all chunks are returned.
+        :return: List of sequence number and partial result.
+        """
+
+        query = (select(result_chunks.c.seq, result_chunks.c.compressed, result_chunks.c.data)
+                 .where(result_chunks.c.task_id == task_id, result_chunks.c.seq > after)
+                 .order_by(result_chunks.c.seq)
+                 .limit(limit))
+        with self.engine.connect() as connection:
+            return [(seq, self._decode(compressed, data)) for seq, compressed, data in connection.execute(query)]
+
+    def delete(self, task_id: str) -> None:
+        """
+        Delete the stream of a task.
+
+        :param task_id: ID of the task.
+        :return: None
+        """
+
+        with self.engine.begin() as connection:
+            connection.execute(delete(result_chunks).where(result_chunks.c.task_id == task_id))
+
+    def cleanup(self) -> int:
+        """
+        Delete all expired chunks.
+
+        :return: Number of deleted chunks.
+        """
+
+        if not self.expires:
+            return 0
+        expired = datetime.now(timezone.utc) - timedelta(seconds=self.expires)
+        with self.engine.begin() as connection:
+            return connection.execute(delete(result_chunks).where(result_chunks.c.created < expired)).rowcount
+
+
+class TaskKeys:
+    def __init__(self, engine: Engine, coalesce_timeout: float = 600.0):
+        """
+        Create a new store of idempotency keys. A key maps identical task calls to the task ID of the call that is
+        running or has finished recently, so the callers can share its result instead of running the task again.
+
+        :param engine: Engine of the result backend database.
+        :param coalesce_timeout: Seconds after which an unfinished call is no longer shared.
+        """
+
+        self.coalesce_timeout = coalesce_timeout
+        self.engine = engine
+        metadata.create_all(bind=self.engine, tables=[task_keys], checkfirst=True)
+
+    def __str__(self):
+        return f"{self.__class__.__name__}({self.engine.url.render_as_string(hide_password=True)})"
+
+    def _reusable(self, now: datetime, ttl: float):
+        # running calls until the coalesce timeout, finished calls until the ttl
+        return or_(task_keys.c.finished.is_(None) & (task_keys.c.created > now - timedelta(seconds=self.coalesce_timeout)),
+                   task_keys.c.finished.is_not(None) & (task_keys.c.finished > now - timedelta(seconds=ttl)))
+
+    def claim(self, key: str, task: str, task_id: str, ttl: float) -> str:
+        """
+        Claim a key for a new call, unless a running or recently finished call has it.
+
+        :param key: Idempotency key of the call.
+        :param task: Name of the task.
+        :param task_id: Task ID of the new call.
+        :param ttl: Seconds the result of a finished call is reused.
+        :return: The task ID of the call to use, which is task_id if the key was claimed.
+        """
+
+        for _ in range(3):
+            now = datetime.now(timezone.utc)
+            with self.engine.begin() as connection:
+                existing = connection.execute(select(task_keys.c.task_id)
+                                              .where(task_keys.c.key == key, self._reusable(now, ttl))).scalar()
+                if existing is not None:
+                    return existing
+                # replacing a stale call, the condition keeps a concurrent claim from being overwritten
+                replaced = connection.execute(update(task_keys)
+                                              .where(task_keys.c.key == key, ~self._reusable(now, ttl))
+                                              .values(task_id=task_id, created=now, finished=None)).rowcount
+            if replaced:
+                return task_id
+            try:
+                with self.engine.begin() as connection:
+                    connection.execute(insert(task_keys).values(key=key, task=task, task_id=task_id, created=now))
+                return task_id
+            except IntegrityError:
+                # claimed concurrently, the next round finds the claim
+                continue
+        return task_id
+
+    def finish(self, key: str, task_id: str, ok: bool = True) -> None:
+        """
+        Mark the call of a key as finished. A failed call is not shared anymore.
+
+        :param key: Idempotency key of the call.
+        :param task_id: Task ID of the call.
+        :param ok: Whether the call succeeded.
+        :return: None
+        """
+
+        with self.engine.begin() as connection:
+            condition = (task_keys.c.key == key) & (task_keys.c.task_id == task_id)
+            if ok:
+                connection.execute(update(task_keys).where(condition).values(finished=datetime.now(timezone.utc)))
+            else:
+                connection.execute(delete(task_keys).where(condition))
+
+    def invalidate(self, key: str | None = None, task: str | None = None) -> int:
+        """
+        Stop sharing the calls of a key or of all keys of a task, so the next identical call runs the task again.
+
+        :param key: Idempotency key of a call.
+        :param task: Name of a task.
+        :return: Number of invalidated keys.
+        """
+
+        if key is None and task is None:
+            raise ValueError("Either key or task is required.")
+        query = delete(task_keys)
+        if key is not None:
+            query = query.where(task_keys.c.key == key)
+        if task is not None:
+            query = query.where(task_keys.c.task == task)
+        with self.engine.begin() as connection:
+            return connection.execute(query).rowcount
+
+    def cleanup(self, ttl: float) -> int:
+        """
+        Delete all keys which are not shared anymore.
+
+        :param ttl: Longest seconds the result of a finished call is reused.
+        :return: Number of deleted keys.
+        """
+
+        with self.engine.begin() as connection:
+            return connection.execute(delete(task_keys).where(~self._reusable(datetime.now(timezone.utc), ttl))).rowcount
+
+
+@cache
+def get_result_engine() -> Engine:
+    """
+    Get the engine of the configured result backend, which is shared by the result streams and the idempotency keys.
+    The database backend uses the engine of the database.
+
+    :return: Engine
+    """
+
+    from mikrotik_manager.db import db
+    from mikrotik_manager.worker import get_result_backend_url
+
+    if settings.result_backend == "database":
+        return db().engine
+    return create_engine(get_result_backend_url().removeprefix("db+"))
+
+
+@cache
+def get_result_stream() -> ResultStream:
+    """
+    Get the result stream store of the configured result backend.
+
+    :return: ResultStream
+    """
+
+    return ResultStream(engine=get_result_engine(),
+                        expires=settings.result_expires,
+                        compression_threshold=settings.result_stream_compression_threshold)
+
+
+@cache
+def get_task_keys() -> TaskKeys:
+    """
+    Get the idempotency key store of the configured result backend.
+
+    :return: TaskKeys
+    """
+
+    return TaskKeys(engine=get_result_engine(), coalesce_timeout=settings.task_coalesce_timeout)
+
+
+def _after_fork() -> None:
+    # forked worker processes must not share the connections of the parent, they are dropped without closing them
+    if get_result_engine.cache_info().currsize:
+        get_result_engine().dispose(close=False)
+
+
+os.register_at_fork(after_in_child=_after_fork)
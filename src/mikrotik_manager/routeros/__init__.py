@@ -0,0 +1,2 @@
+from mikrotik_manager.routeros.api import RouterOsApi, RouterOsError, RouterOsConnectionError, RouterOsTrapError
+from mikrotik_manager.routeros.pool import ConnectionPool, DeviceAddress
@@ -0,0 +1,285 @@
+import asyncio
+import ssl
+
+DEFAULT_PORT = 8728
+DEFAULT_TLS_PORT = 8729
+
+
+class RouterOsError(Exception):
+    ...
+
+
+class RouterOsConnectionError(RouterOsError):
+    ...
+
+
+class RouterOsTrapError(RouterOsError):
+    def __init__(self, message: str, category: str | None = None):
+        super().__init__(message)
+        self.category = category
+
+
+def encode_length(length: int) -> bytes:
+    """
+    Encode the length of a word of the RouterOS API protocol.
+
+    :param length: Length of the word.
+    :return: bytes
+    """
+
+    if length < 0x80:
+        return length.to_bytes(1, "big")
+    if length < 0x4000:
+        return (length | 0x8000).to_bytes(2, "big")
+    if length < 0x200000:
+        return (length | 0xC00000).to_bytes(3, "big")
+    if length < 0x10000000:
+        return (length | 0xE0000000).to_bytes(4, "big")
+    return b"\xF0" + length.to_bytes(4, "big")
+
+
+def encode_sentence(words: list[str]) -> bytes:
+    """
+    Encode a sentence of the RouterOS API protocol.
+
+    :param words: Words of the sentence.
+    :return: bytes
+    """
+
+    data = bytearray()
+    for word in words:
+        # lone surrogates are bytes which were not valid UTF-8 when read, see read_sentence
+        encoded = word.encode("utf-8", errors="surrogateescape")
+        data += encode_length(len(encoded))
+        data += encoded
+    data += b"\x00"
+    return bytes(data)
+
+
+async def read_length(reader: asyncio.StreamReader) -> int:
+    """
+    Read the length of the next word from a stream.
+
+    :param reader: Stream reader.
+    :return: int
+    """
+
+    first = (await reader.readexactly(1))[0]
+    if first & 0x80 == 0x00:
+        return first
+    if first & 0xC0 == 0x80:
+        return int.from_bytes(bytes([first & 0x3F]) + await reader.readexactly(1), "big")
+    if first & 0xE0 == 0xC0:
+        return int.from_bytes(bytes([first & 0x1F]) + await reader.readexactly(2), "big")
+    if first & 0xF0 == 0xE0:
+        return int.from_bytes(bytes([first & 0x0F]) + await reader.readexactly(3), "big")
+    if first == 0xF0:
+        return int.from_bytes(await reader.readexactly(4), "big")
+    raise RouterOsConnectionError(f"Invalid word length prefix: {first:#x}")
+
+
+async def read_sentence(reader: asyncio.StreamReader, errors: str = "replace") -> list[str]:
+    """
+    Read the next sentence from a stream.
+
+    :param reader: Stream reader.
+    :param errors: Handling of bytes which are not valid UTF-8. With 'surrogateescape', a word can be encoded back
+                   to its original bytes, e.g. for file contents.
+    :return: Words of the sentence.
+    """
+
+    words = []
+    while True:
+        length = await read_length(reader)
+        if length == 0:
+            return words
+        words.append((await reader.readexactly(length)).decode("utf-8", errors=errors))
+
+
+def parse_attributes(words: list[str]) -> dict[str, str]:
+    """
+    Parse the '=key=value' attribute words of a sentence.
+
+    :param words: Words of the sentence without the reply word.
+    :return: dict[str, str]
+    """
+
+    attributes = {}
+    for word in words:
+        if not word.startswith("="):
+            continue
+        key, _, value = word[1:].partition("=")
+        attributes[key] = value
+    return attributes
+
+
+class RouterOsApi:
+    def __init__(self,
+                 host: str,
+                 port: int | None = None,
+                 username: str = "admin",
+                 password: str = "",
+                 tls: bool = False,
+                 ssl_context: ssl.SSLContext | None = None,
+                 connect_timeout: float = 10.0,
+                 timeout: float = 30.0):
+        """
+        Create a new RouterOS API session.
+
+        :param host: Host of the device.
+        :param port: API port of the device. If None, 8728 or 8729 (TLS) is used.
+        :param username: Username to log in with.
+        :param password: Password to log in with.
+        :param tls: Use the TLS API service.
+        :param ssl_context: SSL context for TLS. If None, a context without certificate verification is used.
+        :param connect_timeout: Timeout for connecting and logging in.
+        :param timeout: Timeout for a single command.
+        """
+
+        self.host = host
+        self.port = port or (DEFAULT_TLS_PORT if tls else DEFAULT_PORT)
+        self.username = username
+        self.password = password
+        self.tls = tls
+        self.ssl_context = ssl_context
+        self.connect_timeout = connect_timeout
+        self.timeout = timeout
+
+        self._reader: asyncio.StreamReader | None = None
+        self._writer: asyncio.StreamWriter | None = None
+        self._lock = asyncio.Lock()
+
+    def __str__(self):
+        return f"{self.__class__.__name__}({self.username}@{self.host}:{self.port}{', tls' if self.tls else ''})"
+
+    async def __aenter__(self) -> "RouterOsApi":
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *_) -> None:
+        await self.close()
+
+    @property
+    def closed(self) -> bool:
+        return self._writer is None or self._writer.is_closing()
+
+    def _get_ssl_context(self) -> ssl.SSLContext | None:
+        if not self.tls:
+            return None
+        if self.ssl_context is not None:
+            return self.ssl_context
+        # RouterOS devices usually use self-signed certificates
+        context = ssl.create_default_context()
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+        return context
+
+    async def connect(self) -> None:
+        """
+        Connect and log in to the device.
+
+        :return: None
+        """
+
+        try:
+            self._reader, self._writer = await asyncio.wait_for(asyncio.open_connection(host=self.host,
+                                                                                        port=self.port,
+                                                                                        ssl=self._get_ssl_context()),
+                                                                timeout=self.connect_timeout)
+            await asyncio.wait_for(self._talk(["/login", f"=name={self.username}", f"=password={self.password}"]),
+                                   timeout=self.connect_timeout)
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError) as e:
+            await self.close()
+            raise RouterOsConnectionError(f"Could not connect to {self}: {e!r}") from e
+        except RouterOsError:
+            await self.close()
+            raise
+
+    async def close(self) -> None:
+        """
+        Close the session.
+
+        :return: None
+        """
+
+        writer, self._reader, self._writer = self._writer, None, None
+        if writer is None:
+            return
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except (OSError, ssl.SSLError):
+            pass
+
+    async def _talk(self, words: list[str], errors: str = "replace") -> list[dict[str, str]]:
+        if self.closed:
+            raise RouterOsConnectionError(f"{self} is not connected.")
+        self._writer.write(encode_sentence(words))
+        await self._writer.drain()
+
+        replies = []
+        trap = None
+        while True:
+            sentence = await read_sentence(self._reader, errors)
+            if not sentence:
+                continue
+            reply, attributes = sentence[0], parse_attributes(sentence[1:])
+            if reply == "!re":
+                replies.append(attributes)
+            elif reply == "!trap":
+                trap = trap or RouterOsTrapError(attributes.get("message", "Unknown error."), attributes.get("category"))
+            elif reply == "!fatal":
+                await self.close()
+                raise RouterOsConnectionError(f"{self} closed the session: {' '.join(sentence[1:])}")
+            elif reply == "!done":
+                if trap is not None:
+                    raise trap
+                return replies
+
+    async def talk(self,
+                   command: str,
+                   attributes: dict[str, str] | None = None,
+                   queries: list[str] | None = None,
+                   errors: str = "replace") -> list[dict[str, str]]:
+        """
+        Run a command on the device.
+
+        :param command: Command path, e.g. '/system/resource/print'.
+        :param attributes: Attributes of the command, e.g. {'.proplist': 'name,version'}.
+        :param queries: Query words without the leading '?', e.g. ['type=ether'].
+        :param errors: Handling of reply bytes which are not valid UTF-8, see read_sentence.
+        :return: The '!re' replies as list of attribute dictionaries.
+        """
+
+        words = [command]
+        words += [f"={key}={value}" for key, value in (attributes or {}).items()]
+        words += [f"?{query}" for query in (queries or [])]
+        async with self._lock:
+            try:
+                return await asyncio.wait_for(self._talk(words, errors), timeout=self.timeout)
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError) as e:
+                # the session is in an undefined state after a failed exchange
+                await self.close()
+                raise RouterOsConnectionError(f"Command '{command}' on {self} failed: {e!r}") from e
+            except RouterOsTrapError:
+                raise
+            except BaseException:
+                # e.g. a cancelled command leaves its replies unread, the transport is closed without waiting, so a
+                # repeated cancellation cannot interrupt it and the pool does not reuse the session
+                writer, self._reader, self._writer = self._writer, None, None
+                if writer is not None:
+                    writer.close()
+                raise
+
+    async def ping(self) -> bool:
+        """
+        Check if the session is still usable. A session whose ping is answered with an error is not reused either.
+
+        :return: bool
+        """
+
+        try:
+            await self.talk("/system/identity/print")
+        except RouterOsError:
+            return False
+        return True
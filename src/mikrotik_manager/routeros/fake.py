@@ -0,0 +1,234 @@
+import asyncio
+import logging
+import ssl
+import time
+import zlib
+from typing import Callable
+
+from mikrotik_manager.routeros.api import encode_sentence, parse_attributes, read_sentence, RouterOsConnectionError, \
+    RouterOsTrapError
+
+logger = logging.getLogger(__name__)
+
+Handler = Callable[[str, dict[str, str]], list[dict[str, str]]]
+
+
+class FakeRouterOsServer:
+    def __init__(self,
+                 host: str = "127.0.0.1",
+                 port: int = 0,
+                 username: str | None = None,
+                 password: str | None = None,
+                 ssl_context: ssl.SSLContext | None = None,
+                 latency: float = 0.0,
+                 export_lines: int = 200,
+                 handlers: dict[str, Handler] | None = None):
+        """
+        Create a local fake RouterOS API server for development and tests without real hardware.
+
+        Every session behaves like its own device, named after the login username, so a single server can simulate
+        a whole fleet.
+
+        :param host: Host to listen on.
+        :param port: Port to listen on. If 0, a free port is chosen.
+        :param username: Accepted username. If None, every username is accepted.
+        :param password: Accepted password. If None, every password is accepted.
+        :param ssl_context: Server SSL context to serve the TLS API service.
+        :param latency: Seconds to wait before answering a command.
+        :param export_lines: Number of address lines in the configuration export of every device.
+        :param handlers: Additional or replaced command handlers. A handler gets the device name and the command
+                         attributes and returns the '!re' replies.
+        """
+
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.ssl_context = ssl_context
+        self.latency = latency
+        self.export_lines = export_lines
+        self.handlers: dict[str, Handler] = {"/system/identity/print": self._identity,
+                                             "/system/resource/print": self._resource,
+                                             "/system/routerboard/print": self._routerboard,
+                                             "/interface/print": self._interfaces,
+                                             "/export": self._export,
+                                             "/system/backup/save": self._backup,
+                                             "/file/print": self._file_print,
+                                             "/file/read": self._file_read,
+                                             "/file/remove": self._file_remove,
+                                             "/system/reboot": self._reboot,
+                                             **(handlers or {})}
+        self.sessions = 0
+        self.logins = 0
+        self.commands = 0
+        # files of every device by device name and file name
+        self.files: dict[str, dict[str, bytes]] = {}
+        # number of reboots by device name
+        self.reboots: dict[str, int] = {}
+
+        self._server: asyncio.Server | None = None
+
+    def __str__(self):
+        return f"{self.__class__.__name__}({self.host}:{self.port})"
+
+    async def __aenter__(self) -> "FakeRouterOsServer":
+        await self.start()
+        return self
+
+    async def __aexit__(self, *_) -> None:
+        await self.stop()
+
+    @staticmethod
+    def _identity(name: str, _attributes: dict[str, str]) -> list[dict[str, str]]:
+        return [{"name": name}]
+
+    @staticmethod
+    def _resource(name: str, _attributes: dict[str, str]) -> list[dict[str, str]]:
+        return [{"uptime": "1w2d3h4m5s",
+                 "version": "7.16.1 (stable)",
+                 "cpu-load": str(sum(name.encode()) % 100),
+                 "free-memory": "201326592",
+                 "total-memory": "268435456",
+                 "board-name": "RB5009UG+S+",
+                 "architecture-name": "arm64"}]
+
+    @staticmethod
+    def _routerboard(name: str, _attributes: dict[str, str]) -> list[dict[str, str]]:
+        return [{"routerboard": "true",
+                 "model": "RB5009UG+S+",
+                 "serial-number": f"HG{zlib.crc32(name.encode()) % 10 ** 9:09d}",
+                 "firmware-type": "70x0",
+                 "current-firmware": "7.16.1",
+                 "upgrade-firmware": "7.16.1"}]
+
+    @staticmethod
+    def _interfaces(name: str, _attributes: dict[str, str]) -> list[dict[str, str]]:
+        # the counters grow with the time, so consecutive polls give a steady rate
+        now = int(time.time())
+        return [{"name": f"ether{i}",
+                 "type": "ether",
+                 "running": "true",
+                 "disabled": "false",
+                 "rx-byte": str(now * 1000 * i),
+                 "tx-byte": str(now * 500 * i)} for i in range(1, 5)]
+
+    def export(self, name: str) -> str:
+        """
+        Get the configuration export of a device. Only the header changes between two exports.
+
+        :param name: Name of the device.
+        :return: str
+        """
+
+        lines = [f"# {time.strftime('%Y-%m-%d %H:%M:%S')} by RouterOS 7.16.1",
+                 f"# software id = {sum(name.encode()) % 10000:04d}",
+                 "#",
+                 "# model = RB5009UG+S+",
+                 "/interface bridge",
+                 "add name=bridge comment=\"Büro\"",
+                 "/ip address"]
+        lines += [f"add address=10.{i // 256 % 256}.{i % 256}.1/24 interface=bridge network=10.{i // 256 % 256}.{i % 256}.0"
+                  for i in range(self.export_lines)]
+        lines += ["/system identity", f"set name={name}"]
+        return "\n".join(lines) + "\n"
+
+    def _export(self, name: str, attributes: dict[str, str]) -> list[dict[str, str]]:
+        if "file" in attributes:
+            self.files.setdefault(name, {})[f"{attributes['file']}.rsc"] = self.export(name).encode("utf-8")
+        return []
+
+    def _backup(self, name: str, attributes: dict[str, str]) -> list[dict[str, str]]:
+        # binary data which is not valid UTF-8
+        self.files.setdefault(name, {})[f"{attributes['name']}.backup"] = bytes(range(256)) * 64 + name.encode()
+        return []
+
+    def _file_print(self, name: str, _attributes: dict[str, str]) -> list[dict[str, str]]:
+        return [{"name": file, "type": "file", "size": str(len(data))} for file, data in self.files.get(name, {}).items()]
+
+    def _file_read(self, name: str, attributes: dict[str, str]) -> list[dict[str, str]]:
+        data = self.files.get(name, {}).get(attributes.get("file"))
+        if data is None:
+            raise RouterOsTrapError("no such item")
+        offset = int(attributes.get("offset", 0))
+        chunk = data[offset:offset + int(attributes.get("chunk-size", 4096))]
+        return [{"data": chunk.decode("utf-8", errors="surrogateescape")}]
+
+    def _file_remove(self, name: str, attributes: dict[str, str]) -> list[dict[str, str]]:
+        if self.files.get(name, {}).pop(attributes.get("numbers"), None) is None:
+            raise RouterOsTrapError("no such item")
+        return []
+
+    def _reboot(self, name: str, _attributes: dict[str, str]) -> list[dict[str, str]]:
+        self.reboots[name] = self.reboots.get(name, 0) + 1
+        return []
+
+    async def start(self) -> None:
+        """
+        Start listening.
+
+        :return: None
+        """
+
+        self._server = await asyncio.start_server(self._handle, host=self.host, port=self.port, ssl=self.ssl_context)
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.debug(f"{self} started.")
+
+    async def stop(self) -> None:
+        """
+        Stop listening and close all sessions.
+
+        :return: None
+        """
+
+        if self._server is None:
+            return
+        self._server.close()
+        self._server.close_clients()
+        await self._server.wait_closed()
+        self._server = None
+        logger.debug(f"{self} stopped.")
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.sessions += 1
+        name = None
+        try:
+            while True:
+                sentence = await read_sentence(reader)
+                if not sentence:
+                    continue
+                command, attributes = sentence[0], parse_attributes(sentence[1:])
+                if self.latency:
+                    await asyncio.sleep(self.latency)
+
+                # every session has to log in first
+                if command == "/login":
+                    if (self.username is not None and attributes.get("name") != self.username) or \
+                            (self.password is not None and attributes.get("password") != self.password):
+                        writer.write(encode_sentence(["!trap", "=message=invalid user name or password (6)"]))
+                        writer.write(encode_sentence(["!done"]))
+                    else:
+                        self.logins += 1
+                        name = attributes.get("name", "")
+                        writer.write(encode_sentence(["!done"]))
+                elif name is None:
+                    writer.write(encode_sentence(["!fatal", "not logged in"]))
+                    break
+                elif command == "/quit":
+                    writer.write(encode_sentence(["!fatal", "session terminated on request"]))
+                    break
+                elif command in self.handlers:
+                    self.commands += 1
+                    try:
+                        for reply in self.handlers[command](name, attributes):
+                            writer.write(encode_sentence(["!re", *(f"={k}={v}" for k, v in reply.items())]))
+                    except RouterOsTrapError as e:
+                        writer.write(encode_sentence(["!trap", f"=message={e}"]))
+                    writer.write(encode_sentence(["!done"]))
+                else:
+                    writer.write(encode_sentence(["!trap", "=message=no such command"]))
+                    writer.write(encode_sentence(["!done"]))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, RouterOsConnectionError):
+            pass
+        finally:
+            writer.close()
@@ -0,0 +1,225 @@
+import asyncio
+import logging
+import ssl
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import AsyncIterator
+
+from mikrotik_manager.routeros.api import RouterOsApi, RouterOsConnectionError
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class DeviceAddress:
+    host: str
+    port: int | None = None
+    username: str = "admin"
+    password: str = field(default="", repr=False)
+    tls: bool = False
+
+
+@dataclass
+class _IdleConnection:
+    api: RouterOsApi
+    released_at: float
+    checked_at: float
+
+
+class _DevicePool:
+    def __init__(self, max_connections: int):
+        self.semaphore = asyncio.Semaphore(max_connections)
+        self.idle: list[_IdleConnection] = []
+        self.in_use = 0
+        self.failures = 0
+        self.retry_at = 0.0
+
+
+class ConnectionPool:
+    def __init__(self,
+                 max_connections_per_device: int = 2,
+                 idle_timeout: float = 300.0,
+                 health_check_interval: float = 60.0,
+                 reconnect_attempts: int = 3,
+                 reconnect_backoff: float = 0.5,
+                 reconnect_backoff_max: float = 30.0,
+                 connect_timeout: float = 10.0,
+                 timeout: float = 30.0,
+                 ssl_context: ssl.SSLContext | None = None):
+        """
+        Create a new pool of persistent RouterOS API sessions, keyed by device address.
+
+        :param max_connections_per_device: Maximum number of concurrent sessions per device.
+        :param idle_timeout: Seconds after which an unused session is closed.
+        :param health_check_interval: Seconds after which an idle session is checked before it is reused.
+        :param reconnect_attempts: Number of retries if connecting to a device fails.
+        :param reconnect_backoff: Initial backoff in seconds between connection attempts. Doubles with every failure.
+        :param reconnect_backoff_max: Maximum backoff in seconds between connection attempts.
+        :param connect_timeout: Timeout for connecting and logging in.
+        :param timeout: Timeout for a single command.
+        :param ssl_context: SSL context for TLS sessions.
+        """
+
+        self.max_connections_per_device = max_connections_per_device
+        self.idle_timeout = idle_timeout
+        self.health_check_interval = health_check_interval
+        self.reconnect_attempts = reconnect_attempts
+        self.reconnect_backoff = reconnect_backoff
+        self.reconnect_backoff_max = reconnect_backoff_max
+        self.connect_timeout = connect_timeout
+        self.timeout = timeout
+        self.ssl_context = ssl_context
+
+        self._devices: dict[DeviceAddress, _DevicePool] = {}
+        self._reaper: asyncio.Task | None = None
+
+    def __str__(self):
+        return f"{self.__class__.__name__}(devices={len(self._devices)})"
+
+    @property
+    def stats(self) -> dict[str, int]:
+        return {"devices": len(self._devices),
+                "in_use": sum(d.in_use for d in self._devices.values()),
+                "idle": sum(len(d.idle) for d in self._devices.values()),
+                "max_connections_per_device": self.max_connections_per_device}
+
+    def _get_device(self, address: DeviceAddress) -> _DevicePool:
+        device = self._devices.get(address)
+        if device is None:
+            device = self._devices[address] = _DevicePool(self.max_connections_per_device)
+        return device
+
+    def _start_reaper(self) -> None:
+        if self._reaper is None or self._reaper.done():
+            self._reaper = asyncio.create_task(self._reap(), name=f"{self} idle reaper")
+
+    async def _reap(self) -> None:
+        while True:
+            await asyncio.sleep(max(self.idle_timeout / 2, 1.0))
+            await self.evict_idle()
+
+    async def evict_idle(self) -> int:
+        """
+        Close all sessions that are idle for longer than the idle timeout.
+
+        :return: Number of closed sessions.
+        """
+
+        now = asyncio.get_running_loop().time()
+        expired = []
+        for address, device in list(self._devices.items()):
+            keep = []
+            for idle in device.idle:
+                (expired if now - idle.released_at > self.idle_timeout else keep).append(idle)
+            device.idle = keep
+
+            # forget devices that are not used anymore
+            if not device.idle and not device.in_use and not device.failures:
+                del self._devices[address]
+        for idle in expired:
+            await idle.api.close()
+        if expired:
+            logger.debug(f"{self} evicted {len(expired)} idle sessions.")
+        return len(expired)
+
+    async def _connect(self, address: DeviceAddress, device: _DevicePool) -> RouterOsApi:
+        loop = asyncio.get_running_loop()
+        for attempt in range(self.reconnect_attempts + 1):
+            # honour the backoff of earlier failed attempts, also across callers
+            delay = device.retry_at - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            api = RouterOsApi(host=address.host,
+                              port=address.port,
+                              username=address.username,
+                              password=address.password,
+                              tls=address.tls,
+                              ssl_context=self.ssl_context,
+                              connect_timeout=self.connect_timeout,
+                              timeout=self.timeout)
+            try:
+                await api.connect()
+            except RouterOsConnectionError as e:
+                device.failures += 1
+                device.retry_at = loop.time() + min(self.reconnect_backoff * 2 ** (device.failures - 1),
+                                                    self.reconnect_backoff_max)
+                if attempt >= self.reconnect_attempts:
+                    raise
+                logger.debug(f"{e} Retrying ({attempt + 1}/{self.reconnect_attempts}) ...")
+                continue
+            device.failures = 0
+            device.retry_at = 0.0
+            return api
+        raise RouterOsConnectionError(f"Could not connect to {address}.")
+
+    async def _checkout(self, address: DeviceAddress, device: _DevicePool) -> RouterOsApi:
+        now = asyncio.get_running_loop().time()
+        while device.idle:
+            # reuse the most recently released session, so surplus sessions can expire
+            idle = device.idle.pop()
+            if idle.api.closed or now - idle.released_at > self.idle_timeout:
+                await idle.api.close()
+                continue
+            if now - idle.checked_at > self.health_check_interval and not await idle.api.ping():
+                await idle.api.close()
+                continue
+            return idle.api
+        return await self._connect(address, device)
+
+    @asynccontextmanager
+    async def connection(self, address: DeviceAddress) -> AsyncIterator[RouterOsApi]:
+        """
+        Acquire a session to a device. Waits if the device already has the maximum number of sessions in use.
+
+        :param address: Address of the device.
+        :return: AsyncIterator[RouterOsApi]
+        """
+
+        self._start_reaper()
+        device = self._get_device(address)
+        async with device.semaphore:
+            device.in_use += 1
+            try:
+                api = await self._checkout(address, device)
+                try:
+                    yield api
+                finally:
+                    if not api.closed:
+                        now = asyncio.get_running_loop().time()
+                        device.idle.append(_IdleConnection(api=api, released_at=now, checked_at=now))
+            finally:
+                device.in_use -= 1
+
+    async def talk(self,
+                   address: DeviceAddress,
+                   command: str,
+                   attributes: dict[str, str] | None = None,
+                   queries: list[str] | None = None) -> list[dict[str, str]]:
+        """
+        Run a single command on a device using a pooled session.
+
+        :param address: Address of the device.
+        :param command: Command path, e.g. '/system/resource/print'.
+        :param attributes: Attributes of the command.
+        :param queries: Query words without the leading '?'.
+        :return: The '!re' replies as list of attribute dictionaries.
+        """
+
+        async with self.connection(address) as api:
+            return await api.talk(command, attributes=attributes, queries=queries)
+
+    async def close(self) -> None:
+        """
+        Close all sessions of the pool.
+
+        :return: None
+        """
+
+        if self._reaper is not None:
+            self._reaper.cancel()
+            self._reaper = None
+        devices, self._devices = self._devices, {}
+        for device in devices.values():
+            for idle in device.idle:
+                await idle.api.close()
@@ -0,0 +1,453 @@
+import bisect
+import hashlib
+import heapq
+import logging
+import math
+import random
+import time
+from dataclasses import dataclass
+from typing import Any, Iterable
+
+from celery.beat import PersistentScheduler
+
+logger = logging.getLogger(__name__)
+
+
+def stable_hash(key: str) -> int:
+    """
+    Get a hash of a key which is the same in every process, unlike the builtin hash.
+
+    :param key: Key to hash.
+    :return: 64 bit integer.
+    """
+
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    def __init__(self, nodes: Iterable[str] = (), replicas: int = 128):
+        """
+        Create a consistent hash ring. Adding or removing a node only moves the keys of that node, so the devices of
+        the other nodes keep their pooled sessions.
+
+        :param nodes: Names of the nodes.
+        :param replicas: Number of points per node on the ring, more points spread the keys more evenly.
+        """
+
+        self.replicas = replicas
+        self._points: list[int] = []
+        self._nodes: list[str] = []
+        self.nodes: frozenset[str] = frozenset()
+        for node in nodes:
+            self.add(node)
+
+    def __str__(self):
+        return f"{self.__class__.__name__}(nodes={len(self.nodes)})"
+
+    def add(self, node: str) -> None:
+        """
+        Add a node to the ring.
+
+        :param node: Name of the node.
+        :return: None
+        """
+
+        if node in self.nodes:
+            return
+        for replica in range(self.replicas):
+            point = stable_hash(f"{node}#{replica}")
+            index = bisect.bisect(self._points, point)
+            self._points.insert(index, point)
+            self._nodes.insert(index, node)
+        self.nodes = self.nodes | {node}
+
+    def remove(self, node: str) -> None:
+        """
+        Remove a node from the ring.
+
+        :param node: Name of the node.
+        :return: None
+        """
+
+        if node not in self.nodes:
+            return
+        kept = [(point, n) for point, n in zip(self._points, self._nodes) if n != node]
+        self._points = [point for point, _ in kept]
+        self._nodes = [n for _, n in kept]
+        self.nodes = self.nodes - {node}
+
+    def node(self, key: str) -> str | None:
+        """
+        Get the node responsible for a key.
+
+        :param key: Key to look up.
+        :return: Name of the node or None if the ring is empty.
+        """
+
+        if not self._points:
+            return None
+        index = bisect.bisect(self._points, stable_hash(key)) % len(self._points)
+        return self._nodes[index]
+
+
+@dataclass(slots=True)
+class PollState:
+    device_id: int
+    phase: float  # fixed offset of the device within the interval, between 0 and 1
+    interval: float
+    node: str | None = None
+    due: float = 0.0
+    slot: float = 0.0  # slot the device is scheduled for, due is the slot with jitter
+    polled_slot: float | None = None  # slot of the last dispatch
+    dispatched: float | None = None
+    failures: int = 0
+    rtt: float | None = None
+
+
+class FleetScheduler:
+    def __init__(self,
+                 interval: float = 300.0,
+                 jitter: float = 0.1,
+                 max_interval: float = 3600.0,
+                 slow_rtt: float = 5.0,
+                 nodes: Iterable[str] = (),
+                 seed: int | None = None):
+        """
+        Create a fleet scheduler. Every device gets a fixed phase within the poll interval from the hash of its ID,
+        so the polls of the fleet are spread evenly over the interval instead of being due all at once. A small random
+        jitter keeps devices with neighbouring phases from hitting the same tick.
+
+        Failing devices back off exponentially up to max_interval, slow devices are polled at half the rate. After
+        every successful poll the interval of a device is halved again until it reaches the poll interval.
+
+        :param interval: Poll interval of a responsive device in seconds.
+        :param jitter: Maximum jitter as fraction of the poll interval.
+        :param max_interval: Maximum poll interval of a failing device in seconds.
+        :param slow_rtt: Poll duration in seconds from which a device is considered slow.
+        :param nodes: Worker nodes the devices are sharded across. If empty, the devices are not sharded.
+        :param seed: Seed of the jitter, e.g. for simulations.
+        """
+
+        self.interval = interval
+        self.jitter = jitter
+        self.max_interval = max(max_interval, interval)
+        self.slow_rtt = slow_rtt
+        self.ring = HashRing(nodes)
+        self._random = random.Random(seed)
+        self._states: dict[int, PollState] = {}
+        self._heap: list[tuple[float, int]] = []
+
+    def __str__(self):
+        return f"{self.__class__.__name__}(devices={len(self._states)}, nodes={len(self.ring.nodes)})"
+
+    def __len__(self):
+        return len(self._states)
+
+    def __contains__(self, device_id: int) -> bool:
+        return device_id in self._states
+
+    def state(self, device_id: int) -> PollState:
+        """
+        Get the poll state of a device.
+
+        :param device_id: ID of the device.
+        :return: PollState
+        """
+
+        return self._states[device_id]
+
+    def _schedule(self, state: PollState, now: float) -> None:
+        # the next slot of the device phase after now, intervals are powers of two of the poll interval,
+        # so backed off devices stay on the slots of their phase. A device dispatched early by the jitter is
+        # scheduled after the slot it was dispatched for, so it is not polled twice for the same slot.
+        offset = state.phase * self.interval
+        after = now if state.polled_slot is None else max(now, state.polled_slot)
+        state.slot = offset + math.floor((after - offset) / state.interval + 1) * state.interval
+        jitter = self._random.uniform(-0.5, 0.5) * self.jitter * self.interval
+        state.due = max(state.slot + jitter, now)
+        heapq.heappush(self._heap, (state.due, state.device_id))
+
+    def sync(self, device_ids: Iterable[int], now: float | None = None) -> None:
+        """
+        Synchronize the scheduled devices with the fleet. New devices are scheduled on their next slot, removed
+        devices are dropped.
+
+        :param device_ids: IDs of all devices of the fleet.
+        :param now: Current time. If None, the monotonic clock is used.
+        :return: None
+        """
+
+        now = time.monotonic() if now is None else now
+        device_ids = set(device_ids)
+        for device_id in self._states.keys() - device_ids:
+            del self._states[device_id]
+        for device_id in device_ids - self._states.keys():
+            state = PollState(device_id=device_id,
+                              phase=stable_hash(str(device_id)) / 2 ** 64,
+                              interval=self.interval,
+                              node=self.ring.node(str(device_id)))
+            self._states[device_id] = state
+            self._schedule(state, now)
+
+    def set_nodes(self, nodes: Iterable[str]) -> None:
+        """
+        Change the worker nodes the devices are sharded across.
+
+        :param nodes: Names of the nodes.
+        :return: None
+        """
+
+        nodes = set(nodes)
+        for node in self.ring.nodes - nodes:
+            self.ring.remove(node)
+        for node in nodes - self.ring.nodes:
+            self.ring.add(node)
+        for state in self._states.values():
+            state.node = self.ring.node(str(state.device_id))
+
+    def configure(self,
+                  interval: float,
+                  jitter: float,
+                  max_interval: float,
+                  slow_rtt: float,
+                  now: float | None = None) -> None:
+        """
+        Change the poll interval and the back off of the fleet. The intervals of backed off devices are scaled with the
+        poll interval, devices which are not dispatched are scheduled on their next slot.
+
+        :param interval: Poll interval of a responsive device in seconds.
+        :param jitter: Maximum jitter as fraction of the poll interval.
+        :param max_interval: Maximum poll interval of a failing device in seconds.
+        :param slow_rtt: Poll duration in seconds from which a device is considered slow.
+        :param now: Current time. If None, the monotonic clock is used.
+        :return: None
+        """
+
+        now = time.monotonic() if now is None else now
+        scale = interval / self.interval
+        self.interval = interval
+        self.jitter = jitter
+        self.max_interval = max(max_interval, interval)
+        self.slow_rtt = slow_rtt
+        for state in self._states.values():
+            state.interval = min(max(state.interval * scale, self.interval), self.max_interval)
+            if state.dispatched is None:
+                self._schedule(state, now)
+
+    def due(self, now: float | None = None) -> dict[str | None, list[int]]:
+        """
+        Take the devices which are due. They are not due again until they are reported, or until their interval
+        passed without a report, which counts as failure.
+
+        :param now: Current time. If None, the monotonic clock is used.
+        :return: IDs of the due devices by node.
+        """
+
+        now = time.monotonic() if now is None else now
+        due: dict[str | None, list[int]] = {}
+        while self._heap and self._heap[0][0] <= now:
+            when, device_id = heapq.heappop(self._heap)
+            state = self._states.get(device_id)
+            # skipping entries of removed or rescheduled devices
+            if state is None or state.due != when:
+                continue
+            if state.dispatched is not None:
+                # the report got lost, e.g. the worker died
+                self.report(device_id, ok=False, now=now)
+                continue
+            state.dispatched = now
+            state.polled_slot = state.slot
+            # checking again once the interval is over
+            state.due = now + state.interval
+            heapq.heappush(self._heap, (state.due, device_id))
+            due.setdefault(state.node, []).append(device_id)
+        return due
+
+    def report(self, device_id: int, ok: bool, rtt: float | None = None, now: float | None = None) -> None:
+        """
+        Report the result of a poll and schedule the next one.
+
+        :param device_id: ID of the device.
+        :param ok: Whether the poll succeeded.
+        :param rtt: Duration of the poll in seconds.
+        :param now: Current time. If None, the monotonic clock is used.
+        :return: None
+        """
+
+        state = self._states.get(device_id)
+        if state is None:
+            return
+        now = time.monotonic() if now is None else now
+        state.dispatched = None
+        state.rtt = rtt
+        if not ok:
+            state.failures += 1
+            state.interval = min(state.interval * 2, self.max_interval)
+        else:
+            state.failures = 0
+            if rtt is not None and rtt >= self.slow_rtt:
+                state.interval = min(max(state.interval, self.interval * 2), self.max_interval)
+            else:
+                state.interval = max(state.interval / 2, self.interval)
+        self._schedule(state, now)
+
+    @property
+    def next_due(self) -> float | None:
+        """
+        The time the next device is due, or None if no device is scheduled.
+        """
+
+        while self._heap:
+            when, device_id = self._heap[0]
+            state = self._states.get(device_id)
+            if state is not None and state.due == when:
+                return when
+            heapq.heappop(self._heap)
+        return None
+
+
+class FleetBeatScheduler(PersistentScheduler):
+    """
+    Celery beat scheduler which runs the beat schedule and additionally dispatches the device polls of the fleet
+    schedulers in batches to the worker nodes. There is one fleet scheduler per batch task.
+    """
+
+    def __init__(self, *args: Any, **kwargs: Any):
+        from mikrotik_manager.settings import settings
+
+        self.fleets = {task: FleetScheduler(interval=interval,
+                                            jitter=settings.scheduler_jitter,
+                                            max_interval=max(settings.scheduler_max_interval, interval),
+                                            slow_rtt=settings.scheduler_slow_rtt,
+                                            nodes=settings.scheduler_nodes) for task, interval in self.intervals().items()}
+        self._synced: float | None = None
+        self._pending: list[tuple[str, Any, list[int]]] = []
+        self._checked: float | None = None
+        super().__init__(*args, **kwargs)
+
+    @staticmethod
+    def intervals() -> dict[str, float]:
+        """
+        Get the poll intervals of the enabled batch tasks.
+
+        :return: Poll interval in seconds by task name.
+        """
+
+        from mikrotik_manager.settings import settings
+
+        intervals = {"fetch_device_info_batch": settings.scheduler_interval}
+        if settings.metrics_enabled:
+            intervals["collect_metrics_batch"] = settings.metrics_interval
+        if settings.backup_enabled:
+            intervals["backup_devices_batch"] = settings.backup_interval
+        return intervals
+
+    def configure_fleets(self, changed: dict[str, Any]) -> None:
+        """
+        Apply reloaded settings to the fleet schedulers.
+
+        :param changed: Changed settings by field name.
+        :return: None
+        """
+
+        from mikrotik_manager.settings import settings
+
+        if not changed.keys() & {"scheduler_interval", "scheduler_jitter", "scheduler_max_interval",
+                                 "scheduler_slow_rtt", "metrics_interval", "backup_interval"}:
+            return
+        for task, interval in self.intervals().items():
+            self.fleets[task].configure(interval=interval,
+                                        jitter=settings.scheduler_jitter,
+                                        max_interval=settings.scheduler_max_interval,
+                                        slow_rtt=settings.scheduler_slow_rtt)
+            logger.info(f"{self.fleets[task]} reconfigured for '{task}'.")
+
+    def tick(self, *args: Any, **kwargs: Any) -> float:
+        from mikrotik_manager.reload import settings_watcher
+        from mikrotik_manager.settings import settings
+
+        now = time.monotonic()
+        if settings.settings_reload_interval and (self._checked is None or
+                                                  now - self._checked >= settings.settings_reload_interval):
+            self._checked = now
+            # checked from tick, so the fleets are only changed by the thread dispatching them
+            self.configure_fleets(settings_watcher.check())
+        interval = super().tick(*args, **kwargs)
+        if not settings.scheduler_enabled:
+            return interval
+        try:
+            self.dispatch_fleet()
+        except Exception as e:
+            logger.exception(f"{self.__class__.__name__} could not dispatch device polls: {e}")
+        return min(interval, settings.scheduler_tick)
+
+    def sync_fleet(self) -> None:
+        """
+        Load the IDs of the devices from the database.
+
+        :return: None
+        """
+
+        from mikrotik_manager.db import db, Device
+
+        with db().session_maker() as session:
+            device_ids = [device_id for device_id, in session.query(Device.id)]
+        for fleet in self.fleets.values():
+            fleet.sync(device_ids)
+
+    def collect(self) -> None:
+        """
+        Report the results of finished batches to their fleet scheduler.
+
+        :return: None
+        """
+
+        pending = []
+        # an identical batch shares the result of the running one, so the results are forgotten once at the end
+        finished = {}
+        for task, result, device_ids in self._pending:
+            if not result.ready():
+                pending.append((task, result, device_ids))
+                continue
+            finished[result.id] = result
+            fleet = self.fleets[task]
+            summary = result.get(propagate=False)
+            if not isinstance(summary, dict):
+                # the whole batch failed
+                for device_id in device_ids:
+                    fleet.report(device_id, ok=False)
+                continue
+            rtts = dict(summary["rtts"])
+            for device_id in device_ids:
+                fleet.report(device_id, ok=device_id in rtts, rtt=rtts.get(device_id))
+        for result in finished.values():
+            result.forget()
+        self._pending = pending
+
+    def dispatch_fleet(self) -> None:
+        """
+        Send the due devices of the fleet schedulers in batches to their worker nodes.
+
+        :return: None
+        """
+
+        from mikrotik_manager.settings import settings
+        from mikrotik_manager.tasks import backup_devices_batch, collect_metrics_batch, fetch_device_info_batch
+        from mikrotik_manager.worker import task_queue
+
+        # the batches are sent by the tasks, so an identical batch which is still running is not sent again
+        tasks = {task.name: task for task in (fetch_device_info_batch, collect_metrics_batch, backup_devices_batch)}
+        now = time.monotonic()
+        if self._synced is None or now - self._synced >= settings.scheduler_sync_interval:
+            self.sync_fleet()
+            self._synced = now
+        self.collect()
+
+        for task, fleet in self.fleets.items():
+            for node, device_ids in fleet.due(now).items():
+                for i in range(0, len(device_ids), settings.scheduler_batch_size):
+                    batch = device_ids[i:i + settings.scheduler_batch_size]
+                    options = {} if node is None else {"queue": task_queue(task, node=node)}
+                    result = tasks[task].apply_async(args=[batch], **options)
+                    self._pending.append((task, result, batch))
+                    logger.debug(f"{fleet} sent {len(batch)} devices to node '{node}' for '{task}'.")
@@ -0,0 +1,77 @@
+import zlib
+from typing import Any, Callable, Literal
+
+from kombu.serialization import register
+from kombu.utils.json import dumps as json_dumps, loads as json_loads
+
+# first byte of every payload
+UNCOMPRESSED = b"\x00"
+COMPRESSED = b"\x01"
+
+
+def get_serializer_name(serializer: Literal["json", "msgpack"]) -> str:
+    return f"mikrotik-manager-{serializer}"
+
+
+def _get_codec(serializer: Literal["json", "msgpack"]) -> tuple[Callable[[Any], bytes], Callable[[bytes], Any]]:
+    if serializer == "json":
+        return lambda obj: json_dumps(obj).encode("utf-8"), lambda data: json_loads(data.decode("utf-8"))
+    if serializer == "msgpack":
+        try:
+            import msgpack
+        except ImportError as e:
+            raise RuntimeError("The 'msgpack' serializer requires the 'msgpack' extra to be installed.") from e
+        return lambda obj: msgpack.packb(obj, use_bin_type=True), lambda data: msgpack.unpackb(data, raw=False)
+    raise ValueError(f"Unknown serializer '{serializer}'.")
+
+
+def make_codec(serializer: Literal["json", "msgpack"],
+               compression_threshold: int,
+               compression_level: int = 3) -> tuple[Callable[[Any], bytes], Callable[[bytes], Any]]:
+    """
+    Create an encoder and decoder that compress payloads larger than a threshold.
+
+    :param serializer: Serialization format.
+    :param compression_threshold: Payloads larger than this number of bytes are zlib compressed.
+    :param compression_level: zlib compression level.
+    :return: Encoder and decoder.
+    """
+
+    dumps, loads = _get_codec(serializer)
+
+    def encode(obj: Any) -> bytes:
+        data = dumps(obj)
+        if len(data) > compression_threshold:
+            return COMPRESSED + zlib.compress(data, compression_level)
+        return UNCOMPRESSED + data
+
+    def decode(data: bytes | str) -> Any:
+        if isinstance(data, str):
+            data = data.encode("latin-1")
+        if data[:1] == COMPRESSED:
+            return loads(zlib.decompress(data[1:]))
+        return loads(data[1:])
+
+    return encode, decode
+
+
+def register_serializers(serializer: Literal["json", "msgpack"], compression_threshold: int) -> list[str]:
+    """
+    Register the selected serializer and the json serializer with kombu.
+
+    :param serializer: Selected serialization format.
+    :param compression_threshold: Payloads larger than this number of bytes are zlib compressed.
+    :return: Names of the registered serializers, the selected one first.
+    """
+
+    names = []
+    for s in dict.fromkeys((serializer, "json")):
+        encode, decode = make_codec(s, compression_threshold)
+        name = get_serializer_name(s)
+        register(name,
+                 encode,
+                 decode,
+                 content_type=f"application/x-{name}",
+                 content_encoding="binary")
+        names.append(name)
+    return names
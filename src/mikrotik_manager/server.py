@@ -1,11 +1,274 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import socket
+import time
+from multiprocessing.context import SpawnProcess
+from typing import Iterable
+
 from wiederverwendbar.uvicorn import UvicornServer
 
-from mikrotik_manager.core_app import __name__ as __core_app_name__, CoreApp as _CoreApp
-from mikrotik_manager.settings import settings
+from mikrotik_manager import __name__ as __module_name__
+from mikrotik_manager.settings import settings, use_metrics_directory
+
+logger = logging.getLogger(__name__)
+
+
+def _serve(app: str, sock: socket.socket, ssl: dict[str, object]) -> None:
+    # the entry point of a server process, it is spawned, so it imports the app itself
+    import uvicorn
+
+    from mikrotik_manager.cli import init_logger
+
+    init_logger()
+    config = uvicorn.Config(app, factory=True, log_config=None, **ssl)
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+class AffinityBalancer:
+    def __init__(self,
+                 backends: dict[str, tuple[str, int]],
+                 trusted: Iterable[str] = ("127.0.0.1",),
+                 buffer_size: int = 65536,
+                 max_header_size: int = 65536):
+        """
+        Forward the connections of a client always to the same server process. The NiceGUI clients live in the process
+        which rendered their page, so the websocket of a page has to reach the same process.
+        The clients are assigned by their address on a consistent hash ring. Behind a trusted proxy the address is
+        taken from its PROXY protocol header or the X-Forwarded-For header of the request.
+        The connection is assigned once, by the first request. A proxy sending X-Forwarded-For must therefore not reuse
+        its connections for several clients, e.g. nginx without 'keepalive' in the upstream or HAProxy with
+        'http-reuse never'. Otherwise it has to send the PROXY protocol, its header belongs to the connection anyway.
+
+        :param backends: Addresses of the server processes by name.
+        :param trusted: Addresses of the trusted proxies, '*' trusts every address.
+        :param buffer_size: Maximum number of bytes forwarded at once.
+        :param max_header_size: Maximum number of bytes read for the headers of a request.
+        """
+
+        # the scheduler module imports celery, which the server process does not need otherwise
+        from mikrotik_manager.scheduler import HashRing
+
+        self.backends = backends
+        self.trusted = frozenset(trusted)
+        self.buffer_size = buffer_size
+        self.max_header_size = max_header_size
+        self.ring = HashRing(backends.keys())
+
+    def __str__(self):
+        return f"{self.__class__.__name__}(backends={len(self.backends)})"
+
+    def backend(self, client: str) -> tuple[str, int]:
+        """
+        Get the address of the server process of a client.
+
+        :param client: Address of the client.
+        :return: Host and port.
+        """
+
+        return self.backends[self.ring.node(client)]
+
+    async def _pipe(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while data := await reader.read(self.buffer_size):
+                writer.write(data)
+                await writer.drain()
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            if writer.can_write_eof():
+                try:
+                    writer.write_eof()
+                except (ConnectionError, OSError):
+                    pass
+
+    async def client(self, reader: asyncio.StreamReader, peer: str) -> tuple[str, bytes]:
+        """
+        Get the address of the client behind a trusted proxy. The PROXY protocol header is removed, the other read
+        bytes have to be forwarded. Only the headers of the first request are read, later requests on the same
+        connection are forwarded to the same server process.
+
+        :param reader: Reader of the connection.
+        :param peer: Address of the connected peer.
+        :return: Address of the client and the bytes read.
+        """
+
+        if peer not in self.trusted and "*" not in self.trusted:
+            return peer, b""
+        head = await reader.read(self.buffer_size)
+        if head.startswith(b"PROXY "):
+            # version 1 of the PROXY protocol, a line of at most 107 bytes
+            while b"\r\n" not in head and len(head) < 108 and (data := await reader.read(self.buffer_size)):
+                head += data
+            line, _, head = head.partition(b"\r\n")
+            fields = line.split(b" ")
+            return (fields[2].decode("ascii", errors="replace") if len(fields) == 6 else peer), head
+        # a TLS handshake starts with a binary record, only plain HTTP requests have readable headers
+        if not head[:1].isalpha():
+            return peer, head
+        while b"\r\n\r\n" not in head and len(head) < self.max_header_size:
+            if not (data := await reader.read(self.buffer_size)):
+                break
+            head += data
+        for line in head.split(b"\r\n\r\n", 1)[0].split(b"\r\n")[1:]:
+            name, _, value = line.partition(b":")
+            if name.strip().lower() == b"x-forwarded-for" and value.strip():
+                # the first address is the client, the others are proxies
+                return value.split(b",")[0].strip().decode("ascii", errors="replace"), head
+        return peer, head
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """
+        Forward a client connection to its server process until both sides are closed.
+
+        :param reader: Reader of the client connection.
+        :param writer: Writer of the client connection.
+        :return: None
+        """
+
+        peer = writer.get_extra_info("peername")
+        try:
+            client, head = await self.client(reader, peer[0] if peer else "")
+        except (ConnectionError, OSError):
+            writer.close()
+            return
+        try:
+            backend_reader, backend_writer = await asyncio.open_connection(*self.backend(client))
+        except OSError as e:
+            logger.warning(f"{self} could not connect client {client}: {e}")
+            writer.close()
+            return
+        if head:
+            backend_writer.write(head)
+        try:
+            await asyncio.gather(self._pipe(reader, backend_writer), self._pipe(backend_reader, writer))
+        finally:
+            backend_writer.close()
+            writer.close()
+
+    async def serve(self, host: str, port: int) -> None:
+        """
+        Accept client connections until cancelled.
+
+        :param host: Host to listen on.
+        :param port: Port to listen on.
+        :return: None
+        """
+
+        server = await asyncio.start_server(self.handle, host=host, port=port, reuse_address=True)
+        logger.info(f"{self} listening on {host}:{port}.")
+        async with server:
+            await server.serve_forever()
 
 
 class Server(UvicornServer):
     def __init__(self):
-        super().__init__(app=f"{__core_app_name__}:{_CoreApp.__name__}",
+        # the app is imported by uvicorn, so FastAPI and NiceGUI are not imported before they are needed
+        super().__init__(app=f"{__module_name__}.core_app:CoreApp",
                          factory=True,
                          settings=settings)
+
+    def run(self) -> None:
+        """
+        Run the server. Several processes are run by the server itself, uvicorn only runs a single one.
+
+        :return: None
+        """
+
+        workers = self.workers or os.cpu_count() or 1
+        if workers <= 1 or self.reload:
+            self.workers = 1
+            super().run()
+            return
+        logger.info(f"Run {self} with {workers} processes")
+        try:
+            self._run_processes(workers)
+        except KeyboardInterrupt:
+            logger.info(f"Keyboard Interrupt {self}")
+        logger.info(f"Stop {self}")
+
+    def _run_processes(self, workers: int) -> None:
+        """
+        Run several server processes, behind the affinity balancer or a reverse proxy. The processes are restarted if
+        they exit.
+
+        :param workers: Number of server processes.
+        :return: None
+        """
+
+        external = settings.server_balancer == "external"
+        if external and settings.server_worker_base_port is None:
+            raise ValueError("The external balancer needs the ports of the server processes, set server_worker_base_port.")
+
+        # the processes write their samples to files, this has to happen before any metric is created
+        use_metrics_directory(settings.server_metrics_directory)
+
+        ssl = {name: value for name, value in {"ssl_keyfile": self.ssl_keyfile,
+                                               "ssl_certfile": self.ssl_certfile,
+                                               "ssl_keyfile_password": self.ssl_keyfile_password,
+                                               "ssl_version": self.ssl_version,
+                                               "ssl_cert_reqs": self.ssl_cert_reqs,
+                                               "ssl_ca_certs": self.ssl_ca_certs if self.ssl_certfile else None,
+                                               "ssl_ciphers": self.ssl_ciphers}.items() if value is not None}
+
+        # the sockets are bound here, so a restarting process does not lose waiting connections
+        sockets: dict[str, socket.socket] = {}
+        for i in range(workers):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            # the processes are only reachable through the balancer, unless a reverse proxy balances them
+            sock.bind((str(self.host) if external else "127.0.0.1",
+                       settings.server_worker_base_port + i if settings.server_worker_base_port else 0))
+            sock.listen(2048)
+            sock.set_inheritable(True)
+            sockets[f"server-{i}"] = sock
+        balancer = AffinityBalancer({name: sock.getsockname()[:2] for name, sock in sockets.items()},
+                                    trusted=settings.server_forwarded_allow_ips)
+
+        context = multiprocessing.get_context("spawn")
+        processes: dict[str, SpawnProcess] = {}
+
+        def start(name: str) -> None:
+            process = context.Process(target=_serve, args=(self.app, sockets[name], ssl), name=name, daemon=True)
+            process.start()
+            processes[name] = process
+            logger.debug(f"Started server process '{name}' with PID {process.pid} on {sockets[name].getsockname()}.")
+
+        async def supervise() -> None:
+            while True:
+                await asyncio.sleep(1.0)
+                for name, process in list(processes.items()):
+                    if process.is_alive():
+                        continue
+                    logger.warning(f"Server process '{name}' exited with code {process.exitcode}, restarting it.")
+                    self._mark_process_dead(process.pid)
+                    start(name)
+
+        async def main() -> None:
+            if external:
+                await supervise()
+            else:
+                await asyncio.gather(balancer.serve(str(self.host), self.port), supervise())
+
+        for name in sockets:
+            start(name)
+        try:
+            asyncio.run(main())
+        finally:
+            for process in processes.values():
+                process.terminate()
+            deadline = time.monotonic() + 10.0
+            for process in processes.values():
+                process.join(max(0.0, deadline - time.monotonic()))
+                if process.is_alive():
+                    process.kill()
+            for sock in sockets.values():
+                sock.close()
+
+    @staticmethod
+    def _mark_process_dead(pid: int | None) -> None:
+        from prometheus_client import multiprocess
+
+        if pid is not None:
+            multiprocess.mark_process_dead(pid)
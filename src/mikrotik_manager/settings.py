@@ -1,5 +1,9 @@
+import atexit
+import json
 import os
+import shutil
 import sys
+import tempfile
 from pathlib import Path
 from typing import Literal
 
@@ -34,6 +38,72 @@ class CelerySettings(SqlalchemySettings):
     # BEAT_PID_FILE=/var/run/celery/beat.pid
     # BEAT_UID=nobody
     # BEAT_GID=nogroup
+    worker_node: str | None = Field(default=None,
+                                    title="Worker Node",
+                                    description="Name of the fleet scheduler node of this worker. If set, the worker also consumes the device polls sharded to this node.")
+    worker_queues: list[Literal["interactive", "bulk", "backups"]] = Field(default=["interactive", "bulk", "backups"],
+                                                                           min_length=1,
+                                                                           title="Worker Queues",
+                                                                           description="Queues the worker consumes, each by a pool of its own, so bulk work does not delay interactive tasks.")
+    worker_queue_concurrency: dict[str, int] = Field(default={"interactive": 2, "bulk": 4, "backups": 1},
+                                                     title="Worker Queue Concurrency",
+                                                     description="Number of worker processes per queue. Queues which are not listed use the number of CPU cores.")
+    worker_queue_prefetch: dict[str, int] = Field(default={"interactive": 1, "bulk": 4, "backups": 1},
+                                                  title="Worker Queue Prefetch",
+                                                  description="Number of tasks a worker process of a queue reserves in advance. Queues which are not listed reserve 4.")
+    worker_beat: bool = Field(default=False,
+                              title="Worker Beat",
+                              description="Run the beat scheduler embedded in the worker. Only one worker of the cluster may run it.")
+    worker_batch_concurrency: int = Field(default=256,
+                                          ge=1,
+                                          title="Worker Batch Concurrency",
+                                          description="Maximum number of devices polled concurrently by one batch task.")
+    worker_batch_page_size: int = Field(default=100,
+                                        ge=1,
+                                        title="Worker Batch Page Size",
+                                        description="Number of device results per progress update of a batch task.")
+    worker_metrics_port: int | None = Field(default=None,
+                                            title="Worker Metrics Port",
+                                            description="Port the worker serves its Prometheus metrics on. If None, no metrics are served.")
+    worker_metrics_directory: Path = Field(default=Path("worker-metrics"),
+                                           title="Worker Metrics Directory",
+                                           description="Directory the worker processes share their metrics in, every worker uses a directory of its own below it.")
+    worker_metrics_interval: float = Field(default=5.0,
+                                           gt=0,
+                                           title="Worker Metrics Interval",
+                                           description="Seconds between two samples of the connection pool of a worker process.")
+    task_serializer: Literal["json", "msgpack"] = Field(default="json",
+                                                        title="Task Serializer",
+                                                        description="Serialization format of task arguments and results. 'msgpack' requires the 'msgpack' extra.")
+    task_compression_threshold: int = Field(default=16384,
+                                            ge=0,
+                                            title="Task Compression Threshold",
+                                            description="Task arguments and results larger than this number of bytes are compressed.")
+    result_backend: Literal["database", "sqlite"] = Field(default="database",
+                                                          title="Result Backend",
+                                                          description="Where task results are stored. 'database' uses the configured database, 'sqlite' a local file.")
+    result_backend_file: Path = Field(default=Path("results.sqlite"),
+                                      title="Result Backend File",
+                                      description="The SQLite file of the 'sqlite' result backend.")
+    result_expires: int = Field(default=86400,
+                                ge=0,
+                                title="Result Expires",
+                                description="Seconds after which task results and result streams are deleted. If 0, they never expire.")
+    result_compression: Literal["zlib", "gzip", "bzip2"] | None = Field(default=None,
+                                                                        title="Result Compression",
+                                                                        description="Compression of all stored task results. If None, only results above the task compression threshold are compressed.")
+    result_stream_compression_threshold: int = Field(default=4096,
+                                                     ge=0,
+                                                     title="Result Stream Compression Threshold",
+                                                     description="Result stream chunks larger than this number of bytes are compressed.")
+    task_cache_ttl: float = Field(default=30.0,
+                                  ge=0,
+                                  title="Task Cache TTL",
+                                  description="Seconds the result of an idempotent task is reused for an identical call. If 0, only running calls are shared.")
+    task_coalesce_timeout: float = Field(default=600.0,
+                                         gt=0,
+                                         title="Task Coalesce Timeout",
+                                         description="Seconds after which an unfinished idempotent task is no longer shared, e.g. because its worker died.")
     broker_host: str = Field(default="localhost",
                              title="Broker Host",
                              description="The host of the AMQ message broker.")
@@ -48,7 +118,36 @@ class CelerySettings(SqlalchemySettings):
                                         description="The password to connect to the AMQ message broker.")
 
 
-class Settings(CelerySettings, UvicornServerSettings, TyperSettings, LoggerSettings, YamlFile):
+class RouterOsSettings(BaseModel):
+    routeros_connect_timeout: float = Field(default=10.0,
+                                            title="RouterOS Connect Timeout",
+                                            description="Timeout in seconds for connecting and logging in to a device.")
+    routeros_timeout: float = Field(default=30.0,
+                                    title="RouterOS Timeout",
+                                    description="Timeout in seconds for a single API command.")
+    routeros_pool_max_connections_per_device: int = Field(default=2,
+                                                          ge=1,
+                                                          title="RouterOS Pool Max Connections per Device",
+                                                          description="Maximum number of concurrent API sessions per device and worker process.")
+    routeros_pool_idle_timeout: float = Field(default=300.0,
+                                              title="RouterOS Pool Idle Timeout",
+                                              description="Seconds after which an unused API session is closed.")
+    routeros_pool_health_check_interval: float = Field(default=60.0,
+                                                       title="RouterOS Pool Health Check Interval",
+                                                       description="Seconds after which an idle API session is checked before it is reused.")
+    routeros_pool_reconnect_attempts: int = Field(default=3,
+                                                  ge=0,
+                                                  title="RouterOS Pool Reconnect Attempts",
+                                                  description="Number of retries if connecting to a device fails.")
+    routeros_pool_reconnect_backoff: float = Field(default=0.5,
+                                                   title="RouterOS Pool Reconnect Backoff",
+                                                   description="Initial backoff in seconds between connection attempts. Doubles with every failure.")
+    routeros_pool_reconnect_backoff_max: float = Field(default=30.0,
+                                                       title="RouterOS Pool Reconnect Backoff Max",
+                                                       description="Maximum backoff in seconds between connection attempts.")
+
+
+class Settings(RouterOsSettings, CelerySettings, UvicornServerSettings, TyperSettings, LoggerSettings, YamlFile):
     model_config = {
         "case_sensitive": False,
         "file_overwrite": {
@@ -61,13 +160,104 @@ class Settings(CelerySettings, UvicornServerSettings, TyperSettings, LoggerSetti
             "branding_license_url": __license_url__,
             "branding_terms_of_service": __terms_of_service__
         },
-        "file_save_on_load": "if_not_exist"
+        "file_save_on_load": "if_not_exist",
+        # the settings are only replaced as a whole, e.g. by a reload, so readers never see a half changed state
+        "frozen": True
     }
 
+    # settings
+    settings_reload_interval: float = Field(default=5.0, ge=0, description="Seconds between two checks of the settings file for changes of the reloadable settings. If 0, the settings are never reloaded.")
+
+    # db
+    db_pool_size: int = Field(default=10, ge=1, description="Number of pooled connections of the async engine of every process.")
+    db_pool_max_overflow: int = Field(default=20, ge=0, description="Number of connections of the async engine beyond the pool size.")
+    db_pool_timeout: float = Field(default=30.0, gt=0, description="Seconds to wait for a pooled connection or for a locked SQLite database.")
+    db_pool_recycle: int = Field(default=1800, ge=-1, description="Seconds after which a pooled connection is replaced. If -1, connections are never replaced.")
+    db_sqlite_wal: bool = Field(default=True, description="Use write-ahead logging for SQLite database files, so readers do not block the writer.")
+    db_status_batch_size: int = Field(default=1000, ge=1, description="Maximum number of device status updates written at once.")
+    db_status_interval: float = Field(default=0.5, gt=0, description="Maximum seconds a device status update waits before it is written.")
+    db_status_max_attempts: int = Field(default=5, ge=1, description="Maximum number of attempts to write a device status update if the database is not reachable.")
+
+    # server
+    server_workers: int = Field(default=1, ge=0, le=100, title="Server Workers",
+                                description="Number of server processes. If greater than 1, the clients are balanced across them with session affinity. If 0, one per CPU core.")
+    server_worker_base_port: int | None = Field(default=None, ge=1, le=65535,
+                                                description="First port the server processes listen on if there is more than one, at localhost for the internal balancer. If None, free ports are used.")
+    server_balancer: Literal["internal", "external"] = Field(default="internal",
+                                                             description="Balancer of the server processes if there is more than one. 'internal' forwards the clients with session affinity, 'external' lets the processes listen on the server host and leaves the sticky routing to a reverse proxy.")
+    server_forwarded_allow_ips: list[str] = Field(default=["127.0.0.1"],
+                                                  description="Addresses of the proxies whose PROXY protocol or X-Forwarded-For header names the client the internal balancer assigns. '*' trusts every address. The X-Forwarded-For header is only read from the first request of a connection, so a proxy sending it must not reuse its connections for several clients, otherwise it has to send the PROXY protocol.")
+    server_metrics_directory: Path = Field(default=Path("server-metrics"),
+                                           description="Directory the server processes share their metrics in if there is more than one, every server uses a directory of its own below it.")
+
     # app
     app_debug: bool = Field(default=False, description="App debug mode.")
     app_root_web_path: str = Field(default="", description="App root web path.")
     app_pid_file: Path | None = Field(default=None, description="App PID file path.")
+    app_metrics_enabled: bool = Field(default=True, description="Serve the Prometheus metrics of the server at '/metrics'.")
+    app_api_token: str | None = Field(default=None, description="Bearer token of the API at '/api'. If None, the API is disabled.")
+
+    # inventory
+    inventory_last_seen_interval: float = Field(default=900.0,
+                                                description="Seconds after which the last seen timestamp of an unchanged device is written.")
+
+    # scheduler
+    scheduler_enabled: bool = Field(default=False, description="Poll all devices periodically by the beat scheduler.")
+    scheduler_interval: float = Field(default=300.0, gt=0, description="Seconds between two polls of a responsive device.")
+    scheduler_jitter: float = Field(default=0.1, ge=0, le=1, description="Maximum random jitter of a poll as fraction of the poll interval.")
+    scheduler_max_interval: float = Field(default=3600.0, gt=0, description="Maximum seconds between two polls of a failing device.")
+    scheduler_slow_rtt: float = Field(default=5.0, gt=0, description="Poll duration in seconds from which a device is polled at half the rate.")
+    scheduler_nodes: list[str] = Field(default_factory=list, description="Worker nodes the devices are sharded across. If empty, the devices are not sharded.")
+    scheduler_batch_size: int = Field(default=500, ge=1, description="Maximum number of devices per dispatched batch task.")
+    scheduler_tick: float = Field(default=1.0, gt=0, description="Seconds between two checks for due devices.")
+    scheduler_sync_interval: float = Field(default=60.0, gt=0, description="Seconds between two reloads of the devices from the database.")
+
+    # metrics
+    metrics_enabled: bool = Field(default=False, description="Collect interface traffic, CPU and memory samples of all devices by the fleet scheduler.")
+    metrics_interval: float = Field(default=60.0, gt=0, description="Seconds between two metric samples of a device.")
+    metrics_retention_1m: float = Field(default=7.0, ge=0, description="Days the 1 minute rollup is kept. If 0, it is kept forever.")
+    metrics_retention_1h: float = Field(default=90.0, ge=0, description="Days the 1 hour rollup is kept. If 0, it is kept forever.")
+    metrics_retention_1d: float = Field(default=1825.0, ge=0, description="Days the 1 day rollup is kept. If 0, it is kept forever.")
+    metrics_compact_interval: float = Field(default=300.0, gt=0, description="Seconds between two merges of the written metric samples into their blocks.")
+    metrics_max_points: int = Field(default=1500, ge=1, description="Maximum number of points per series of a graph.")
+
+    # backup
+    backup_enabled: bool = Field(default=False, description="Back up the configuration of all devices by the fleet scheduler.")
+    backup_interval: float = Field(default=86400.0, gt=0, description="Seconds between two backups of a device.")
+    backup_binary: bool = Field(default=False, description="Also store a binary backup besides the configuration export.")
+    backup_show_sensitive: bool = Field(default=False, description="Include passwords and keys in the configuration export.")
+    backup_directory: Path = Field(default=Path("backups"), description="Directory of the stored backup chunks.")
+    backup_retention: float = Field(default=365.0, ge=0, description="Days a backup version is kept, the latest version is always kept. If 0, versions are kept forever.")
+    backup_average_chunk_lines: int = Field(default=64, ge=1, description="Average number of lines per stored chunk of an export.")
+    backup_read_chunk_size: int = Field(default=32768, ge=1, le=32768, description="Number of bytes read from a device at once.")
+    backup_diff_max_lines: int = Field(default=5000, ge=1, description="Maximum number of diff lines shown at once.")
+
+    # jobs
+    jobs_wave_size: int = Field(default=100, ge=1, description="Default number of devices per wave of a bulk action.")
+    jobs_wave_interval: float = Field(default=0.0, ge=0, description="Default seconds to wait between two waves of a bulk action.")
+    jobs_concurrency: int = Field(default=32, ge=1, description="Default maximum number of devices a bulk action runs on at the same time.")
+    jobs_site_concurrency: int = Field(default=4, ge=1, description="Default maximum number of devices of the same site a bulk action runs on at the same time.")
+    jobs_rate: float = Field(default=5.0, gt=0, description="Default number of devices per second a bulk action is started on.")
+    jobs_burst: int = Field(default=10, ge=1, description="Default number of devices a bulk action may start on at once after being idle.")
+    jobs_global_rate: float = Field(default=10.0, gt=0, description="Number of devices per second all bulk actions of the cluster together are started on.")
+    jobs_global_burst: int = Field(default=20, ge=1, description="Number of devices all bulk actions of the cluster together may start on at once after being idle.")
+    jobs_max_failure_ratio: float = Field(default=0.1, ge=0, le=1, description="Default share of failed devices of a wave above which a bulk action is paused.")
+    jobs_interactive_max_devices: int = Field(default=10, ge=0, description="Bulk actions on up to this number of devices run on the interactive queue, larger ones on the bulk queue.")
+    jobs_control_interval: float = Field(default=1.0, gt=0, description="Seconds between two checks of a running bulk action for pause and abort requests.")
+    jobs_lease: float = Field(default=60.0, gt=0, description="Seconds without a heartbeat of its runner after which a running bulk action counts as orphaned, so it can be paused, resumed or aborted.")
+
+    # listener
+    listener_host: str = Field(default="0.0.0.0", description="Host the syslog and SNMP trap listener binds to.")
+    listener_syslog_port: int | None = Field(default=514, ge=1, le=65535, description="UDP port of the syslog listener. If None, no syslog messages are received.")
+    listener_trap_port: int | None = Field(default=162, ge=1, le=65535, description="UDP port of the SNMP trap listener. If None, no traps are received.")
+    listener_trap_community: str | None = Field(default=None, description="Only accept SNMP traps of this community. If None, traps of every community are accepted.")
+    listener_batch_size: int = Field(default=1000, ge=1, description="Maximum number of received messages processed at once.")
+    listener_batch_interval: float = Field(default=0.2, gt=0, description="Maximum seconds a received message waits before it is processed.")
+    listener_queue_size: int = Field(default=100000, ge=1, description="Maximum number of received messages waiting to be processed, further messages are dropped.")
+    listener_index_interval: float = Field(default=60.0, gt=0, description="Seconds between two reloads of the device addresses from the database.")
+    listener_store_messages: bool = Field(default=False, description="Also store syslog messages and traps which are no known event, e.g. firewall logs.")
+    listener_refresh_interval: float = Field(default=60.0, ge=0, description="Minimum seconds between two inventory refreshes of a device triggered by configuration changes or reboots. If 0, events trigger no refreshes.")
+    listener_event_retention: float = Field(default=30.0, ge=0, description="Days a device event is kept. If 0, events are kept forever.")
 
     # ui
     ui_web_path: str = Field(default="/ui", description="UI web path prefix.")
@@ -83,11 +273,140 @@ class Settings(CelerySettings, UvicornServerSettings, TyperSettings, LoggerSetti
     ui_reconnect_timeout: float = Field(default=3.0, description="Reconnect timeout.")
     ui_prod_js: bool = Field(default=False,
                              description="Use production JavaScript.")  # ToDo: set default to True in production
+    ui_status_update_interval: float = Field(default=1.0, description="Minimum seconds between device status updates sent to a client.")
+    ui_device_table_rows_per_page: int = Field(default=100, description="Number of devices per page of the device table.")
     ui_storage_secret: str = Field(default="test", description="Storage secret.")  # ToDo: make storage_secret required
+    ui_storage_backend: Literal["file", "database"] = Field(default="file", description="Where the user and general storage is kept, 'database' shares it between servers.")
+    ui_storage_path: Path | None = Field(default=None, description="Directory of the 'file' storage backend. If None, the NiceGUI default is used.")
+
+
+# prefix of the environment variables of the package
+ENV_PREFIX = "MIKROTIK_MANAGER_"
+# path of the snapshot of the validated settings, inherited by child processes
+SNAPSHOT_ENV = f"{ENV_PREFIX}SETTINGS_SNAPSHOT"
+# directory the processes share their metrics in, it has to be set before the metrics are imported
+MULTIPROCESS_ENV = "PROMETHEUS_MULTIPROC_DIR"
+
+
+def settings_file_path() -> Path:
+    """
+    Get the path of the settings file.
+
+    :return: Path
+    """
+
+    return Settings._InstanceConfig(cls=Settings, instance_config={}).file_path
+
+
+def settings_file_key(path: Path) -> tuple[str, int, int] | None:
+    """
+    Get the key of a settings file, which changes with every write.
+
+    :param path: Path of the settings file.
+    :return: Path, modification time and size or None if the file does not exist.
+    """
+
+    try:
+        stat = path.stat()
+    except OSError:
+        return None
+    return str(path.absolute()), stat.st_mtime_ns, stat.st_size
+
+
+def snapshot_key(path: Path) -> str:
+    """
+    Get the key of the settings snapshot, which changes with the version, the settings file and the environment
+    variables of the package.
+
+    :param path: Path of the settings file.
+    :return: str
+    """
+
+    environment = sorted((name, value) for name, value in os.environ.items()
+                         if name.upper().startswith(ENV_PREFIX) and name != SNAPSHOT_ENV)
+    return json.dumps([__version__, settings_file_key(path), environment])
+
+
+def _remove_snapshot(path: str, pid: int) -> None:
+    # forked children inherit the exit handlers, only the creator removes the snapshot
+    if os.getpid() == pid:
+        Path(path).unlink(missing_ok=True)
+
+
+def _remove_metrics_directory(path: Path, pid: int) -> None:
+    # like the snapshot, only the creator removes the directory
+    if os.getpid() == pid:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def use_metrics_directory(base: Path) -> Path:
+    """
+    Create a metrics directory of the current process below base and let the child processes share it. Every process
+    group gets a directory of its own, so a second worker or server on the same base does not remove the samples of
+    the running one. Directories of processes which are not running anymore are removed.
+
+    :param base: Directory of the metrics directories.
+    :return: Path of the directory.
+    """
+
+    base.mkdir(parents=True, exist_ok=True)
+    if os.name == "posix":
+        for path in base.iterdir():
+            if not path.name.isdigit():
+                continue
+            try:
+                os.kill(int(path.name), 0)
+            except ProcessLookupError:
+                shutil.rmtree(path, ignore_errors=True)
+            except OSError:
+                # running, but owned by another user
+                pass
+    directory = base / str(os.getpid())
+    # the samples of a previous process with the same ID are outdated
+    shutil.rmtree(directory, ignore_errors=True)
+    directory.mkdir()
+    os.environ[MULTIPROCESS_ENV] = str(directory.absolute())
+    atexit.register(_remove_metrics_directory, directory, os.getpid())
+    return directory
+
+
+def load_settings() -> Settings:
+    """
+    Load the settings. Child processes use the snapshot of their parent instead of parsing the settings file again,
+    as long as the file is unchanged. Forked processes share the settings of their parent anyway. The snapshot is
+    validated like the file, as its JSON only has the paths, enums and versions of the settings as strings and
+    model_construct would keep them so.
+
+    :return: Settings
+    """
+
+    path = settings_file_path()
+    key = snapshot_key(path)
+    snapshot = os.environ.get(SNAPSHOT_ENV)
+    if snapshot:
+        try:
+            # the first line is the key, the rest the settings as JSON
+            snapshot_key_line, data = Path(snapshot).read_text(encoding="utf-8").split("\n", 1)
+            if snapshot_key_line == key:
+                return Settings.model_validate_json(data)
+        except Exception:
+            # an outdated or broken snapshot is replaced below
+            pass
+
+    loaded = Settings.load()
+    try:
+        fd, snapshot = tempfile.mkstemp(prefix="mikrotik-manager-settings-", suffix=".json")
+        with os.fdopen(fd, "w", encoding="utf-8") as file:
+            file.write(f"{key}\n{loaded.model_dump_json()}")
+    except OSError:
+        return loaded
+    os.environ[SNAPSHOT_ENV] = snapshot
+    atexit.register(_remove_snapshot, snapshot, os.getpid())
+    return loaded
 
 
 try:
-    settings = Settings.load()
+    settings = load_settings()
 except ValidationError as e:
     print("Settings validation error:", e)
     sys.exit(1)
@@ -0,0 +1,67 @@
+import re
+import subprocess
+import sys
+import time
+from dataclasses import dataclass
+
+from mikrotik_manager import __name__ as __module_name__
+
+# modules imported lazily by the commands
+COMMAND_MODULES: dict[str, list[str]] = {"cli": [],
+                                         "serve": [f"{__module_name__}.server", f"{__module_name__}.core_app"],
+                                         "worker": [f"{__module_name__}.worker", f"{__module_name__}.tasks"],
+                                         "listen": [f"{__module_name__}.listener"],
+                                         "init": [f"{__module_name__}.db"]}
+
+_IMPORT_TIME_PATTERN = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+
+@dataclass
+class ImportTime:
+    name: str
+    depth: int
+    self_us: int
+    cumulative_us: int
+
+
+def profile_imports(modules: list[str]) -> tuple[float, list[ImportTime]]:
+    """
+    Import the CLI and the given modules in a fresh interpreter with '-X importtime'.
+
+    :param modules: Modules to import after the CLI.
+    :return: Wall time in seconds and the import times.
+    """
+
+    code = "; ".join(f"import {module}" for module in [f"{__module_name__}.cli", *modules])
+    start = time.perf_counter()
+    process = subprocess.run([sys.executable, "-X", "importtime", "-c", code], capture_output=True, text=True)
+    wall_time = time.perf_counter() - start
+    if process.returncode != 0:
+        raise RuntimeError(f"Importing {', '.join(modules) or 'the CLI'} failed:\n{process.stderr[-2000:]}")
+
+    import_times = []
+    for line in process.stderr.splitlines():
+        match = _IMPORT_TIME_PATTERN.match(line)
+        if match is None:
+            continue
+        import_times.append(ImportTime(name=match.group(4),
+                                       depth=(len(match.group(3)) - 1) // 2,
+                                       self_us=int(match.group(1)),
+                                       cumulative_us=int(match.group(2))))
+    return wall_time, import_times
+
+
+def measure_help(repeat: int = 3) -> float:
+    """
+    Measure the wall time of 'mikrotik-manager --help' in a fresh interpreter.
+
+    :param repeat: Number of runs, the fastest one is returned.
+    :return: Wall time in seconds.
+    """
+
+    wall_times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-m", __module_name__, "--help"], capture_output=True, check=True)
+        wall_times.append(time.perf_counter() - start)
+    return min(wall_times)
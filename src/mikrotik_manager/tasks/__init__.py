@@ -1 +1,7 @@
 from mikrotik_manager.tasks.test import test
+from mikrotik_manager.tasks.devices import fetch_device_info_batch
+from mikrotik_manager.tasks.metrics import collect_metrics_batch
+from mikrotik_manager.tasks.backups import backup_devices_batch
+from mikrotik_manager.tasks.maintenance import cleanup_result_streams, cleanup_task_keys, cleanup_metrics, compact_metrics, \
+    cleanup_backups, cleanup_device_events
+from mikrotik_manager.tasks.jobs import run_job
@@ -0,0 +1,142 @@
+from functools import partial
+from pathlib import Path
+from typing import Any
+
+from celery.utils.log import get_task_logger
+
+from mikrotik_manager.backups import get_backup_store
+from mikrotik_manager.routeros.api import RouterOsApi
+from mikrotik_manager.routeros.pool import ConnectionPool, DeviceAddress
+from mikrotik_manager.settings import settings
+from mikrotik_manager.tasks.base import BaseTask
+from mikrotik_manager.tasks.devices import load_devices, poll_devices
+from mikrotik_manager.worker import celery_app
+
+logger = get_task_logger(__name__)
+
+# name of the temporary files on the devices
+FILE_NAME = "mikrotik-manager"
+
+
+async def download_file(api: RouterOsApi, name: str, path: Path, chunk_size: int = 32768) -> int:
+    """
+    Download a file of a device chunk by chunk into a local file and remove it from the device.
+
+    :param api: Session of the device.
+    :param name: Name of the file on the device.
+    :param path: Local path to write to.
+    :param chunk_size: Number of bytes read at once.
+    :return: Size of the file.
+    """
+
+    size = 0
+    try:
+        with open(path, "wb") as file:
+            while True:
+                # file contents are not necessarily UTF-8, surrogateescape gives back the original bytes
+                replies = await api.talk("/file/read",
+                                         attributes={"file": name, "offset": str(size), "chunk-size": str(chunk_size)},
+                                         errors="surrogateescape")
+                data = replies[0].get("data", "").encode("utf-8", errors="surrogateescape") if replies else b""
+                file.write(data)
+                size += len(data)
+                if len(data) < chunk_size:
+                    return size
+    finally:
+        # a broken session would hide the original error
+        if not api.closed:
+            await api.talk("/file/remove", attributes={"numbers": name})
+
+
+async def fetch_backup(pool: ConnectionPool,
+                       address: DeviceAddress,
+                       temp_file: Any,
+                       binary: bool = False,
+                       show_sensitive: bool = False,
+                       chunk_size: int = 32768) -> dict[str, str]:
+    """
+    Stream the configuration export and optionally a binary backup of a device into local temporary files.
+
+    :param pool: Connection pool to use.
+    :param address: Address of the device.
+    :param temp_file: Called to get the path of a new local temporary file.
+    :param binary: Also fetch a binary backup.
+    :param show_sensitive: Include passwords and keys in the export.
+    :param chunk_size: Number of bytes read at once.
+    :return: Path of the downloaded file by kind.
+    """
+
+    paths = {}
+    try:
+        async with pool.connection(address) as api:
+            attributes = {"file": FILE_NAME}
+            if show_sensitive:
+                attributes["show-sensitive"] = ""
+            await api.talk("/export", attributes=attributes)
+            paths["export"] = temp_file()
+            await download_file(api, f"{FILE_NAME}.rsc", paths["export"], chunk_size)
+            if binary:
+                await api.talk("/system/backup/save", attributes={"name": FILE_NAME, "dont-encrypt": "yes"})
+                paths["backup"] = temp_file()
+                await download_file(api, f"{FILE_NAME}.backup", paths["backup"], chunk_size)
+    except BaseException:
+        for path in paths.values():
+            path.unlink(missing_ok=True)
+        raise
+    return {kind: str(path) for kind, path in paths.items()}
+
+
+@celery_app.task(name="backup_devices_batch", bind=True, idempotent=True, cache_ttl=0)
+def backup_devices_batch(self: BaseTask,
+                         device_ids: list[int],
+                         concurrency: int | None = None,
+                         page_size: int | None = None) -> dict[str, Any]:
+    """
+    Back up the configuration of a chunk of devices in one worker process. The files are streamed to disk and
+    added to the backup store page by page.
+
+    :param device_ids: IDs of the devices.
+    :param concurrency: Maximum number of devices backed up at the same time. If None, the setting is used.
+    :param page_size: Number of devices per page added to the store. If None, the setting is used.
+    :return: Summary of poll_devices with the number of created versions.
+    """
+
+    store = get_backup_store()
+    created = 0
+
+    def discard(page: list[dict[str, Any]]) -> None:
+        for result in page:
+            if result["ok"]:
+                for path in result["info"].values():
+                    Path(path).unlink(missing_ok=True)
+
+    def publish(page: list[dict[str, Any]]) -> None:
+        nonlocal created
+        try:
+            for result in page:
+                if not result["ok"]:
+                    continue
+                for kind, path in result["info"].items():
+                    created += store.add(result["id"], Path(path), kind)[1]
+        finally:
+            # the added files are not needed anymore, the ones not added after a failure are removed as well
+            discard(page)
+
+    fetch = partial(fetch_backup,
+                    temp_file=store.temp_file,
+                    binary=settings.backup_binary,
+                    show_sensitive=settings.backup_show_sensitive,
+                    chunk_size=settings.backup_read_chunk_size)
+    devices = load_devices(device_ids)
+    # adding the files from the task thread, so the event loop is not blocked by the disk and the database
+    summary = self.consume_async(lambda on_page: poll_devices(pool=self.pool,
+                                                              devices=devices,
+                                                              concurrency=concurrency or settings.worker_batch_concurrency,
+                                                              page_size=page_size or settings.worker_batch_page_size,
+                                                              on_page=on_page,
+                                                              fetch=fetch),
+                                 consume=publish,
+                                 discard=discard)
+    summary["created"] = created
+    logger.debug(f"Backed up {summary['total']} devices, {created} new versions, {summary['failed']} failed.")
+    return summary
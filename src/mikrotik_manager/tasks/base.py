@@ -1,5 +1,349 @@
-from celery import Task
+import asyncio
+import hashlib
+import json
+import os
+import queue
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Coroutine, TypeVar
+
+from celery import Task, states
+from celery.utils.log import get_task_logger
+from celery.result import AsyncResult
+from celery.signals import task_postrun, task_prerun, worker_process_init, worker_process_shutdown, worker_ready
+from celery.utils import uuid
+
+from mikrotik_manager.db import async_session_maker, db
+from mikrotik_manager.device_status import StatusWriter
+from mikrotik_manager.events import publish_inventory_deltas
+from mikrotik_manager.inventory import Inventory
+from mikrotik_manager.reload import settings_watcher
+from mikrotik_manager.results import get_task_keys
+from mikrotik_manager.routeros.pool import ConnectionPool
+from mikrotik_manager.settings import settings
+from mikrotik_manager.telemetry import mark_process_dead, sample_pool, task_finished, task_started
+from mikrotik_manager.timeseries import MetricCollector, get_metric_store
+
+logger = get_task_logger(__name__)
+
+T = TypeVar("T")
+
+# header which carries the idempotency key claimed by apply_async to the worker
+IDEMPOTENCY_HEADER = "idempotency_key"
+# options routing a call, identical arguments routed elsewhere are a different call
+ROUTING_OPTIONS = ("exchange", "queue", "routing_key")
 
 
 class BaseTask(Task):
-    ...
+    # identical calls of an idempotent task share one run, see apply_async
+    idempotent: bool = False
+    # seconds the result of an idempotent task is reused, if None, the setting is used
+    cache_ttl: float | None = None
+
+    # event loop and connection pool of the current worker process
+    _runtime_lock = threading.Lock()
+    _runtime_pid: int | None = None
+    _loop: asyncio.AbstractEventLoop | None = None
+    _pool: ConnectionPool | None = None
+    _inventory: tuple[int, Inventory] | None = None
+    _metrics: tuple[int, MetricCollector] | None = None
+    _status_writer: tuple[int, StatusWriter | None] | None = None
+
+    def idempotency_key(self,
+                        args: tuple | list | None = None,
+                        kwargs: dict[str, Any] | None = None,
+                        options: dict[str, Any] | None = None) -> str:
+        """
+        Get the idempotency key of a call, which is the same for identical calls of the task.
+
+        :param args: Positional arguments of the call.
+        :param kwargs: Keyword arguments of the call.
+        :param options: Options of the call, only the routing options are part of the key.
+        :return: '<task name>:<hash of the arguments and the routing>'
+        """
+
+        # a queue or exchange may be given by its object instead of its name
+        routing = {name: getattr(options[name], "name", options[name]) for name in ROUTING_OPTIONS
+                   if (options or {}).get(name) is not None}
+        data = json.dumps([list(args or ()), kwargs or {}, routing], sort_keys=True, separators=(",", ":"),
+                          default=str)
+        return f"{self.name}:{hashlib.sha256(data.encode('utf-8')).hexdigest()}"
+
+    def apply_async(self,
+                    args: tuple | list | None = None,
+                    kwargs: dict[str, Any] | None = None,
+                    task_id: str | None = None,
+                    force: bool = False,
+                    **options: Any) -> AsyncResult:
+        """
+        Send a call of the task. An identical call of an idempotent task gets the result of the call that is running
+        or finished less than cache_ttl seconds ago instead of running the task again.
+
+        :param args: Positional arguments of the call.
+        :param kwargs: Keyword arguments of the call.
+        :param task_id: Task ID of the call. If None, a new one is generated.
+        :param force: Run the task again even if an identical call is running or finished recently.
+        :param options: Options of Task.apply_async.
+        :return: AsyncResult, possibly of an earlier call.
+        """
+
+        if not self.idempotent:
+            return super().apply_async(args, kwargs, task_id=task_id, **options)
+        key = self.idempotency_key(args, kwargs, options)
+        task_id = task_id or uuid()
+        keys = get_task_keys()
+        if force:
+            keys.invalidate(key=key)
+        claimed = keys.claim(key, task=self.name, task_id=task_id,
+                             ttl=settings.task_cache_ttl if self.cache_ttl is None else self.cache_ttl)
+        if claimed != task_id:
+            logger.debug(f"Sharing the result of {self.name}[{claimed}] for an identical call.")
+            return self.AsyncResult(claimed)
+        # the worker finishes the claimed key, it can not be derived from the deserialized arguments reliably
+        options["headers"] = {**(options.get("headers") or {}), IDEMPOTENCY_HEADER: key}
+        try:
+            return super().apply_async(args, kwargs, task_id=task_id, **options)
+        except Exception:
+            keys.finish(key, task_id, ok=False)
+            raise
+
+    def after_return(self, status: str, retval: Any, task_id: str, args: tuple, kwargs: dict[str, Any],
+                     einfo: Any) -> None:
+        if not self.idempotent:
+            return
+        # custom headers are attributes of the request in a worker, an eager call only has them in the headers
+        key = self.request.get(IDEMPOTENCY_HEADER) or (self.request.headers or {}).get(IDEMPOTENCY_HEADER)
+        if key is None:
+            # the call did not claim a key, e.g. it was sent by name
+            return
+        try:
+            get_task_keys().finish(key, task_id, ok=status == states.SUCCESS)
+        except Exception as e:
+            logger.warning(f"Could not finish the idempotency key of {self.name}[{task_id}]: {e}")
+
+    def invalidate(self, *args: Any, **kwargs: Any) -> int:
+        """
+        Stop sharing the result of an identical call with the default routing, or of all calls of the task if no
+        arguments are given.
+
+        :param args: Positional arguments of the call.
+        :param kwargs: Keyword arguments of the call.
+        :return: Number of invalidated calls.
+        """
+
+        if not args and not kwargs:
+            return get_task_keys().invalidate(task=self.name)
+        return get_task_keys().invalidate(key=self.idempotency_key(args, kwargs))
+
+    @classmethod
+    def _get_runtime(cls) -> tuple[asyncio.AbstractEventLoop, ConnectionPool]:
+        with BaseTask._runtime_lock:
+            # prefork children inherit the state of the parent, but not its threads
+            if BaseTask._runtime_pid != os.getpid():
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="routeros-loop", daemon=True).start()
+                BaseTask._loop = loop
+                BaseTask._pool = ConnectionPool(max_connections_per_device=settings.routeros_pool_max_connections_per_device,
+                                                idle_timeout=settings.routeros_pool_idle_timeout,
+                                                health_check_interval=settings.routeros_pool_health_check_interval,
+                                                reconnect_attempts=settings.routeros_pool_reconnect_attempts,
+                                                reconnect_backoff=settings.routeros_pool_reconnect_backoff,
+                                                reconnect_backoff_max=settings.routeros_pool_reconnect_backoff_max,
+                                                connect_timeout=settings.routeros_connect_timeout,
+                                                timeout=settings.routeros_timeout)
+                BaseTask._runtime_pid = os.getpid()
+                loop.call_soon_threadsafe(sample_pool, BaseTask._pool, settings.worker_metrics_interval)
+            return BaseTask._loop, BaseTask._pool
+
+    @property
+    def pool(self) -> ConnectionPool:
+        """
+        The RouterOS connection pool of the current worker process.
+        It may only be used from coroutines passed to run_async.
+        """
+
+        return self._get_runtime()[1]
+
+    @property
+    def inventory(self) -> Inventory:
+        """
+        The inventory cache of the current worker process.
+        """
+
+        with BaseTask._runtime_lock:
+            if BaseTask._inventory is None or BaseTask._inventory[0] != os.getpid():
+                BaseTask._inventory = (os.getpid(), Inventory(session_maker=db().session_maker,
+                                                              publish=publish_inventory_deltas,
+                                                              last_seen_interval=settings.inventory_last_seen_interval))
+            return BaseTask._inventory[1]
+
+    @property
+    def metrics(self) -> MetricCollector:
+        """
+        The metric collector of the current worker process.
+        """
+
+        with BaseTask._runtime_lock:
+            if BaseTask._metrics is None or BaseTask._metrics[0] != os.getpid():
+                BaseTask._metrics = (os.getpid(), MetricCollector(store=get_metric_store()))
+            return BaseTask._metrics[1]
+
+    @property
+    def status_writer(self) -> StatusWriter | None:
+        """
+        The device status writer of the current worker process, or None if the database has no async engine.
+        It may only be used from coroutines passed to run_async.
+        """
+
+        with BaseTask._runtime_lock:
+            if BaseTask._status_writer is None or BaseTask._status_writer[0] != os.getpid():
+                try:
+                    writer = StatusWriter(session_maker=async_session_maker(),
+                                          batch_size=settings.db_status_batch_size,
+                                          interval=settings.db_status_interval,
+                                          max_attempts=settings.db_status_max_attempts,
+                                          publish=publish_inventory_deltas)
+                except RuntimeError as e:
+                    logger.warning(f"The device status is not written: {e}")
+                    writer = None
+                BaseTask._status_writer = (os.getpid(), writer)
+            return BaseTask._status_writer[1]
+
+    def submit_async(self, coro: Coroutine[Any, Any, T]) -> Future[T]:
+        """
+        Schedule a coroutine on the event loop of the current worker process.
+
+        :param coro: Coroutine to run.
+        :return: Future of the result.
+        """
+
+        loop, _ = self._get_runtime()
+        return asyncio.run_coroutine_threadsafe(coro, loop)
+
+    def run_async(self, coro: Coroutine[Any, Any, T], timeout: float | None = None) -> T:
+        """
+        Run a coroutine on the event loop of the current worker process and wait for its result.
+
+        :param coro: Coroutine to run.
+        :param timeout: Timeout in seconds. If None, wait forever.
+        :return: The result of the coroutine.
+        """
+
+        return self.submit_async(coro).result(timeout)
+
+    def consume_async(self,
+                      produce: Callable[[Callable[[Any], None]], Coroutine[Any, Any, T]],
+                      consume: Callable[[Any], None],
+                      page_size: int | None = None,
+                      tick: Callable[[], None] | None = None,
+                      discard: Callable[[Any], None] | None = None,
+                      interval: float = 0.1,
+                      cancel_timeout: float = 10.0) -> T:
+        """
+        Run a coroutine producing items on the event loop of the current worker process and consume the items in the
+        task thread, so the event loop is not blocked by the consumer, e.g. by the database or the disk.
+        If the consumer fails, the coroutine is cancelled and the items left are discarded.
+
+        :param produce: Called with the function queueing an item, returns the coroutine.
+        :param consume: Called with every item, or with pages of up to page_size items.
+        :param page_size: Number of items passed to consume at once. If None, every item is passed on its own.
+        :param tick: Called after every round of at most interval seconds, e.g. to check for control requests.
+        :param discard: Called with every item left after a failure, e.g. to remove its files.
+        :param interval: Maximum seconds to wait for an item.
+        :param cancel_timeout: Maximum seconds to wait for the cancelled coroutine before discarding the items.
+        :return: The result of the coroutine.
+        """
+
+        items: queue.SimpleQueue[Any] = queue.SimpleQueue()
+        stopped = threading.Event()
+
+        async def run() -> T:
+            try:
+                return await produce(items.put)
+            finally:
+                stopped.set()
+
+        future = self.submit_async(run())
+        try:
+            while not future.done() or not items.empty():
+                page = []
+                try:
+                    page.append(items.get(timeout=interval))
+                    while page_size is not None and len(page) < page_size:
+                        page.append(items.get_nowait())
+                except queue.Empty:
+                    pass
+                if page:
+                    consume(page if page_size is not None else page[0])
+                if tick is not None:
+                    tick()
+        except BaseException:
+            future.cancel()
+            # the items queued until the coroutine stops are discarded as well
+            stopped.wait(cancel_timeout)
+            while discard is not None and not items.empty():
+                try:
+                    discard(items.get_nowait())
+                except Exception as e:
+                    logger.warning(f"Could not discard an item of {self.name}: {e}")
+            raise
+        return future.result()
+
+    def stream(self, items: Any) -> int:
+        """
+        Push a partial result of the current task to its result stream.
+
+        :param items: JSON serializable partial result.
+        :return: Sequence number of the chunk.
+        """
+
+        from mikrotik_manager.results import get_result_stream
+
+        return get_result_stream().push(self.request.id, items)
+
+    @classmethod
+    def shutdown_runtime(cls) -> None:
+        """
+        Close all pooled sessions and stop the event loop of the current worker process.
+
+        :return: None
+        """
+
+        with BaseTask._runtime_lock:
+            if BaseTask._runtime_pid != os.getpid():
+                return
+            loop, pool = BaseTask._loop, BaseTask._pool
+            BaseTask._runtime_pid, BaseTask._loop, BaseTask._pool = None, None, None
+            writer = BaseTask._status_writer[1] if BaseTask._status_writer is not None and \
+                                                   BaseTask._status_writer[0] == os.getpid() else None
+            BaseTask._status_writer = None
+        if writer is not None:
+            try:
+                asyncio.run_coroutine_threadsafe(writer.close(), loop).result(10)
+            except Exception as e:
+                logger.warning(f"{writer} could not write the pending device status: {e}")
+        asyncio.run_coroutine_threadsafe(pool.close(), loop).result(10)
+        loop.call_soon_threadsafe(loop.stop)
+
+
+@worker_process_init.connect
+@worker_ready.connect
+def _start_settings_watcher(**_) -> None:
+    # worker_process_init for the prefork children, worker_ready for the process running the tasks of the other pools
+    settings_watcher.start()
+
+
+@worker_process_shutdown.connect
+def _shutdown_runtime(**_) -> None:
+    BaseTask.shutdown_runtime()
+    mark_process_dead()
+
+
+@task_prerun.connect
+def _task_prerun(task_id: str, **_) -> None:
+    task_started(task_id)
+
+
+@task_postrun.connect
+def _task_postrun(task_id: str, task: Any, state: str | None = None, **_) -> None:
+    task_finished(task_id, task.name, state)
@@ -0,0 +1,190 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable
+
+from celery.utils.log import get_task_logger
+from sqlalchemy import select
+
+from mikrotik_manager.db import Device, db
+from mikrotik_manager.device_status import StatusWriter
+from mikrotik_manager.routeros.pool import ConnectionPool, DeviceAddress
+from mikrotik_manager.settings import settings
+from mikrotik_manager.tasks.base import BaseTask
+from mikrotik_manager.telemetry import DEVICE_POLLS, DEVICE_RTT
+from mikrotik_manager.worker import celery_app
+
+logger = get_task_logger(__name__)
+
+
+def device_address(device: dict[str, Any]) -> DeviceAddress:
+    """
+    Get the address of a device from its task representation.
+
+    :param device: Device with 'host' and optional 'port', 'username', 'password' and 'tls'.
+    :return: DeviceAddress
+    :raises ValueError: If the device has no host, e.g. because it does not exist anymore.
+    """
+
+    if "host" not in device:
+        raise ValueError(f"Device {device.get('id')} does not exist.")
+    return DeviceAddress(host=device["host"],
+                         port=device.get("port"),
+                         username=device.get("username", "admin"),
+                         password=device.get("password", ""),
+                         tls=device.get("tls", False))
+
+
+def load_devices(device_ids: list[int], chunk_size: int = 500) -> list[dict[str, Any]]:
+    """
+    Load the addresses of devices from the database. The tasks get device IDs only, so the credentials are never
+    sent through the broker.
+
+    :param device_ids: IDs of the devices.
+    :param chunk_size: Maximum number of IDs per query.
+    :return: Devices with 'id' and the fields of device_address in the order of the IDs. A device which does not
+             exist only has its 'id'.
+    """
+
+    devices = {}
+    with db().session_maker() as session:
+        for i in range(0, len(device_ids), chunk_size):
+            query = (select(Device.id, Device.host, Device.port, Device.username, Device.password, Device.tls)
+                     .where(Device.id.in_(device_ids[i:i + chunk_size])))
+            for row in session.execute(query):
+                devices[row.id] = dict(row._mapping)
+    return [devices.get(device_id, {"id": device_id}) for device_id in device_ids]
+
+
+async def fetch_device_info(pool: ConnectionPool, address: DeviceAddress) -> dict[str, str | None]:
+    """
+    Fetch the basic information of a device.
+
+    :param pool: Connection pool to use.
+    :param address: Address of the device.
+    :return: Hostname, model, serial number and firmware version.
+    """
+
+    async with pool.connection(address) as api:
+        identity = await api.talk("/system/identity/print")
+        resource = await api.talk("/system/resource/print")
+        routerboard = await api.talk("/system/routerboard/print")
+    identity = identity[0] if identity else {}
+    resource = resource[0] if resource else {}
+    routerboard = routerboard[0] if routerboard else {}
+    return {"hostname": identity.get("name"),
+            "model": routerboard.get("model", resource.get("board-name")),
+            "serial_number": routerboard.get("serial-number"),
+            "firmware_version": routerboard.get("current-firmware"),
+            "version": resource.get("version")}
+
+
+async def poll_devices(pool: ConnectionPool,
+                       devices: list[dict[str, Any]],
+                       concurrency: int,
+                       page_size: int,
+                       on_page: Callable[[list[dict[str, Any]]], None] | None = None,
+                       fetch: Callable[[ConnectionPool, DeviceAddress], Awaitable[Any]] = fetch_device_info,
+                       status: StatusWriter | None = None) -> dict[str, Any]:
+    """
+    Fetch the basic information (or anything else fetched by fetch) of many devices concurrently.
+    A failing device is reported in its result and does not fail the others.
+    The results themselves are only passed to on_page, the summary keeps the poll duration and the error by device.
+
+    :param pool: Connection pool to use.
+    :param devices: Devices with 'id' and the fields of device_address.
+    :param concurrency: Maximum number of devices polled at the same time.
+    :param page_size: Number of results per page passed to on_page.
+    :param on_page: Called with every full page of results and with the last partial page, also if the poll is
+                    cancelled.
+    :param fetch: Coroutine function fetching the 'info' of one device.
+    :param status: Writer of the device status. If None, the status is not written.
+    :return: Summary with the counts, the 'rtts' of the successful devices and the 'errors' of the failed devices
+             as lists of ID and value.
+    """
+
+    semaphore = asyncio.Semaphore(concurrency)
+    rtts: list[tuple[Any, float]] = []
+    errors: list[tuple[Any, str]] = []
+    page: list[dict[str, Any]] = []
+
+    async def poll(device: dict[str, Any]) -> None:
+        nonlocal page
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                info = await fetch(pool, device_address(device))
+                result = {"id": device.get("id"), "ok": True, "info": info, "rtt": time.perf_counter() - start}
+                DEVICE_RTT.observe(result["rtt"])
+            except Exception as e:
+                # whatever goes wrong with one device, the others are still polled
+                result = {"id": device.get("id"), "ok": False, "error": f"{e.__class__.__name__}: {e}"}
+            DEVICE_POLLS.labels(result="ok" if result["ok"] else "failed").inc()
+            if status is not None and result["id"] is not None:
+                status.put(result["id"],
+                           status="online" if result["ok"] else "offline",
+                           rtt=result.get("rtt"),
+                           error=result.get("error"))
+        if result["ok"]:
+            rtts.append((result["id"], result["rtt"]))
+        else:
+            errors.append((result["id"], result["error"]))
+        page.append(result)
+        if len(page) >= page_size:
+            full_page, page = page, []
+            if on_page is not None:
+                on_page(full_page)
+
+    try:
+        await asyncio.gather(*(poll(device) for device in devices))
+    finally:
+        # a cancelled poll passes the results it has as well, e.g. so their files are removed
+        if page and on_page is not None:
+            on_page(page)
+
+    return {"total": len(rtts) + len(errors),
+            "succeeded": len(rtts),
+            "failed": len(errors),
+            "rtts": rtts,
+            "errors": errors}
+
+
+@celery_app.task(name="fetch_device_info_batch", bind=True, idempotent=True)
+def fetch_device_info_batch(self: BaseTask,
+                            device_ids: list[int],
+                            concurrency: int | None = None,
+                            page_size: int | None = None,
+                            update_inventory: bool = True) -> dict[str, Any]:
+    """
+    Fetch the basic information of a chunk of devices in one worker process.
+    Results are pushed in pages to the result stream of the task, the progress is reported as 'PROGRESS' state.
+
+    :param device_ids: IDs of the devices.
+    :param concurrency: Maximum number of devices polled at the same time. If None, the setting is used.
+    :param page_size: Number of results per progress update. If None, the setting is used.
+    :param update_inventory: Write changed device information to the inventory.
+    :return: Summary of poll_devices.
+    """
+
+    devices = load_devices(device_ids)
+    total = len(devices)
+    done = 0
+
+    def publish(page: list[dict[str, Any]]) -> None:
+        nonlocal done
+        done += len(page)
+        if update_inventory:
+            self.inventory.apply({result["id"]: result["info"] for result in page if result["ok"]})
+        seq = self.stream(page)
+        self.update_state(state="PROGRESS", meta={"done": done, "total": total, "seq": seq})
+
+    logger.debug(f"Polling {total} devices.")
+    # publishing the pages from the task thread, so the event loop is not blocked by the result backend
+    summary = self.consume_async(lambda on_page: poll_devices(pool=self.pool,
+                                                              devices=devices,
+                                                              concurrency=concurrency or settings.worker_batch_concurrency,
+                                                              page_size=page_size or settings.worker_batch_page_size,
+                                                              on_page=on_page,
+                                                              status=self.status_writer if update_inventory else None),
+                                 consume=publish)
+    logger.debug(f"Polled {summary['total']} devices, {summary['failed']} failed.")
+    return summary
@@ -0,0 +1,230 @@
+import asyncio
+import inspect
+import time
+from pathlib import Path
+from typing import Any, Awaitable, Callable, get_type_hints
+
+from celery.utils.log import get_task_logger
+from pydantic import TypeAdapter, ValidationError
+
+from mikrotik_manager.backups import get_backup_store
+from mikrotik_manager.jobs import TokenBucket, WaveRunner, get_job_bucket, get_job_store
+from mikrotik_manager.routeros.api import RouterOsConnectionError
+from mikrotik_manager.routeros.pool import ConnectionPool
+from mikrotik_manager.settings import settings
+from mikrotik_manager.tasks.backups import fetch_backup
+from mikrotik_manager.tasks.base import BaseTask
+from mikrotik_manager.tasks.devices import device_address, fetch_device_info_batch
+from mikrotik_manager.worker import celery_app
+
+logger = get_task_logger(__name__)
+
+
+async def reboot(pool: ConnectionPool, device: dict[str, Any]) -> None:
+    """
+    Reboot a device.
+
+    :param pool: Connection pool to use.
+    :param device: Device with 'id' and the fields of device_address.
+    :return: None
+    """
+
+    async with pool.connection(device_address(device)) as api:
+        try:
+            await api.talk("/system/reboot")
+        except RouterOsConnectionError:
+            # the device may close the session before confirming the reboot
+            pass
+        await api.close()
+
+
+async def upgrade(pool: ConnectionPool, device: dict[str, Any], channel: str | None = None) -> None:
+    """
+    Install the latest RouterOS version on a device, which reboots it. Nothing is done if it is up to date.
+
+    :param pool: Connection pool to use.
+    :param device: Device with 'id' and the fields of device_address.
+    :param channel: Update channel, e.g. 'stable'. If None, the channel of the device is used.
+    :return: None
+    """
+
+    async with pool.connection(device_address(device)) as api:
+        if channel is not None:
+            await api.talk("/system/package/update/set", attributes={"channel": channel})
+        # the check reports its progress, the last reply holds the result
+        replies = await api.talk("/system/package/update/check-for-updates")
+        status = replies[-1] if replies else {}
+        if "latest-version" not in status:
+            raise ValueError(f"No update information: {status.get('status', 'unknown')}")
+        if status["latest-version"] == status.get("installed-version"):
+            return
+        try:
+            await api.talk("/system/package/update/install")
+        except RouterOsConnectionError:
+            pass
+        await api.close()
+
+
+async def backup(pool: ConnectionPool, device: dict[str, Any], binary: bool | None = None) -> None:
+    """
+    Back up the configuration of a device into the backup store.
+
+    :param pool: Connection pool to use.
+    :param device: Device with 'id' and the fields of device_address.
+    :param binary: Also store a binary backup. If None, the setting is used.
+    :return: None
+    """
+
+    store = get_backup_store()
+    paths = await fetch_backup(pool,
+                               device_address(device),
+                               temp_file=store.temp_file,
+                               binary=settings.backup_binary if binary is None else binary,
+                               show_sensitive=settings.backup_show_sensitive,
+                               chunk_size=settings.backup_read_chunk_size)
+    try:
+        for kind, path in paths.items():
+            await asyncio.to_thread(store.add, device["id"], Path(path), kind)
+    finally:
+        for path in paths.values():
+            Path(path).unlink(missing_ok=True)
+
+
+# actions a job can run, called with the pool, the device and the parameters of the job
+ACTIONS: dict[str, Callable[..., Awaitable[Any]]] = {"reboot": reboot,
+                                                     "upgrade": upgrade,
+                                                     "backup": backup}
+
+
+def validate_params(action: str, params: dict[str, Any]) -> dict[str, Any]:
+    """
+    Validate the parameters of a job against the signature of its action.
+
+    :param action: Name of the action.
+    :param params: Parameters passed to the action.
+    :return: Parameters converted to the types of the action.
+    :raises ValueError: If the action is unknown or the parameters do not match its signature.
+    """
+
+    if action not in ACTIONS:
+        raise ValueError(f"Unknown action '{action}'.")
+    function = ACTIONS[action]
+    hints = get_type_hints(function)
+    # the pool and the device are passed by the runner
+    parameters = list(inspect.signature(function).parameters.values())[2:]
+    unknown = sorted(params.keys() - {parameter.name for parameter in parameters})
+    if unknown:
+        raise ValueError(f"Unknown parameters of action '{action}': {', '.join(unknown)}.")
+    missing = [parameter.name for parameter in parameters
+               if parameter.default is inspect.Parameter.empty and parameter.name not in params]
+    if missing:
+        raise ValueError(f"Missing parameters of action '{action}': {', '.join(missing)}.")
+    validated = {}
+    for name, value in params.items():
+        try:
+            validated[name] = TypeAdapter(hints.get(name, Any)).validate_python(value)
+        except ValidationError as e:
+            raise ValueError(f"Invalid parameter '{name}' of action '{action}': {e.errors()[0]['msg']}.")
+    return validated
+
+
+@celery_app.task(name="run_job", bind=True)
+def run_job(self: BaseTask, job_id: int) -> dict[str, Any]:
+    """
+    Run a queued job wave by wave until it is finished, paused or aborted. A wave is completed before the next one
+    starts. If too many devices of a wave fail, the job is paused. The lease of the job is renewed while checking
+    for control requests, if it was lost the runner stops without ending the job.
+
+    :param job_id: ID of the job.
+    :return: Progress of the job.
+    """
+
+    store = get_job_store()
+    job = store.claim(job_id)
+    if job is None:
+        logger.warning(f"Job {job_id} is not queued.")
+        return store.progress(job_id)
+    runner_id = job["runner"]
+    try:
+        params = validate_params(job["action"], job["params"])
+    except ValueError as e:
+        store.finish(job_id, "aborted", str(e), runner=runner_id)
+        return store.progress(job_id)
+
+    def action(device: dict[str, Any]) -> Awaitable[Any]:
+        return ACTIONS[job["action"]](self.pool, device, **params)
+
+    def check() -> str | None:
+        # renewing the lease, a runner which lost it must not touch the job anymore
+        return store.control(job_id) if store.renew(job_id, runner_id) else "lost"
+
+    bucket = TokenBucket(rate=job["rate"], burst=job["burst"])
+    control = None
+    message = None
+    waves = store.pending(job_id)
+    for i, (wave, devices) in enumerate(waves):
+        control = check()
+        if control is not None:
+            break
+
+        logger.debug(f"Running job {job_id} '{job['action']}' on {len(devices)} devices of wave {wave}.")
+        runner = WaveRunner(action=action,
+                            concurrency=job["concurrency"],
+                            site_concurrency=job["site_concurrency"],
+                            bucket=bucket,
+                            shared_bucket=get_job_bucket())
+        failed = 0
+        checked = time.monotonic()
+
+        def record(page: list[dict[str, Any]]) -> None:
+            nonlocal failed
+            store.record(job_id, page)
+            failed += sum(1 for result in page if not result["ok"])
+
+        def tick() -> None:
+            nonlocal checked, control
+            if control is None and time.monotonic() - checked >= settings.jobs_control_interval:
+                checked = time.monotonic()
+                control = check()
+                if control is not None:
+                    runner.stop()
+
+        # recording the results and checking for control requests from the task thread, so the event loop is
+        # not blocked by the database
+        self.consume_async(lambda on_result: runner.run(devices, on_result=on_result),
+                           consume=record,
+                           page_size=settings.worker_batch_page_size,
+                           tick=tick)
+        self.update_state(state="PROGRESS", meta={"wave": wave, "waves": len(waves)})
+        if control is not None:
+            break
+        if failed > job["max_failure_ratio"] * len(devices):
+            control = "pause"
+            message = f"{failed} of {len(devices)} devices of wave {wave} failed."
+            break
+
+        # waiting between the waves, a control request ends the wait
+        if i + 1 < len(waves) and job["wave_interval"]:
+            deadline = time.monotonic() + job["wave_interval"]
+            while control is None and time.monotonic() < deadline:
+                time.sleep(min(settings.jobs_control_interval, max(0.0, deadline - time.monotonic())))
+                control = check()
+            if control is not None:
+                break
+
+    # a request arriving after the last wave is too late
+    control = control or check()
+    if control == "lost":
+        logger.warning(f"Job {job_id} was taken from its runner.")
+    elif not store.progress(job_id)["counts"]["pending"]:
+        store.finish(job_id, "finished", message, runner=runner_id)
+    elif control == "abort":
+        store.finish(job_id, "aborted", message, runner=runner_id)
+    else:
+        store.finish(job_id, "paused", message, runner=runner_id)
+    if job["action"] in ("reboot", "upgrade"):
+        # the shared device information of the changed devices is outdated
+        fetch_device_info_batch.invalidate()
+    progress = store.progress(job_id)
+    logger.debug(f"Job {job_id} {progress['state']}, {progress['done']} of {progress['total']} devices done.")
+    return progress
@@ -0,0 +1,62 @@
+from datetime import datetime, timedelta, timezone
+
+from celery.utils.log import get_task_logger
+from sqlalchemy import delete
+
+from mikrotik_manager.backups import get_backup_store
+from mikrotik_manager.db import DeviceEvent, db
+from mikrotik_manager.results import get_result_stream, get_task_keys
+from mikrotik_manager.settings import settings
+from mikrotik_manager.timeseries import get_metric_store
+from mikrotik_manager.worker import celery_app
+
+logger = get_task_logger(__name__)
+
+
+@celery_app.task(name="cleanup_result_streams")
+def cleanup_result_streams() -> int:
+    deleted = get_result_stream().cleanup()
+    logger.debug(f"Deleted {deleted} expired result stream chunks.")
+    return deleted
+
+
+@celery_app.task(name="cleanup_task_keys")
+def cleanup_task_keys() -> int:
+    # the cache ttl of a task may be longer than the setting
+    ttl = max([settings.task_cache_ttl, *(task.cache_ttl or 0 for task in celery_app.tasks.values()
+                                          if getattr(task, "idempotent", False))])
+    deleted = get_task_keys().cleanup(ttl=ttl)
+    logger.debug(f"Deleted {deleted} expired idempotency keys.")
+    return deleted
+
+
+@celery_app.task(name="cleanup_metrics")
+def cleanup_metrics() -> int:
+    deleted = get_metric_store().cleanup()
+    logger.debug(f"Deleted {deleted} expired metric blocks.")
+    return deleted
+
+
+@celery_app.task(name="compact_metrics")
+def compact_metrics() -> int:
+    merged = get_metric_store().compact()
+    logger.debug(f"Merged {merged} metric samples into their blocks.")
+    return merged
+
+
+@celery_app.task(name="cleanup_backups")
+def cleanup_backups() -> int:
+    deleted = get_backup_store().cleanup(retention=settings.backup_retention * 86400)
+    logger.debug(f"Deleted {deleted} expired backup versions.")
+    return deleted
+
+
+@celery_app.task(name="cleanup_device_events")
+def cleanup_device_events() -> int:
+    if not settings.listener_event_retention:
+        return 0
+    before = datetime.now(timezone.utc) - timedelta(days=settings.listener_event_retention)
+    with db().session_maker() as session, session.begin():
+        deleted = session.execute(delete(DeviceEvent).where(DeviceEvent.time < before)).rowcount
+    logger.debug(f"Deleted {deleted} expired device events.")
+    return deleted
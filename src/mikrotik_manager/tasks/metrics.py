@@ -0,0 +1,79 @@
+import time
+from typing import Any
+
+from celery.utils.log import get_task_logger
+
+from mikrotik_manager.routeros.pool import ConnectionPool, DeviceAddress
+from mikrotik_manager.settings import settings
+from mikrotik_manager.tasks.base import BaseTask
+from mikrotik_manager.tasks.devices import load_devices, poll_devices
+from mikrotik_manager.worker import celery_app
+
+logger = get_task_logger(__name__)
+
+
+async def fetch_metrics(pool: ConnectionPool, address: DeviceAddress) -> dict[str, Any]:
+    """
+    Fetch the CPU and memory usage and the traffic counters of all enabled interfaces of a device.
+
+    :param pool: Connection pool to use.
+    :param address: Address of the device.
+    :return: Unix 'timestamp', 'gauges' and 'counters' by series name. Traffic counters are in bits.
+    """
+
+    async with pool.connection(address) as api:
+        resource = await api.talk("/system/resource/print")
+        interfaces = await api.talk("/interface/print")
+    timestamp = time.time()
+    resource = resource[0] if resource else {}
+    gauges = {}
+    if "cpu-load" in resource:
+        gauges["cpu_load"] = float(resource["cpu-load"])
+    if "total-memory" in resource and "free-memory" in resource:
+        gauges["memory_used"] = float(int(resource["total-memory"]) - int(resource["free-memory"]))
+        gauges["memory_total"] = float(resource["total-memory"])
+    counters = {}
+    for interface in interfaces:
+        if interface.get("disabled") == "true" or "name" not in interface:
+            continue
+        if "rx-byte" in interface:
+            counters[f"interface/{interface['name']}/rx_bps"] = int(interface["rx-byte"]) * 8.0
+        if "tx-byte" in interface:
+            counters[f"interface/{interface['name']}/tx_bps"] = int(interface["tx-byte"]) * 8.0
+    return {"timestamp": timestamp, "gauges": gauges, "counters": counters}
+
+
+@celery_app.task(name="collect_metrics_batch", bind=True, idempotent=True)
+def collect_metrics_batch(self: BaseTask,
+                          device_ids: list[int],
+                          concurrency: int | None = None,
+                          page_size: int | None = None) -> dict[str, Any]:
+    """
+    Collect the metrics of a chunk of devices in one worker process. The samples of every page are written in bulk.
+
+    :param device_ids: IDs of the devices.
+    :param concurrency: Maximum number of devices polled at the same time. If None, the setting is used.
+    :param page_size: Number of devices per bulk write. If None, the setting is used.
+    :return: Summary of poll_devices with the number of written samples.
+    """
+
+    written = 0
+
+    def publish(page: list[dict[str, Any]]) -> None:
+        nonlocal written
+        written += self.metrics.apply({result["id"]: result["info"] for result in page if result["ok"]})
+
+    devices = load_devices(device_ids)
+    # writing the pages from the task thread, so the event loop is not blocked by the database
+    summary = self.consume_async(lambda on_page: poll_devices(pool=self.pool,
+                                                              devices=devices,
+                                                              concurrency=concurrency or settings.worker_batch_concurrency,
+                                                              page_size=page_size or settings.worker_batch_page_size,
+                                                              on_page=on_page,
+                                                              fetch=fetch_metrics,
+                                                              status=self.status_writer),
+                                 consume=publish)
+    summary["samples"] = written
+    logger.debug(f"Collected {written} samples of {summary['total']} devices, {summary['failed']} failed.")
+    return summary
+
@@ -0,0 +1,223 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from typing import Any, Iterator
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, \
+    generate_latest, multiprocess, start_http_server
+from prometheus_client.core import GaugeMetricFamily
+from prometheus_client.registry import Collector
+
+from mikrotik_manager.settings import MULTIPROCESS_ENV, settings
+
+logger = logging.getLogger(__name__)
+
+TASK_DURATION = Histogram("mikrotik_manager_task_duration_seconds",
+                          "Duration of the tasks.",
+                          ["task"],
+                          buckets=(0.01, 0.05, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0))
+TASKS = Counter("mikrotik_manager_tasks",
+                "Finished tasks.",
+                ["task", "state"])
+DEVICE_RTT = Histogram("mikrotik_manager_device_rtt_seconds",
+                       "Duration of the successful device polls.",
+                       buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0))
+DEVICE_POLLS = Counter("mikrotik_manager_device_polls",
+                       "Device polls.",
+                       ["result"])
+POOL_SESSIONS = Gauge("mikrotik_manager_pool_sessions",
+                      "RouterOS API sessions of the connection pools.",
+                      ["state"],
+                      multiprocess_mode="livesum")
+POOL_DEVICES = Gauge("mikrotik_manager_pool_devices",
+                     "Devices known to the connection pools.",
+                     multiprocess_mode="livesum")
+POOL_CAPACITY = Gauge("mikrotik_manager_pool_capacity",
+                      "Maximum number of sessions to the known devices of the connection pools.",
+                      multiprocess_mode="livesum")
+PAGE_RENDER_DURATION = Histogram("mikrotik_manager_page_render_seconds",
+                                 "Time to build a UI page.",
+                                 ["path"],
+                                 buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0))
+
+
+def broker_queues() -> list[str]:
+    """
+    Get the names of the broker queues the tasks are sent to.
+
+    :return: Queue names.
+    """
+
+    from mikrotik_manager.worker import QUEUES
+
+    return [*QUEUES, *(f"{queue}.{node}" for node in settings.scheduler_nodes for queue in QUEUES if queue != "interactive")]
+
+
+class QueueDepthCollector(Collector):
+    def __init__(self, timeout: float = 1.0, max_age: float = 10.0):
+        """
+        Collect the number of waiting messages of the broker queues. The connection to the broker is kept open and
+        the depths are sampled at most every max_age seconds, so frequent scrapes do not load the broker.
+
+        :param timeout: Timeout in seconds for connecting to the broker.
+        :param max_age: Seconds the sampled depths are reused for.
+        """
+
+        self.timeout = timeout
+        self.max_age = max_age
+
+        self._lock = threading.Lock()
+        self._connection: Any = None
+        self._depths: dict[str, int] = {}
+        self._sampled: float | None = None
+
+    def _sample(self) -> dict[str, int]:
+        from mikrotik_manager.worker import celery_app
+
+        if self._connection is None:
+            self._connection = celery_app.connection_for_read(connect_timeout=self.timeout)
+        connection = self._connection
+        # connecting again only if the connection was lost
+        connection.connect()
+        depths = {}
+        for queue in broker_queues():
+            # a failing passive declare closes the channel, so every queue gets its own
+            with connection.channel() as channel:
+                try:
+                    _, depths[queue], _ = channel.queue_declare(queue=queue, passive=True)
+                except connection.channel_errors:
+                    continue
+        return depths
+
+    def collect(self) -> Iterator[GaugeMetricFamily]:
+        family = GaugeMetricFamily("mikrotik_manager_queue_depth",
+                                   "Messages waiting in the broker queues.",
+                                   labels=["queue"])
+        with self._lock:
+            if self._sampled is None or time.monotonic() - self._sampled >= self.max_age:
+                # a failed sample is not repeated before max_age either, an unreachable broker would block every scrape
+                self._sampled = time.monotonic()
+                try:
+                    self._depths = self._sample()
+                except Exception as e:
+                    logger.debug(f"Could not collect the queue depths: {e}")
+                    self._depths = {}
+                    if self._connection is not None:
+                        self._connection.release()
+                        self._connection = None
+            depths = self._depths
+        for queue, count in depths.items():
+            family.add_metric([queue], count)
+        yield family
+
+
+_registry: CollectorRegistry | None = None
+
+
+def get_registry() -> CollectorRegistry:
+    """
+    Get the registry of the current process. If the multiprocess directory is set, the samples of all processes
+    writing to it are collected.
+
+    :return: CollectorRegistry
+    """
+
+    global _registry
+
+    if _registry is None:
+        if os.environ.get(MULTIPROCESS_ENV):
+            _registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(_registry)
+        else:
+            _registry = REGISTRY
+        _registry.register(QueueDepthCollector())
+    return _registry
+
+
+def latest() -> tuple[bytes, str]:
+    """
+    Get the current samples in the Prometheus text format.
+
+    :return: Samples and their content type.
+    """
+
+    return generate_latest(get_registry()), CONTENT_TYPE_LATEST
+
+
+def start_server(port: int) -> bool:
+    """
+    Serve the samples on a port in a background thread.
+
+    :param port: Port to listen on.
+    :return: False if the port could not be bound, e.g. because it is already in use.
+    """
+
+    try:
+        start_http_server(port, registry=get_registry())
+    except OSError as e:
+        logger.error(f"Could not serve metrics on port {port}: {e}")
+        return False
+    logger.debug(f"Serving metrics on port {port}.")
+    return True
+
+
+# started tasks by task ID, only the tasks of the current process
+_task_starts: dict[str, float] = {}
+
+
+def task_started(task_id: str) -> None:
+    """
+    Record the start of a task.
+
+    :param task_id: ID of the task.
+    :return: None
+    """
+
+    _task_starts[task_id] = time.perf_counter()
+
+
+def task_finished(task_id: str, task: str, state: str | None) -> None:
+    """
+    Record the end of a task.
+
+    :param task_id: ID of the task.
+    :param task: Name of the task.
+    :param state: Final state of the task.
+    :return: None
+    """
+
+    start = _task_starts.pop(task_id, None)
+    if start is not None:
+        TASK_DURATION.labels(task=task).observe(time.perf_counter() - start)
+    TASKS.labels(task=task, state=state or "UNKNOWN").inc()
+
+
+def sample_pool(pool: Any, interval: float) -> None:
+    """
+    Sample the state of a connection pool now and every interval. It has to be called on the event loop of the pool.
+
+    :param pool: ConnectionPool to sample.
+    :param interval: Seconds between two samples.
+    :return: None
+    """
+
+    stats = pool.stats
+    POOL_SESSIONS.labels(state="in_use").set(stats["in_use"])
+    POOL_SESSIONS.labels(state="idle").set(stats["idle"])
+    POOL_DEVICES.set(stats["devices"])
+    POOL_CAPACITY.set(stats["devices"] * stats["max_connections_per_device"])
+    # a timer instead of a task, so stopping the loop leaves nothing pending behind
+    asyncio.get_running_loop().call_later(interval, sample_pool, pool, interval)
+
+
+def mark_process_dead() -> None:
+    """
+    Remove the live samples of the current process from the multiprocess directory, e.g. when it shuts down.
+
+    :return: None
+    """
+
+    if os.environ.get(MULTIPROCESS_ENV):
+        multiprocess.mark_process_dead(os.getpid())
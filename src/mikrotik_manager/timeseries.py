@@ -0,0 +1,489 @@
+import logging
+import math
+import sys
+import time
+import zlib
+from array import array
+from collections import defaultdict
+from dataclasses import dataclass
+from functools import cache
+from typing import Any, Iterable
+
+from sqlalchemy import and_, delete, insert, or_, select
+from sqlalchemy.orm import sessionmaker
+
+from mikrotik_manager.db import db, MetricBlock, MetricCounter, MetricSample, MetricSeries
+from mikrotik_manager.device_status import upsert
+from mikrotik_manager.settings import settings
+
+logger = logging.getLogger(__name__)
+
+# device ID, series name, unix timestamp and value
+Sample = tuple[int, str, float, float]
+
+
+@dataclass(frozen=True, slots=True)
+class Resolution:
+    name: str
+    step: int  # seconds per slot
+    slots: int  # slots per block
+
+    @property
+    def span(self) -> int:
+        return self.step * self.slots
+
+    def block_start(self, timestamp: float) -> int:
+        return int(timestamp // self.span * self.span)
+
+    def slot(self, timestamp: float) -> int:
+        return int(timestamp % self.span // self.step)
+
+
+# every sample is aggregated into all resolutions at once, so no rollup job has to scan raw samples
+RESOLUTIONS = {"1m": Resolution("1m", 60, 1440),
+               "1h": Resolution("1h", 3600, 720),
+               "1d": Resolution("1d", 86400, 366)}
+
+
+# column of each aggregate within a block
+AGGREGATES = {"avg": 1, "min": 2, "max": 3}
+
+
+class Block:
+    __slots__ = ("slots", "values")
+
+    def __init__(self, slots: int, values: array | None = None):
+        """
+        Aggregates of the slots of one block, stored as four packed columns: count, mean, minimum and maximum.
+        Slots without samples are NaN, so ranges of slots can be returned as slices without touching every value.
+
+        :param slots: Number of slots.
+        :param values: Packed columns. If None, the block is empty.
+        """
+
+        self.slots = slots
+        self.values = values if values is not None else array("d", [0.0]) * slots + array("d", [math.nan]) * (slots * 3)
+
+    @classmethod
+    def decode(cls, slots: int, data: bytes, columns: Iterable[int] = range(4)) -> "Block":
+        """
+        Decode a block. Every column is stored as a flag byte telling whether it is compressed, its length and its
+        data, so a query only has to decompress the columns it needs.
+
+        :param slots: Number of slots.
+        :param data: Encoded block.
+        :param columns: Columns to decode, the others are NaN.
+        :return: Block
+        """
+
+        block = cls(slots)
+        data = memoryview(data)
+        offset = 0
+        for column in range(4):
+            length = int.from_bytes(data[offset + 1:offset + 5], "little")
+            if column in columns:
+                payload = data[offset + 5:offset + 5 + length]
+                values = array("d")
+                values.frombytes(zlib.decompress(payload) if data[offset] else payload)
+                if sys.byteorder == "big":
+                    values.byteswap()
+                block.values[column * slots:(column + 1) * slots] = values
+            offset += 5 + length
+        return block
+
+    def encode(self, level: int = 6) -> bytes:
+        parts = []
+        for column in range(4):
+            values = self.values[column * self.slots:(column + 1) * self.slots]
+            if sys.byteorder == "big":
+                values.byteswap()
+            data = values.tobytes()
+            # sparse columns compress well, columns of measured values hardly, but would slow down every read
+            compressed = zlib.compress(data, level)
+            flag, payload = (1, compressed) if len(compressed) < len(data) // 2 else (0, data)
+            parts += [flag.to_bytes(1, "little"), len(payload).to_bytes(4, "little"), payload]
+        return b"".join(parts)
+
+    def add(self, slot: int, value: float) -> None:
+        values, slots = self.values, self.slots
+        count = values[slot] + 1
+        values[slot] = count
+        if count == 1:
+            values[slots + slot] = values[2 * slots + slot] = values[3 * slots + slot] = value
+            return
+        values[slots + slot] += (value - values[slots + slot]) / count
+        if value < values[2 * slots + slot]:
+            values[2 * slots + slot] = value
+        if value > values[3 * slots + slot]:
+            values[3 * slots + slot] = value
+
+    def aggregates(self, first: int, last: int, names: Iterable[str] = ("avg", "min", "max")) -> dict[str, array]:
+        """
+        Get the aggregates of a range of slots.
+
+        :param first: First slot.
+        :param last: Last slot, exclusive.
+        :param names: Aggregates to get, 'avg', 'min' and 'max'.
+        :return: Values per slot by aggregate, NaN for slots without samples.
+        """
+
+        return {name: self.values[offset + first:offset + last]
+                for name, offset in ((name, AGGREGATES[name] * self.slots) for name in names)}
+
+
+class MetricStore:
+    def __init__(self, session_maker: sessionmaker, retention: dict[str, float] | None = None, chunk_size: int = 500):
+        """
+        Create a new time series store. Samples are aggregated into blocks of fixed size per series and resolution,
+        so a graph over 30 days of hundreds of series reads a few hundred rows instead of millions of samples.
+        Written samples are appended to a table of their own and merged into their blocks by compact, so a block is
+        rewritten once per compaction instead of once per sample. Queries include the samples not merged yet.
+
+        :param session_maker: Session maker of the database.
+        :param retention: Seconds each resolution is kept by cleanup. Resolutions without retention are kept forever.
+        :param chunk_size: Maximum number of series per query, to stay below the parameter limit of the database.
+        """
+
+        self.session_maker = session_maker
+        self.retention = retention or {}
+        self.chunk_size = chunk_size
+
+        self._series: dict[tuple[int, str], int] = {}
+
+    def __str__(self):
+        return f"{self.__class__.__name__}(series={len(self._series)})"
+
+    def _chunks(self, items: list[Any]) -> Iterable[list[Any]]:
+        for i in range(0, len(items), self.chunk_size):
+            yield items[i:i + self.chunk_size]
+
+    def _load_series(self, keys: set[tuple[int, str]]) -> None:
+        device_ids = sorted({device_id for device_id, _ in keys})
+        with self.session_maker() as session:
+            for chunk in self._chunks(device_ids):
+                query = select(MetricSeries.device_id, MetricSeries.name, MetricSeries.id).where(MetricSeries.device_id.in_(chunk))
+                for device_id, name, series_id in session.execute(query):
+                    self._series[(device_id, name)] = series_id
+
+    def series_ids(self, keys: Iterable[tuple[int, str]]) -> dict[tuple[int, str], int]:
+        """
+        Get the IDs of series, missing series are created.
+
+        :param keys: Device ID and name of the series.
+        :return: Series ID by device ID and name.
+        """
+
+        keys = set(keys)
+        if keys - self._series.keys():
+            self._load_series(keys - self._series.keys())
+        missing = keys - self._series.keys()
+        if missing:
+            with self.session_maker() as session, session.begin():
+                # another process may create some of them in the meantime
+                statement = upsert(MetricSeries.__table__,
+                                   dialect=session.bind.dialect.name,
+                                   key=("device_id", "name"),
+                                   columns=("name",))
+                session.execute(statement, [{"device_id": device_id, "name": name} for device_id, name in missing])
+            self._load_series(missing)
+        return {key: self._series[key] for key in keys}
+
+    def series(self, device_ids: Iterable[int]) -> list[dict[str, Any]]:
+        """
+        Get the series of devices.
+
+        :param device_ids: IDs of the devices.
+        :return: List of series with 'id', 'device_id' and 'name'.
+        """
+
+        result = []
+        with self.session_maker() as session:
+            for chunk in self._chunks(sorted(set(device_ids))):
+                query = select(MetricSeries.id, MetricSeries.device_id, MetricSeries.name).where(MetricSeries.device_id.in_(chunk))
+                result += [{"id": row[0], "device_id": row[1], "name": row[2]} for row in session.execute(query)]
+        result.sort(key=lambda s: (s["device_id"], s["name"]))
+        return result
+
+    def _read_blocks(self,
+                     session: Any,
+                     series_ids: list[int],
+                     resolution: Resolution,
+                     starts: Iterable[int]) -> dict[tuple[int, int], bytes]:
+        table = MetricBlock.__table__
+        starts = sorted(set(starts))
+        blocks = {}
+        for chunk in self._chunks(series_ids):
+            query = (select(table.c.series_id, table.c.start, table.c.data)
+                     .where(table.c.series_id.in_(chunk),
+                            table.c.resolution == resolution.name,
+                            table.c.start.in_(starts)))
+            for series_id, start, data in session.execute(query):
+                blocks[(series_id, start)] = data
+        return blocks
+
+    def _read_samples(self,
+                      session: Any,
+                      series_ids: list[int],
+                      resolution: Resolution,
+                      start: float,
+                      end: float) -> dict[tuple[int, int], list[tuple[int, float]]]:
+        # the samples not merged yet by block, as slot and value
+        table = MetricSample.__table__
+        samples = defaultdict(list)
+        for chunk in self._chunks(series_ids):
+            query = (select(table.c.series_id, table.c.timestamp, table.c.value)
+                     .where(table.c.series_id.in_(chunk), table.c.timestamp >= start, table.c.timestamp < end))
+            for series_id, timestamp, value in session.execute(query):
+                samples[(series_id, resolution.block_start(timestamp))].append((resolution.slot(timestamp), value))
+        return samples
+
+    def write(self, samples: list[Sample]) -> int:
+        """
+        Write samples in bulk. They are appended and merged into their blocks by compact.
+
+        :param samples: Samples as device ID, series name, unix timestamp and value.
+        :return: Number of written samples.
+        """
+
+        samples = [sample for sample in samples if sample[3] is not None and not math.isnan(sample[3])]
+        if not samples:
+            return 0
+        series_ids = self.series_ids((device_id, name) for device_id, name, _, _ in samples)
+        with self.session_maker() as session, session.begin():
+            session.execute(insert(MetricSample.__table__),
+                            [{"series_id": series_ids[(device_id, name)], "timestamp": timestamp, "value": value}
+                             for device_id, name, timestamp, value in samples])
+        return len(samples)
+
+    def compact(self, limit: int = 100000) -> int:
+        """
+        Merge the written samples into their blocks. Every touched block is read and written once per run.
+
+        :param limit: Maximum number of samples merged in one transaction.
+        :return: Number of merged samples.
+        """
+
+        table = MetricSample.__table__
+        merged = 0
+        while True:
+            with self.session_maker() as session, session.begin():
+                rows = session.execute(select(table.c.id, table.c.series_id, table.c.timestamp, table.c.value)
+                                       .order_by(table.c.id)
+                                       .limit(limit)).all()
+                if not rows:
+                    break
+                # the samples are taken before the blocks are read, so a concurrent run of compact waits for this one
+                # and finds them deleted, or finds different samples and merges nothing
+                deleted = session.execute(delete(table).where(table.c.id <= rows[-1][0])).rowcount
+                if deleted != len(rows):
+                    session.rollback()
+                    logger.debug(f"{self} skipped compaction, the samples were changed by another process.")
+                    break
+                self._merge(session, rows)
+            merged += len(rows)
+            logger.debug(f"{self} merged {len(rows)} samples into their blocks.")
+            if len(rows) < limit:
+                break
+        return merged
+
+    def _merge(self, session: Any, rows: list[Any]) -> None:
+        # grouping the samples by block
+        grouped: dict[Resolution, dict[tuple[int, int], list[tuple[int, float]]]] = {r: defaultdict(list) for r in RESOLUTIONS.values()}
+        for _, series_id, timestamp, value in rows:
+            for resolution, blocks in grouped.items():
+                blocks[(series_id, resolution.block_start(timestamp))].append((resolution.slot(timestamp), value))
+
+        table = MetricBlock.__table__
+        for resolution, blocks in grouped.items():
+            existing = self._read_blocks(session,
+                                         sorted({series_id for series_id, _ in blocks}),
+                                         resolution,
+                                         (start for _, start in blocks))
+            rows = []
+            for (series_id, start), values in blocks.items():
+                data = existing.get((series_id, start))
+                block = Block(resolution.slots) if data is None else Block.decode(resolution.slots, data)
+                for slot, value in values:
+                    block.add(slot, value)
+                rows.append({"series_id": series_id, "resolution": resolution.name, "start": start,
+                             "data": block.encode()})
+            # a block created by another process in the meantime is replaced instead of failing the merge
+            session.execute(upsert(table, dialect=session.bind.dialect.name, key=("series_id", "resolution", "start"),
+                                   columns=("data",)), rows)
+
+    def swap_counters(self, counters: dict[int, tuple[float, float]]) -> dict[int, tuple[float, float]]:
+        """
+        Store the latest values of counters and get the values stored before.
+
+        :param counters: Unix timestamp and value by series ID.
+        :return: Unix timestamp and value stored before by series ID, counters without one are missing.
+        """
+
+        if not counters:
+            return {}
+        table = MetricCounter.__table__
+        previous = {}
+        with self.session_maker() as session, session.begin():
+            for chunk in self._chunks(sorted(counters)):
+                query = select(table.c.series_id, table.c.timestamp, table.c.value).where(table.c.series_id.in_(chunk))
+                for series_id, timestamp, value in session.execute(query):
+                    previous[series_id] = (timestamp, value)
+            session.execute(upsert(table, dialect=session.bind.dialect.name, key="series_id",
+                                   columns=("timestamp", "value")),
+                            [{"series_id": series_id, "timestamp": timestamp, "value": value}
+                             for series_id, (timestamp, value) in counters.items()])
+        return previous
+
+    @staticmethod
+    def resolution_for(start: float, end: float, max_points: int = 1500) -> Resolution:
+        """
+        Get the finest resolution which returns at most max_points slots for a time range.
+
+        :param start: Start of the range as unix timestamp.
+        :param end: End of the range as unix timestamp.
+        :param max_points: Maximum number of slots.
+        :return: Resolution
+        """
+
+        for resolution in RESOLUTIONS.values():
+            if (end - start) / resolution.step <= max_points:
+                return resolution
+        return RESOLUTIONS["1d"]
+
+    def query(self,
+              series_ids: Iterable[int],
+              start: float,
+              end: float,
+              resolution: str | None = None,
+              max_points: int = 1500,
+              aggregates: Iterable[str] = ("avg", "min", "max")) -> tuple[list[int], dict[int, dict[str, array]]]:
+        """
+        Query the aggregates of series over a time range.
+
+        :param series_ids: IDs of the series.
+        :param start: Start of the range as unix timestamp.
+        :param end: End of the range as unix timestamp.
+        :param resolution: Name of the resolution. If None, the finest resolution with at most max_points slots is used.
+        :param max_points: Maximum number of slots if the resolution is chosen automatically.
+        :param aggregates: Aggregates to get, 'avg', 'min' and 'max'.
+        :return: Timestamps of the slots and the values per slot by aggregate and series ID, NaN for slots without samples.
+        """
+
+        resolution = RESOLUTIONS[resolution] if resolution is not None else self.resolution_for(start, end, max_points)
+        first = int(start // resolution.step * resolution.step)
+        timestamps = list(range(first, int(end) + 1, resolution.step))
+        starts = range(resolution.block_start(first), int(end) + 1, resolution.span)
+        series_ids = sorted(set(series_ids))
+        aggregates = tuple(aggregates)
+        with self.session_maker() as session:
+            blocks = self._read_blocks(session, series_ids, resolution, starts)
+            staged = self._read_samples(session, series_ids, resolution, starts.start, starts.stop) if starts else {}
+
+        result = {}
+        for series_id in series_ids:
+            series = {name: array("d") for name in aggregates}
+            for block_start in starts:
+                # the part of the block within the range
+                first_slot = max(first - block_start, 0) // resolution.step
+                last_slot = min((timestamps[-1] - block_start) // resolution.step + 1, resolution.slots) if timestamps else 0
+                if last_slot <= first_slot:
+                    continue
+                data = blocks.get((series_id, block_start))
+                samples = staged.get((series_id, block_start))
+                if data is None and not samples:
+                    for values in series.values():
+                        values.extend(array("d", [math.nan]) * (last_slot - first_slot))
+                    continue
+                if data is None:
+                    block = Block(resolution.slots)
+                else:
+                    # adding samples needs the count and all aggregates of the slots
+                    columns = range(4) if samples else {AGGREGATES[name] for name in aggregates}
+                    block = Block.decode(resolution.slots, data, columns=columns)
+                for slot, value in samples or ():
+                    block.add(slot, value)
+                for name, values in block.aggregates(first_slot, last_slot, aggregates).items():
+                    series[name] += values
+            result[series_id] = series
+        return timestamps, result
+
+    def cleanup(self, now: float | None = None) -> int:
+        """
+        Delete all blocks older than the retention of their resolution.
+
+        :param now: Current unix timestamp. If None, the current time is used.
+        :return: Number of deleted blocks.
+        """
+
+        now = time.time() if now is None else now
+        table = MetricBlock.__table__
+        conditions = [and_(table.c.resolution == name, table.c.start < now - retention - RESOLUTIONS[name].span)
+                      for name, retention in self.retention.items() if retention]
+        if not conditions:
+            return 0
+        with self.session_maker() as session, session.begin():
+            return session.execute(delete(table).where(or_(*conditions))).rowcount
+
+
+class MetricCollector:
+    def __init__(self, store: MetricStore):
+        """
+        Create a new metric collector. It turns the fetched gauges and counters of devices into samples, counters are
+        written as rate per second since their previous value. The previous values are stored in the database, so
+        every worker process continues the rates of the others.
+
+        :param store: Store to write to.
+        """
+
+        self.store = store
+
+    def __str__(self):
+        return f"{self.__class__.__name__}(store={self.store})"
+
+    def samples(self, metrics: dict[int, dict[str, Any]]) -> list[Sample]:
+        """
+        Get the samples of fetched metrics and store the values of their counters.
+
+        :param metrics: Fetched metrics with 'timestamp', 'gauges' and 'counters' by device ID.
+        :return: List of samples.
+        """
+
+        samples = [(device_id, name, m["timestamp"], value)
+                   for device_id, m in metrics.items() for name, value in m["gauges"].items()]
+        counters = {(device_id, name): (m["timestamp"], value)
+                    for device_id, m in metrics.items() for name, value in m["counters"].items()}
+        if not counters:
+            return samples
+        series_ids = self.store.series_ids(counters)
+        previous = self.store.swap_counters({series_ids[key]: current for key, current in counters.items()})
+        for (device_id, name), (timestamp, value) in counters.items():
+            last = previous.get(series_ids[(device_id, name)])
+            # the first sample and counter resets have no rate
+            if last is None or timestamp <= last[0] or value < last[1]:
+                continue
+            samples.append((device_id, name, timestamp, (value - last[1]) / (timestamp - last[0])))
+        return samples
+
+    def apply(self, metrics: dict[int, dict[str, Any]]) -> int:
+        """
+        Write fetched metrics of many devices in bulk.
+
+        :param metrics: Fetched metrics by device ID.
+        :return: Number of written samples.
+        """
+
+        return self.store.write(self.samples(metrics))
+
+
+@cache
+def get_metric_store() -> MetricStore:
+    """
+    Get the metric store of the configured database.
+
+    :return: MetricStore
+    """
+
+    return MetricStore(session_maker=db().session_maker,
+                       retention={"1m": settings.metrics_retention_1m * 86400,
+                                  "1h": settings.metrics_retention_1h * 86400,
+                                  "1d": settings.metrics_retention_1d * 86400})
@@ -1,7 +1,11 @@
 from typing import Union, TYPE_CHECKING
+from nicegui import app
 
+from mikrotik_manager.reload import settings_watcher
 from mikrotik_manager.settings import settings
 from mikrotik_manager.ui.pages import *
+from mikrotik_manager.ui.status_hub import status_hub
+from mikrotik_manager.ui.storage import configure_storage
 
 if TYPE_CHECKING:
     from mikrotik_manager.core_app import CoreApp
@@ -20,6 +24,17 @@ class UiApp:
         # add root route
         ui.page("/")(self.root)
 
+        # feed the device status of all clients from the workers
+        app.on_startup(status_hub.start)
+        app.on_shutdown(status_hub.stop)
+
+        # apply changes of the reloadable settings without a restart
+        app.on_startup(settings_watcher.start)
+        app.on_shutdown(settings_watcher.stop)
+
+        # keep the user storage where all server processes find it
+        configure_storage()
+
         # initialize nicegui
         ui.run_with(
             app=self.core_app,
@@ -1,14 +1,19 @@
+import asyncio
 import inspect
+import time
 from dataclasses import dataclass
 from functools import wraps
 from pathlib import Path
 from typing import Any, Callable, Literal
-from nicegui import ui, helpers
+from nicegui import context, ui, helpers
 from nicegui.client import Client
+from nicegui.slot import Slot
 from fastapi import Request
 
 from nicegui.api_router import APIRouter
 
+from mikrotik_manager.telemetry import PAGE_RENDER_DURATION
+
 
 class BaseLayout:
     @dataclass
@@ -18,6 +23,52 @@ class BaseLayout:
         position: int
         func: Callable[..., Any]
         signature: inspect.Signature
+        depends_on: tuple[str, ...] = ()
+        concurrent: bool = False
+
+    @dataclass(frozen=True, slots=True)
+    class Call:
+        name: str
+        func: Callable[..., Any]
+        parameters: tuple[str, ...] | None  # None means the function accepts any keyword argument
+        coroutine: bool
+        depends_on: frozenset[str]
+        concurrent: bool
+
+        @classmethod
+        def compile(cls,
+                    name: str,
+                    func: Callable[..., Any],
+                    signature: inspect.Signature,
+                    provided: set[str],
+                    depends_on: tuple[str, ...] = (),
+                    concurrent: bool = False) -> "BaseLayout.Call":
+            coroutine = helpers.is_coroutine_function(func)
+            parameters = []
+            for parameter in signature.parameters.values():
+                if parameter.kind == inspect.Parameter.VAR_KEYWORD:
+                    # the function may consume every result, so it depends on everything before it
+                    return cls(name=name,
+                               func=func,
+                               parameters=None,
+                               coroutine=coroutine,
+                               depends_on=frozenset(provided),
+                               concurrent=False)
+                if parameter.kind in (inspect.Parameter.POSITIONAL_OR_KEYWORD, inspect.Parameter.KEYWORD_ONLY):
+                    parameters.append(parameter.name)
+
+            # a function depends on every section whose result it consumes
+            return cls(name=name,
+                       func=func,
+                       parameters=tuple(parameters),
+                       coroutine=coroutine,
+                       depends_on=frozenset(depends_on) | (provided & set(parameters)),
+                       concurrent=concurrent and coroutine)
+
+        def kwargs(self, kw: dict[str, Any]) -> dict[str, Any]:
+            if self.parameters is None:
+                return kw
+            return {p: kw[p] for p in self.parameters if p in kw}
 
     def __init__(self):
         self._sections: dict[str, BaseLayout.Section] = {}
@@ -31,7 +82,25 @@ class BaseLayout:
     def section(self,
                 name: str | None = None,
                 render: Literal["before", "after"] = "before",
-                position: int | None = None) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+                position: int | None = None,
+                depends_on: list[str] | None = None,
+                concurrent: bool = False) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+        """
+        Register a section of the layout.
+
+        Sections consuming the result of another section (by having a parameter named like it) depend on it.
+        Async sections marked as concurrent are awaited together with the neighbouring concurrent sections they do
+        not depend on. They should only place elements into their own containers, because the order of elements
+        created by concurrently running sections is not guaranteed.
+
+        :param name: Name of the section. If None, the function's name is used.
+        :param render: Render the section before or after the page body.
+        :param position: Position of the section. If None, the section is appended.
+        :param depends_on: Additional sections this section has to wait for.
+        :param concurrent: Allow awaiting this section concurrently with independent sections.
+        :return: Decorator
+        """
+
         if self._finalized:
             raise RuntimeError("Cannot add sections after the layout has been finalized. Eg. after a page has been defined.")
 
@@ -52,10 +121,119 @@ class BaseLayout:
                                                       render=render,
                                                       position=position if position is not None else 1 if len(sections) == 0 else sections[-1].position + 1,
                                                       func=func,
-                                                      signature=inspect.signature(func))
+                                                      signature=inspect.signature(func),
+                                                      depends_on=tuple(depends_on or ()),
+                                                      concurrent=concurrent)
             return func
         return decorator
 
+    def compile(self, func: Callable[..., Any]) -> Callable[..., Any]:
+        """
+        Compile a page function together with all sections into a fixed call plan.
+
+        The section set is frozen after this call, so sorting, parameter mapping and coroutine detection are done
+        once here instead of on every request.
+
+        :param func: The page function.
+        :return: The wrapper to register with nicegui.
+        """
+
+        self._finalized = True
+
+        # building the call plan
+        calls = []
+        provided: set[str] = set()
+        for section in [*self._get_sections("before"), None, *self._get_sections("after")]:
+            if section is None:
+                call = BaseLayout.Call.compile(name="body", func=func, signature=inspect.signature(func), provided=provided)
+            else:
+                call = BaseLayout.Call.compile(name=section.name,
+                                               func=section.func,
+                                               signature=section.signature,
+                                               provided=provided,
+                                               depends_on=section.depends_on,
+                                               concurrent=section.concurrent)
+            for dependency in call.depends_on - provided:
+                if dependency not in self._sections:
+                    raise ValueError(f"Section '{call.name}' depends on unknown section '{dependency}'.")
+                raise ValueError(f"Section '{call.name}' depends on section '{dependency}' which is rendered after it.")
+            calls.append(call)
+            provided.add(call.name)
+        body = calls[len(self._get_sections("before"))]
+
+        # grouping independent concurrent calls into stages
+        plan: list[tuple[BaseLayout.Call, ...]] = []
+        for call in calls:
+            if (plan
+                    and call.concurrent
+                    and all(c.concurrent for c in plan[-1])
+                    and not call.depends_on & {c.name for c in plan[-1]}):
+                plan[-1] = (*plan[-1], call)
+            else:
+                plan.append((call,))
+
+        async def run_concurrent(slot: Slot, call: BaseLayout.Call, call_kwargs: dict[str, Any]) -> Any:
+            # every gathered task has its own slot stack, so the slot of the page has to be entered again
+            with slot:
+                return await call.func(**call_kwargs)
+
+        @wraps(func)
+        async def wrapper(**kw) -> Any:
+            body_result = None
+            for stage in plan:
+                if len(stage) == 1:
+                    # calling the function with the precomputed parameters
+                    call = stage[0]
+                    result = call.func(**call.kwargs(kw))
+
+                    # if the function is a coroutine, await its result
+                    if call.coroutine:
+                        result = await result
+                    results = ((call, result),)
+                else:
+                    # awaiting all independent sections of the stage together in the current slot
+                    slot = context.slot
+                    results = zip(stage, await asyncio.gather(*(run_concurrent(slot, call, call.kwargs(kw))
+                                                                for call in stage)))
+
+                for call, result in results:
+                    if call is body:
+                        body_result = result
+
+                    # adding the result to the possible kwargs for the next functions
+                    if result is None:
+                        continue
+                    if call.name in kw:
+                        raise ValueError(f"Section '{call.name}' returned a value but the parameter is already set.")
+                    kw[call.name] = result
+
+            return body_result
+
+        # backup of signature of the original function
+        signature = inspect.signature(func)
+
+        parameters = list(signature.parameters.values())
+
+        # ensuring 'request' and 'client' are in the parameters
+        if "request" not in {p.name for p in parameters}:
+            parameters.insert(0,
+                              inspect.Parameter("request",
+                                                inspect.Parameter.POSITIONAL_OR_KEYWORD,
+                                                annotation=Request))
+        if "client" not in {p.name for p in parameters}:
+            parameters.insert(0,
+                              inspect.Parameter("client",
+                                                inspect.Parameter.POSITIONAL_OR_KEYWORD,
+                                                annotation=Client))
+
+        # removing parameters that are provided by sections
+        parameters = [p for p in parameters if p.name not in self._sections]
+
+        # replacing the signature of the wrapper
+        wrapper.__signature__ = inspect.Signature(parameters)
+
+        return wrapper
+
     def page(self,
              path: str, *,
              title: str | None = None,
@@ -71,82 +249,16 @@ class BaseLayout:
         self._finalized = True
 
         def decorator(func: Callable[..., Any]) -> Callable[..., Any]:
-            @wraps(func)
-            async def wrapper(*a, **kw) -> Any:
-                # getting additional parameters for the decorated function
-                request: Request = kw["request"]
-                client: Client = kw["client"]
-
-                def map_parameters(s: inspect.Signature) -> dict[str, Any]:
-                    _kw = {k: v for k, v in kw.items() if k in s.parameters.keys()}
-                    return s.bind(*a, **_kw).arguments
-
-                def add_to_kwargs(name: str, r: Any) -> None:
-                    if r is None:
-                        return
-                    if name in kw:
-                        raise ValueError(f"Section '{section.name}' returned a value but the parameter is already set.")
-                    kw[section.name] = r
-
-                # calling the 'before' sections
-                for section in self._get_sections("before"):
-                    # calling the section function
-                    before_result = section.func(**map_parameters(section.signature))
-
-                    # if the section function is a coroutine, await its result
-                    if helpers.is_coroutine_function(section.func):
-                        before_result = await before_result
-
-                    # adding the result to the possible kwargs for the next functions
-                    add_to_kwargs(name=section.name, r=before_result)
-
-                # calling the original function
-                result = func(**map_parameters(signature))
-
-                # if the original function is a coroutine, await its result
-                if helpers.is_coroutine_function(func):
-                    result = await result
-
-                # adding the result to the possible kwargs for the next functions
-                add_to_kwargs(name="body", r=result)
-
-                # calling the 'after' sections
-                for section in self._get_sections("after"):
-                    # calling the section function
-                    after_result = section.func(**map_parameters(section.signature))
-
-                    # if the section function is a coroutine, await its result
-                    if helpers.is_coroutine_function(section.func):
-                        after_result = await after_result
-
-                    # adding the result to the possible kwargs for the next functions
-                    add_to_kwargs(name=section.name, r=after_result)
-
-                return result
-
-            # backup of signature of the original function
-            signature = inspect.signature(func)
-
-            parameters = list(signature.parameters.values())
-
-            # ensuring 'request' and 'client' are in the parameters
-            if "request" not in {p.name for p in parameters}:
-                parameters.insert(0,
-                                  inspect.Parameter("request",
-                                                    inspect.Parameter.POSITIONAL_OR_KEYWORD,
-                                                    annotation=Request))
-            if "client" not in {p.name for p in parameters}:
-                parameters.insert(0,
-                                  inspect.Parameter("client",
-                                                    inspect.Parameter.POSITIONAL_OR_KEYWORD,
-                                                    annotation=Client))
-
-            # removing parameters that are provided by sections
-            for section in self._sections.values():
-                parameters = [p for p in parameters if p.name != section.name]
+            # compiling the page into a fixed call plan
+            compiled = self.compile(func)
 
-            # replacing the signature of the wrapper
-            wrapper.__signature__ = inspect.Signature(parameters)
+            @wraps(compiled)
+            async def wrapper(**kw) -> Any:
+                start = time.perf_counter()
+                try:
+                    return await compiled(**kw)
+                finally:
+                    PAGE_RENDER_DURATION.labels(path=path).observe(time.perf_counter() - start)
 
             # registering the page with nicegui
             ui.page(path=path,
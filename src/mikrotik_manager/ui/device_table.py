@@ -0,0 +1,140 @@
+from typing import Any
+
+from nicegui import json, ui, run
+from nicegui.events import GenericEventArguments
+from sqlalchemy import and_, func, or_, select
+
+from mikrotik_manager.db import db, Device, DeviceStatus
+from mikrotik_manager.settings import settings
+
+COLUMNS = [{"name": "name", "label": "Name", "field": "name", "sortable": True, "align": "left"},
+           {"name": "host", "label": "Host", "field": "host", "sortable": True, "align": "left"},
+           {"name": "site", "label": "Standort", "field": "site", "sortable": True, "align": "left"},
+           {"name": "hostname", "label": "Hostname", "field": "hostname", "sortable": True, "align": "left"},
+           {"name": "model", "label": "Modell", "field": "model", "sortable": True, "align": "left"},
+           {"name": "serial_number", "label": "Seriennummer", "field": "serial_number", "sortable": True, "align": "left"},
+           {"name": "version", "label": "Version", "field": "version", "sortable": True, "align": "left"},
+           {"name": "status", "label": "Status", "field": "status", "sortable": True, "align": "left"},
+           {"name": "last_seen", "label": "Zuletzt gesehen", "field": "last_seen", "sortable": True, "align": "left"}]
+SEARCH_COLUMNS = ("name", "host", "site", "hostname", "model", "serial_number")
+
+
+def _column(field: str) -> Any:
+    # the status is joined from the last status of the devices
+    return DeviceStatus.status if field == "status" else getattr(Device, field)
+
+
+def query_devices(offset: int,
+                  limit: int,
+                  sort_by: str | None = None,
+                  descending: bool = False,
+                  search: str = "",
+                  count: bool = True) -> tuple[int | None, list[dict[str, Any]]]:
+    """
+    Query one page of devices. Filtering, sorting and pagination are done by the database.
+    The search matches the beginning of the search columns, so every column is searched by a range of its index.
+
+    :param offset: Number of rows to skip.
+    :param limit: Maximum number of rows.
+    :param sort_by: Column to sort by. If None or unknown, the devices are sorted by name.
+    :param descending: Sort descending.
+    :param search: Only return devices with one of the search columns starting with this text.
+    :param count: Count the matching devices. If False, None is returned as their number.
+    :return: Total number of matching devices and the rows of the page.
+    """
+
+    columns = [_column(column["field"]) for column in COLUMNS]
+    condition = None
+    if search:
+        # a prefix is the range up to the next possible text, unlike a LIKE with a leading wildcard it uses the index
+        upper = search[:-1] + chr(ord(search[-1]) + 1)
+        condition = or_(*(and_(getattr(Device, column) >= search, getattr(Device, column) < upper)
+                          for column in SEARCH_COLUMNS))
+
+    order = _column(sort_by if sort_by in {column["name"] for column in COLUMNS} else "name")
+    query = (select(Device.id, *columns)
+             .outerjoin(DeviceStatus, DeviceStatus.device_id == Device.id)
+             .order_by(order.desc() if descending else order.asc(), Device.id))
+    count_query = select(func.count(Device.id))
+    if condition is not None:
+        query = query.where(condition)
+        count_query = count_query.where(condition)
+
+    with db().session() as session:
+        total = session.execute(count_query).scalar_one() if count else None
+        rows = session.execute(query.offset(offset).limit(limit)).all()
+    return total, [{"id": row[0], **{column["field"]: row[i + 1] for i, column in enumerate(COLUMNS)}} for row in rows]
+
+
+class DeviceTable(ui.table):
+    def __init__(self, rows_per_page: int | None = None):
+        super().__init__(rows=[],
+                         columns=COLUMNS,
+                         row_key="id",
+                         pagination={"page": 1,
+                                     "rowsPerPage": rows_per_page or settings.ui_device_table_rows_per_page,
+                                     "sortBy": "name",
+                                     "descending": False,
+                                     "rowsNumber": 0})
+
+        # only the rows of the current page are held and rendered, the browser renders only the visible ones
+        self.props("virtual-scroll flat bordered dense")
+        self.search = ""
+        # the number of matching devices is only counted again when the search changes
+        self._total: int | None = None
+        self.on("request", self._handle_request, ["pagination"])
+
+    async def _handle_request(self, e: GenericEventArguments) -> None:
+        await self.load(e.args["pagination"])
+
+    async def load(self, pagination: dict[str, Any] | None = None) -> None:
+        """
+        Load a page of devices.
+
+        :param pagination: Quasar pagination object. If None, the current page is reloaded.
+        :return: None
+        """
+
+        pagination = {**self.pagination, **(pagination or {})}
+        rows_per_page = pagination["rowsPerPage"] or settings.ui_device_table_rows_per_page
+        total, rows = await run.io_bound(query_devices,
+                                         offset=(pagination["page"] - 1) * rows_per_page,
+                                         limit=rows_per_page,
+                                         sort_by=pagination.get("sortBy"),
+                                         descending=pagination.get("descending", False),
+                                         search=self.search,
+                                         count=self._total is None)
+        if total is not None:
+            self._total = total
+        self.pagination = {**pagination, "rowsPerPage": rows_per_page, "rowsNumber": self._total}
+        self.rows = rows
+
+    async def set_search(self, search: str) -> None:
+        self.search = search or ""
+        self._total = None
+        await self.load({"page": 1})
+
+    def apply_changes(self, changes: dict[int, dict[str, Any]]) -> None:
+        """
+        Apply status changes to the rows of the current page.
+
+        :param changes: Changed fields by device ID.
+        :return: None
+        """
+
+        patches = []
+        for row in self.rows:
+            if row["id"] not in changes:
+                continue
+            patch = {key: value for key, value in changes[row["id"]].items() if key in row and row[key] != value}
+            if patch:
+                patches.append([row["id"], patch])
+                # the rows are observed, changing them would send all of them again
+                with self._props.suspend_updates():
+                    row.update(patch)
+        if not patches:
+            return
+        # only the changed fields are sent
+        self.client.run_javascript(f"const rows = getElement({self.id}).$attrs.rows;"
+                                   f"for (const [id, patch] of {json.dumps(patches)})"
+                                   f"  Object.assign(rows.find(row => row.id === id) || {{}}, patch);")
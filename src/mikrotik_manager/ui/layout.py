@@ -2,6 +2,8 @@ from nicegui import ui
 from nicegui.client import Client
 from fastapi import Request
 
+from mikrotik_manager.db import async_session_maker
+from mikrotik_manager.device_status import status_counts
 from mikrotik_manager.settings import settings
 
 from mikrotik_manager.ui.base_layout import BaseLayout
@@ -64,6 +66,32 @@ class Header(ui.header):
             self.title.classes("text-2xl font-bold")
 
 
+@layout.section(concurrent=True)
+async def header_status(header: Header):
+    # the elements are created before awaiting the query, so their position does not depend on other sections
+    with header.header_right_section:
+        online_label = ui.label().classes("text-green-3")
+        offline_label = ui.label().classes("text-red-3")
+
+    counts = (await status_counts(async_session_maker())).get(None, {})
+    online_label.text = f"{counts.get('online', 0)} erreichbar"
+    offline_label.text = f"{counts.get('offline', 0)} nicht erreichbar"
+
+
+@layout.section(concurrent=True)
+async def sidebar():
+    drawer = ui.left_drawer(bordered=True)
+    drawer.classes("bg-blue-grey-1")
+
+    counts = await status_counts(async_session_maker(), by_site=True)
+    with drawer:
+        ui.label("Standorte").classes("text-lg font-bold")
+        for site in sorted(counts, key=lambda s: (s is None, s or "")):
+            with ui.row(align_items="center", wrap=False).classes("w-full"):
+                ui.label(site or "Ohne Standort")
+                ui.space()
+                ui.badge(str(counts[site]["online"]), color="positive").tooltip("Erreichbar")
+                ui.badge(str(counts[site]["offline"]), color="negative").tooltip("Nicht erreichbar")
 
 
 @layout.section()
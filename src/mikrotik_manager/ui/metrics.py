@@ -0,0 +1,140 @@
+import math
+import time
+from typing import Any, Awaitable, Callable
+
+from nicegui import ui, run
+from sqlalchemy import select
+
+from mikrotik_manager.db import db, Device
+from mikrotik_manager.settings import settings
+from mikrotik_manager.timeseries import get_metric_store
+
+RANGES = {"1h": ("1 Stunde", 3600),
+          "24h": ("24 Stunden", 86400),
+          "7d": ("7 Tage", 7 * 86400),
+          "30d": ("30 Tage", 30 * 86400)}
+
+
+def query_device_names() -> dict[int, str]:
+    """
+    Query the names of all devices.
+
+    :return: Name by device ID, sorted by name.
+    """
+
+    with db().session() as session:
+        return {row[0]: row[1] for row in session.execute(select(Device.id, Device.name).order_by(Device.name))}
+
+
+def query_series_names(device_ids: list[int]) -> list[str]:
+    """
+    Query the names of all series of devices.
+
+    :param device_ids: IDs of the devices.
+    :return: Sorted series names.
+    """
+
+    return sorted({series["name"] for series in get_metric_store().series(device_ids)})
+
+
+def query_metrics(device_ids: list[int],
+                  names: list[str] | None,
+                  duration: int,
+                  aggregates: tuple[str, ...] = ("avg", "min", "max")) -> tuple[list[int], list[dict[str, Any]]]:
+    """
+    Query the series of devices up to now.
+
+    :param device_ids: IDs of the devices.
+    :param names: Names of the series. If None, all series of the devices are queried.
+    :param duration: Length of the range in seconds.
+    :param aggregates: Aggregates to get, 'avg', 'min' and 'max'.
+    :return: Timestamps of the slots and the series with 'device_id', 'name' and the values of the aggregates,
+             NaN for slots without samples.
+    """
+
+    store = get_metric_store()
+    series = [s for s in store.series(device_ids) if names is None or s["name"] in names]
+    end = time.time()
+    timestamps, values = store.query((s["id"] for s in series), start=end - duration, end=end,
+                                     max_points=settings.metrics_max_points,
+                                     aggregates=aggregates)
+    return timestamps, [{"device_id": s["device_id"], "name": s["name"], **values[s["id"]]} for s in series]
+
+
+def format_value(name: str, value: float | None) -> str:
+    """
+    Format a value of a series for display.
+
+    :param name: Name of the series.
+    :param value: Value.
+    :return: str
+    """
+
+    if value is None or math.isnan(value):
+        return "-"
+    if name.endswith("_bps"):
+        return f"{value / 1e6:.2f} Mbit/s"
+    if name.startswith("memory_"):
+        return f"{value / 2 ** 20:.1f} MiB"
+    if name == "cpu_load":
+        return f"{value:.1f} %"
+    return f"{value:.2f}"
+
+
+class MetricFilter(ui.row):
+    def __init__(self, with_names: bool = True):
+        """
+        Selection of devices, series names and time range shared by the metric pages.
+
+        :param with_names: Show the selection of series names.
+        """
+
+        super().__init__(align_items="center")
+
+        self.device_names: dict[int, str] = {}
+        self._callbacks: list[Callable[[], Awaitable[None]]] = []
+
+        with self:
+            self.device_select = ui.select({}, multiple=True, with_input=True, label="Geräte")
+            self.device_select.props("dense use-chips clearable").classes("min-w-64")
+            self.device_select.on_value_change(self._handle_device_change)
+            self.name_select = ui.select([], multiple=True, label="Messwerte")
+            self.name_select.props("dense use-chips clearable").classes("min-w-64")
+            self.name_select.set_visibility(with_names)
+            self.name_select.on_value_change(self._handle_change)
+            self.range_toggle = ui.toggle({key: label for key, (label, _) in RANGES.items()}, value="24h")
+            self.range_toggle.on_value_change(self._handle_change)
+
+    @property
+    def device_ids(self) -> list[int]:
+        return list(self.device_select.value or [])
+
+    @property
+    def names(self) -> list[str] | None:
+        return list(self.name_select.value or []) if self.name_select.visible else None
+
+    @property
+    def duration(self) -> int:
+        return RANGES[self.range_toggle.value][1]
+
+    def on_change(self, callback: Callable[[], Awaitable[None]]) -> None:
+        self._callbacks.append(callback)
+
+    async def load(self) -> None:
+        """
+        Load the selectable devices.
+
+        :return: None
+        """
+
+        self.device_names = await run.io_bound(query_device_names)
+        self.device_select.set_options(self.device_names)
+
+    async def _handle_device_change(self) -> None:
+        names = await run.io_bound(query_series_names, self.device_ids)
+        self.name_select.set_options(names, value=[name for name in self.name_select.value or [] if name in names])
+        await self._handle_change()
+
+    async def _handle_change(self) -> None:
+        for callback in self._callbacks:
+            await callback()
@@ -1 +1,4 @@
 from mikrotik_manager.ui.pages.dashboard import *
+from mikrotik_manager.ui.pages.graphs import *
+from mikrotik_manager.ui.pages.measurements import *
+from mikrotik_manager.ui.pages.files import *
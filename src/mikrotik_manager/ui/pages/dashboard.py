@@ -2,7 +2,10 @@ from nicegui import ui
 from nicegui.client import Client
 from fastapi import Request
 
-from mikrotik_manager.ui.layout import layout, Header
+from mikrotik_manager.settings import settings
+from mikrotik_manager.ui.device_table import DeviceTable
+from mikrotik_manager.ui.layout import layout, Header, VERTICAL_HEIGHT
+from mikrotik_manager.ui.status_hub import status_hub
 
 
 @layout.page("/dashboard", title="Dashboard")
@@ -10,5 +13,14 @@ async def dashboard(request: Request,
                     client: Client,
                     header: Header):
     ui.label("Diese Seite ist noch in Arbeit.").classes("text-red-500")
-    ui.label('CONTENT')
-    [ui.label(f'Line {i}') for i in range(100)]
+
+    search_input = ui.input(placeholder="Suchen ...").props("dense clearable debounce=300").classes("w-64")
+    device_table = DeviceTable()
+    device_table.classes(f"w-full {VERTICAL_HEIGHT}")
+    search_input.on_value_change(lambda e: device_table.set_search(e.value))
+    await device_table.load()
+
+    # applying the coalesced changes of the shared hub at most once per interval
+    subscription = status_hub.subscribe()
+    client.on_delete(subscription.close)
+    ui.timer(settings.ui_status_update_interval, lambda: device_table.apply_changes(subscription.take()))
@@ -0,0 +1,127 @@
+import itertools
+
+from nicegui import app, ui, run
+from nicegui.client import Client
+from fastapi import HTTPException, Request
+from fastapi.responses import StreamingResponse
+
+from mikrotik_manager.backups import get_backup_store
+from mikrotik_manager.settings import settings
+from mikrotik_manager.ui.layout import layout, Header, VERTICAL_HEIGHT
+from mikrotik_manager.ui.metrics import query_device_names
+
+KIND_LABELS = {"export": "Export", "backup": "Backup"}
+
+COLUMNS = [{"name": "created", "label": "Erstellt", "field": "created", "sortable": True, "align": "left"},
+           {"name": "kind", "label": "Art", "field": "kind", "sortable": True, "align": "left"},
+           {"name": "size", "label": "Größe", "field": "size", "align": "right"},
+           {"name": "lines", "label": "Zeilen", "field": "lines", "align": "right"},
+           {"name": "checked", "label": "Zuletzt geprüft", "field": "checked", "align": "left"}]
+
+
+def format_size(size: int) -> str:
+    """
+    Format a file size for the UI.
+
+    :param size: Size in bytes.
+    :return: Formatted size.
+    """
+
+    for unit in ("B", "KiB", "MiB"):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GiB"
+
+
+def query_diff(old_id: int, new_id: int, max_lines: int) -> tuple[str, bool]:
+    """
+    Get the diff between two versions, limited to a number of lines.
+
+    :param old_id: ID of the old version.
+    :param new_id: ID of the new version.
+    :param max_lines: Maximum number of lines.
+    :return: Diff and whether it was truncated.
+    """
+
+    lines = list(itertools.islice(get_backup_store().diff(old_id, new_id), max_lines + 1))
+    return "".join(lines[:max_lines]), len(lines) > max_lines
+
+
+@app.get("/files/{backup_id}/download")
+def download(backup_id: int) -> StreamingResponse:
+    # streaming the chunks, so large backups are never loaded at once
+    store = get_backup_store()
+    try:
+        version = store.version(backup_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Backup {backup_id} does not exist.")
+    suffix = "rsc" if version["kind"] == "export" else "backup"
+    file_name = f"{version['device_id']}-{version['created']:%Y%m%d-%H%M%S}.{suffix}"
+    return StreamingResponse(store.read(backup_id),
+                             media_type="text/plain" if version["kind"] == "export" else "application/octet-stream",
+                             headers={"Content-Disposition": f'attachment; filename="{file_name}"'})
+
+
+@layout.page("/files", title="Dateien")
+async def files(request: Request,
+                client: Client,
+                header: Header):
+    with ui.row(align_items="center"):
+        device_select = ui.select({}, with_input=True, label="Gerät").props("dense").classes("min-w-64")
+        diff_button = ui.button("Vergleichen", icon="difference").props("dense unelevated")
+        download_button = ui.button("Herunterladen", icon="download").props("dense unelevated")
+    with ui.splitter(value=40).classes(f"w-full {VERTICAL_HEIGHT}") as splitter:
+        with splitter.before:
+            table = ui.table(rows=[], columns=COLUMNS, row_key="id", selection="multiple")
+            table.props("virtual-scroll flat bordered dense")
+            table.classes("w-full h-full")
+        with splitter.after:
+            diff_label = ui.label("Zwei Exporte zum Vergleichen auswählen.").classes("px-2")
+            diff_code = ui.code("", language="diff").classes("w-full")
+            diff_code.set_visibility(False)
+
+    def update_buttons() -> None:
+        diff_button.set_enabled(len(table.selected) == 2 and all(row["kind_id"] == "export" for row in table.selected))
+        download_button.set_enabled(len(table.selected) == 1)
+
+    async def load_versions() -> None:
+        table.selected = []
+        diff_code.set_visibility(False)
+        if device_select.value is None:
+            table.rows = []
+        else:
+            versions = await run.io_bound(get_backup_store().versions, device_select.value)
+            table.rows = [{"id": version["id"],
+                           "kind_id": version["kind"],
+                           "kind": KIND_LABELS.get(version["kind"], version["kind"]),
+                           "created": f"{version['created']:%d.%m.%Y %H:%M:%S}",
+                           "checked": f"{version['checked']:%d.%m.%Y %H:%M:%S}",
+                           "size": format_size(version["size"]),
+                           "lines": version["lines"] if version["kind"] == "export" else ""}
+                          for version in versions]
+        update_buttons()
+
+    async def show_diff() -> None:
+        # the ids grow with the creation, so the smaller one is the older version
+        old_id, new_id = sorted(row["id"] for row in table.selected)
+        diff, truncated = await run.io_bound(query_diff, old_id, new_id, settings.backup_diff_max_lines)
+        if diff.count("\n") <= 2:
+            diff_label.text = "Die Versionen sind identisch."
+        elif truncated:
+            diff_label.text = f"Nur die ersten {settings.backup_diff_max_lines} Zeilen werden angezeigt."
+        else:
+            diff_label.text = ""
+        diff_code.set_content(diff)
+        diff_code.set_visibility(True)
+
+    def download_version() -> None:
+        ui.download.from_url(f"/files/{table.selected[0]['id']}/download")
+
+    device_select.on_value_change(load_versions)
+    table.on_select(update_buttons)
+    diff_button.on_click(show_diff)
+    download_button.on_click(download_version)
+    update_buttons()
+
+    device_select.set_options(await run.io_bound(query_device_names))
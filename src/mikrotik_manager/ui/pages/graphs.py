@@ -0,0 +1,43 @@
+import math
+
+from nicegui import ui, run
+from nicegui.client import Client
+from fastapi import Request
+
+from mikrotik_manager.ui.layout import layout, Header
+from mikrotik_manager.ui.metrics import MetricFilter, query_metrics
+
+
+@layout.page("/graphs", title="Diagramme")
+async def graphs(request: Request,
+                 client: Client,
+                 header: Header):
+    metric_filter = MetricFilter()
+    chart = ui.echart({"tooltip": {"trigger": "axis"},
+                       "legend": {"type": "scroll"},
+                       "xAxis": {"type": "time"},
+                       "yAxis": {"type": "value"},
+                       "series": []})
+    chart.classes("w-full h-[calc(100vh-10rem)]")
+
+    async def update() -> None:
+        if not metric_filter.device_ids or not metric_filter.names:
+            chart.options["series"] = []
+            chart.update()
+            return
+        timestamps, series = await run.io_bound(query_metrics,
+                                                metric_filter.device_ids,
+                                                metric_filter.names,
+                                                metric_filter.duration,
+                                                ("avg",))
+        # gaps are passed as null, so the lines are interrupted where no samples exist
+        chart.options["series"] = [{"type": "line",
+                                    "name": f"{metric_filter.device_names.get(s['device_id'], s['device_id'])} {s['name']}",
+                                    "showSymbol": False,
+                                    "data": [[timestamp * 1000, None if math.isnan(value) else value]
+                                             for timestamp, value in zip(timestamps, s["avg"])]}
+                                   for s in series]
+        chart.update()
+
+    metric_filter.on_change(update)
+    await metric_filter.load()
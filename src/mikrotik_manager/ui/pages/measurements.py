@@ -0,0 +1,44 @@
+import math
+
+from nicegui import ui, run
+from nicegui.client import Client
+from fastapi import Request
+
+from mikrotik_manager.ui.layout import layout, Header
+from mikrotik_manager.ui.metrics import MetricFilter, format_value, query_metrics
+
+COLUMNS = [{"name": "device", "label": "Gerät", "field": "device", "sortable": True, "align": "left"},
+           {"name": "name", "label": "Messwert", "field": "name", "sortable": True, "align": "left"},
+           {"name": "current", "label": "Aktuell", "field": "current", "align": "right"},
+           {"name": "min", "label": "Minimum", "field": "min", "align": "right"},
+           {"name": "avg", "label": "Durchschnitt", "field": "avg", "align": "right"},
+           {"name": "max", "label": "Maximum", "field": "max", "align": "right"}]
+
+
+@layout.page("/measurements", title="Messdaten")
+async def measurements(request: Request,
+                       client: Client,
+                       header: Header):
+    metric_filter = MetricFilter(with_names=False)
+    table = ui.table(rows=[], columns=COLUMNS, row_key="id")
+    table.props("virtual-scroll flat bordered dense")
+    table.classes("w-full h-[calc(100vh-10rem)]")
+
+    async def update() -> None:
+        timestamps, series = await run.io_bound(query_metrics, metric_filter.device_ids, None, metric_filter.duration)
+        rows = []
+        for i, s in enumerate(series):
+            avg = [value for value in s["avg"] if not math.isnan(value)]
+            minimum = [value for value in s["min"] if not math.isnan(value)]
+            maximum = [value for value in s["max"] if not math.isnan(value)]
+            rows.append({"id": i,
+                         "device": metric_filter.device_names.get(s["device_id"], s["device_id"]),
+                         "name": s["name"],
+                         "current": format_value(s["name"], avg[-1] if avg else None),
+                         "min": format_value(s["name"], min(minimum) if minimum else None),
+                         "avg": format_value(s["name"], sum(avg) / len(avg) if avg else None),
+                         "max": format_value(s["name"], max(maximum) if maximum else None)})
+        table.rows = rows
+
+    metric_filter.on_change(update)
+    await metric_filter.load()
@@ -0,0 +1,129 @@
+import asyncio
+import logging
+import threading
+from typing import Any
+
+from sqlalchemy import select
+
+from mikrotik_manager.inventory import INVENTORY_FIELDS
+
+logger = logging.getLogger(__name__)
+
+
+class Subscription:
+    def __init__(self, hub: "StatusHub"):
+        self.hub = hub
+        self._pending: dict[int, dict[str, Any]] = {}
+
+    def push(self, deltas: list[dict[str, Any]]) -> None:
+        # coalescing all changes since the last take
+        for delta in deltas:
+            self._pending.setdefault(delta["id"], {}).update(delta)
+
+    def take(self) -> dict[int, dict[str, Any]]:
+        """
+        Take all changes since the last call.
+
+        :return: Changed fields by device ID.
+        """
+
+        pending, self._pending = self._pending, {}
+        return pending
+
+    def close(self) -> None:
+        self.hub.unsubscribe(self)
+
+
+class StatusHub:
+    def __init__(self):
+        """
+        Create a new status hub. It holds the device status of the process, fed once by the inventory deltas of the
+        workers, and hands coalesced changes to all subscribed clients.
+        """
+
+        self.devices: dict[int, dict[str, Any]] = {}
+        self._subscriptions: set[Subscription] = set()
+        self._subscriber = None
+        self._thread: threading.Thread | None = None
+
+    def __str__(self):
+        return f"{self.__class__.__name__}(devices={len(self.devices)}, subscriptions={len(self._subscriptions)})"
+
+    def subscribe(self) -> Subscription:
+        subscription = Subscription(self)
+        self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        self._subscriptions.discard(subscription)
+
+    def apply(self, deltas: list[dict[str, Any]]) -> None:
+        """
+        Apply deltas to the status and hand the real changes to all subscriptions.
+
+        :param deltas: List of deltas with 'id' and the changed fields.
+        :return: None
+        """
+
+        changes = []
+        for delta in deltas:
+            device = self.devices.setdefault(delta["id"], {"id": delta["id"]})
+            changed = {key: value for key, value in delta.items() if device.get(key) != value}
+            if not changed:
+                continue
+            device.update(changed)
+            changes.append({"id": delta["id"], **changed})
+        if not changes:
+            return
+        for subscription in self._subscriptions:
+            subscription.push(changes)
+
+    def load(self) -> None:
+        """
+        Load the current status of all devices from the database.
+
+        :return: None
+        """
+
+        from mikrotik_manager.db import db, Device, DeviceStatus
+
+        columns = [Device.name, *(getattr(Device, field) for field in INVENTORY_FIELDS), DeviceStatus.status]
+        with db().session() as session:
+            rows = session.execute(select(Device.id, *columns)
+                                   .outerjoin(DeviceStatus, DeviceStatus.device_id == Device.id)).all()
+        self.apply([{"id": row[0], **dict(zip(["name", *INVENTORY_FIELDS, "status"], row[1:]))} for row in rows])
+
+    async def start(self) -> None:
+        """
+        Load the status and subscribe to the inventory deltas of the workers.
+
+        :return: None
+        """
+
+        from mikrotik_manager.events import InventorySubscriber
+
+        try:
+            await asyncio.to_thread(self.load)
+        except Exception as e:
+            logger.warning(f"{self} could not load the device status: {e}")
+
+        loop = asyncio.get_running_loop()
+        self._subscriber = InventorySubscriber(callback=lambda deltas: loop.call_soon_threadsafe(self.apply, deltas))
+        self._thread = threading.Thread(target=self._subscriber.run, name="status-hub", daemon=True)
+        self._thread.start()
+
+    async def stop(self) -> None:
+        """
+        Stop the subscription to the inventory deltas.
+
+        :return: None
+        """
+
+        if self._subscriber is None:
+            return
+        self._subscriber.should_stop = True
+        await asyncio.to_thread(self._thread.join, 5)
+        self._subscriber, self._thread = None, None
+
+
+status_hub = StatusHub()
@@ -0,0 +1,155 @@
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import Any
+
+from nicegui import app, background_tasks, core, json
+from nicegui.persistence import PersistentDict
+from nicegui.storage import Storage
+from sqlalchemy import delete, select
+
+from mikrotik_manager.db import db, StorageEntry
+from mikrotik_manager.device_status import upsert
+from mikrotik_manager.settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+class DatabasePersistentDict(PersistentDict):
+    def __init__(self, id: str):  # pylint: disable=redefined-builtin
+        """
+        NiceGUI storage kept in the database, so it is shared by all server processes and survives restarts.
+        The data is loaded once per process, changes are written back in the background. Every key is a row of its
+        own and only the changed keys are written, so processes changing different keys do not overwrite each other.
+
+        :param id: ID of the storage, e.g. 'general' or 'user-<session id>'.
+        """
+
+        self.id = id
+        # the stored values as JSON by key and the changes not written yet
+        self._saved: dict[str, str] = {}
+        self._changed: dict[str, str] = {}
+        self._removed: set[str] = set()
+        super().__init__(data={}, on_change=self.backup)
+
+    def __str__(self):
+        return f"{self.__class__.__name__}(id={self.id})"
+
+    def _load(self) -> dict[str, Any]:
+        with db().session_maker() as session:
+            return {key: value for key, value in session.execute(select(StorageEntry.key, StorageEntry.value)
+                                                                 .where(StorageEntry.id == self.id))}
+
+    def _write(self, changed: dict[str, str], removed: set[str]) -> None:
+        now = datetime.now(timezone.utc)
+        with db().session_maker() as session, session.begin():
+            if changed:
+                session.execute(upsert(StorageEntry.__table__,
+                                       dialect=session.bind.dialect.name,
+                                       key=("id", "key"),
+                                       columns=("value", "updated")),
+                                [{"id": self.id, "key": key, "value": json.loads(value), "updated": now}
+                                 for key, value in changed.items()])
+            if removed:
+                session.execute(delete(StorageEntry).where(StorageEntry.id == self.id,
+                                                           StorageEntry.key.in_(sorted(removed))))
+
+    def _delete(self) -> None:
+        with db().session_maker() as session, session.begin():
+            session.execute(delete(StorageEntry).where(StorageEntry.id == self.id))
+
+    def _apply_loaded(self, data: dict[str, Any]) -> None:
+        self._saved.update((key, json.dumps(value)) for key, value in data.items())
+        self.update(data)
+
+    async def initialize(self) -> None:
+        try:
+            self._apply_loaded(await asyncio.to_thread(self._load))
+        except Exception as e:
+            logger.warning(f"{self} could not be loaded: {e}")
+
+    def initialize_sync(self) -> None:
+        try:
+            self._apply_loaded(self._load())
+        except Exception as e:
+            logger.warning(f"{self} could not be loaded: {e}")
+
+    def _take_changes(self) -> tuple[dict[str, str], set[str]]:
+        changed, removed = self._changed, self._removed
+        self._changed, self._removed = {}, set()
+        return changed, removed
+
+    def backup(self) -> None:
+        """
+        Write the changed keys to the database.
+
+        :return: None
+        """
+
+        # plain JSON, the observable dict may change while it is written
+        data = {key: json.dumps(value) for key, value in self.items()}
+        for key, value in data.items():
+            if self._saved.get(key) != value:
+                self._changed[key] = value
+                self._removed.discard(key)
+        for key in self._saved.keys() - data.keys():
+            self._changed.pop(key, None)
+            self._removed.add(key)
+        self._saved = data
+        if not self._changed and not self._removed:
+            return
+
+        @background_tasks.await_on_shutdown
+        async def async_backup() -> None:
+            # the changes are taken on the event loop, so the changes of later calls are not lost
+            await asyncio.to_thread(self._write, *self._take_changes())
+
+        if core.loop and core.loop.is_running():
+            # a pending write is replaced by this one, which writes the changes of both
+            background_tasks.create_lazy(async_backup(), name=f"storage-{self.id}")
+        else:
+            self._write(*self._take_changes())
+
+    def clear(self) -> None:
+        super().clear()
+        # the keys written by other processes are removed as well
+        self._saved, self._changed, self._removed = {}, {}, set()
+        if core.loop and core.loop.is_running():
+            background_tasks.create_lazy(asyncio.to_thread(self._delete), name=f"storage-{self.id}")
+        else:
+            self._delete()
+
+
+class DatabaseStorage(Storage):
+    def __init__(self):
+        """
+        NiceGUI storage whose general and user storage are kept in the database.
+        """
+
+        super().__init__()
+        self._general = DatabasePersistentDict("general")
+
+    async def _create_user_storage(self, session_id: str) -> None:
+        self._users[session_id] = DatabasePersistentDict(f"user-{session_id}")
+        await self._users[session_id].initialize()
+
+
+def configure_storage() -> None:
+    """
+    Keep the NiceGUI storage in the configured backend. It replaces the storage of the app, so it has to be called
+    before the first request.
+
+    :return: None
+    """
+
+    if settings.ui_storage_backend == "database":
+        storage = DatabaseStorage()
+    elif settings.ui_storage_path is not None:
+        Storage.path = settings.ui_storage_path.absolute()
+        storage = Storage()
+    else:
+        return
+    # the storage created by NiceGUI on import is not used
+    app.storage = storage
+    app.on_shutdown(storage.on_shutdown)
+    storage.general.initialize_sync()
@@ -1,7 +1,40 @@
+import multiprocessing
+import signal
+
 from celery import Celery
 
 from mikrotik_manager import __name__ as __module_name__
-from mikrotik_manager.settings import settings
+from mikrotik_manager.serialization import register_serializers
+from mikrotik_manager.settings import settings, use_metrics_directory
+
+
+QUEUES = ("interactive", "bulk", "backups")
+
+# queue of every task, unknown tasks go to the bulk queue
+TASK_QUEUES = {"test": "interactive",
+               "run_job": "interactive",
+               "fetch_device_info_batch": "bulk",
+               "collect_metrics_batch": "bulk",
+               "backup_devices_batch": "backups",
+               "cleanup_result_streams": "bulk",
+               "cleanup_task_keys": "bulk",
+               "cleanup_metrics": "bulk",
+               "compact_metrics": "bulk",
+               "cleanup_backups": "bulk",
+               "cleanup_device_events": "bulk"}
+
+
+def task_queue(task: str, node: str | None = None) -> str:
+    """
+    Get the queue a task is sent to.
+
+    :param task: Name of the task.
+    :param node: Fleet scheduler node the task is sharded to. If None, the task is not sharded.
+    :return: Queue name, '<queue>.<node>' for sharded tasks.
+    """
+
+    queue = TASK_QUEUES.get(task, "bulk")
+    return queue if node is None else f"{queue}.{node}"
 
 
 def get_broker_url():
@@ -12,28 +45,136 @@ def get_broker_url():
     return broker_url
 
 
+def get_db_url():
+    db_url = f"{settings.db_protocol}://"
+    if settings.db_protocol == "sqlite":
+        if settings.db_file is not None:
+            db_url += f"/{settings.db_file}"
+        return db_url
+    if settings.db_username is not None:
+        db_url += settings.db_username
+        if settings.db_password is not None:
+            db_url += f":{settings.db_password}"
+        db_url += "@"
+    db_url += f"{settings.db_host}"
+    if settings.db_port is not None:
+        db_url += f":{settings.db_port}"
+    db_url += f"/{settings.db_name}"
+    return db_url
+
+
+def get_result_backend_url():
+    if settings.result_backend == "sqlite":
+        return f"db+sqlite:///{settings.result_backend_file}"
+    return f"db+{get_db_url()}"
+
+
+serializers = register_serializers(serializer=settings.task_serializer,
+                                   compression_threshold=settings.task_compression_threshold)
+
 celery_app = Celery(__module_name__,
                     include=[f"{__module_name__}.tasks"],
                     task_cls=f"{__module_name__}.tasks.base:BaseTask")
 celery_app.conf.update(broker_url=get_broker_url(),
-                       result_backend="rpc://",
-                       # beat_scheduler="sqlalchemy_celery_beat.schedulers:DatabaseScheduler",
-                       # beat_dburi=get_db_url(),
-                       task_serializer="json",
-                       result_serializer="json",
-                       accept_content=["json"],
+                       result_backend=get_result_backend_url(),
+                       result_expires=settings.result_expires or None,
+                       result_compression=settings.result_compression,
+                       beat_schedule={"cleanup_result_streams": {"task": "cleanup_result_streams", "schedule": 3600.0},
+                                      "cleanup_task_keys": {"task": "cleanup_task_keys", "schedule": 3600.0},
+                                      "cleanup_metrics": {"task": "cleanup_metrics", "schedule": 3600.0},
+                                      "compact_metrics": {"task": "compact_metrics",
+                                                          "schedule": settings.metrics_compact_interval},
+                                      "cleanup_backups": {"task": "cleanup_backups", "schedule": 86400.0},
+                                      "cleanup_device_events": {"task": "cleanup_device_events", "schedule": 3600.0}},
+                       beat_scheduler=f"{__module_name__}.scheduler:FleetBeatScheduler",
+                       task_default_queue="bulk",
+                       task_routes={task: {"queue": queue} for task, queue in TASK_QUEUES.items()},
+                       task_serializer=serializers[0],
+                       result_serializer=serializers[0],
+                       accept_content=[*serializers, "json"],
+                       result_accept_content=[*serializers, "json"],
                        timezone="Europe/Berlin",
                        enable_utc=True)
 
 
-def run():
+def worker_argv(queue: str, beat: bool = False) -> list[str]:
     """
-    Run the Celery worker.
+    Get the arguments of the Celery worker of a queue.
 
+    :param queue: Name of the queue.
+    :param beat: Run the beat scheduler embedded in the worker.
+    :return: Arguments of celery_app.worker_main.
+    """
+
+    queues = [queue]
+    if settings.worker_node is not None and queue != "interactive":
+        # the sharded device polls of this node are sent to queues of its own
+        queues.append(f"{queue}.{settings.worker_node}")
+    argv = ["worker",
+            "--loglevel=debug",
+            f"--hostname={queue}.{settings.worker_node or 'worker'}@%h",
+            f"--queues={','.join(queues)}",
+            f"--prefetch-multiplier={settings.worker_queue_prefetch.get(queue, 4)}"]
+    if queue in settings.worker_queue_concurrency:
+        argv.append(f"--concurrency={settings.worker_queue_concurrency[queue]}")
+    if beat:
+        argv.append("--beat")
+    return argv
+
+
+def _run_worker(argv: list[str]) -> None:
+    celery_app.worker_main(argv)
+
+
+def _stop(*_) -> None:
+    raise KeyboardInterrupt
+
+
+def run(queues: list[str] | None = None):
+    """
+    Run the Celery worker. Every queue is consumed by a worker process of its own.
+
+    :param queues: Queues to consume. If None, the setting is used.
     :return: None
     """
 
-    celery_app.worker_main(["worker", "--loglevel=debug"])
+    queues = list(dict.fromkeys(queues or settings.worker_queues))
+    unknown = [queue for queue in queues if queue not in QUEUES]
+    if unknown:
+        raise ValueError(f"Unknown queues: {', '.join(unknown)}")
+
+    if settings.worker_metrics_port is not None:
+        # the processes write their samples to files, this has to happen before any metric is created
+        use_metrics_directory(settings.worker_metrics_directory)
+
+        from mikrotik_manager.telemetry import start_server
+
+        start_server(settings.worker_metrics_port)
+
+    if len(queues) == 1:
+        celery_app.worker_main(worker_argv(queues[0], beat=settings.worker_beat))
+        return
+
+    # the pool of a worker serves one queue, so a worker per queue keeps bulk work from occupying interactive pools
+    context = multiprocessing.get_context("spawn")
+    processes = [context.Process(target=_run_worker,
+                                 args=(worker_argv(queue, beat=settings.worker_beat and i == 0),),
+                                 name=f"worker-{queue}") for i, queue in enumerate(queues)]
+    signal.signal(signal.SIGTERM, _stop)
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # a warm shutdown of every worker
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        for process in processes:
+            process.join()
 
 
 if __name__ == "__main__":
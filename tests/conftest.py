@@ -0,0 +1,43 @@
+import atexit
+import shutil
+import tempfile
+from pathlib import Path
+
+import pytest
+
+from mikrotik_manager.settings import settings
+
+pytest_plugins = ["nicegui.testing.user_plugin"]
+
+# the files of the tests are kept in a directory of their own, it is changed before the database is initialized
+_directory = Path(tempfile.mkdtemp(prefix="mikrotik-manager-tests-"))
+atexit.register(shutil.rmtree, _directory, ignore_errors=True)
+(_directory / "db.sqlite").touch()
+# the settings are frozen, they are replaced as a whole like on a reload
+object.__setattr__(settings, "__dict__", settings.model_copy(update={
+    "db_protocol": "sqlite",
+    "db_file": _directory / "db.sqlite",
+    "result_backend": "sqlite",
+    "result_backend_file": _directory / "results.sqlite",
+    "backup_directory": _directory / "backups",
+    "worker_metrics_directory": _directory / "worker-metrics",
+    "server_metrics_directory": _directory / "server-metrics",
+    "ui_storage_backend": "file",
+    "ui_storage_path": _directory / "storage",
+    "settings_reload_interval": 0.0}).__dict__)
+
+from mikrotik_manager.worker import celery_app  # noqa: E402
+
+# the inventory deltas are published without a broker
+celery_app.conf.broker_url = "memory://"
+
+
+@pytest.fixture(autouse=True)
+async def async_engine():
+    # every test runs on an event loop of its own, the pooled connections of the async engine are bound to it
+    yield
+    from mikrotik_manager import db
+
+    if db._async_engine is not None:
+        await db._async_engine[1].dispose()
+        db._async_engine = None
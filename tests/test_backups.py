@@ -0,0 +1,132 @@
+import asyncio
+import os
+import time
+import zlib
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from mikrotik_manager.backups import BackupStore
+from mikrotik_manager.db import ModelBase
+
+SECTIONS = {"interface bridge": [f"add name=bridge{i}" for i in range(20)],
+            "ip address": [f"add address=10.0.{i}.1/24 interface=bridge{i}" for i in range(20)],
+            "system identity": ["set name=router"]}
+
+
+def export(timestamp: str, sections: dict[str, list[str]]) -> bytes:
+    lines = [f"# {timestamp} by RouterOS 7.16.1", "# software id = 1234"]
+    for section, section_lines in sections.items():
+        lines += [f"/{section}", *section_lines]
+    return ("\n".join(lines) + "\n").encode()
+
+
+@pytest.fixture
+def store(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'backups.sqlite'}")
+    ModelBase.metadata.create_all(bind=engine)
+    yield BackupStore(directory=tmp_path / "backups", session_maker=sessionmaker(bind=engine), average_lines=8)
+    engine.dispose()
+
+
+def add(store: BackupStore, data: bytes, device_id: int = 1) -> tuple[int, bool]:
+    path = store.temp_file()
+    path.write_bytes(data)
+    return store.add(device_id, path)
+
+
+def objects(store: BackupStore) -> set[str]:
+    return {path.name for path in store.objects_directory.rglob("*") if path.is_file()}
+
+
+def test_header_is_a_chunk_of_its_own(store):
+    first_id, new = add(store, export("2026-01-01 00:00:00", SECTIONS))
+    assert new
+    first_objects = objects(store)
+    second_id, new = add(store, export("2026-01-02 00:00:00", SECTIONS))
+    assert second_id == first_id and not new
+    # only the header is stored again
+    assert len(objects(store) - first_objects) == 1
+    assert b"".join(store.read(first_id)) == export("2026-01-01 00:00:00", SECTIONS)
+
+
+def test_reused_chunks_are_touched(store):
+    add(store, export("2026-01-01 00:00:00", SECTIONS))
+    old = time.time() - 7200
+    for path in store.objects_directory.rglob("*"):
+        if path.is_file():
+            os.utime(path, (old, old))
+    # the same content of another device is not collected while it is added
+    backup_id, _ = add(store, export("2026-01-02 00:00:00", SECTIONS), device_id=2)
+    manifest = store._parse_manifest(store._get_backup(backup_id).manifest)
+    assert all(store._object_path(digest).stat().st_mtime > old + 3600 for digest, _ in manifest)
+
+
+def test_diff_compares_changed_chunks(store, monkeypatch):
+    old_id, _ = add(store, export("2026-01-01 00:00:00", SECTIONS))
+    changed = dict(SECTIONS)
+    changed["ip address"] = [line.replace("10.0.5.", "10.1.5.") for line in SECTIONS["ip address"]]
+    changed["system identity"] = ["set name=router-2"]
+    new_id, _ = add(store, export("2026-01-02 00:00:00", changed))
+
+    loaded = []
+    chunk_lines = store._chunk_lines
+    monkeypatch.setattr(store, "_chunk_lines", lambda digest: loaded.append(digest) or chunk_lines(digest))
+    diff = list(store.diff(old_id, new_id))
+    assert [line for line in diff if line[0] in "+-" and not line.startswith(("+++", "---"))] == [
+        "-# 2026-01-01 00:00:00 by RouterOS 7.16.1\n",
+        "+# 2026-01-02 00:00:00 by RouterOS 7.16.1\n",
+        "-add address=10.0.5.1/24 interface=bridge5\n",
+        "+add address=10.1.5.1/24 interface=bridge5\n",
+        "-set name=router\n",
+        "+set name=router-2\n"]
+    # the hunks refer to the lines of the whole export
+    old_lines = export("2026-01-01 00:00:00", SECTIONS).decode().split("\n")
+    headers = [i for i, line in enumerate(diff) if line.startswith("@@")]
+    for i, end in zip(headers, headers[1:] + [len(diff)]):
+        start, length = map(int, (diff[i].split()[1][1:].split(",") + ["1"])[:2])
+        assert [line[1:] for line in diff[i + 1:end] if line[0] in " -"] == \
+               [f"{line}\n" for line in old_lines[start - 1:start - 1 + length]]
+    # unchanged chunks are not loaded
+    assert len(loaded) < len(store._parse_manifest(store._get_backup(new_id).manifest))
+
+
+def test_diff_follows_moved_chunk_boundaries(store):
+    # a line cutting a chunk moves the boundaries of the chunks after it within the section
+    boundary = next(f"set comment=x{i}" for i in range(1000) if zlib.crc32(f"set comment=x{i}\n".encode()) % 8 == 0)
+    sections = {"ip firewall filter": [f"add chain=forward comment=rule{i}" for i in range(41)]}
+    old_id, _ = add(store, export("2026-01-01 00:00:00", sections))
+    rules = sections["ip firewall filter"]
+    changed = {"ip firewall filter": rules[:18] + [boundary] + rules[18:]}
+    new_id, _ = add(store, export("2026-01-01 00:00:00", changed))
+
+    diff = list(store.diff(old_id, new_id))
+    assert [line for line in diff if line.startswith("@@")] == ["@@ -19,6 +19,7 @@\n"]
+    assert [line for line in diff[2:] if line[0] in "+-"] == [f"+{boundary}\n"]
+
+
+def test_backup_task_removes_the_files_on_errors(store, monkeypatch):
+    from mikrotik_manager.tasks import backups
+    from mikrotik_manager.tasks.base import BaseTask
+
+    async def fetch_backup(pool, address, temp_file, **kwargs):
+        # like the real fetch, a cancelled fetch leaves no file
+        await asyncio.sleep(0.01)
+        path = temp_file()
+        path.write_bytes(export("2026-01-01 00:00:00", SECTIONS))
+        return {"export": str(path)}
+
+    def add_backup(device_id, path, kind="export"):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(backups, "get_backup_store", lambda: store)
+    monkeypatch.setattr(backups, "load_devices",
+                        lambda device_ids: [{"id": i, "host": "127.0.0.1"} for i in device_ids])
+    monkeypatch.setattr(backups, "fetch_backup", fetch_backup)
+    monkeypatch.setattr(store, "add", add_backup)
+    with pytest.raises(OSError):
+        backups.backup_devices_batch.run(list(range(50)), concurrency=5, page_size=2)
+    BaseTask.shutdown_runtime()
+    # neither the file which failed nor the ones fetched or queued until the poll stopped are left
+    assert not list(store.temp_directory.iterdir())
@@ -0,0 +1,54 @@
+import pytest
+from typer.testing import CliRunner
+
+from benchmarks import pages
+from benchmarks.__main__ import app
+from benchmarks.suite import compare, direction, load_report, run_suite, save_report
+
+
+def _report(**metrics: float) -> dict:
+    return {"version": "0", "created": "", "quick": True, "benchmarks": {"db": metrics}, "durations": {}, "errors": {}}
+
+
+def test_compare():
+    assert [direction(metric) for metric in ("writes_per_second", "speedup", "p95_ms", "lost", "devices")] == \
+           [1, 1, -1, -1, 0]
+    baseline = _report(writes_per_second=100.0, p95_ms=10.0, lookup_ms=10.0, devices=10.0, lost=0.0)
+    current = _report(writes_per_second=80.0, p95_ms=5.0, lookup_ms=10.5, devices=20.0, lost=0.0, new_ms=1.0)
+    states = {row["metric"]: row["state"] for row in compare(baseline, current, threshold=0.1)}
+    assert states == {"writes_per_second": "regressed", "p95_ms": "improved", "lookup_ms": "unchanged",
+                      "devices": "info", "lost": "unchanged"}
+
+
+def test_report_roundtrip(tmp_path):
+    report = _report(writes_per_second=100.0)
+    save_report(report, tmp_path / "reports" / "report.json")
+    assert load_report(tmp_path / "reports" / "report.json") == report
+
+
+def test_run_suite():
+    with pytest.raises(ValueError):
+        run_suite(names=["scheduler", "unknown"])
+    results = []
+    report = run_suite(names=["scheduler", "serialization"], quick=True,
+                       on_result=lambda name, metrics, error: results.append((name, error)))
+    assert results == [("scheduler", None), ("serialization", None)] and not report["errors"]
+    assert report["benchmarks"]["scheduler"] and report["benchmarks"]["serialization"]
+    assert set(report["durations"]) == {"scheduler", "serialization"}
+
+
+def test_command(tmp_path):
+    runner = CliRunner()
+    assert runner.invoke(app, ["--only", "unknown"]).exit_code == 1
+    save_report(_report(), tmp_path / "baseline.json")
+    result = runner.invoke(app, ["--only", "scheduler", "--quick", "--output", str(tmp_path / "report.json"),
+                                 "--baseline", str(tmp_path / "baseline.json")])
+    assert result.exit_code == 0, result.output
+    assert load_report(tmp_path / "report.json")["benchmarks"]["scheduler"]
+
+
+def test_pages_connect_the_websocket():
+    report = pages.run(clients=2, requests=2, devices=10, dwell=0.2)
+    assert report["errors"] == 0 and report["pages_per_second"] > 0
+    # every loaded page shook hands over its websocket
+    assert report["websocket_p50_ms"] > 0
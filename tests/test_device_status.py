@@ -0,0 +1,83 @@
+import pytest
+from sqlalchemy.exc import OperationalError
+
+from mikrotik_manager.db import Device, DeviceStatus, async_session_maker, create_all, db
+from mikrotik_manager.device_status import StatusWriter
+
+
+@pytest.fixture
+def devices():
+    create_all()
+    with db().session() as session:
+        session.add_all([Device(id=i, name=f"device-{i}", host=f"10.0.0.{i}") for i in range(1, 4)])
+        session.commit()
+    yield
+    with db().session() as session:
+        session.query(DeviceStatus).delete()
+        session.query(Device).delete()
+        session.commit()
+
+
+async def test_writer_publishes_transitions(devices):
+    published = []
+    writer = StatusWriter(session_maker=async_session_maker(), publish=published.append)
+    writer.put(1, "online", rtt=0.1)
+    writer.put(2, "offline", error="timeout")
+    await writer.flush()
+    assert sorted(published[0], key=lambda delta: delta["id"]) == [{"id": 1, "status": "online"},
+                                                                   {"id": 2, "status": "offline"}]
+
+    # unchanged devices are written, but not published
+    writer.put(1, "online", rtt=0.2)
+    writer.put(2, "online", rtt=0.3)
+    writer.put(3, "offline")
+    await writer.flush()
+    assert sorted(published[1], key=lambda delta: delta["id"]) == [{"id": 2, "status": "online"},
+                                                                   {"id": 3, "status": "offline"}]
+    writer.put(1, "online", rtt=0.4)
+    await writer.close()
+    assert len(published) == 2 and writer.written == 6
+    with db().session() as session:
+        assert session.get(DeviceStatus, 1).rtt == 0.4
+
+
+async def test_writer_drops_invalid_updates(devices):
+    writer = StatusWriter(session_maker=async_session_maker())
+    # the device 4 does not exist, e.g. it was deleted while it was polled
+    for device_id in range(1, 5):
+        writer.put(device_id, "online")
+    await writer.flush()
+    assert writer.written == 3 and writer.dropped == 1 and not writer._pending
+    with db().session() as session:
+        assert sorted(status.device_id for status in session.query(DeviceStatus)) == [1, 2, 3]
+
+
+async def test_writer_retries_transient_errors(devices, monkeypatch):
+    writer = StatusWriter(session_maker=async_session_maker(), max_attempts=3)
+    write = writer._write
+    failures = []
+
+    async def unreachable(rows):
+        failures.append(len(rows))
+        raise OperationalError("INSERT", {}, Exception("database is locked"))
+
+    monkeypatch.setattr(writer, "_write", unreachable)
+    writer.put(1, "online")
+    writer.put(2, "online")
+    for _ in range(2):
+        with pytest.raises(OperationalError):
+            await writer.flush()
+    assert failures == [2, 2] and writer.dropped == 0
+
+    # a newer update is not dropped with the old one
+    writer.put(2, "offline")
+    monkeypatch.setattr(writer, "_write", write)
+    await writer.flush()
+    assert writer.written == 2 and writer.dropped == 0
+
+    monkeypatch.setattr(writer, "_write", unreachable)
+    writer.put(1, "offline")
+    for _ in range(3):
+        with pytest.raises(OperationalError):
+            await writer.flush()
+    assert writer.dropped == 1 and not writer._pending and not writer._attempts
@@ -0,0 +1,80 @@
+from datetime import datetime, timezone
+
+import pytest
+from nicegui import ui
+from nicegui.testing import User
+from sqlalchemy import and_, select, text
+
+from mikrotik_manager.db import Device, DeviceStatus, create_all, db
+from mikrotik_manager.ui.device_table import DeviceTable, query_devices
+
+
+@pytest.fixture
+def devices():
+    create_all()
+    with db().session() as session:
+        session.add_all([Device(id=i, name=f"device-{i:02d}", host=f"10.0.0.{i}", site="a" if i % 2 else "b")
+                         for i in range(1, 21)])
+        session.flush()
+        session.add(DeviceStatus(device_id=1, status="online", updated=datetime.now(timezone.utc)))
+        session.commit()
+    yield
+    with db().session() as session:
+        session.query(DeviceStatus).delete()
+        session.query(Device).delete()
+        session.commit()
+
+
+def test_query_devices(devices):
+    total, rows = query_devices(offset=0, limit=5, sort_by="status", descending=True)
+    assert total == 20 and len(rows) == 5
+    assert rows[0]["name"] == "device-01" and rows[0]["status"] == "online"
+    total, rows = query_devices(offset=5, limit=5, search="device-1")
+    assert total == 10 and [row["name"] for row in rows] == ["device-15", "device-16", "device-17", "device-18",
+                                                             "device-19"]
+    # only the beginning of the columns is matched
+    assert query_devices(offset=0, limit=5, search="0.0.1")[0] == 0
+    total, rows = query_devices(offset=0, limit=5, search="10.0.0.2", count=False)
+    assert total is None and [row["name"] for row in rows] == ["device-02", "device-20"]
+
+
+async def test_apply_changes_patches_rows(user: User, devices, monkeypatch):
+    tables = []
+
+    @ui.page("/table")
+    async def page():
+        table = DeviceTable(rows_per_page=5)
+        await table.load()
+        tables.append(table)
+
+    await user.open("/table")
+    table = tables[0]
+    updates, scripts = [], []
+    monkeypatch.setattr(table, "update", lambda: updates.append(True))
+    monkeypatch.setattr(table.client, "run_javascript", lambda code, **kwargs: scripts.append(code))
+
+    table.apply_changes({2: {"status": "offline", "unknown": 1}, 3: {"name": "device-03"}, 100: {"status": "online"}})
+    assert updates == []
+    assert len(scripts) == 1 and '[[2,{"status":"offline"}]]' in scripts[0]
+    assert table.rows[1]["status"] == "offline" and "unknown" not in table.rows[1]
+
+    # nothing is sent without a change
+    table.apply_changes({2: {"status": "offline"}})
+    assert len(scripts) == 1
+
+    # the devices are counted once per search
+    counts = []
+    monkeypatch.setattr("mikrotik_manager.ui.device_table.query_devices",
+                        lambda count, **kwargs: counts.append(count) or query_devices(count=count, **kwargs))
+    await table.load({"page": 2})
+    assert counts == [False] and table.pagination["rowsNumber"] == 20
+    await table.set_search("device-1")
+    assert counts == [False, True] and table.pagination["rowsNumber"] == 10
+
+
+def test_search_uses_indexes(devices):
+    with db().session() as session:
+        statement = select(Device.id).where(and_(Device.host >= "10.0.0.2", Device.host < "10.0.0.3"))
+        compiled = statement.compile(session.bind, compile_kwargs={"literal_binds": True})
+        plan = " ".join(str(row[-1]) for row in session.execute(text(f"EXPLAIN QUERY PLAN {compiled}")))
+    assert "ix_devices_host" in plan
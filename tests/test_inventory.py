@@ -0,0 +1,67 @@
+import subprocess
+import sys
+
+import pytest
+from sqlalchemy.exc import OperationalError
+
+from mikrotik_manager.db import Device, create_all, db
+from mikrotik_manager.inventory import Inventory
+
+
+@pytest.fixture
+def devices():
+    create_all()
+    with db().session() as session:
+        session.add_all([Device(id=i, name=f"device-{i}", host=f"10.0.0.{i}") for i in (1, 2)])
+        session.commit()
+    yield
+    with db().session() as session:
+        session.query(Device).delete()
+        session.commit()
+
+
+def test_import_does_not_initialize_the_database():
+    code = ("import mikrotik_manager.db as module\n"
+            "assert module.Device.__tablename__ == 'devices'\n"
+            "from wiederverwendbar.singleton import Singleton\n"
+            "assert 'SqlalchemyDbSingleton' not in Singleton.singleton_map\n")
+    subprocess.run([sys.executable, "-c", code], check=True)
+
+
+def test_apply_writes_changed_fields(devices):
+    published = []
+    inventory = Inventory(db().session_maker, publish=published.extend)
+    deltas = inventory.apply({1: {"hostname": "a", "model": "RB5009"}, 2: {"hostname": "b"}})
+    assert deltas == [{"id": 1, "hostname": "a", "model": "RB5009"}, {"id": 2, "hostname": "b"}]
+    assert published == deltas
+    assert inventory.apply({1: {"hostname": "a", "model": "RB5009"}}) == []
+    assert inventory.apply({1: {"hostname": "c", "model": "RB5009"}}) == [{"id": 1, "hostname": "c"}]
+    with db().session() as session:
+        assert session.get(Device, 1).hostname == "c"
+
+
+def test_failed_write_keeps_the_cache(devices, monkeypatch):
+    inventory = Inventory(db().session_maker)
+    inventory.apply({1: {"hostname": "a"}})
+
+    def fail(*args):
+        raise OperationalError("UPDATE", {}, Exception("database is locked"))
+
+    with monkeypatch.context() as patch:
+        patch.setattr(inventory, "_write", fail)
+        with pytest.raises(OperationalError):
+            inventory.apply({1: {"hostname": "b"}})
+    # the failed change is not taken as written and is applied again
+    assert inventory.apply({1: {"hostname": "b"}}) == [{"id": 1, "hostname": "b"}]
+    with db().session() as session:
+        assert session.get(Device, 1).hostname == "b"
+
+
+def test_changes_of_other_processes_are_not_masked(devices):
+    # every worker process has an inventory of its own
+    first, second = Inventory(db().session_maker), Inventory(db().session_maker)
+    first.apply({1: {"hostname": "a"}})
+    assert second.apply({1: {"hostname": "b"}}) == [{"id": 1, "hostname": "b"}]
+    assert first.apply({1: {"hostname": "a"}}) == [{"id": 1, "hostname": "a"}]
+    with db().session() as session:
+        assert session.get(Device, 1).hostname == "a"
@@ -0,0 +1,128 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import update
+
+from mikrotik_manager.api import api_router
+from mikrotik_manager.db import Device, Job, JobItem, RateLimit, create_all, db
+from mikrotik_manager.jobs import SharedTokenBucket, get_job_store
+from mikrotik_manager.routeros.fake import FakeRouterOsServer
+from mikrotik_manager.settings import settings
+from mikrotik_manager.tasks.base import BaseTask
+from mikrotik_manager.tasks.jobs import run_job, validate_params
+
+
+@pytest.fixture
+def server():
+    server = FakeRouterOsServer(password="secret")
+    run_job.run_async(server.start())
+    yield server
+    run_job.run_async(server.stop())
+    BaseTask.shutdown_runtime()
+
+
+@pytest.fixture
+def devices(server):
+    create_all()
+    with db().session() as session:
+        session.add_all([Device(id=i, name=f"device-{i}", host=server.host, port=server.port, username=f"device-{i}",
+                                password="secret", site="a" if i % 2 else "b") for i in range(1, 7)])
+        session.commit()
+    yield list(range(1, 7))
+    with db().session() as session:
+        session.query(JobItem).delete()
+        session.query(Job).delete()
+        session.query(RateLimit).delete()
+        session.query(Device).delete()
+        session.commit()
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setitem(settings.__dict__, "app_api_token", "token")
+    monkeypatch.setattr("mikrotik_manager.api.start_job", lambda job_id: None)
+    app = FastAPI()
+    app.include_router(api_router)
+    return TestClient(app)
+
+
+def test_api_requires_the_token(client, devices, monkeypatch):
+    assert client.get("/api/jobs").status_code == 401
+    assert client.get("/api/jobs", headers={"Authorization": "Bearer wrong"}).status_code == 401
+    assert client.get("/api/jobs", headers={"Authorization": "Bearer token"}).status_code == 200
+    monkeypatch.setitem(settings.__dict__, "app_api_token", None)
+    assert client.get("/api/jobs", headers={"Authorization": "Bearer token"}).status_code == 403
+
+
+def test_list_limits_are_bounded(client, devices):
+    headers = {"Authorization": "Bearer token"}
+    assert client.get("/api/jobs?limit=5000", headers=headers).status_code == 422
+    assert client.get("/api/jobs?limit=0", headers=headers).status_code == 422
+    assert client.get("/api/devices?limit=5000", headers=headers).status_code == 422
+    assert client.get("/api/devices?offset=-1", headers=headers).status_code == 422
+    assert client.get("/api/jobs?limit=1000", headers=headers).status_code == 200
+
+
+def test_params_are_validated_at_creation(client, devices):
+    headers = {"Authorization": "Bearer token"}
+    for params in ({"channel": "stable", "force": True}, {"channel": ["stable"]}):
+        response = client.post("/api/jobs", headers=headers, json={"action": "upgrade", "device_ids": devices,
+                                                                   "params": params})
+        assert response.status_code == 422
+    assert client.post("/api/jobs", headers=headers, json={"action": "format", "device_ids": devices}).status_code == 422
+    response = client.post("/api/jobs", headers=headers, json={"action": "upgrade", "device_ids": devices,
+                                                               "params": {"channel": "stable"}})
+    assert response.status_code == 201 and response.json()["total"] == 6
+    assert validate_params("backup", {"binary": "true"}) == {"binary": True}
+
+
+def test_orphaned_jobs_can_be_controlled(devices):
+    store = get_job_store()
+    job_id = store.create("reboot", devices)
+    runner = store.claim(job_id)["runner"]
+    assert store.renew(job_id, runner)
+    # a runner with a valid lease handles the abort itself
+    assert store.abort(job_id) and store.get(job_id)["state"] == "running"
+
+    # its worker was killed
+    with db().session() as session, session.begin():
+        session.execute(update(Job).where(Job.id == job_id)
+                        .values(heartbeat=datetime.now(timezone.utc) - timedelta(seconds=settings.jobs_lease + 1)))
+    assert store.resume(job_id) and store.get(job_id)["state"] == "queued"
+    # the old runner does not touch the job anymore
+    assert not store.renew(job_id, runner)
+    assert not store.finish(job_id, "finished", runner=runner)
+
+    runner = store.claim(job_id)["runner"]
+    with db().session() as session, session.begin():
+        session.execute(update(Job).where(Job.id == job_id).values(heartbeat=None))
+    assert store.abort(job_id)
+    progress = store.progress(job_id)
+    assert progress["state"] == "aborted" and progress["counts"]["skipped"] == 6
+
+
+def test_shared_bucket():
+    create_all()
+    now = 1000.0
+    first, second = (SharedTokenBucket(session_maker=db().session_maker, name="test", rate=2.0, burst=2,
+                                       clock=lambda: now) for _ in range(2))
+    # the buckets of all jobs take from the same tokens
+    assert [first.reserve(), second.reserve(), first.reserve(), second.reserve()] == [0.0, 0.0, 0.5, 1.0]
+    now += 1.0
+    assert second.reserve() == 0.5
+    with db().session() as session:
+        session.query(RateLimit).delete()
+        session.commit()
+
+
+def test_run_job(server, devices):
+    store = get_job_store()
+    job_id = store.create("reboot", devices, wave_size=4)
+    progress = run_job.apply(args=(job_id,)).get()
+    assert progress["state"] == "finished" and progress["counts"]["succeeded"] == 6
+    assert progress["runner"] is None and progress["heartbeat"] is not None
+    assert sum(server.reboots.values()) == 6
+    with db().session() as session:
+        assert session.get(RateLimit, "jobs").tokens < settings.jobs_global_burst
@@ -0,0 +1,111 @@
+import asyncio
+import time
+from datetime import datetime, timezone
+
+import pytest
+from nicegui import ui
+from nicegui.testing import User
+
+from mikrotik_manager.db import Device, DeviceStatus, create_all, db
+from mikrotik_manager.ui.base_layout import BaseLayout
+
+
+@pytest.fixture
+def devices():
+    create_all()
+    now = datetime.now(timezone.utc)
+    with db().session() as session:
+        session.add_all([Device(id=1, name="device-1", host="10.0.0.1", site="a"),
+                         Device(id=2, name="device-2", host="10.0.0.2", site="a"),
+                         Device(id=3, name="device-3", host="10.0.0.3")])
+        session.flush()
+        session.add_all([DeviceStatus(device_id=1, status="online", updated=now),
+                         DeviceStatus(device_id=3, status="offline", updated=now)])
+        session.commit()
+    yield
+    with db().session() as session:
+        session.query(Device).delete()
+        session.commit()
+
+
+async def test_concurrent_sections(user: User):
+    layout = BaseLayout()
+    order = []
+
+    @layout.section()
+    def clock():
+        return time.perf_counter()
+
+    @layout.section(concurrent=True)
+    async def first():
+        with ui.row() as row:
+            await asyncio.sleep(0.2)
+            ui.label("first")
+        order.append("first")
+        return row
+
+    @layout.section(concurrent=True)
+    async def second():
+        await asyncio.sleep(0.2)
+        ui.label("second")
+        order.append("second")
+        return 2
+
+    @layout.section(concurrent=True)
+    async def third(first, second):
+        order.append("third")
+        ui.label(f"third {second}")
+
+    durations = []
+
+    @layout.page("/concurrent")
+    def page(client, clock, first):
+        durations.append(time.perf_counter() - clock)
+        ui.label("body")
+
+    await user.open("/concurrent")
+    for text in ("first", "second", "third 2", "body"):
+        await user.should_see(text)
+    assert sorted(order[:2]) == ["first", "second"] and order[2] == "third"
+    # both independent sections were awaited together
+    assert durations[0] < 0.35
+
+
+def test_unknown_dependency():
+    layout = BaseLayout()
+
+    @layout.section(depends_on=["missing"])
+    def header():
+        pass
+
+    with pytest.raises(ValueError, match="unknown section 'missing'"):
+        layout.compile(lambda client: None)
+
+
+def test_dependency_rendered_after():
+    layout = BaseLayout()
+
+    @layout.section(depends_on=["footer"])
+    def header():
+        pass
+
+    @layout.section(render="after")
+    def footer():
+        pass
+
+    with pytest.raises(ValueError, match="rendered after it"):
+        layout.compile(lambda client: None)
+
+
+async def test_status_sections(user: User, devices):
+    from mikrotik_manager.ui.layout import layout
+
+    @layout.page("/status")
+    def page():
+        ui.label("body")
+
+    await user.open("/status")
+    await user.should_see("1 erreichbar")
+    await user.should_see("1 nicht erreichbar")
+    await user.should_see("Standorte")
+    await user.should_see("Ohne Standort")
@@ -0,0 +1,157 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from mikrotik_manager.db import Device, DeviceEvent, DeviceStatus, async_session_maker, create_all, db
+from mikrotik_manager.listener import DeviceIndex, EventListener, parse_syslog, parse_trap, send_refresh
+from mikrotik_manager.tasks import fetch_device_info_batch
+
+
+def _tlv(tag: int, value: bytes) -> bytes:
+    return bytes([tag, len(value)]) + value
+
+
+def _oid(oid: str) -> bytes:
+    parts = [int(part) for part in oid.split(".")]
+    encoded = bytes([parts[0] * 40 + parts[1]])
+    for part in parts[2:]:
+        chunk = [part & 0x7F]
+        part >>= 7
+        while part:
+            chunk.insert(0, 0x80 | (part & 0x7F))
+            part >>= 7
+        encoded += bytes(chunk)
+    return _tlv(0x06, encoded)
+
+
+def _integer(value: int) -> bytes:
+    return _tlv(0x02, value.to_bytes(max(1, (value.bit_length() + 8) // 8), "big", signed=True))
+
+
+def _trap(version: int, pdu: bytes, community: str = "public") -> bytes:
+    return _tlv(0x30, _integer(version) + _tlv(0x04, community.encode()) + pdu)
+
+
+def _bindings(*bindings: tuple[bytes, bytes]) -> bytes:
+    return _tlv(0x30, b"".join(_tlv(0x30, oid + value) for oid, value in bindings))
+
+
+LINK_DOWN = _trap(1, _tlv(0xA7, _integer(7) + _integer(0) + _integer(0) + _bindings(
+    (_oid("1.3.6.1.2.1.1.3.0"), _tlv(0x43, b"\x30\x39")),
+    (_oid("1.3.6.1.6.3.1.1.4.1.0"), _oid("1.3.6.1.6.3.1.1.5.3")),
+    (_oid("1.3.6.1.2.1.2.2.1.1.2"), _integer(2)),
+    (_oid("1.3.6.1.2.1.2.2.1.2.2"), _tlv(0x04, b"ether2")))))
+
+
+@pytest.fixture
+def devices():
+    create_all()
+    with db().session() as session:
+        session.add_all([Device(id=1, name="device-1", host="10.0.0.1"),
+                         Device(id=2, name="device-2", host="10.0.0.2")])
+        session.commit()
+    yield
+    with db().session() as session:
+        session.query(DeviceEvent).delete()
+        session.query(DeviceStatus).delete()
+        session.query(Device).delete()
+        session.commit()
+
+
+@pytest.fixture
+async def listener(devices):
+    index = DeviceIndex(session_maker=async_session_maker(), resolve=False)
+    await index.refresh()
+    published = []
+    listener = EventListener(session_maker=async_session_maker(), index=index, publish=published.append)
+    listener.published = published
+    return listener
+
+
+def test_parse_syslog():
+    event = parse_syslog(b"<30>Oct 18 12:00:00 router interface,info ether1 link down")
+    assert event == {"kind": "link", "severity": 6, "message": "router interface,info ether1 link down",
+                     "data": {"interface": "ether1", "state": "down"}}
+    event = parse_syslog(b"<131>1 2026-10-18T12:00:00Z router - - - - login failure for user root from 10.0.0.9 "
+                         b"via ssh")
+    assert event["kind"] == "login_failure" and event["severity"] == 3
+    assert event["data"] == {"user": "root", "address": "10.0.0.9", "via": "ssh"}
+    assert parse_syslog(b"<133>system,info ip address added by admin")["data"] == {"action": "added", "user": "admin"}
+    assert parse_syslog(b"no header \xff")["kind"] == "message"
+    assert parse_syslog(b"no header \xff")["severity"] is None
+
+
+def test_parse_trap():
+    event = parse_trap(LINK_DOWN)
+    assert event["kind"] == "link" and event["message"] == "ether2 link down"
+    assert event["data"]["if_index"] == 2 and event["data"]["variables"]["1.3.6.1.2.1.1.3.0"] == 12345
+
+    # SNMPv1: enterprise, agent address, generic trap 'linkUp', specific trap, time stamp and variable bindings
+    pdu = _tlv(0xA4, _oid("1.3.6.1.4.1.14988") + _tlv(0x40, bytes([10, 0, 0, 1])) + _integer(3) + _integer(0) +
+               _tlv(0x43, b"\x01") + _bindings((_oid("1.3.6.1.2.1.31.1.1.1.1.1"), _tlv(0x04, b"ether1"))))
+    event = parse_trap(_trap(0, pdu))
+    assert event["kind"] == "link" and event["message"] == "ether1 link up"
+    # an enterprise specific trap is a message
+    event = parse_trap(_trap(0, pdu.replace(_integer(3) + _integer(0), _integer(6) + _integer(9))))
+    assert event["kind"] == "message" and event["data"]["trap"] == "1.3.6.1.4.1.14988.0.9"
+
+    assert parse_trap(LINK_DOWN, community="public") is not None
+    assert parse_trap(LINK_DOWN, community="private") is None
+    # truncated, no sequence, an SNMPv2c PDU with the version of SNMPv1 and a trap without its OID
+    assert parse_trap(LINK_DOWN[:-3]) is None
+    assert parse_trap(b"") is None and parse_trap(_integer(1)) is None
+    assert parse_trap(_trap(0, LINK_DOWN[LINK_DOWN.index(0xA7):])) is None
+    assert parse_trap(_trap(1, _tlv(0xA7, _integer(7) + _integer(0) + _integer(0) + _bindings()))) is None
+
+
+async def test_lookup_mapped_addresses(listener):
+    index = listener.index
+    assert index.lookup("10.0.0.1") == index.lookup("::ffff:10.0.0.1") == 1
+    assert index.lookup("::ffff:10.0.0.9") is None and index.lookup("not:an:address") is None
+
+
+async def test_process_stores_events(listener):
+    refreshed = []
+    listener.refresh = refreshed.append
+    listener.store_messages = False
+    await listener.process([("syslog", b"<133>system,info ip address added by admin", "::ffff:10.0.0.1"),
+                            ("syslog", b"<134>firewall,info input: in:ether1", "10.0.0.2"),
+                            ("trap", LINK_DOWN, "10.0.0.2"),
+                            ("trap", b"\x30\x05", "10.0.0.2"),
+                            ("syslog", b"<14>ether1 link down", "10.0.0.9")])
+    assert (listener.unknown, listener.invalid, listener.events) == (1, 1, 2)
+    # only the changed configuration refreshes the device, once per interval
+    assert refreshed == [[1]]
+    await listener.process([("syslog", b"<133>system,info ip address removed by admin", "10.0.0.1")])
+    assert refreshed == [[1]]
+    with db().session() as session:
+        events = session.query(DeviceEvent).order_by(DeviceEvent.id).all()
+        assert [(event.device_id, event.source, event.kind) for event in events] == [(1, "syslog", "config"),
+                                                                                    (2, "trap", "link"),
+                                                                                    (1, "syslog", "config")]
+        assert events[1].data["interface"] == "ether2"
+        assert session.get(Device, 1).last_seen is not None and session.get(Device, 2).last_seen is not None
+
+
+async def test_process_publishes_online_transitions(listener):
+    with db().session() as session:
+        session.add(DeviceStatus(device_id=2, status="offline", updated=datetime.now(timezone.utc)))
+        session.commit()
+    deltas = await listener.process([("syslog", b"<14>ether1 link down", "10.0.0.1"),
+                                     ("syslog", b"<14>system, info user admin logged in", "10.0.0.2")])
+    assert {delta["id"]: delta["status"] for delta in deltas} == {1: "online", 2: "online"}
+    assert listener.published == [deltas]
+    with db().session() as session:
+        assert session.get(DeviceStatus, 1).status == session.get(DeviceStatus, 2).status == "online"
+
+    # a device which is already online is not published again
+    assert await listener.process([("syslog", b"<14>ether1 link up", "10.0.0.1")]) == [{"id": 1,
+                                                                                          "last_event": "ether1 link up"}]
+
+
+def test_send_refresh(monkeypatch):
+    sent = []
+    monkeypatch.setattr(fetch_device_info_batch, "apply_async", lambda args, **options: sent.append((args, options)))
+    send_refresh([1, 2])
+    # a recently fetched result of the devices is not shared
+    assert sent == [([[1, 2]], {"force": True})]
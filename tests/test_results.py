@@ -0,0 +1,59 @@
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.exc import IntegrityError
+
+from mikrotik_manager.results import ResultStream, TaskKeys, get_result_stream, get_task_keys
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'results.sqlite'}")
+    yield engine
+    engine.dispose()
+
+
+def test_stream(engine):
+    stream = ResultStream(engine, compression_threshold=100)
+    assert stream.push("task", [1, 2]) == 1
+    assert stream.push("task", ["x" * 1000]) == 2
+    assert stream.push("other", []) == 1
+    assert stream.read("task") == [(1, [1, 2]), (2, ["x" * 1000])]
+    assert stream.read("task", after=1) == [(2, ["x" * 1000])]
+    stream.delete("task")
+    assert stream.read("task") == []
+
+
+def test_push_retries_taken_numbers(engine):
+    stream = ResultStream(engine, attempts=2)
+    other = ResultStream(create_engine(engine.url))
+    collisions = [1]
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def collide(_connection, _cursor, statement, *_):
+        # another process pushes between reading the last number and inserting the next one
+        if statement.startswith("INSERT") and collisions[0]:
+            collisions[0] -= 1
+            other.push("task", ["other"])
+
+    assert stream.push("task", ["mine"]) == 2
+    assert stream.read("task") == [(1, ["other"]), (2, ["mine"])]
+    collisions[0] = 2
+    with pytest.raises(IntegrityError):
+        stream.push("task", ["mine"])
+    other.engine.dispose()
+
+
+def test_task_keys(engine):
+    keys = TaskKeys(engine)
+    assert keys.claim("task:a", task="task", task_id="1", ttl=60) == "1"
+    assert keys.claim("task:a", task="task", task_id="2", ttl=60) == "1"
+    keys.finish("task:a", "1", ok=False)
+    assert keys.claim("task:a", task="task", task_id="3", ttl=60) == "3"
+    keys.finish("task:a", "3")
+    assert keys.claim("task:a", task="task", task_id="4", ttl=60) == "3"
+    assert keys.claim("task:a", task="task", task_id="5", ttl=0) == "5"
+    assert keys.invalidate(task="task") == 1
+
+
+def test_stores_share_the_engine():
+    assert get_result_stream().engine is get_task_keys().engine
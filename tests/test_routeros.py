@@ -0,0 +1,120 @@
+import asyncio
+import ssl
+from pathlib import Path
+
+import pytest
+
+from mikrotik_manager.routeros import ConnectionPool, DeviceAddress, RouterOsApi, RouterOsConnectionError, \
+    RouterOsTrapError
+from mikrotik_manager.routeros.api import encode_length, encode_sentence, read_length, read_sentence
+from mikrotik_manager.routeros.fake import FakeRouterOsServer
+
+CERTIFICATE = Path(__file__).parent / "data" / "routeros.pem"
+
+
+@pytest.mark.parametrize("length", [0, 1, 0x7F, 0x80, 0x3FFF, 0x4000, 0x1FFFFF, 0x200000, 0xFFFFFFF, 0x10000000])
+async def test_length(length):
+    reader = asyncio.StreamReader()
+    reader.feed_data(encode_length(length))
+    reader.feed_eof()
+    assert await read_length(reader) == length
+
+
+async def test_sentence():
+    reader = asyncio.StreamReader()
+    reader.feed_data(encode_sentence(["/system/identity/print", "=name=ä" + "x" * 200]))
+    reader.feed_eof()
+    assert await read_sentence(reader) == ["/system/identity/print", "=name=ä" + "x" * 200]
+
+
+async def test_session():
+    async with FakeRouterOsServer(password="secret") as server:
+        api = RouterOsApi(host=server.host, port=server.port, username="device-1", password="secret")
+        await api.connect()
+        assert await api.talk("/system/identity/print") == [{"name": "device-1"}]
+        with pytest.raises(RouterOsTrapError):
+            await api.talk("/unknown")
+        # a trap does not end the session
+        assert await api.ping()
+        await api.close()
+        assert api.closed
+
+        api = RouterOsApi(host=server.host, port=server.port, username="device-1", password="wrong")
+        with pytest.raises(RouterOsTrapError):
+            await api.connect()
+
+
+async def test_serial_number_is_stable():
+    async with FakeRouterOsServer() as server:
+        pool = ConnectionPool()
+        first = await pool.talk(DeviceAddress(server.host, server.port, "device-1"), "/system/routerboard/print")
+        second = await pool.talk(DeviceAddress(server.host, server.port, "device-1"), "/system/routerboard/print")
+        await pool.close()
+    assert first[0]["serial-number"] == second[0]["serial-number"] == "HG073368697"
+
+
+async def test_pool_reuses_sessions():
+    async with FakeRouterOsServer() as server:
+        pool = ConnectionPool(max_connections_per_device=2)
+        address = DeviceAddress(server.host, server.port, "device-1")
+        replies = await asyncio.gather(*(pool.talk(address, "/system/identity/print") for _ in range(10)))
+        assert replies == [[{"name": "device-1"}]] * 10
+        assert server.sessions == 2
+        assert pool.stats["idle"] == 2
+
+        # sessions failing the health check are closed and replaced
+        def failing(name, attributes):
+            raise RouterOsTrapError("failure")
+
+        pool.health_check_interval = 0.0
+        server.handlers["/system/identity/print"] = failing
+        await pool.talk(address, "/system/resource/print")
+        assert server.sessions == 3 and pool.stats["idle"] == 1
+        await pool.close()
+
+
+async def test_cancelled_session_is_not_reused():
+    async with FakeRouterOsServer() as server:
+        pool = ConnectionPool()
+        address = DeviceAddress(server.host, server.port, "device-1")
+        await pool.talk(address, "/system/identity/print")
+        server.latency = 0.2
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(pool.talk(address, "/system/identity/print"), timeout=0.05)
+        # the reply of the cancelled command is not read as the reply of the next one
+        assert pool.stats["idle"] == 0
+        server.latency = 0.0
+        assert await pool.talk(address, "/system/resource/print") != [{"name": "device-1"}]
+        assert server.sessions == 2
+        await pool.close()
+
+
+async def test_pool_backoff():
+    pool = ConnectionPool(reconnect_attempts=2, reconnect_backoff=0.01, connect_timeout=1.0)
+    with pytest.raises(RouterOsConnectionError):
+        await pool.talk(DeviceAddress("127.0.0.1", 1), "/system/identity/print")
+    await pool.close()
+
+
+async def test_pool_evicts_idle_sessions():
+    async with FakeRouterOsServer() as server:
+        pool = ConnectionPool(idle_timeout=0.05)
+        await pool.talk(DeviceAddress(server.host, server.port, "device-1"), "/system/identity/print")
+        await asyncio.sleep(0.1)
+        assert await pool.evict_idle() == 1
+        assert pool.stats["devices"] == 0
+        await pool.close()
+
+
+async def test_tls():
+    context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    context.load_cert_chain(CERTIFICATE)
+    async with FakeRouterOsServer(ssl_context=context) as server:
+        pool = ConnectionPool()
+        address = DeviceAddress(server.host, server.port, "device-1", tls=True)
+        assert await pool.talk(address, "/system/identity/print") == [{"name": "device-1"}]
+
+        # a session without TLS is not accepted
+        with pytest.raises(RouterOsConnectionError):
+            await RouterOsApi(host=server.host, port=server.port, connect_timeout=1.0).connect()
+        await pool.close()
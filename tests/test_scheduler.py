@@ -0,0 +1,85 @@
+import time
+from collections import Counter
+
+from mikrotik_manager.scheduler import FleetBeatScheduler, FleetScheduler, HashRing
+from mikrotik_manager.settings import settings
+from mikrotik_manager.tasks import fetch_device_info_batch
+from mikrotik_manager.worker import celery_app
+
+
+def test_every_device_once_per_interval():
+    interval, jitter, tick = 60.0, 0.1, 0.5
+    fleet = FleetScheduler(interval=interval, jitter=jitter, seed=1)
+    fleet.sync(range(1000), now=0.0)
+    dispatched: dict[int, list[float]] = {device_id: [] for device_id in range(1000)}
+    now = 0.0
+    while now < interval * 10:
+        for device_ids in fleet.due(now).values():
+            for device_id in device_ids:
+                dispatched[device_id].append(now)
+                fleet.report(device_id, ok=True, rtt=0.1, now=now)
+        now += tick
+
+    for times in dispatched.values():
+        assert len(times) in (9, 10, 11)
+        gaps = [b - a for a, b in zip(times, times[1:])]
+        # the phase of a device is fixed, only the jitter moves its poll
+        assert all(interval * (1 - jitter) - tick <= gap <= interval * (1 + jitter) + tick for gap in gaps)
+    # the polls are spread over the interval instead of being due at once
+    per_second = Counter(int(times[0]) for times in dispatched.values())
+    assert max(per_second.values()) < 1000 / interval * 4
+
+
+def test_dispatched_devices_are_not_due_again():
+    fleet = FleetScheduler(interval=10.0, jitter=0.0)
+    fleet.sync(range(100), now=0.0)
+    first = fleet.due(now=10.0)[None]
+    assert sorted(first) == list(range(100))
+    assert fleet.due(now=15.0) == {}
+    # without a report the device counts as failed after its interval and backs off
+    assert fleet.due(now=20.0) == {}
+    assert all(fleet.state(device_id).failures == 1 and fleet.state(device_id).interval == 20.0
+               for device_id in range(100))
+
+
+def test_ring_rebalancing_is_bounded():
+    keys = [str(i) for i in range(20000)]
+    ring = HashRing([f"node-{i}" for i in range(4)])
+    before = {key: ring.node(key) for key in keys}
+    shares = Counter(before.values())
+    assert all(abs(share - len(keys) / 4) < len(keys) / 4 * 0.25 for share in shares.values())
+
+    # a new node only takes keys, about its share of them
+    ring.add("node-4")
+    after = {key: ring.node(key) for key in keys}
+    moved = [key for key in keys if before[key] != after[key]]
+    assert all(after[key] == "node-4" for key in moved)
+    assert len(keys) / 5 * 0.75 < len(moved) < len(keys) / 5 * 1.25
+
+    # a removed node only gives away its own keys
+    ring.remove("node-0")
+    removed = {key: ring.node(key) for key in keys}
+    assert all(removed[key] == after[key] for key in keys if after[key] != "node-0")
+    assert "node-0" not in removed.values()
+
+
+def test_dispatch_claims_the_idempotency_key(tmp_path, monkeypatch):
+    sent = []
+
+    def send_task(*args, **kwargs):
+        raise AssertionError("the batches have to be sent by the tasks")
+
+    monkeypatch.setitem(settings.__dict__, "scheduler_batch_size", 4)
+    monkeypatch.setattr(celery_app, "send_task", send_task)
+    monkeypatch.setattr(fetch_device_info_batch, "apply_async",
+                        lambda args, **options: sent.append(args[0]) or fetch_device_info_batch.AsyncResult(
+                            str(len(sent))))
+    scheduler = FleetBeatScheduler(app=celery_app, schedule_filename=str(tmp_path / "beat"), lazy=True)
+    fleet = scheduler.fleets["fetch_device_info_batch"]
+    # all devices are due, the fleet is not synchronized with the database
+    fleet.sync(range(1, 11), now=time.monotonic() - fleet.interval * 2)
+    scheduler._synced = time.monotonic()
+
+    scheduler.dispatch_fleet()
+    assert sorted(device_id for batch in sent for device_id in batch) == list(range(1, 11))
+    assert [len(batch) for batch in sent] == [4, 4, 2]
@@ -0,0 +1,51 @@
+import asyncio
+
+from mikrotik_manager.server import AffinityBalancer
+
+
+async def test_balancer_honours_trusted_proxies():
+    received: dict[str, list[bytes]] = {}
+
+    async def backend(name: str) -> asyncio.Server:
+        async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+            received.setdefault(name, []).append(await reader.readuntil(b"\r\n\r\n"))
+            writer.write(name.encode())
+            await writer.drain()
+            writer.close()
+
+        return await asyncio.start_server(handle, "127.0.0.1", 0)
+
+    backends = {f"server-{i}": await backend(f"server-{i}") for i in range(4)}
+    addresses = {name: server.sockets[0].getsockname()[:2] for name, server in backends.items()}
+
+    async def request(balancer: AffinityBalancer, data: bytes) -> str:
+        front = await asyncio.start_server(balancer.handle, "127.0.0.1", 0)
+        reader, writer = await asyncio.open_connection(*front.sockets[0].getsockname()[:2])
+        writer.write(data)
+        await writer.drain()
+        name = (await reader.read()).decode()
+        writer.close()
+        front.close()
+        return name
+
+    balancer = AffinityBalancer(addresses)
+    # a client which is not assigned to the server process of the proxy itself
+    client = next(f"10.0.0.{i}" for i in range(1, 255)
+                  if balancer.ring.node(f"10.0.0.{i}") != balancer.ring.node("127.0.0.1"))
+    get = b"GET / HTTP/1.1\r\nHost: manager\r\n\r\n"
+
+    name = await request(balancer, f"PROXY TCP4 {client} 10.1.0.1 50000 443\r\n".encode() + get)
+    assert name == balancer.ring.node(client)
+    # the PROXY protocol header is not forwarded
+    assert received[name][-1] == get
+
+    name = await request(balancer, b"GET / HTTP/1.1\r\nX-Forwarded-For: " + f"{client}, 10.1.0.1".encode() + b"\r\n\r\n")
+    assert name == balancer.ring.node(client)
+
+    # the header of an untrusted peer is ignored
+    untrusted = AffinityBalancer(addresses, trusted=("10.1.0.1",))
+    name = await request(untrusted, b"GET / HTTP/1.1\r\nX-Forwarded-For: " + client.encode() + b"\r\n\r\n")
+    assert name == untrusted.ring.node("127.0.0.1")
+
+    for server in backends.values():
+        server.close()
@@ -0,0 +1,55 @@
+import os
+from pathlib import Path
+
+import pytest
+import yaml
+from pydantic import ValidationError
+
+from mikrotik_manager.reload import SettingsWatcher
+from mikrotik_manager.settings import SNAPSHOT_ENV, Settings, load_settings, settings
+
+
+def test_snapshot_is_json(monkeypatch):
+    monkeypatch.setenv(SNAPSHOT_ENV, "")
+    loaded = load_settings()
+    snapshot = Path(os.environ[SNAPSHOT_ENV])
+    key, data = snapshot.read_text(encoding="utf-8").split("\n", 1)
+    assert Settings.model_validate_json(data).model_dump(mode="json") == loaded.model_dump(mode="json")
+
+    # the child processes use the snapshot instead of the settings file
+    loads = []
+    monkeypatch.setattr(Settings, "load", classmethod(lambda cls: loads.append(True) or loaded))
+    assert load_settings().model_dump_json() == loaded.model_dump_json()
+    assert loads == []
+
+    # an environment variable of the package changes the key
+    monkeypatch.setenv("MIKROTIK_MANAGER_TEST", "1")
+    load_settings()
+    assert loads == [True] and os.environ[SNAPSHOT_ENV] != str(snapshot)
+
+
+def test_watcher_swaps_the_settings(tmp_path):
+    target = settings.model_copy()
+    watcher = SettingsWatcher(target=target, interval=0.0)
+    watcher.path = tmp_path / "settings.yml"
+    before = target.__dict__
+    changes = []
+    watcher.on_change(changes.append)
+
+    watcher.path.write_text(yaml.safe_dump({"jobs_rate": target.jobs_rate + 1, "db_pool_size": 99}))
+    assert watcher.check() == {"jobs_rate": before["jobs_rate"] + 1}
+    assert target.jobs_rate == before["jobs_rate"] + 1 and target.db_pool_size == before["db_pool_size"]
+    # the previous snapshot is not changed in place
+    assert target.__dict__ is not before and before["jobs_rate"] == target.jobs_rate - 1
+    assert changes == [{"jobs_rate": target.jobs_rate}]
+
+    # nothing is applied if a change is invalid
+    watcher.path.write_text(yaml.safe_dump({"jobs_rate": -1, "jobs_burst": target.jobs_burst + 1}))
+    assert watcher.check() == {} and target.jobs_burst == before["jobs_burst"]
+
+
+def test_settings_are_frozen():
+    # also the settings loaded from the snapshot, they are only replaced as a whole
+    for loaded in (settings, load_settings()):
+        with pytest.raises(ValidationError):
+            loaded.jobs_rate = 1.0
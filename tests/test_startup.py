@@ -0,0 +1,42 @@
+import json
+import subprocess
+import sys
+import time
+
+import pytest
+
+# seconds 'mikrotik-manager --help' may take, most of it is importing pydantic and SQLAlchemy for the settings
+HELP_BUDGET = 2.5
+
+# uvicorn is not in the list, the server settings of wiederverwendbar import it
+HEAVY_MODULES = ("celery", "celery.beat", "kombu", "nicegui", "fastapi", "prometheus_client", "aiosqlite")
+
+
+def imported(*modules: str) -> set[str]:
+    # the modules are imported in a fresh interpreter, the tests have imported everything already
+    code = "".join(f"import {module}\n" for module in ("json", "sys", *modules))
+    code += "print(json.dumps(sorted(sys.modules)))"
+    return set(json.loads(subprocess.run([sys.executable, "-c", code], check=True, capture_output=True,
+                                         text=True).stdout))
+
+
+def test_cli_does_not_import_heavy_modules():
+    loaded = imported("mikrotik_manager.cli")
+    assert not loaded & set(HEAVY_MODULES)
+
+
+# socketio, which NiceGUI depends on, imports kombu itself
+@pytest.mark.parametrize("module, allowed", [("mikrotik_manager.server", ()),
+                                             ("mikrotik_manager.telemetry", ("prometheus_client",)),
+                                             ("mikrotik_manager.ui.base_layout", ("nicegui", "fastapi", "kombu",
+                                                                                  "prometheus_client"))])
+def test_modules_do_not_import_the_worker(module, allowed):
+    loaded = imported(module)
+    assert not loaded & (set(HEAVY_MODULES) - set(allowed))
+    assert "mikrotik_manager.worker" not in loaded
+
+
+def test_help_budget():
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-m", "mikrotik_manager", "--help"], check=True, capture_output=True)
+    assert time.perf_counter() - start < HELP_BUDGET
@@ -0,0 +1,45 @@
+from nicegui import app
+from sqlalchemy import select
+
+from mikrotik_manager.db import StorageEntry, create_all, db
+from mikrotik_manager.settings import settings
+from mikrotik_manager.ui.storage import DatabasePersistentDict, DatabaseStorage, configure_storage
+
+
+def stored(id: str) -> dict[str, object]:  # pylint: disable=redefined-builtin
+    with db().session() as session:
+        return dict(session.execute(select(StorageEntry.key, StorageEntry.value).where(StorageEntry.id == id)).all())
+
+
+def test_keys_are_written_separately():
+    create_all()
+    # two server processes with the same storage
+    first, second = DatabasePersistentDict("test"), DatabasePersistentDict("test")
+    first.initialize_sync()
+    second.initialize_sync()
+    first["theme"] = "dark"
+    second["columns"] = ["name", "host"]
+    assert stored("test") == {"theme": "dark", "columns": ["name", "host"]}
+
+    # only the changed keys are written
+    first["theme"] = "light"
+    del second["columns"]
+    assert stored("test") == {"theme": "light"}
+    loaded = DatabasePersistentDict("test")
+    loaded.initialize_sync()
+    assert dict(loaded) == {"theme": "light"}
+
+    # clearing removes the keys of all processes
+    second["columns"] = ["name"]
+    first.clear()
+    assert stored("test") == {}
+
+
+async def test_database_storage(monkeypatch):
+    create_all()
+    monkeypatch.setitem(settings.__dict__, "ui_storage_backend", "database")
+    monkeypatch.setattr(app, "storage", app.storage)
+    configure_storage()
+    assert isinstance(app.storage, DatabaseStorage) and isinstance(app.storage.general, DatabasePersistentDict)
+    await app.storage._create_user_storage("session")
+    assert app.storage._users["session"].id == "user-session"
@@ -0,0 +1,126 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+from celery import Task
+from kombu import Queue
+
+from mikrotik_manager.db import Device, create_all, db
+from mikrotik_manager.routeros import ConnectionPool
+from mikrotik_manager.routeros.fake import FakeRouterOsServer
+from mikrotik_manager.results import get_task_keys
+from mikrotik_manager.tasks.base import IDEMPOTENCY_HEADER, BaseTask
+from mikrotik_manager.tasks.devices import fetch_device_info_batch, load_devices, poll_devices
+from mikrotik_manager.worker import celery_app
+
+
+@celery_app.task(name="test_count_since", bind=True, idempotent=True, cache_ttl=0)
+def count_since(self, items: list, since: datetime) -> int:
+    return len(items)
+
+
+@pytest.fixture
+def server():
+    # the fake devices answer on the event loop of the task runtime, like the pool expects
+    server = FakeRouterOsServer(password="secret")
+    fetch_device_info_batch.run_async(server.start())
+    yield server
+    fetch_device_info_batch.run_async(server.stop())
+    BaseTask.shutdown_runtime()
+
+
+@pytest.fixture
+def devices(server):
+    create_all()
+    with db().session() as session:
+        session.add_all([Device(id=i, name=f"device-{i}", host=server.host, port=server.port, username=f"device-{i}",
+                                password="secret") for i in range(1, 31)])
+        session.commit()
+    yield list(range(1, 31))
+    with db().session() as session:
+        session.query(Device).delete()
+        session.commit()
+
+
+def test_idempotency_key_is_carried_in_a_header(monkeypatch):
+    sent = []
+    monkeypatch.setattr(Task, "apply_async", lambda self, args, kwargs, task_id, **options: sent.append(
+        (task_id, options)) or self.AsyncResult(task_id))
+    since = datetime(2026, 1, 1)
+    result = count_since.apply_async(args=[[1, 2], since], queue="bulk")
+    assert count_since.apply_async(args=[[1, 2], since], queue=Queue("bulk")).id == result.id
+    # an identical call routed elsewhere is not shared
+    assert count_since.apply_async(args=[[1, 2], since]).id != result.id
+
+    task_id, options = sent[0]
+    assert task_id == result.id
+    assert options["headers"][IDEMPOTENCY_HEADER] == count_since.idempotency_key([[1, 2], since], None,
+                                                                                  {"queue": "bulk"})
+    # the worker gets the arguments changed by the serializer, but finishes the claimed key
+    count_since.apply(args=[[1, 2], since.isoformat()], task_id=task_id, headers=options["headers"])
+    assert count_since.apply_async(args=[[1, 2], since], queue="bulk").id != result.id
+    get_task_keys().invalidate(task=count_since.name)
+
+
+async def test_poll_devices_isolates_failures():
+    async def fetch(pool, address):
+        if address.host == "broken":
+            raise RuntimeError("unexpected")
+        return {"host": address.host}
+
+    pages = []
+    devices = [{"id": 1, "host": "a"}, {"id": 2, "host": "broken"}, {"id": 3, "host": "b"}, {"id": 4}]
+    summary = await poll_devices(pool=ConnectionPool(), devices=devices, concurrency=2, page_size=3,
+                                 on_page=pages.append, fetch=fetch)
+    assert summary["total"] == 4 and summary["succeeded"] == 2 and summary["failed"] == 2
+    assert dict(summary["errors"]) == {2: "RuntimeError: unexpected", 4: "ValueError: Device 4 does not exist."}
+    assert sorted(device_id for device_id, _ in summary["rtts"]) == [1, 3]
+    # the results are only passed to the pages
+    assert "results" not in summary
+    assert [len(page) for page in pages] == [3, 1]
+
+
+def test_consume_async_cancels_the_producer():
+    produced, discarded, stopped = [], [], []
+
+    async def produce(put):
+        try:
+            for i in range(100):
+                put(i)
+                produced.append(i)
+                await asyncio.sleep(0.01)
+        except asyncio.CancelledError:
+            stopped.append(True)
+            raise
+
+    def consume(item):
+        if item == 2:
+            raise RuntimeError("disk full")
+
+    with pytest.raises(RuntimeError):
+        fetch_device_info_batch.consume_async(produce, consume, discard=discarded.append)
+    BaseTask.shutdown_runtime()
+    # the producer stopped and the items nobody consumed were discarded
+    assert stopped == [True] and len(produced) < 100
+    assert discarded == produced[3:]
+
+
+def test_load_devices(devices):
+    loaded = load_devices([2, 1000, 1], chunk_size=1)
+    assert [device["id"] for device in loaded] == [2, 1000, 1]
+    assert loaded[0]["password"] == "secret" and loaded[0]["username"] == "device-2"
+    assert loaded[1] == {"id": 1000}
+
+
+def test_fetch_device_info_batch(devices):
+    from mikrotik_manager.results import get_result_stream
+
+    result = fetch_device_info_batch.apply(args=(devices + [1000],), kwargs={"page_size": 7})
+    summary = result.get()
+    assert summary["total"] == 31 and summary["failed"] == 1
+    assert dict(summary["errors"]) == {1000: "ValueError: Device 1000 does not exist."}
+    chunks = get_result_stream().read(result.id)
+    assert [seq for seq, _ in chunks] == [1, 2, 3, 4, 5]
+    assert sum(len(items) for _, items in chunks) == 31
+    with db().session() as session:
+        assert session.get(Device, 1).hostname == "device-1"
@@ -0,0 +1,46 @@
+import os
+import socket
+import subprocess
+import sys
+
+from mikrotik_manager.settings import MULTIPROCESS_ENV, use_metrics_directory
+from mikrotik_manager.telemetry import QueueDepthCollector, start_server
+
+
+def test_metrics_directory_per_process(tmp_path, monkeypatch):
+    monkeypatch.delenv(MULTIPROCESS_ENV, raising=False)
+    # a process which is not running anymore and another running one
+    dead = subprocess.run([sys.executable, "-c", "import os; print(os.getpid())"], capture_output=True,
+                          text=True).stdout.strip()
+    (tmp_path / dead).mkdir()
+    (tmp_path / str(os.getppid())).mkdir()
+    (tmp_path / str(os.getppid()) / "counter_1.db").touch()
+
+    directory = use_metrics_directory(tmp_path)
+    assert directory == tmp_path / str(os.getpid()) and os.environ[MULTIPROCESS_ENV] == str(directory.absolute())
+    assert not (tmp_path / dead).exists()
+    assert (tmp_path / str(os.getppid()) / "counter_1.db").exists()
+
+
+def test_start_server_on_a_bound_port():
+    with socket.socket() as sock:
+        sock.bind(("", 0))
+        sock.listen()
+        assert not start_server(sock.getsockname()[1])
+
+
+def test_queue_depths_are_cached(monkeypatch):
+    collector = QueueDepthCollector(max_age=60.0)
+    samples = []
+    monkeypatch.setattr(collector, "_sample", lambda: samples.append(True) or {"bulk": 3})
+    for _ in range(3):
+        family = next(collector.collect())
+        assert [(sample.labels, sample.value) for sample in family.samples] == [({"queue": "bulk"}, 3)]
+    assert len(samples) == 1
+
+    # the connection is kept between the samples
+    collector = QueueDepthCollector(max_age=0.0)
+    next(collector.collect())
+    connection = collector._connection
+    next(collector.collect())
+    assert connection is not None and collector._connection is connection
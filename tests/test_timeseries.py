@@ -0,0 +1,86 @@
+import math
+
+import pytest
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.orm import sessionmaker
+
+from mikrotik_manager.db import MetricBlock, MetricSample, ModelBase
+from mikrotik_manager.timeseries import RESOLUTIONS, Block, MetricCollector, MetricStore
+
+DAY = 86400 * 20000
+
+
+@pytest.fixture
+def store(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'metrics.sqlite'}")
+    ModelBase.metadata.create_all(bind=engine)
+    yield MetricStore(session_maker=sessionmaker(bind=engine))
+    engine.dispose()
+
+
+def count(store: MetricStore, model) -> int:
+    with store.session_maker() as session:
+        return session.execute(select(func.count()).select_from(model)).scalar_one()
+
+
+def test_block_roundtrip():
+    block = Block(10)
+    block.add(1, 2.0)
+    block.add(1, 4.0)
+    block.add(9, -1.0)
+    decoded = Block.decode(10, block.encode())
+    aggregates = decoded.aggregates(0, 10)
+    assert aggregates["avg"][1] == 3.0 and aggregates["min"][1] == 2.0 and aggregates["max"][1] == 4.0
+    assert aggregates["avg"][9] == -1.0 and math.isnan(aggregates["avg"][0])
+
+
+def test_write_appends_and_compact_merges(store):
+    samples = [(1, "cpu", DAY + i * 60, float(i)) for i in range(120)]
+    assert store.write(samples[:60]) == 60
+    assert store.write(samples[60:] + [(1, "cpu", DAY, math.nan)]) == 60
+    # a write does not touch the blocks
+    assert count(store, MetricBlock) == 0 and count(store, MetricSample) == 120
+
+    series_id = store.series_ids([(1, "cpu")])[(1, "cpu")]
+    staged = store.query([series_id], start=DAY, end=DAY + 7199, resolution="1m")
+    assert store.compact(limit=50) == 120
+    assert count(store, MetricSample) == 0
+    assert count(store, MetricBlock) == len(RESOLUTIONS)
+    merged = store.query([series_id], start=DAY, end=DAY + 7199, resolution="1m")
+    assert staged == merged
+    assert list(merged[1][series_id]["avg"]) == [float(i) for i in range(120)]
+
+    # new samples are added to the existing blocks
+    store.write([(1, "cpu", DAY + 30, 1.0)])
+    hourly = store.query([series_id], start=DAY, end=DAY + 3599, resolution="1h")[1][series_id]
+    assert hourly["max"][0] == 59.0 and hourly["min"][0] == 0.0 and hourly["avg"][0] == pytest.approx(1771 / 61)
+    store.compact()
+    assert store.query([series_id], start=DAY, end=DAY + 3599, resolution="1h")[1][series_id]["avg"][0] == \
+           pytest.approx(1771 / 61)
+
+
+def test_compact_replaces_concurrently_created_blocks(store, monkeypatch):
+    store.write([(1, "cpu", DAY, 1.0)])
+    store.compact()
+    store.write([(1, "cpu", DAY, 3.0)])
+    # another process created the blocks after they were read
+    monkeypatch.setattr(store, "_read_blocks", lambda *args: {})
+    assert store.compact() == 1
+    assert count(store, MetricBlock) == len(RESOLUTIONS)
+
+
+def test_series_are_created_once(store):
+    other = MetricStore(session_maker=store.session_maker)
+    first = store.series_ids([(1, "cpu"), (1, "memory")])
+    # the other process does not know them yet and creates them again
+    assert other.series_ids([(1, "cpu"), (2, "cpu")])[(1, "cpu")] == first[(1, "cpu")]
+
+
+def test_counter_rates_are_shared(store):
+    first, second = MetricCollector(store), MetricCollector(store)
+    assert first.apply({1: {"timestamp": DAY, "gauges": {"cpu": 5.0}, "counters": {"rx_bps": 1000.0}}}) == 1
+    # the next value is collected by another worker process
+    samples = second.samples({1: {"timestamp": DAY + 10, "gauges": {}, "counters": {"rx_bps": 3000.0}}})
+    assert samples == [(1, "rx_bps", DAY + 10, 200.0)]
+    # a counter reset has no rate
+    assert first.samples({1: {"timestamp": DAY + 20, "gauges": {}, "counters": {"rx_bps": 10.0}}}) == []